@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the elf file discovery in a large build tree with and without persistent elf index.
+
+The benchmark generates a CMake-like build directory with object files, dependency files and
+extension-less helper files. The only elf file is located in a subdirectory, so the whole tree is scanned.
+The last case replaces one file of the large top level build directory before each search, so the directory
+is scanned again, but only the new file is opened.
+
+Usage::
+
+    python benchmarks/bench_elf_discovery.py [--files 50000] [--dirs 100] [--repeat 5]
+"""
+import argparse
+import os
+import os.path
+import shutil
+import tempfile
+import time
+
+from vznncv.stlink.tools.wrapper._cache_utils import CACHE_DIR_ENV_VAR
+from vznncv.stlink.tools.wrapper._search_utils import resolve_elf_file_location
+
+_DEMO_ELF = os.path.join(os.path.dirname(__file__), '..', 'tests', 'fixtures', 'stm_project_stub', 'build', 'demo.elf')
+_FILE_KINDS = ('.o', '.d', '', '.cmake', '', '.txt', '')
+
+
+def generate_build_tree(project_dir: str, *, file_count: int, dir_count: int):
+    build_dir = os.path.join(project_dir, 'build')
+    sub_dirs = [os.path.join(build_dir, f'module_{i}') for i in range(dir_count)]
+    for sub_dir in sub_dirs:
+        os.makedirs(sub_dir)
+    for i in range(file_count):
+        ext = _FILE_KINDS[i % len(_FILE_KINDS)]
+        # put some files into the top level build directory
+        target_dir = build_dir if i % 10 == 0 else sub_dirs[i % dir_count]
+        with open(os.path.join(target_dir, f'file_{i}{ext}'), 'wb') as f:
+            f.write(b'#!/bin/sh\n' if not ext else b'\0' * 16)
+    os.makedirs(os.path.join(build_dir, 'bin'))
+    shutil.copy(_DEMO_ELF, os.path.join(build_dir, 'bin', 'firmware'))
+
+    # directories that are modified recently aren't cached by the index
+    old_time = time.time() - 3600
+    for dir_path, _, _ in os.walk(build_dir):
+        os.utime(dir_path, (old_time, old_time))
+
+
+def measure(fn, repeat: int) -> float:
+    durations = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start_time)
+    return min(durations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=50000)
+    parser.add_argument('--dirs', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.environ[CACHE_DIR_ENV_VAR] = os.path.join(tmp_dir, 'cache')
+        project_dir = os.path.join(tmp_dir, 'project')
+        generate_build_tree(project_dir, file_count=args.files, dir_count=args.dirs)
+        expected_path = os.path.join(project_dir, 'build', 'bin', 'firmware')
+
+        def resolve_without_index():
+            assert resolve_elf_file_location(project_dir, None, use_index=False) == expected_path
+
+        def resolve_with_index():
+            assert resolve_elf_file_location(project_dir, None) == expected_path
+
+        def resolve_with_cold_index():
+            shutil.rmtree(os.environ[CACHE_DIR_ENV_VAR], ignore_errors=True)
+            resolve_with_index()
+
+        def resolve_with_touched_file():
+            # replace one helper file of the top level build directory, like a linker does
+            touched_path = os.path.join(project_dir, 'build', 'touched_helper')
+            with open(touched_path + '.tmp', 'wb') as f:
+                f.write(b'#!/bin/sh\n')
+            os.replace(touched_path + '.tmp', touched_path)
+            resolve_with_index()
+
+        cases = [
+            ('full scan', resolve_without_index),
+            ('index (cold)', resolve_with_cold_index),
+            ('index (warm)', resolve_with_index),
+            ('index (1 touched)', resolve_with_touched_file),
+        ]
+        print(f"Build tree: {args.files} files in {args.dirs + 2} directories")
+        for name, fn in cases:
+            print(f"{name:<18}: {measure(fn, args.repeat) * 1000:8.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of the memory mapped ELF reader against a naive ``read()``-based parser.
+
+The benchmark generates an ELF32 file with small loadable segments and large debug information
+(like typical firmware images) and measures time to calculate loadable segment hash and to find a symbol.
+
+Usage::
+
+    python benchmarks/bench_elf_reader.py [--debug-size-mb 32] [--repeat 20]
+"""
+import argparse
+import hashlib
+import os.path
+import struct
+import tempfile
+import timeit
+
+from vznncv.stlink.tools.wrapper._elf_utils import ElfFile, compute_image_hash
+
+
+def generate_elf(path: str, *, load_size: int, debug_size: int, symbol_count: int):
+    """
+    Generate little-endian ELF32 file with one loadable segment, debug section and symbol table.
+    """
+    section_names = b'\0.text\0.debug_info\0.symtab\0.strtab\0.shstrtab\0'
+    symbol_names = b'\0' + b''.join(f'symbol_{i}\0'.encode() for i in range(symbol_count))
+    symbols = b'\0' * 16
+    name_offset = 1
+    for i in range(symbol_count):
+        symbols += struct.pack('<IIIBBH', name_offset, 0x08000000 + i * 4, 4, 0x12, 0, 1)
+        name_offset += len(f'symbol_{i}') + 1
+
+    text_offset = 52 + 32
+    debug_offset = text_offset + load_size
+    symtab_offset = debug_offset + debug_size
+    strtab_offset = symtab_offset + len(symbols)
+    shstrtab_offset = strtab_offset + len(symbol_names)
+    sh_offset = shstrtab_offset + len(section_names)
+
+    with open(path, 'wb') as f:
+        f.write(b'\x7fELF\x01\x01\x01' + b'\0' * 9)
+        f.write(struct.pack('<HHIIIIIHHHHHH', 2, 40, 1, 0x08000001, 52, sh_offset, 0, 52, 32, 1, 40, 6, 5))
+        f.write(struct.pack('<IIIIIIII', 1, text_offset, 0x08000000, 0x08000000, load_size, load_size, 5, 4))
+        f.write(os.urandom(load_size))
+        chunk = b'\xA5' * (1024 * 1024)
+        for i in range(0, debug_size, len(chunk)):
+            f.write(chunk[:min(len(chunk), debug_size - i)])
+        f.write(symbols)
+        f.write(symbol_names)
+        f.write(section_names)
+        f.write(b'\0' * 40)
+        f.write(struct.pack('<IIIIIIIIII', 1, 1, 6, 0x08000000, text_offset, load_size, 0, 0, 4, 0))
+        f.write(struct.pack('<IIIIIIIIII', 7, 1, 0, 0, debug_offset, debug_size, 0, 0, 1, 0))
+        f.write(struct.pack('<IIIIIIIIII', 19, 2, 0, 0, symtab_offset, len(symbols), 4, 1, 4, 16))
+        f.write(struct.pack('<IIIIIIIIII', 27, 3, 0, 0, strtab_offset, len(symbol_names), 0, 0, 1, 0))
+        f.write(struct.pack('<IIIIIIIIII', 35, 3, 0, 0, shstrtab_offset, len(section_names), 0, 0, 1, 0))
+
+
+def naive_image_hash(path: str) -> str:
+    with open(path, 'rb') as f:
+        data = f.read()
+    _, _, _, _, phoff, _, _, _, phentsize, phnum, _, _, _ = struct.unpack_from('<HHIIIIIHHHHHH', data, 16)
+    segments = []
+    for i in range(phnum):
+        p_type, p_offset, _, p_paddr, p_filesz, _, _, _ = struct.unpack_from('<IIIIIIII', data, phoff + i * phentsize)
+        if p_type == 1 and p_filesz:
+            segments.append((p_paddr, data[p_offset:p_offset + p_filesz]))
+    h = hashlib.sha256()
+    for address, segment_data in sorted(segments):
+        h.update(struct.pack('<II', address, len(segment_data)))
+        h.update(segment_data)
+    return h.hexdigest()
+
+
+def naive_find_symbol(path: str, name: str) -> int:
+    with open(path, 'rb') as f:
+        data = f.read()
+    _, _, _, _, _, shoff, _, _, _, _, shentsize, shnum, _ = struct.unpack_from('<HHIIIIIHHHHHH', data, 16)
+    headers = [struct.unpack_from('<IIIIIIIIII', data, shoff + i * shentsize) for i in range(shnum)]
+    for header in headers:
+        if header[1] != 2:
+            continue
+        strtab_offset = headers[header[6]][4]
+        for offset in range(header[4], header[4] + header[5], 16):
+            st_name, st_value = struct.unpack_from('<II', data, offset)
+            end = data.index(b'\0', strtab_offset + st_name)
+            if data[strtab_offset + st_name:end].decode() == name:
+                return st_value
+    raise KeyError(name)
+
+
+def mmap_find_symbol(path: str, name: str) -> int:
+    with ElfFile(path) as elf_file:
+        return elf_file.find_symbol(name).value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--load-size-kb', type=int, default=512)
+    parser.add_argument('--debug-size-mb', type=int, default=32)
+    parser.add_argument('--symbols', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        elf_path = os.path.join(tmp_dir, 'bench.elf')
+        generate_elf(elf_path, load_size=args.load_size_kb * 1024, debug_size=args.debug_size_mb * 1024 * 1024,
+                     symbol_count=args.symbols)
+        assert naive_image_hash(elf_path) == compute_image_hash(elf_path)
+        last_symbol = f'symbol_{args.symbols - 1}'
+        assert naive_find_symbol(elf_path, last_symbol) == mmap_find_symbol(elf_path, last_symbol)
+
+        print(f"elf file size: {os.path.getsize(elf_path) / 1024 / 1024:.1f} MiB")
+        cases = [
+            ('image hash (read)', lambda: naive_image_hash(elf_path)),
+            ('image hash (mmap)', lambda: compute_image_hash(elf_path)),
+            ('find symbol (read)', lambda: naive_find_symbol(elf_path, last_symbol)),
+            ('find symbol (mmap)', lambda: mmap_find_symbol(elf_path, last_symbol)),
+        ]
+        for name, fn in cases:
+            best_time = min(timeit.repeat(fn, number=1, repeat=args.repeat))
+            print(f"{name:<20}: {best_time * 1000:8.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
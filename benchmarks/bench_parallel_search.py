@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the sequential and concurrent elf file search with artificial file system latency.
+
+Network file systems (NFS, SMB) add a round-trip to each directory listing, stat and file read.
+The benchmark emulates it by adding a delay to ``os.scandir``, ``os.stat`` and ``open`` calls of the search module.
+
+Usage::
+
+    python benchmarks/bench_parallel_search.py [--files 2000] [--dirs 40] [--latency 0.5] [--workers 1,4,16]
+"""
+import argparse
+import builtins
+import os
+import os.path
+import shutil
+import tempfile
+import time
+from unittest.mock import patch
+
+from vznncv.stlink.tools.wrapper import _search_utils
+from vznncv.stlink.tools.wrapper._cache_utils import CACHE_DIR_ENV_VAR
+from vznncv.stlink.tools.wrapper._search_utils import resolve_elf_file_location
+
+_DEMO_ELF = os.path.join(os.path.dirname(__file__), '..', 'tests', 'fixtures', 'stm_project_stub', 'build', 'demo.elf')
+_FILE_KINDS = ('.o', '.d', '', '.cmake', '', '.txt', '')
+
+
+def generate_build_tree(project_dir: str, *, file_count: int, dir_count: int):
+    build_dir = os.path.join(project_dir, 'build')
+    sub_dirs = [os.path.join(build_dir, f'module_{i}') for i in range(dir_count)]
+    for sub_dir in sub_dirs:
+        os.makedirs(sub_dir)
+    for i in range(file_count):
+        ext = _FILE_KINDS[i % len(_FILE_KINDS)]
+        with open(os.path.join(sub_dirs[i % dir_count], f'file_{i}{ext}'), 'wb') as f:
+            f.write(b'#!/bin/sh\n' if not ext else b'\0' * 16)
+    shutil.copy(_DEMO_ELF, os.path.join(sub_dirs[0], 'firmware'))
+
+    # directories that are modified recently aren't cached by the index
+    old_time = time.time() - 3600
+    for dir_path, _, _ in os.walk(build_dir):
+        os.utime(dir_path, (old_time, old_time))
+
+
+def slow_file_system(latency: float):
+    """
+    Add delay to the file system calls of the search module.
+    """
+    original_scandir = os.scandir
+    original_stat = os.stat
+    original_open = builtins.open
+
+    def slow_scandir(*args, **kwargs):
+        time.sleep(latency)
+        return original_scandir(*args, **kwargs)
+
+    def slow_stat(*args, **kwargs):
+        time.sleep(latency)
+        return original_stat(*args, **kwargs)
+
+    def slow_open(*args, **kwargs):
+        time.sleep(latency)
+        return original_open(*args, **kwargs)
+
+    patchers = [
+        patch.object(_search_utils.os, 'scandir', slow_scandir),
+        patch.object(_search_utils.os, 'stat', slow_stat),
+        patch.object(_search_utils, 'open', slow_open, create=True),
+    ]
+    for patcher in patchers:
+        patcher.start()
+    return patchers
+
+
+def measure(fn, repeat: int) -> float:
+    durations = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start_time)
+    return min(durations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=2000)
+    parser.add_argument('--dirs', type=int, default=40)
+    parser.add_argument('--latency', type=float, default=0.5, help='latency of each file system call in ms')
+    parser.add_argument('--workers', default='1,4,16', help='comma separated numbers of search threads')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    workers_values = [int(value) for value in args.workers.split(',')]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.environ[CACHE_DIR_ENV_VAR] = os.path.join(tmp_dir, 'cache')
+        project_dir = os.path.join(tmp_dir, 'project')
+        generate_build_tree(project_dir, file_count=args.files, dir_count=args.dirs)
+        expected_path = os.path.join(project_dir, 'build', 'module_0', 'firmware')
+
+        def resolve_without_index(workers):
+            assert resolve_elf_file_location(project_dir, None, use_index=False, workers=workers) == expected_path
+
+        def resolve_with_cold_index(workers):
+            shutil.rmtree(os.environ[CACHE_DIR_ENV_VAR], ignore_errors=True)
+            assert resolve_elf_file_location(project_dir, None, workers=workers) == expected_path
+
+        def resolve_with_warm_index(workers):
+            assert resolve_elf_file_location(project_dir, None, workers=workers) == expected_path
+
+        cases = [
+            ('full scan', resolve_without_index),
+            ('index (cold)', resolve_with_cold_index),
+            ('index (warm)', resolve_with_warm_index),
+        ]
+        print(f"Build tree: {args.files} files in {args.dirs + 1} directories, "
+              f"file system call latency: {args.latency} ms")
+        print(f"{'':<16}" + ''.join(f"{f'{workers} threads':>14}" for workers in workers_values))
+        patchers = slow_file_system(args.latency / 1000)
+        try:
+            for name, fn in cases:
+                durations = [measure(lambda: fn(workers), args.repeat) for workers in workers_values]
+                print(f"{name:<16}" + ''.join(f"{duration * 1000:11.1f} ms" for duration in durations))
+        finally:
+            for patcher in patchers:
+                patcher.stop()
+
+
+if __name__ == '__main__':
+    main()
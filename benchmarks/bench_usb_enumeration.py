@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Benchmark of libusb based ST-Link enumeration with a stubbed ``usb.core.find``.
+
+The stub emulates a host with thousands of usb devices. Device descriptor field reads are cheap,
+but serial number reading requires device opening and control transfers, so it's emulated with a delay.
+
+Usage::
+
+    python benchmarks/bench_usb_enumeration.py [--devices 5000] [--stlinks 16] [--serial-delay-ms 2]
+"""
+import argparse
+import os
+import tempfile
+import time
+from unittest.mock import patch
+
+import vznncv.stlink.tools.wrapper._stlink_utils as stlink_utils
+from vznncv.stlink.tools.wrapper._cache_utils import CACHE_DIR_ENV_VAR
+
+
+class FakeUsbDevice:
+    def __init__(self, *, idVendor, idProduct, serial_number, bus, address, serial_delay):
+        self.idVendor = idVendor
+        self.idProduct = idProduct
+        self.bus = bus
+        self.address = address
+        self._serial_number = serial_number
+        self._serial_delay = serial_delay
+
+    @property
+    def serial_number(self):
+        time.sleep(self._serial_delay)
+        return self._serial_number
+
+
+def make_fake_find(devices):
+    def fake_find(find_all=False, custom_match=None, **kwargs):
+        def match(dev):
+            return all(getattr(dev, k) == v for k, v in kwargs.items()) and (custom_match is None or custom_match(dev))
+
+        matched = (dev for dev in devices if match(dev))
+        return matched if find_all else next(matched, None)
+
+    return fake_find
+
+
+def legacy_get_stlink_serials():
+    """
+    Enumeration before VID/PID filtering and serial number caching.
+    """
+    result = []
+    for usb_dev in stlink_utils.usb.core.find(find_all=True):
+        if (usb_dev.idVendor, usb_dev.idProduct) not in stlink_utils._STLINK_DEVICE_TYPES:
+            continue
+        result.append(stlink_utils._normalize_serial_number(usb_dev.serial_number))
+    return result
+
+
+def current_get_stlink_serials():
+    return [d.serial_number for d in stlink_utils._get_libusb_stlink_devices()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--devices', type=int, default=5000)
+    parser.add_argument('--stlinks', type=int, default=16)
+    parser.add_argument('--serial-delay-ms', type=float, default=2.0)
+    args = parser.parse_args()
+
+    devices = []
+    for i in range(args.devices):
+        devices.append(FakeUsbDevice(idVendor=0x0BDA + i % 7, idProduct=0x0411 + i, serial_number=f'SN{i:010}',
+                                     bus=1 + i // 127, address=1 + i % 127, serial_delay=args.serial_delay_ms / 1000))
+    for i in range(args.stlinks):
+        devices.append(FakeUsbDevice(idVendor=0x0483, idProduct=0x374b, serial_number=f'{i:024X}',
+                                     bus=100, address=1 + i, serial_delay=args.serial_delay_ms / 1000))
+
+    with tempfile.TemporaryDirectory() as cache_dir, patch('usb.core.find', make_fake_find(devices)):
+        os.environ[CACHE_DIR_ENV_VAR] = cache_dir
+        cases = [
+            ('legacy enumeration', legacy_get_stlink_serials),
+            ('filtered (cold cache)', current_get_stlink_serials),
+            ('filtered (warm cache)', current_get_stlink_serials),
+        ]
+        for name, fn in cases:
+            start_time = time.perf_counter()
+            serials = fn()
+            elapsed = time.perf_counter() - start_time
+            assert len(serials) == args.stlinks
+            print(f"{name:<24}: {elapsed * 1000:8.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
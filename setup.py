@@ -37,10 +37,14 @@ setup(
         ]
     },
     install_requires=[
-        'click',
+        'click>=8.0',
         'pyusb',
         'cached_property'
     ],
+    extras_require={
+        'pyocd': ['pyocd'],
+        'config': ['tomli; python_version < "3.11"']
+    },
     tests_require=test_requirements,
     version=__version__
 )
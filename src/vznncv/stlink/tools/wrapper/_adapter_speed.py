@@ -0,0 +1,78 @@
+"""
+Helper module to choose debug adapter (SWD) clock.
+
+In the automatic mode the upload starts with the highest clock of the ST-Link speed ladder. If the upload fails,
+it's repeated with the next lower clock. The clock of the successful upload is remembered for the device
+and the target, so the next uploads start with it.
+"""
+import logging
+import threading
+import time
+from typing import Optional, Tuple
+
+from ._cache_utils import get_cache_path, read_json_file, write_json_file
+from ._stlink_utils import StLinkDevice
+
+logger = logging.getLogger(__name__)
+
+ADAPTER_SPEED_AUTO = 'auto'
+
+# SWD clocks (kHz) that are supported by ST-Link firmware
+_SPEED_LADDERS = {
+    'V2': (4000, 1800, 950, 480, 240, 125),
+    'V3': (24000, 8000, 3300, 1000, 200),
+}
+# maximal number of the clock reductions during one upload
+MAX_SPEED_BACKOFF_STEPS = 3
+
+_ADAPTER_SPEEDS_FILE = 'adapter_speeds.json'
+_adapter_speeds_lock = threading.Lock()
+
+
+def get_adapter_speed_ladder(stlink_device: StLinkDevice) -> Tuple[int, ...]:
+    """
+    Get supported SWD clocks of the device in descending order.
+    """
+    version = stlink_device.type.version.upper()
+    return _SPEED_LADDERS['V3' if version.startswith('V3') else 'V2']
+
+
+def get_lower_adapter_speed(ladder: Tuple[int, ...], speed_khz: int) -> Optional[int]:
+    """
+    Get next lower clock of the ladder or ``None`` if ``speed_khz`` is the lowest one.
+    """
+    for ladder_speed in ladder:
+        if ladder_speed < speed_khz:
+            return ladder_speed
+    return None
+
+
+def _get_speed_key(hla_serial: str, target: Optional[str]) -> str:
+    return f'{hla_serial.upper()}:{target}'
+
+
+def get_cached_adapter_speed(hla_serial: str, target: Optional[str]) -> Optional[int]:
+    """
+    Get clock of the last successful automatic upload.
+    """
+    speeds = read_json_file(get_cache_path(_ADAPTER_SPEEDS_FILE, create_dir=False), default={})
+    entry = speeds.get(_get_speed_key(hla_serial, target)) if isinstance(speeds, dict) else None
+    if not isinstance(entry, dict) or not isinstance(entry.get('speed_khz'), int):
+        return None
+    return entry['speed_khz']
+
+
+def store_adapter_speed(hla_serial: str, target: Optional[str], speed_khz: int):
+    """
+    Remember clock of the successful automatic upload.
+    """
+    speeds_path = get_cache_path(_ADAPTER_SPEEDS_FILE)
+    with _adapter_speeds_lock:
+        speeds = read_json_file(speeds_path, default={})
+        if not isinstance(speeds, dict):
+            speeds = {}
+        speeds[_get_speed_key(hla_serial, target)] = {'speed_khz': speed_khz, 'timestamp': time.time()}
+        try:
+            write_json_file(speeds_path, speeds)
+        except OSError as e:
+            logger.debug(f"Cannot save adapter speeds \"{speeds_path}\": {e}")
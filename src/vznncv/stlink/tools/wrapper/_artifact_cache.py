@@ -0,0 +1,392 @@
+"""
+Helper module to cache firmware artifacts that are produced from .elf files.
+
+Artifacts are stored in the user cache directory and are addressed by SHA-256 hash of the .elf file content.
+Each artifact contains loadable segments of the image, metadata and converted images (binary or Intel HEX)
+that are created on demand. The least recently used artifacts are removed if total cache size exceeds the limit.
+
+Several images (.elf files and binary files with load addresses) can be combined into one artifact, so they are
+programmed by a single backend invocation.
+"""
+import hashlib
+import json
+import logging
+import os
+import os.path
+import shutil
+import time
+from typing import NamedTuple, List, Optional, Tuple, Sequence
+
+from ._cache_utils import get_cache_dir, get_cache_path, read_json_file, write_json_file, write_binary_file
+from ._elf_utils import ElfLoadSegment, read_elf_load_segments, compute_segments_hash, pack_segments, \
+    unpack_segments, is_elf_file
+
+logger = logging.getLogger(__name__)
+
+_ARTIFACTS_DIR = 'artifacts'
+_METADATA_FILE = 'metadata.json'
+_SEGMENTS_FILE = 'segments.bin'
+_IMAGE_FILES = {'bin': 'image.bin', 'hex': 'image.hex'}
+_METADATA_VERSION = 1
+
+DEFAULT_MAX_CACHE_SIZE = 256 * 1024 * 1024
+# maximal gap between segments that is filled in the binary image
+_MAX_BIN_GAP = 1024 * 1024
+
+IMAGE_FORMATS = ('elf', 'bin', 'hex')
+
+
+class ImageFile(NamedTuple):
+    """
+    Image file that is passed to the upload backend.
+    """
+    path: str
+    # "elf", "bin" or "hex"
+    format: str
+    # load address of the binary image
+    base_address: Optional[int] = None
+
+
+class ImageSource(NamedTuple):
+    """
+    Image that is combined with other images.
+    """
+    # .elf or binary file path
+    path: str
+    # load address of the binary file. It isn't used for .elf files
+    base_address: Optional[int] = None
+
+    def __str__(self):
+        return self.path if self.base_address is None else f'{self.path}@0x{self.base_address:08X}'
+
+
+def parse_image_source(value: str) -> ImageSource:
+    """
+    Parse image description ``PATH[@ADDRESS]``.
+    """
+    path, sep, address = value.rpartition('@')
+    if not sep:
+        return ImageSource(path=value)
+    try:
+        base_address = int(address, 0)
+    except ValueError:
+        raise ValueError(f"Invalid load address of the image \"{value}\": {address}") from None
+    if not path or base_address < 0:
+        raise ValueError(f"Invalid image \"{value}\"")
+    return ImageSource(path=path, base_address=base_address)
+
+
+class ImageArtifact(NamedTuple):
+    elf_file: str
+    # SHA-256 hash of the elf file content
+    elf_sha256: str
+    # hash of the loadable segments (see ``compute_segments_hash``)
+    image_hash: str
+    segments: List[ElfLoadSegment]
+    # image file of the requested format
+    image_file: ImageFile
+
+    @property
+    def image_size(self) -> int:
+        return sum(len(segment.data) for segment in self.segments)
+
+
+def compute_file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def convert_segments_to_bin(segments: List[ElfLoadSegment], *, fill_byte: int = 0xFF) -> Tuple[int, bytes]:
+    """
+    Convert segments into a continuous binary image. Gaps between segments are filled with ``fill_byte``.
+
+    :return: image base address and data
+    """
+    segments = sorted((segment for segment in segments if segment.data), key=lambda segment: segment.address)
+    if not segments:
+        raise ValueError("Image doesn't have loadable data")
+    base_address = segments[0].address
+    data = bytearray()
+    for segment in segments:
+        offset = segment.address - base_address
+        if offset < len(data):
+            raise ValueError(f"Image segments overlap at 0x{segment.address:08X}")
+        gap = offset - len(data)
+        if gap > _MAX_BIN_GAP:
+            raise ValueError(f"Image segments have too big gap ({gap} bytes) at 0x{segment.address:08X} "
+                             f"to convert them into binary image")
+        data.extend(bytes([fill_byte]) * gap)
+        data.extend(segment.data)
+    return base_address, bytes(data)
+
+
+def _format_ihex_record(record_type: int, address: int, data: bytes) -> str:
+    record = bytes([len(data), (address >> 8) & 0xFF, address & 0xFF, record_type]) + data
+    checksum = (-sum(record)) & 0xFF
+    return f':{record.hex().upper()}{checksum:02X}'
+
+
+def convert_segments_to_ihex(segments: List[ElfLoadSegment], *, record_size: int = 16) -> str:
+    """
+    Convert segments into Intel HEX format with extended linear address records.
+    """
+    lines = []
+    upper_address = None
+    for segment in sorted(segments, key=lambda segment: segment.address):
+        offset = 0
+        while offset < len(segment.data):
+            address = segment.address + offset
+            if address >> 16 != upper_address:
+                upper_address = address >> 16
+                lines.append(_format_ihex_record(0x04, 0, upper_address.to_bytes(2, 'big')))
+            # records shouldn't cross 64 KiB boundary
+            chunk_size = min(record_size, len(segment.data) - offset, 0x10000 - (address & 0xFFFF))
+            lines.append(_format_ihex_record(0x00, address & 0xFFFF, bytes(segment.data[offset:offset + chunk_size])))
+            offset += chunk_size
+    lines.append(_format_ihex_record(0x01, 0, b''))
+    return '\n'.join(lines) + '\n'
+
+
+def _get_artifacts_dir() -> str:
+    return os.path.join(get_cache_dir(), _ARTIFACTS_DIR)
+
+
+def _get_artifact_path(elf_sha256: str, file_name: str) -> str:
+    return get_cache_path(_ARTIFACTS_DIR, elf_sha256, file_name, create_dir=False)
+
+
+def _load_artifact_segments(elf_sha256: str) -> Optional[Tuple[dict, List[ElfLoadSegment]]]:
+    metadata = read_json_file(_get_artifact_path(elf_sha256, _METADATA_FILE))
+    if not isinstance(metadata, dict) or metadata.get('version') != _METADATA_VERSION:
+        return None
+    try:
+        with open(_get_artifact_path(elf_sha256, _SEGMENTS_FILE), 'rb') as f:
+            segments = unpack_segments(f.read())
+    except (OSError, ValueError) as e:
+        logger.debug(f"Cannot read artifact {elf_sha256}: {e}")
+        return None
+    if compute_segments_hash(segments) != metadata.get('image_hash'):
+        logger.debug(f"Segments of the artifact {elf_sha256} don't match its metadata")
+        return None
+    return metadata, segments
+
+
+def _store_artifact(elf_file: str, elf_sha256: str, segments: List[ElfLoadSegment]) -> dict:
+    image_hash = compute_segments_hash(segments)
+    metadata = {
+        'version': _METADATA_VERSION,
+        'elf_file': elf_file,
+        'elf_sha256': elf_sha256,
+        'image_hash': image_hash,
+        'segments': [{'address': segment.address, 'size': len(segment.data)} for segment in segments],
+        'created': time.time()
+    }
+    write_binary_file(_get_artifact_path(elf_sha256, _SEGMENTS_FILE), pack_segments(segments))
+    # metadata is written last, so it marks complete artifact
+    write_json_file(_get_artifact_path(elf_sha256, _METADATA_FILE), metadata)
+    return metadata
+
+
+def _ensure_image_file(elf_sha256: str, segments: List[ElfLoadSegment], image_format: str) -> ImageFile:
+    image_path = _get_artifact_path(elf_sha256, _IMAGE_FILES[image_format])
+    base_address = None
+    if image_format == 'bin':
+        base_address = min((segment.address for segment in segments if segment.data), default=0)
+    if not os.path.isfile(image_path):
+        logger.debug(f"Convert image {elf_sha256} to {image_format} format")
+        if image_format == 'bin':
+            base_address, data = convert_segments_to_bin(segments)
+        else:
+            data = convert_segments_to_ihex(segments).encode('ascii')
+        write_binary_file(image_path, data)
+    return ImageFile(path=image_path, format=image_format, base_address=base_address)
+
+
+def _touch_artifact(elf_sha256: str):
+    try:
+        os.utime(_get_artifact_path(elf_sha256, _METADATA_FILE))
+    except OSError:
+        pass
+
+
+def get_image_artifact(elf_file: str, *, image_format: str = 'elf',
+                       max_cache_size: int = DEFAULT_MAX_CACHE_SIZE) -> ImageArtifact:
+    """
+    Get cached artifact of the .elf file. If it isn't cached, the .elf file is parsed and the artifact is stored.
+
+    :param elf_file: .elf file path
+    :param image_format: format of the image file: "elf" (the original file), "bin" or "hex"
+    :param max_cache_size: maximal total size of the cached artifacts
+    :return: image artifact
+    """
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f"Unknown image format: {image_format}")
+    elf_file = os.path.abspath(elf_file)
+    elf_sha256 = compute_file_sha256(elf_file)
+
+    cached_artifact = _load_artifact_segments(elf_sha256)
+    if cached_artifact is not None:
+        logger.debug(f"Use cached artifact {elf_sha256}")
+        metadata, segments = cached_artifact
+        _touch_artifact(elf_sha256)
+    else:
+        segments = read_elf_load_segments(elf_file)
+        metadata = _store_artifact(elf_file, elf_sha256, segments)
+
+    if image_format == 'elf':
+        image_file = ImageFile(path=elf_file, format='elf')
+    else:
+        image_file = _ensure_image_file(elf_sha256, segments, image_format)
+    if cached_artifact is None or image_format != 'elf':
+        evict_artifacts(max_cache_size, keep=(elf_sha256,))
+
+    return ImageArtifact(
+        elf_file=elf_file,
+        elf_sha256=elf_sha256,
+        image_hash=metadata['image_hash'],
+        segments=segments,
+        image_file=image_file
+    )
+
+
+def _get_image_ranges(segments: List[ElfLoadSegment]) -> List[Tuple[int, int]]:
+    ranges = []
+    for segment in sorted(segments, key=lambda segment: segment.address):
+        if not segment.data:
+            continue
+        end_address = segment.address + len(segment.data)
+        if ranges and segment.address <= ranges[-1][1]:
+            ranges[-1] = (ranges[-1][0], max(ranges[-1][1], end_address))
+        else:
+            ranges.append((segment.address, end_address))
+    return ranges
+
+
+def check_image_overlaps(images: Sequence[Tuple[ImageSource, List[ElfLoadSegment]]]):
+    """
+    Check that memory regions of the images don't overlap.
+
+    :raises ValueError: if any images overlap
+    """
+    image_ranges = [(image_source, _get_image_ranges(segments)) for image_source, segments in images]
+    for i, (image_source, ranges) in enumerate(image_ranges):
+        for other_image_source, other_ranges in image_ranges[i + 1:]:
+            for start_address, end_address in ranges:
+                for other_start_address, other_end_address in other_ranges:
+                    if start_address < other_end_address and other_start_address < end_address:
+                        raise ValueError(f"Images \"{image_source}\" and \"{other_image_source}\" overlap at "
+                                         f"0x{max(start_address, other_start_address):08X}")
+
+
+def _read_image_source(image_source: ImageSource) -> Tuple[str, List[ElfLoadSegment]]:
+    if is_elf_file(image_source.path):
+        if image_source.base_address is not None:
+            raise ValueError(f"Load address cannot be set for elf image \"{image_source}\"")
+        artifact = get_image_artifact(image_source.path)
+        return artifact.elf_sha256, artifact.segments
+    if image_source.base_address is None:
+        raise ValueError(f"Image \"{image_source.path}\" isn't an elf file, so its load address must be set")
+    with open(image_source.path, 'rb') as f:
+        data = f.read()
+    if not data:
+        raise ValueError(f"Image \"{image_source.path}\" is empty")
+    return hashlib.sha256(data).hexdigest(), [ElfLoadSegment(address=image_source.base_address, data=data)]
+
+
+def get_combined_image_artifact(image_sources: Sequence[ImageSource], *, image_format: str = 'hex',
+                                max_cache_size: int = DEFAULT_MAX_CACHE_SIZE) -> ImageArtifact:
+    """
+    Combine several images into one artifact.
+
+    The images must not overlap. The artifact is addressed by hashes and load addresses of the images.
+
+    :param image_sources: .elf files and binary files with load addresses
+    :param image_format: format of the combined image file: "hex" or "bin" ("elf" is replaced by "hex")
+    :param max_cache_size: maximal total size of the cached artifacts
+    :return: image artifact. Its ``elf_file`` is the first image
+    """
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f"Unknown image format: {image_format}")
+    image_sources = [image_source._replace(path=os.path.abspath(image_source.path))
+                     for image_source in image_sources]
+    images = []
+    image_keys = []
+    for image_source in image_sources:
+        image_sha256, segments = _read_image_source(image_source)
+        images.append((image_source, segments))
+        image_keys.append([image_sha256, image_source.base_address])
+    check_image_overlaps(images)
+    artifact_key = hashlib.sha256(json.dumps(['combined', image_keys]).encode('utf-8')).hexdigest()
+
+    cached_artifact = _load_artifact_segments(artifact_key)
+    if cached_artifact is not None:
+        logger.debug(f"Use cached artifact {artifact_key}")
+        metadata, segments = cached_artifact
+        _touch_artifact(artifact_key)
+    else:
+        segments = sorted((segment for _, image_segments in images for segment in image_segments),
+                          key=lambda segment: segment.address)
+        metadata = _store_artifact(', '.join(str(image_source) for image_source in image_sources),
+                                   artifact_key, segments)
+    image_file = _ensure_image_file(artifact_key, segments, 'hex' if image_format == 'elf' else image_format)
+    evict_artifacts(max_cache_size, keep=(artifact_key, *(image_key for image_key, _ in image_keys)))
+
+    return ImageArtifact(
+        elf_file=image_sources[0].path,
+        elf_sha256=artifact_key,
+        image_hash=metadata['image_hash'],
+        segments=segments,
+        image_file=image_file
+    )
+
+
+def _get_dir_size(path: str) -> int:
+    size = 0
+    for dir_entry in os.scandir(path):
+        try:
+            if dir_entry.is_file(follow_symlinks=False):
+                size += dir_entry.stat(follow_symlinks=False).st_size
+        except OSError:
+            pass
+    return size
+
+
+def evict_artifacts(max_cache_size: int, *, keep: Tuple[str, ...] = ()) -> List[str]:
+    """
+    Remove the least recently used artifacts until total cache size is less than ``max_cache_size``.
+
+    :param max_cache_size: maximal cache size in bytes
+    :param keep: hashes of the artifacts that shouldn't be removed
+    :return: hashes of the removed artifacts
+    """
+    artifacts_dir = _get_artifacts_dir()
+    artifacts = []
+    try:
+        dir_entries = list(os.scandir(artifacts_dir))
+    except FileNotFoundError:
+        return []
+    for dir_entry in dir_entries:
+        if not dir_entry.is_dir(follow_symlinks=False):
+            continue
+        try:
+            last_used = os.stat(os.path.join(dir_entry.path, _METADATA_FILE)).st_mtime
+        except OSError:
+            # incomplete artifact
+            last_used = 0.0
+        artifacts.append((last_used, dir_entry.name, _get_dir_size(dir_entry.path)))
+
+    total_size = sum(size for _, _, size in artifacts)
+    removed_artifacts = []
+    for _, elf_sha256, size in sorted(artifacts):
+        if total_size <= max_cache_size:
+            break
+        if elf_sha256 in keep:
+            continue
+        logger.debug(f"Remove cached artifact {elf_sha256}")
+        shutil.rmtree(os.path.join(artifacts_dir, elf_sha256), ignore_errors=True)
+        total_size -= size
+        removed_artifacts.append(elf_sha256)
+    return removed_artifacts
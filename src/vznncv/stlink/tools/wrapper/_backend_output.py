@@ -0,0 +1,317 @@
+"""
+Helper module to process output of the upload backends (OpenOCD and PyOCD).
+
+Backend output is processed line by line. Known lines (erase, program, verify results and errors)
+are converted into progress events, that can be shown as short status lines or json lines.
+"""
+import collections
+import json
+import re
+import sys
+import threading
+import time
+from typing import NamedTuple, Optional, List, Dict, Any, TextIO, Callable
+
+_DEFAULT_LOG_BUFFER_SIZE = 1000
+# progress step of the text output, that cannot be updated in place
+_PROGRESS_LINE_STEP = 25
+
+# backend invocation phases, that are detected by output events
+BACKEND_PHASES = ('startup', 'program', 'verify', 'finish')
+_EVENT_PHASES = {
+    'program_started': 'program',
+    'progress': 'program',
+    'program_finished': 'finish',
+    'verify_started': 'verify',
+    'verify_finished': 'finish',
+}
+
+
+class BackendEvent(NamedTuple):
+    timestamp: float
+    # event kind: "program_started", "erased", "programmed", "program_finished",
+    # "verify_started", "verified", "verify_finished", "progress", "error"
+    kind: str
+    # backend output line that produces the event
+    message: str
+    bytes: Optional[int] = None
+    # operation duration in seconds
+    duration: Optional[float] = None
+    # operation speed in bytes per second
+    rate: Optional[float] = None
+    # operation progress from 0.0 to 1.0
+    progress: Optional[float] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {key: value for key, value in self._asdict().items() if value is not None}
+
+
+_UNIT_FACTORS = {'b': 1, 'kib': 1024, 'kb': 1024, 'mib': 1024 * 1024, 'mb': 1024 * 1024}
+
+
+def _parse_rate(value: str, unit: str) -> float:
+    return float(value) * _UNIT_FACTORS[unit.lower()]
+
+
+class BackendOutputParser:
+    """
+    Base class of the backend output parsers.
+    """
+
+    def parse_line(self, line: str) -> List[BackendEvent]:
+        raise NotImplementedError
+
+
+class OpenOcdOutputParser(BackendOutputParser):
+    _MARKER_EVENTS = {
+        'Programming Started': 'program_started',
+        'Programming Finished': 'program_finished',
+        'Verify Started': 'verify_started',
+        'Verified OK': 'verify_finished',
+    }
+    _MARKER_REGEX = re.compile(r'^\*\*\s*(?P<marker>.+?)\s*\*\*$')
+    _TRANSFER_REGEX = re.compile(
+        r'^(?P<operation>wrote|verified)\s+(?P<bytes>\d+)\s+bytes.*?\s+in\s+(?P<duration>[\d.]+)s'
+        r'(?:\s+\((?P<rate>[\d.]+)\s*(?P<rate_unit>[KMk]i?B|B)/s\))?'
+    )
+    _ERASE_REGEX = re.compile(r'^erased sectors\s.*?(?:\s+in\s+(?P<duration>[\d.]+)s)?$')
+    _ERROR_REGEX = re.compile(r'^(?:Error:|\*\*\s*(?:Programming|Verify) Failed)')
+
+    def parse_line(self, line: str) -> List[BackendEvent]:
+        line = line.strip()
+        timestamp = time.time()
+        m = self._MARKER_REGEX.match(line)
+        if m is not None and m.group('marker') in self._MARKER_EVENTS:
+            return [BackendEvent(timestamp=timestamp, kind=self._MARKER_EVENTS[m.group('marker')], message=line)]
+        m = self._TRANSFER_REGEX.match(line)
+        if m is not None:
+            return [BackendEvent(
+                timestamp=timestamp,
+                kind='programmed' if m.group('operation') == 'wrote' else 'verified',
+                message=line,
+                bytes=int(m.group('bytes')),
+                duration=float(m.group('duration')),
+                rate=_parse_rate(m.group('rate'), m.group('rate_unit')) if m.group('rate') else None
+            )]
+        m = self._ERASE_REGEX.match(line)
+        if m is not None:
+            return [BackendEvent(timestamp=timestamp, kind='erased', message=line,
+                                 duration=float(m.group('duration')) if m.group('duration') else None)]
+        if self._ERROR_REGEX.match(line):
+            return [BackendEvent(timestamp=timestamp, kind='error', message=line)]
+        return []
+
+
+class PyOcdOutputParser(BackendOutputParser):
+    _SUMMARY_REGEX = re.compile(
+        r'Erased\s+(?P<erased>\d+)\s+bytes.*?programmed\s+(?P<programmed>\d+)\s+bytes.*?'
+        r'at\s+(?P<rate>[\d.]+)\s*(?P<rate_unit>[KMk]i?B|B)/s'
+    )
+    _PROGRESS_REGEX = re.compile(r'\[[=>\s]*\]\s*(?P<percent>\d+)%')
+    # old "0001234:ERROR:module:message" and new "0001234 E message [module]" log formats
+    _ERROR_REGEX = re.compile(r'(?::(?:ERROR|CRITICAL):|^\s*\d+\s+[EC]\s|^Error:)')
+
+    def __init__(self):
+        self._last_percent = None
+
+    def parse_line(self, line: str) -> List[BackendEvent]:
+        timestamp = time.time()
+        events = []
+        # progress bar is updated with carriage return
+        for percent in self._PROGRESS_REGEX.findall(line):
+            percent = int(percent)
+            if percent != self._last_percent:
+                self._last_percent = percent
+                events.append(BackendEvent(timestamp=timestamp, kind='progress', message=line.strip(),
+                                           progress=percent / 100))
+        line = line.split('\r')[-1].strip()
+        m = self._SUMMARY_REGEX.search(line)
+        if m is not None:
+            events.append(BackendEvent(timestamp=timestamp, kind='erased', message=line,
+                                       bytes=int(m.group('erased'))))
+            events.append(BackendEvent(timestamp=timestamp, kind='programmed', message=line,
+                                       bytes=int(m.group('programmed')),
+                                       rate=_parse_rate(m.group('rate'), m.group('rate_unit'))))
+        elif self._ERROR_REGEX.search(line):
+            events.append(BackendEvent(timestamp=timestamp, kind='error', message=line))
+        return events
+
+
+def create_output_parser(backend: str) -> BackendOutputParser:
+    if backend == 'openocd':
+        return OpenOcdOutputParser()
+    elif backend == 'pyocd':
+        return PyOcdOutputParser()
+    else:
+        raise ValueError(f"Unknown backend: {backend}")
+
+
+class OutputSettings(NamedTuple):
+    # "text" - raw backend logs, "json" - progress events as json lines in the stdout
+    output_format: str = 'text'
+    # keep backend logs in memory and show them only on failure
+    quiet: bool = False
+    log_buffer_size: int = _DEFAULT_LOG_BUFFER_SIZE
+
+
+def _is_tty(stream: TextIO) -> bool:
+    try:
+        return stream.isatty()
+    except (AttributeError, ValueError):
+        return False
+
+
+def _format_event_text(event: BackendEvent) -> Optional[str]:
+    if event.kind == 'error':
+        return event.message
+    elif event.kind in ('programmed', 'verified', 'erased'):
+        parts = [event.kind]
+        if event.bytes is not None:
+            parts.append(f'{event.bytes} bytes')
+        if event.duration is not None:
+            parts.append(f'in {event.duration:.3f}s')
+        if event.rate is not None:
+            parts.append(f'({event.rate / 1024:.2f} KiB/s)')
+        return ' '.join(parts)
+    return None
+
+
+class DeviceOutput:
+    """
+    Output of the backends that are run for one device.
+
+    :param settings: output settings
+    :param hla_serial: device serial number
+    :param lock: lock that is shared between concurrent uploads
+    :param prefix_lines: prefix output lines with device serial number
+    :param event_handler: optional callback that is invoked with backend name and each event
+    """
+
+    def __init__(self, settings: OutputSettings, *, hla_serial: str, lock: Optional[threading.Lock] = None,
+                 prefix_lines: bool = False, log_stream: Optional[TextIO] = None,
+                 event_stream: Optional[TextIO] = None,
+                 event_handler: Optional[Callable[[str, BackendEvent], None]] = None):
+        self.settings = settings
+        self.hla_serial = hla_serial
+        self._lock = lock if lock is not None else threading.Lock()
+        self._prefix = f'[{hla_serial}] ' if prefix_lines else ''
+        self._log_stream = log_stream
+        self._event_stream = event_stream
+        self._event_handler = event_handler
+        # progress line, that is updated in place and isn't terminated yet
+        self._progress_line_active = False
+        self._last_progress_step = None
+
+    @property
+    def log_stream(self) -> TextIO:
+        return self._log_stream if self._log_stream is not None else sys.stderr
+
+    @property
+    def event_stream(self) -> TextIO:
+        return self._event_stream if self._event_stream is not None else sys.stdout
+
+    def write_log_lines(self, lines: List[str]):
+        with self._lock:
+            self._end_progress_line()
+            for line in lines:
+                self.log_stream.write(f'{self._prefix}{line}\n')
+            self.log_stream.flush()
+
+    def write_event(self, backend: str, event: BackendEvent, *, logged: bool = False):
+        """
+        Show backend event.
+
+        :param backend: backend name
+        :param event: event
+        :param logged: the event line is shown with backend logs already
+        """
+        if self._event_handler is not None:
+            self._event_handler(backend, event)
+        if self.settings.output_format == 'json':
+            event_dict = {'hla_serial': self.hla_serial, 'backend': backend}
+            event_dict.update(event.to_dict())
+            with self._lock:
+                self.event_stream.write(json.dumps(event_dict) + '\n')
+                self.event_stream.flush()
+        elif event.kind == 'progress':
+            if not logged:
+                self._write_progress(backend, event.progress)
+        elif event.kind == 'program_started':
+            self._last_progress_step = None
+        elif self.settings.quiet:
+            event_text = _format_event_text(event)
+            if event_text is not None:
+                self.write_log_lines([f'{backend}: {event_text}'])
+
+    def _write_progress(self, backend: str, progress: float):
+        percent = int(progress * 100)
+        progress_text = f'{self._prefix}{backend}: {percent}%'
+        with self._lock:
+            if self._prefix or not _is_tty(self.log_stream):
+                # lines of the concurrent uploads or redirected output cannot be updated in place
+                progress_step = percent // _PROGRESS_LINE_STEP
+                if progress_step == self._last_progress_step:
+                    return
+                self._last_progress_step = progress_step
+                self.log_stream.write(f'{progress_text}\n')
+            else:
+                self.log_stream.write(f'\r{progress_text}')
+                self._progress_line_active = True
+                if percent >= 100:
+                    self._end_progress_line()
+            self.log_stream.flush()
+
+    def _end_progress_line(self):
+        if self._progress_line_active:
+            self._progress_line_active = False
+            self.log_stream.write('\n')
+
+    def open_stream(self, backend: str) -> 'BackendOutputStream':
+        return BackendOutputStream(self, backend)
+
+
+class BackendOutputStream:
+    """
+    Output of a single backend invocation.
+    """
+
+    def __init__(self, device_output: DeviceOutput, backend: str):
+        self._device_output = device_output
+        self._backend = backend
+        self._parser = create_output_parser(backend)
+        self._quiet = device_output.settings.quiet
+        self._log_buffer = collections.deque(maxlen=device_output.settings.log_buffer_size)
+        self._line_count = 0
+        self.events: List[BackendEvent] = []
+        # current backend phase (see ``BACKEND_PHASES``)
+        self.phase = 'startup'
+
+    def feed_line(self, line: str):
+        self._line_count += 1
+        if self._quiet:
+            self._log_buffer.append(line)
+        else:
+            self._device_output.write_log_lines([line.split('\r')[-1]])
+        for event in self._parser.parse_line(line):
+            self.events.append(event)
+            self.phase = _EVENT_PHASES.get(event.kind, self.phase)
+            self._device_output.write_event(self._backend, event, logged=not self._quiet)
+
+    def feed_text(self, text: str):
+        for line in text.splitlines():
+            self.feed_line(line)
+
+    def finish(self, success: bool):
+        """
+        Complete backend output processing. In quiet mode the buffered logs are shown if backend has failed.
+        """
+        if success or not self._quiet or not self._log_buffer:
+            return
+        skipped_lines = self._line_count - len(self._log_buffer)
+        header = f'{self._backend} logs'
+        if skipped_lines:
+            header += f' (last {len(self._log_buffer)} lines, {skipped_lines} lines are skipped)'
+        log_lines = [f'==== {header} ====']
+        log_lines.extend(line.split('\r')[-1] for line in self._log_buffer)
+        log_lines.append(f'==== end of {header} ====')
+        self._device_output.write_log_lines(log_lines)
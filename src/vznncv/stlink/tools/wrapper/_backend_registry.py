@@ -0,0 +1,146 @@
+"""
+Helper module to detect versions and capabilities of the backend tools.
+
+Each tool is probed with ``--version`` once. The result is cached by the executable path, size and modification
+time, so the tool isn't run again until it's updated.
+"""
+import logging
+import os
+import os.path
+import re
+from typing import NamedTuple, Optional, Tuple, Dict, Pattern
+
+from ._cache_utils import get_cache_path, read_json_file, write_json_file
+from ._process_utils import ProcessRunner, ProcessTimeoutError
+
+logger = logging.getLogger(__name__)
+
+# OpenOCD 0.11+ matches ST-Link serial numbers as hex strings, so non-ascii workaround isn't needed
+OPENOCD_HEX_SERIAL = 'hex_serial'
+# OpenOCD 0.12+ provides driver independent "adapter serial" command instead of deprecated "hla_serial"
+OPENOCD_ADAPTER_SERIAL = 'adapter_serial'
+# OpenOCD 0.11+ provides "adapter speed" command instead of deprecated "adapter_khz"
+OPENOCD_ADAPTER_SPEED = 'adapter_speed'
+
+# verification modes of the programmed image: skip verification, read target memory back or compare checksums
+# of the host image with target-side calculated ones
+VERIFY_NONE = 'none'
+VERIFY_READBACK = 'readback'
+VERIFY_CRC = 'crc'
+VERIFY_MODES = (VERIFY_NONE, VERIFY_READBACK, VERIFY_CRC)
+
+
+class _BackendSpec(NamedTuple):
+    version_re: Pattern
+    # capabilities and minimal versions that provide them
+    capabilities: Dict[str, Tuple[int, ...]]
+
+
+_BACKEND_SPECS = {
+    'openocd': _BackendSpec(
+        version_re=re.compile(r'Open On-Chip Debugger\s+v?(\d+(?:\.\d+)*)'),
+        capabilities={
+            OPENOCD_HEX_SERIAL: (0, 11),
+            OPENOCD_ADAPTER_SERIAL: (0, 12),
+            OPENOCD_ADAPTER_SPEED: (0, 11),
+        }
+    ),
+    'pyocd': _BackendSpec(
+        version_re=re.compile(r'^\s*v?(\d+(?:\.\d+)+)', re.MULTILINE),
+        capabilities={}
+    ),
+}
+
+_BACKEND_CACHE_FILE = 'backends.json'
+_PROBE_TIMEOUT = 10.0
+
+
+class BackendInfo(NamedTuple):
+    name: str
+    path: str
+    # ``None`` if version cannot be detected
+    version: Optional[Tuple[int, ...]]
+    capabilities: Tuple[str, ...] = ()
+
+    def has_capability(self, capability: str) -> bool:
+        return capability in self.capabilities
+
+    @property
+    def version_str(self) -> str:
+        return 'unknown version' if self.version is None else '.'.join(str(v) for v in self.version)
+
+    def __str__(self):
+        return f"{self.name} {self.version_str} ({self.path})"
+
+
+def parse_backend_version(backend: str, output: str) -> Optional[Tuple[int, ...]]:
+    """
+    Parse version from the backend ``--version`` output.
+    """
+    match = _BACKEND_SPECS[backend].version_re.search(output)
+    if match is None:
+        return None
+    return tuple(int(part) for part in match.group(1).split('.'))
+
+
+def _get_capabilities(backend: str, version: Optional[Tuple[int, ...]]) -> Tuple[str, ...]:
+    if version is None:
+        return ()
+    return tuple(sorted(
+        capability for capability, min_version in _BACKEND_SPECS[backend].capabilities.items()
+        if version >= min_version
+    ))
+
+
+def _run_version_command(backend: str, path: str, timeout: float) -> Optional[str]:
+    logger.debug(f"Probe {backend} version: {path}")
+    output_lines = []
+    try:
+        ProcessRunner(timeout=timeout).run_process([path, '--version'], cwd=None, line_handler=output_lines.append)
+    except (OSError, ProcessTimeoutError) as e:
+        logger.debug(f"Cannot probe {backend} version: {e}")
+        return None
+    return '\n'.join(output_lines)
+
+
+def get_backend_info(backend: str, path: str, *, timeout: float = _PROBE_TIMEOUT) -> BackendInfo:
+    """
+    Get backend version and capabilities.
+
+    If version cannot be detected, no capabilities are reported, so the most compatible command lines are used.
+
+    :param backend: backend name ("openocd" or "pyocd")
+    :param path: backend executable path
+    :param timeout: timeout of the version probe
+    """
+    if backend not in _BACKEND_SPECS:
+        raise ValueError(f"Unknown backend: {backend}")
+    path = os.path.abspath(path)
+    real_path = os.path.realpath(path)
+    try:
+        path_stat = os.stat(real_path)
+        stamp = [path_stat.st_size, path_stat.st_mtime_ns]
+    except OSError:
+        stamp = None
+
+    cache_path = get_cache_path(_BACKEND_CACHE_FILE, create_dir=False)
+    cache = read_json_file(cache_path, default={})
+    if not isinstance(cache, dict):
+        cache = {}
+    cache_key = f'{backend}:{real_path}'
+    entry = cache.get(cache_key)
+    if stamp is not None and isinstance(entry, dict) and entry.get('stamp') == stamp:
+        version = entry.get('version')
+        version = None if version is None else tuple(version)
+    else:
+        output = _run_version_command(backend, path, timeout)
+        version = None if output is None else parse_backend_version(backend, output)
+        # failed probes aren't cached, as they can be caused by temporary problems
+        if stamp is not None and output is not None:
+            cache[cache_key] = {'stamp': stamp, 'version': version}
+            try:
+                write_json_file(cache_path, cache)
+            except OSError as e:
+                logger.debug(f"Cannot save backend cache \"{cache_path}\": {e}")
+
+    return BackendInfo(name=backend, path=path, version=version, capabilities=_get_capabilities(backend, version))
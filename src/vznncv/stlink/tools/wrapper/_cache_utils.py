@@ -0,0 +1,106 @@
+"""
+Helper module to store application state and caches in the user cache directory.
+"""
+import json
+import logging
+import os
+import os.path
+import sys
+import tempfile
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+_APP_DIR_NAME = 'vznncv-stlink-tools-wrapper'
+
+# environment variable to override cache directory location
+CACHE_DIR_ENV_VAR = 'VZNNCV_STLINK_CACHE_DIR'
+
+
+def get_cache_dir() -> str:
+    """
+    Get application cache directory.
+
+    The directory isn't created automatically.
+    """
+    cache_dir = os.environ.get(CACHE_DIR_ENV_VAR)
+    if cache_dir:
+        return os.path.abspath(cache_dir)
+
+    if sys.platform == 'win32':
+        base_dir = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~\\AppData\\Local')
+        return os.path.join(base_dir, _APP_DIR_NAME, 'Cache')
+    elif sys.platform == 'darwin':
+        return os.path.join(os.path.expanduser('~/Library/Caches'), _APP_DIR_NAME)
+    else:
+        base_dir = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+        return os.path.join(base_dir, _APP_DIR_NAME)
+
+
+def get_cache_path(*parts: str, create_dir: bool = True) -> str:
+    """
+    Get path inside application cache directory.
+
+    :param parts: path components relative to the cache directory
+    :param create_dir: create parent directory of the path if it doesn't exist
+    :return: absolute path
+    """
+    path = os.path.join(get_cache_dir(), *parts)
+    if create_dir:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def read_json_file(path: str, default: Any = None) -> Any:
+    """
+    Read json file.
+
+    If file doesn't exist or it's corrupted, the ``default`` value is returned.
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+    except (OSError, ValueError) as e:
+        logger.debug(f"Cannot read \"{path}\": {e}")
+        return default
+
+
+def write_json_file(path: str, data: Any):
+    """
+    Write json file atomically.
+    """
+    write_binary_file(path, json.dumps(data, indent=2, sort_keys=True).encode('utf-8'))
+
+
+def write_binary_file(path: str, data: bytes):
+    """
+    Write file atomically.
+    """
+    dir_path = os.path.dirname(os.path.abspath(path))
+    os.makedirs(dir_path, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=dir_path, prefix='.tmp_')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def remove_file(path: str) -> bool:
+    """
+    Remove file if it exists.
+
+    :return: ``True`` if file has been removed, otherwise ``False``
+    """
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        return False
+    return True
@@ -1,6 +1,7 @@
 import logging
+import math
 import os
-from typing import Optional
+from typing import Optional, Tuple, Union
 
 import click
 
@@ -25,26 +26,188 @@ def verbose_option(f):
     return f
 
 
+class _PhaseTimeoutParamType(click.ParamType):
+    """
+    Backend phase timeout in the "<phase>=<seconds>" format.
+    """
+
+    name = 'phase=seconds'
+
+    _PHASES = ('startup', 'program', 'verify', 'finish')
+
+    def convert(self, value, param, ctx):
+        if isinstance(value, tuple):
+            return value
+        phase, sep, seconds = value.partition('=')
+        phase = phase.strip()
+        if not sep or phase not in self._PHASES:
+            self.fail(f"Invalid phase timeout \"{value}\". Expected <phase>=<seconds>, "
+                      f"where phase is one of: {', '.join(self._PHASES)}", param, ctx)
+        try:
+            seconds = float(seconds)
+        except ValueError:
+            self.fail(f"Invalid phase timeout \"{value}\". Timeout must be a number", param, ctx)
+        if seconds <= 0:
+            self.fail(f"Invalid phase timeout \"{value}\". Timeout must be positive", param, ctx)
+        return phase, seconds
+
+
+class _SizeParamType(click.ParamType):
+    """
+    Size in bytes. Decimal or hexadecimal values with optional "K"/"M" suffixes are accepted (2048, 0x800, 2K).
+    """
+
+    name = 'size'
+
+    _SUFFIXES = {'k': 1024, 'kb': 1024, 'kib': 1024, 'm': 1024 * 1024, 'mb': 1024 * 1024, 'mib': 1024 * 1024}
+
+    def convert(self, value, param, ctx):
+        if isinstance(value, int):
+            return value
+        str_value = value.strip().lower()
+        multiplier = 1
+        for suffix, suffix_multiplier in sorted(self._SUFFIXES.items(), key=lambda item: -len(item[0])):
+            if str_value.endswith(suffix) and not str_value.startswith('0x'):
+                str_value = str_value[:-len(suffix)].strip()
+                multiplier = suffix_multiplier
+                break
+        try:
+            size = int(str_value, 0) * multiplier
+        except ValueError:
+            self.fail(f"{value!r} isn't a valid size", param, ctx)
+        if size <= 0:
+            self.fail(f"{value!r} isn't a positive size", param, ctx)
+        return size
+
+
+class _AdapterSpeedParamType(click.ParamType):
+    """
+    Adapter speed in kHz or "auto".
+    """
+
+    name = 'auto|kHz'
+
+    def convert(self, value, param, ctx):
+        if isinstance(value, int) or value == 'auto':
+            return value
+        try:
+            speed = int(value)
+        except ValueError:
+            speed = None
+        if speed is None or speed <= 0:
+            self.fail(f"{value!r} isn't \"auto\" or positive number of kHz", param, ctx)
+        return speed
+
+
+class _ImageSourceParamType(click.ParamType):
+    """
+    Image path with optional load address "PATH[@ADDRESS]".
+    """
+
+    name = 'path[@address]'
+
+    def convert(self, value, param, ctx):
+        from ._artifact_cache import ImageSource, parse_image_source
+
+        if isinstance(value, ImageSource):
+            return value
+        try:
+            return parse_image_source(value)
+        except ValueError as e:
+            self.fail(str(e), param, ctx)
+
+
 @click.group(context_settings=_CONTEXT_SETTINGS)
 def main():
     pass
 
 
-_UPLOAD_BACKEND = ['pyocd', 'openocd', 'auto']
+_UPLOAD_BACKEND = ['pyocd', 'pyocd-api', 'openocd', 'auto']
 
 
 @main.command(name='upload-app', short_help='Upload compiled application')
 @click.option('--project-dir', help='Project directory', type=click.Path(exists=True, file_okay=False),
               default=os.getcwd)
 @click.option('--elf-file', help='Application elf file or folder with elf file')
-@click.option('--backend', help='Backend to upload program', type=click.Choice(_UPLOAD_BACKEND), default='auto')
-@click.option('--hla-serial', metavar='<hla-serial>',
+@click.option('--elf-select', type=click.Choice(['single', 'newest']), default='single', show_default=True,
+              help='Policy to choose elf file if multiple files are found. "single" - fail, '
+                   '"newest" - use the most recently modified one')
+@click.option('--extra-image', 'extra_images', type=_ImageSourceParamType(), multiple=True,
+              help='Image that is programmed together with the application in the same backend session '
+                   '(like bootloader or configuration data): elf file or binary file with load address '
+                   '(for example "config.bin@0x080E0000"). The option can be repeated')
+@click.option('--search-exclude', 'search_excludes', metavar='<pattern>', multiple=True,
+              help='Gitignore-style pattern of the paths that are skipped during elf and OpenOCD configuration '
+                   'file search. ".git", "CMakeFiles", "_deps" and similar directories are skipped by default. '
+                   'The option can be repeated')
+@click.option('--search-workers', type=click.IntRange(min=1),
+              help='Number of threads to scan project directories during elf and OpenOCD configuration file search. '
+                   'It speeds up search on network file systems')
+@click.option('--rescan', is_flag=True,
+              help='Search elf file, OpenOCD configuration and backend executables again instead of using '
+                   'memoized locations')
+@click.option('--backend', type=click.Choice(_UPLOAD_BACKEND), default='auto',
+              help='Backend to upload program. "pyocd-api" uses pyocd python package in the current process '
+                   'instead of pyocd command')
+@click.option('--hla-serial', metavar='<hla-serial>', multiple=True,
               help='StLink device hla serial. It can be used to select concrete StLink '
-                   'adapter if you have multiple ones')
+                   'adapter if you have multiple ones. The option can be repeated to upload '
+                   'application to several adapters simultaneously')
+@click.option('--all-devices', help='Upload application to all connected StLink adapters', is_flag=True)
+@click.option('--jobs', '-j', help='Maximal number of simultaneous uploads, if multiple adapters are used',
+              type=click.IntRange(min=1))
+@click.option('--force', help='Upload application even if a device already holds the same image', is_flag=True)
+@click.option('--delta-sector-size', type=_SizeParamType(),
+              help='Enable delta upload and set flash sector size (like 2K or 0x800). Only flash sectors that differ '
+                   'from the image that has been uploaded last are programmed. Only targets with uniform flash '
+                   'sectors are supported')
+@click.option('--wait-for-device', metavar='[TIMEOUT]', type=click.FloatRange(min=0), is_flag=False,
+              flag_value=math.inf, default=None,
+              help='Wait until ST-Link devices are connected instead of failing immediately. '
+                   'Optional value is maximal waiting time in seconds. Without it the command waits infinitely')
+@click.option('--timings', help='Print duration of the upload phases at the end', is_flag=True)
+@click.option('--timings-file', help='Save duration of the upload phases, flashed bytes and throughput to json file',
+              type=click.Path(dir_okay=False, writable=True, resolve_path=True))
+@click.option('--output-format', type=click.Choice(['text', 'json']), default='text', show_default=True,
+              help='Backend output format. "text" - backend logs, "json" - progress events (erase, program, verify, '
+                   'errors) as json lines in the stdout')
+@click.option('--quiet', '-q', is_flag=True,
+              help='Hide backend logs. They are shown only if the backend fails')
+@click.option('--timeout', type=click.FloatRange(min=0, min_open=True),
+              help='Maximal duration of each backend invocation in seconds. '
+                   'The backend is terminated if it is exceeded')
+@click.option('--phase-timeout', 'phase_timeouts', type=_PhaseTimeoutParamType(), multiple=True,
+              help='Maximal duration of the backend invocation phase ("startup", "program", "verify" or "finish") '
+                   'like "startup=20". The option can be repeated')
+@click.option('--image-format', type=click.Choice(['elf', 'bin', 'hex']), default='elf', show_default=True,
+              help='Format of the image that is passed to the backend. Binary and hex images are converted from '
+                   'the elf file and are cached by its content hash')
+@click.option('--adapter-speed', type=_AdapterSpeedParamType(),
+              help='SWD clock in kHz. "auto" - find the highest clock that uploads application successfully. '
+                   'It is remembered for the device and the target and is lowered automatically if upload fails')
+@click.option('--verify', type=click.Choice(['none', 'readback', 'crc']),
+              help='Verification of the programmed image. "none" - skip it, "readback" - read target memory back, '
+                   '"crc" - compare CRC32 checksums of the image with target-side calculated ones. By default OpenOCD '
+                   'verifies image and pyocd doesn\'t verify it')
+@click.option('--ram', is_flag=True,
+              help='Load application to the target SRAM and run it without flash programming. All loadable segments '
+                   'must be placed in SRAM. Elf files that are linked to SRAM are loaded to it automatically')
+@click.option('--watch', is_flag=True,
+              help='Upload application and watch the elf file. It is uploaded again after each change of the loadable '
+                   'content without new search of the files and devices. Press Ctrl+C to stop')
+@click.option('--broker-socket', type=click.Path(dir_okay=False),
+              help='Probe broker socket. Probes are leased from it before upload. '
+                   'By default the broker is used if it\'s running on the default socket')
+@click.option('--probe-pool', metavar='<name>', help='Lease any free probe of the broker pool and upload application '
+                                                     'to it')
+@click.option('--lease-timeout', type=click.FloatRange(min=0), help='Maximal probe lease wait time in seconds')
 @click.option('--openocd-path', help='OpenOCD path', type=click.Path(exists=True))
 @click.option('--openocd-config', help='Explicit path to OpenOCD configuration. It it is not set, then script will try '
                                        'to find it automatically in the project directory',
               type=click.Path(exists=True))
+@click.option('--openocd-server', help='Upload application using persistent OpenOCD server. '
+                                       'The server is started if it is not running',
+              is_flag=True)
 @click.option('--pyocd-path', help='PyOCD path', type=click.Path(exists=True))
 @click.option('--pyocd-target',
               help='PyOCD target. See `pyocd pack` and `pyocd list --targets` commands for more details')
@@ -52,14 +215,29 @@ _UPLOAD_BACKEND = ['pyocd', 'openocd', 'auto']
 @click.option('--pyocd-script', help='PyOCD script file. See `pyocd flash` commands for more details')
 @verbose_option
 @click.pass_context
-def upload_app(ctx, project_dir: str, elf_file: Optional[str], backend: str, hla_serial: Optional[str],
-               openocd_path: Optional[str], openocd_config: Optional[str],
+def upload_app(ctx, project_dir: str, elf_file: Optional[str], elf_select: str, extra_images: Tuple,
+               search_excludes: Tuple[str, ...],
+               search_workers: Optional[int], rescan: bool, backend: str, hla_serial: Tuple[str, ...],
+               all_devices: bool, jobs: Optional[int], force: bool, delta_sector_size: Optional[int],
+               wait_for_device: Optional[float], timings: bool, timings_file: Optional[str],
+               output_format: str, quiet: bool, timeout: Optional[float], phase_timeouts: Tuple[Tuple[str, float], ...],
+               image_format: str, adapter_speed: Union[int, str, None], verify: Optional[str], ram: bool, watch: bool,
+               broker_socket: Optional[str], probe_pool: Optional[str], lease_timeout: Optional[float],
+               openocd_path: Optional[str], openocd_config: Optional[str], openocd_server: bool,
                pyocd_path: Optional[str], pyocd_target: Optional[str],
                pyocd_config: Optional[str], pyocd_script: Optional[str]):
     """
     Upload compiled application.
 
+    Options that aren't set explicitly are read from "[upload-app]" table of the project configuration
+    file ".vznncv-stlink.toml" (like "elf-file", "backend", "openocd-config").
+
+    The last image that is uploaded with each ST-Link device is remembered. If the device already holds
+    the same image (loadable segments of the elf file aren't changed and target memory checksum matches),
+    the upload is skipped. Use "--force" flag to upload application unconditionally.
 
+    If a probe broker is running (see "broker" command), the probe is leased before upload, so concurrent
+    uploads wait for each other instead of failing.
     """
     import vznncv.stlink.tools.wrapper._upload_utils as _upload_utils
     import traceback
@@ -69,12 +247,37 @@ def upload_app(ctx, project_dir: str, elf_file: Optional[str], backend: str, hla
             # common options
             project_dir=project_dir,
             elf_file=elf_file,
+            elf_select=elf_select,
+            extra_images=extra_images,
+            search_excludes=search_excludes,
+            search_workers=search_workers,
+            rescan=rescan,
             backend=backend,
             hla_serial=hla_serial,
+            all_devices=all_devices,
+            jobs=jobs,
+            force=force,
+            delta_sector_size=delta_sector_size,
+            wait_for_device=wait_for_device,
+            timings=timings,
+            timings_file=timings_file,
+            output_format=output_format,
+            quiet=quiet,
+            timeout=timeout,
+            phase_timeouts=dict(phase_timeouts),
+            image_format=image_format,
+            adapter_speed=adapter_speed,
+            verify=verify,
+            ram=ram,
+            watch=watch,
+            broker_socket=broker_socket,
+            probe_pool=probe_pool,
+            lease_timeout=lease_timeout,
             verbose=ctx.obj['verbose'],
             # openocd options
             openocd_path=openocd_path,
             openocd_config=openocd_config,
+            openocd_server=openocd_server,
             # pyocd options
             pyocd_path=pyocd_path,
             pyocd_target=pyocd_target,
@@ -86,11 +289,25 @@ def upload_app(ctx, project_dir: str, elf_file: Optional[str], backend: str, hla
         ctx.exit(1)
 
 
+def _device_to_dict(stlink_device) -> dict:
+    return dict(
+        name=stlink_device.name,
+        vendor_id=stlink_device.vendor_id,
+        product_id=stlink_device.product_id,
+        hla_serial=stlink_device.serial_number
+    )
+
+
 @main.command(name='show-devices', short_help='Show available stlink debugger/programmer')
 @click.option('--format', help='Output format. "text" - human readable representation, "json" - json',
               type=click.Choice(['json', 'text']), default='text')
+@click.option('--watch', help='Watch device connections and disconnections. '
+                              'Events are printed as newline-delimited json with "json" format',
+              is_flag=True, default=False)
+@click.option('--poll-interval', help='Device polling interval in seconds, if hotplug notifications aren\'t available',
+              type=click.FloatRange(min=0.05), default=1.0, show_default=True)
 @verbose_option
-def show_devices(format):
+def show_devices(format, watch, poll_interval):
     """
     Show available ST-Link devices and information about them.
 
@@ -100,7 +317,14 @@ def show_devices(format):
     - device vendor id
     - device product id
     - device hla number
+
+    With "--watch" option the command prints "added" event for each connected device
+    and then reports device connections and disconnections until it's interrupted.
     """
+    if watch:
+        _watch_devices(format, poll_interval)
+        return
+
     from ._stlink_utils import get_stlink_devices
     import json
 
@@ -113,13 +337,262 @@ def show_devices(format):
             print(f'hla serial: {device_info.serial_number}')
             print("")
     elif format == 'json':
-        output_dict = [dict(
-            name=d.name,
-            vendor_id=d.vendor_id,
-            product_id=d.product_id,
-            hla_serial=d.serial_number
-        ) for d in device_infos]
+        output_dict = [_device_to_dict(d) for d in device_infos]
         output_str = json.dumps(output_dict, indent=4)
         print(output_str)
     else:
         raise ValueError("Unknown format: {}".format(format))
+
+
+def _watch_devices(format, poll_interval):
+    from ._hotplug_utils import watch_stlink_devices
+    import json
+
+    try:
+        for device_event in watch_stlink_devices(poll_interval=poll_interval):
+            stlink_device = device_event.device
+            if format == 'text':
+                print(f'{device_event.event}: {stlink_device.name} '
+                      f'(0x{stlink_device.vendor_id:04X}:0x{stlink_device.product_id:04X}) '
+                      f'hla serial: {stlink_device.serial_number}', flush=True)
+            elif format == 'json':
+                event_dict = dict(event=device_event.event, timestamp=device_event.timestamp)
+                event_dict.update(_device_to_dict(stlink_device))
+                print(json.dumps(event_dict), flush=True)
+            else:
+                raise ValueError("Unknown format: {}".format(format))
+    except KeyboardInterrupt:
+        pass
+
+
+@main.group(name='openocd-server', short_help='Manage persistent OpenOCD servers')
+def openocd_server():
+    """
+    Manage persistent OpenOCD servers.
+
+    A persistent server keeps OpenOCD attached to the target, so "upload-app --openocd-server"
+    command doesn't pay for OpenOCD startup on each upload.
+    """
+    pass
+
+
+def _resolve_single_device(hla_serial: Optional[str]):
+    from ._upload_utils import _resolve_target_devices
+    from ._stlink_utils import get_stlink_devices
+
+    hla_serials = [] if hla_serial is None else [hla_serial]
+    return _resolve_target_devices(get_stlink_devices(), hla_serials=hla_serials, all_devices=False)[0]
+
+
+@openocd_server.command(name='start', short_help='Start persistent OpenOCD server')
+@click.option('--project-dir', help='Project directory', type=click.Path(exists=True, file_okay=False),
+              default=os.getcwd)
+@click.option('--hla-serial', metavar='<hla-serial>', help='StLink device hla serial')
+@click.option('--openocd-path', help='OpenOCD path', type=click.Path(exists=True))
+@click.option('--openocd-config', help='Explicit path to OpenOCD configuration. It it is not set, then script will try '
+                                       'to find it automatically in the project directory',
+              type=click.Path(exists=True))
+@click.option('--tcl-port', help='OpenOCD TCL RPC port. A free port is chosen if it is not set', type=int)
+@verbose_option
+@click.pass_context
+def openocd_server_start(ctx, project_dir: str, hla_serial: Optional[str], openocd_path: Optional[str],
+                         openocd_config: Optional[str], tcl_port: Optional[int]):
+    """
+    Start persistent OpenOCD server for ST-Link device.
+    """
+    import shutil
+    import traceback
+    from ._backend_registry import get_backend_info
+    from ._openocd_utils import start_openocd_server
+    from ._project_config import load_project_config
+    from ._search_utils import resolve_openocd_config_file
+
+    try:
+        stlink_device = _resolve_single_device(hla_serial)
+        project_dir = os.path.abspath(project_dir)
+        project_config = load_project_config(project_dir)
+        openocd_path = openocd_path if openocd_path is not None else project_config.openocd_path
+        openocd_config = openocd_config if openocd_config is not None else project_config.openocd_config
+        if openocd_path is None:
+            openocd_path = shutil.which('openocd')
+            if openocd_path is None:
+                raise ValueError("OpenOCD isn't found in the PATH")
+        start_openocd_server(
+            openocd_path=openocd_path,
+            openocd_config=resolve_openocd_config_file(project_dir=project_dir, config_path=openocd_config),
+            hla_serial=stlink_device.serial_number,
+            project_dir=project_dir,
+            tcl_port=tcl_port,
+            verbose=ctx.obj['verbose'],
+            openocd_info=get_backend_info('openocd', openocd_path)
+        )
+    except Exception:
+        logger.warning(traceback.format_exc())
+        ctx.exit(1)
+
+
+@openocd_server.command(name='stop', short_help='Stop persistent OpenOCD server')
+@click.option('--hla-serial', metavar='<hla-serial>', help='StLink device hla serial')
+@click.option('--all', 'stop_all', help='Stop all running servers', is_flag=True)
+@verbose_option
+@click.pass_context
+def openocd_server_stop(ctx, hla_serial: Optional[str], stop_all: bool):
+    """
+    Stop persistent OpenOCD server.
+
+    If there is only one running server, the hla serial can be omitted.
+    """
+    from ._openocd_utils import list_openocd_servers, stop_openocd_server
+
+    server_infos = list_openocd_servers()
+    if hla_serial is not None:
+        server_infos = [s for s in server_infos if s.hla_serial == hla_serial.upper()]
+    elif not stop_all and len(server_infos) > 1:
+        logger.warning("Found multiple running OpenOCD servers. Please specify hla serial or use \"--all\" flag")
+        ctx.exit(1)
+    if not server_infos:
+        logger.warning("No running OpenOCD servers are found")
+        ctx.exit(1)
+    for server_info in server_infos:
+        stop_openocd_server(server_info)
+
+
+@openocd_server.command(name='status', short_help='Show running OpenOCD servers')
+@click.option('--format', help='Output format. "text" - human readable representation, "json" - json',
+              type=click.Choice(['json', 'text']), default='text')
+@verbose_option
+def openocd_server_status(format):
+    """
+    Show running persistent OpenOCD servers.
+
+    Information about servers that aren't alive anymore is removed.
+    """
+    from ._openocd_utils import list_openocd_servers
+    import json
+
+    server_infos = list_openocd_servers()
+    if format == 'text':
+        for server_info in server_infos:
+            print(f'hla serial: {server_info.hla_serial}')
+            print(f'pid: {server_info.pid}')
+            print(f'tcl port: {server_info.tcl_port}')
+            print(f'config: {server_info.openocd_config}')
+            print(f'log: {server_info.log_file}')
+            print("")
+    elif format == 'json':
+        print(json.dumps([server_info._asdict() for server_info in server_infos], indent=4))
+    else:
+        raise ValueError("Unknown format: {}".format(format))
+
+
+class _ProbePoolParamType(click.ParamType):
+    """
+    Probe pool definition "NAME=SERIAL[,SERIAL...]".
+    """
+
+    name = 'name=serial[,serial...]'
+
+    def convert(self, value, param, ctx):
+        if isinstance(value, tuple):
+            return value
+        name, sep, serials = value.partition('=')
+        serials = tuple(serial.strip() for serial in serials.split(',') if serial.strip())
+        if not sep or not name.strip() or not serials:
+            self.fail(f"{value!r} isn't a pool definition \"NAME=SERIAL[,SERIAL...]\"", param, ctx)
+        return name.strip(), serials
+
+
+@main.group(name='broker', short_help='Lease probes to concurrent processes')
+def broker():
+    """
+    Lease probes to concurrent processes.
+
+    The broker listens on a Unix socket and grants probes to the clients in the order of their requests.
+    A lease is released when the client finishes or dies. "upload-app" command leases probes
+    from the broker automatically if it's running.
+    """
+    pass
+
+
+def _broker_socket_option(f):
+    return click.option('--socket', 'socket_path', type=click.Path(dir_okay=False),
+                        help='Broker socket path. Default location can be changed with '
+                             'VZNNCV_STLINK_BROKER_SOCKET environment variable')(f)
+
+
+@broker.command(name='run', short_help='Run probe broker')
+@_broker_socket_option
+@click.option('--pool', 'pools', metavar='<name>=<serial>[,<serial>...]', type=_ProbePoolParamType(), multiple=True,
+              help='Probe pool. Clients can lease any free probe of the pool by its name')
+@verbose_option
+@click.pass_context
+def broker_run(ctx, socket_path: Optional[str], pools: Tuple[Tuple[str, Tuple[str, ...]], ...]):
+    """
+    Run probe broker in the foreground until it's interrupted or stopped.
+    """
+    from ._probe_broker import run_probe_broker, get_probe_broker_socket_path
+    import traceback
+
+    try:
+        run_probe_broker(socket_path if socket_path is not None else get_probe_broker_socket_path(), dict(pools))
+    except Exception:
+        logger.warning(traceback.format_exc())
+        ctx.exit(1)
+
+
+@broker.command(name='stop', short_help='Stop probe broker')
+@_broker_socket_option
+@verbose_option
+@click.pass_context
+def broker_stop(ctx, socket_path: Optional[str]):
+    """
+    Stop probe broker. Active leases are revoked.
+    """
+    from ._probe_broker import stop_probe_broker, get_probe_broker_socket_path, ProbeBrokerError
+
+    try:
+        stop_probe_broker(socket_path if socket_path is not None else get_probe_broker_socket_path())
+    except ProbeBrokerError as e:
+        logger.warning(str(e))
+        ctx.exit(1)
+
+
+@broker.command(name='stats', short_help='Show probe leases and wait times')
+@_broker_socket_option
+@click.option('--format', help='Output format. "text" - human readable representation, "json" - json',
+              type=click.Choice(['json', 'text']), default='text')
+@verbose_option
+@click.pass_context
+def broker_stats(ctx, socket_path: Optional[str], format):
+    """
+    Show probe holders, queue depths and lease wait times.
+    """
+    from ._probe_broker import get_probe_broker_stats, get_probe_broker_socket_path, ProbeBrokerError
+    import json
+
+    try:
+        stats = get_probe_broker_stats(socket_path if socket_path is not None else get_probe_broker_socket_path())
+    except ProbeBrokerError as e:
+        logger.warning(str(e))
+        ctx.exit(1)
+    if format == 'text':
+        print(f'queue depth: {stats["queue_depth"]}')
+        print(f'leases: {stats["leases"]}')
+        print(f'wait time: mean {stats["wait_time"]["mean"]:.3f} s, max {stats["wait_time"]["max"]:.3f} s')
+        print("")
+        for probe in stats['probes']:
+            holder = probe['holder']
+            print(f'hla serial: {probe["serial"]}')
+            print(f'pools: {", ".join(probe["pools"])}')
+            if holder is None:
+                print('holder: -')
+            else:
+                print(f'holder: {holder["client"]} (lease {holder["lease_id"]}, {holder["hold_time"]:.1f} s)')
+            print(f'queue depth: {probe["queue_depth"]}')
+            print(f'leases: {probe["leases"]}')
+            print(f'wait time: mean {probe["wait_time"]["mean"]:.3f} s, max {probe["wait_time"]["max"]:.3f} s')
+            print("")
+    elif format == 'json':
+        print(json.dumps(stats, indent=4))
+    else:
+        raise ValueError("Unknown format: {}".format(format))
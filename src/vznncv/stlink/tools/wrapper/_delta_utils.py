@@ -0,0 +1,73 @@
+"""
+Helper module to calculate flash sectors that should be reprogrammed to upload a new image.
+"""
+from typing import NamedTuple, List, Dict
+
+from ._elf_utils import ElfLoadSegment
+
+_ERASED_BYTE = 0xFF
+
+
+class FlashRegion(NamedTuple):
+    """
+    Sector aligned flash region that should be erased and programmed.
+    """
+    address: int
+    data: bytes
+
+
+def split_into_sectors(segments: List[ElfLoadSegment], sector_size: int) -> Dict[int, bytes]:
+    """
+    Split image into flash sectors.
+
+    Sector bytes that aren't covered by the image segments are filled with erased flash value (``0xFF``).
+
+    :return: dictionary with sector addresses and their content
+    """
+    if sector_size <= 0:
+        raise ValueError(f"Sector size must be positive, but it's {sector_size}")
+    sectors: Dict[int, bytearray] = {}
+    for segment in segments:
+        address = segment.address
+        data = memoryview(segment.data)
+        while data:
+            sector_address = address - address % sector_size
+            sector_offset = address - sector_address
+            chunk_size = min(sector_size - sector_offset, len(data))
+            sector = sectors.get(sector_address)
+            if sector is None:
+                sector = sectors[sector_address] = bytearray([_ERASED_BYTE]) * sector_size
+            sector[sector_offset:sector_offset + chunk_size] = data[:chunk_size]
+            address += chunk_size
+            data = data[chunk_size:]
+    return {sector_address: bytes(sector) for sector_address, sector in sectors.items()}
+
+
+def compute_changed_regions(old_segments: List[ElfLoadSegment], new_segments: List[ElfLoadSegment],
+                            sector_size: int) -> List[FlashRegion]:
+    """
+    Find flash sectors of the new image that differ from the old image.
+
+    Adjacent changed sectors are merged into a single region. Sectors that are used by the old image only
+    aren't included, as they don't belong to the new image.
+    """
+    old_sectors = split_into_sectors(old_segments, sector_size)
+    new_sectors = split_into_sectors(new_segments, sector_size)
+
+    regions: List[FlashRegion] = []
+    region_address = None
+    region_chunks: List[bytes] = []
+    for sector_address in sorted(new_sectors):
+        sector = new_sectors[sector_address]
+        if old_sectors.get(sector_address) == sector:
+            continue
+        if region_address is not None and region_address + len(region_chunks) * sector_size == sector_address:
+            region_chunks.append(sector)
+            continue
+        if region_address is not None:
+            regions.append(FlashRegion(address=region_address, data=b''.join(region_chunks)))
+        region_address = sector_address
+        region_chunks = [sector]
+    if region_address is not None:
+        regions.append(FlashRegion(address=region_address, data=b''.join(region_chunks)))
+    return regions
@@ -0,0 +1,336 @@
+"""
+Helper module to read firmware images from .elf files.
+
+The module contains a small ELF32 reader. The file is mapped into memory, so only headers and
+requested parts of the file are read. Segment and section data are returned as ``memoryview``
+objects without copying.
+"""
+import hashlib
+import itertools
+import mmap
+import struct
+from typing import NamedTuple, List, Optional, Iterator, Union
+
+_ELF_MAGIC = b'\x7fELF'
+_EI_NIDENT = 16
+_ELFCLASS32 = 1
+_ELFDATA2LSB = 1
+_ELFDATA2MSB = 2
+
+PT_LOAD = 1
+
+SHT_SYMTAB = 2
+SHT_NOBITS = 8
+
+SHF_ALLOC = 0x2
+
+SHN_UNDEF = 0
+
+
+class ElfFormatError(ValueError):
+    pass
+
+
+class ElfProgramHeader(NamedTuple):
+    type: int
+    offset: int
+    vaddr: int
+    paddr: int
+    filesz: int
+    memsz: int
+    flags: int
+    align: int
+
+
+class ElfSectionHeader(NamedTuple):
+    name: str
+    type: int
+    flags: int
+    addr: int
+    offset: int
+    size: int
+    link: int
+    info: int
+    addralign: int
+    entsize: int
+
+
+class ElfSymbol(NamedTuple):
+    name: str
+    value: int
+    size: int
+    type: int
+    bind: int
+    section_index: int
+
+
+class ElfLoadSegment(NamedTuple):
+    """
+    Loadable segment of the firmware image.
+    """
+    # load (physical) address
+    address: int
+    # segment data that should be written to the target memory;
+    # views of ElfFile must not be used after the file is closed
+    data: Union[bytes, memoryview]
+
+
+class ElfFile:
+    """
+    Memory mapped ELF32 file reader.
+
+    The object should be closed after usage. All ``memoryview`` objects that are returned by it
+    must be released before it.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            try:
+                self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # empty file cannot be mapped
+                raise ElfFormatError(f"File \"{path}\" isn't elf file")
+            self._data = memoryview(self._mmap)
+            try:
+                self._parse_header()
+            except BaseException:
+                self._data.release()
+                self._mmap.close()
+                raise
+        except BaseException:
+            self._file.close()
+            raise
+        self._program_headers: Optional[List[ElfProgramHeader]] = None
+        self._section_headers: Optional[List[ElfSectionHeader]] = None
+        self._symbols: Optional[List[ElfSymbol]] = None
+
+    def _parse_header(self):
+        e_ident = bytes(self._data[:_EI_NIDENT])
+        if len(e_ident) < _EI_NIDENT or e_ident[:4] != _ELF_MAGIC:
+            raise ElfFormatError(f"File \"{self.path}\" isn't elf file")
+        if e_ident[4] != _ELFCLASS32:
+            raise ElfFormatError(f"File \"{self.path}\" isn't 32-bit elf file")
+        if e_ident[5] == _ELFDATA2LSB:
+            self._endian = '<'
+        elif e_ident[5] == _ELFDATA2MSB:
+            self._endian = '>'
+        else:
+            raise ElfFormatError(f"File \"{self.path}\" has unknown data encoding")
+
+        header_struct = struct.Struct(self._endian + 'HHIIIIIHHHHHH')
+        if len(self._data) < _EI_NIDENT + header_struct.size:
+            raise ElfFormatError(f"File \"{self.path}\" has truncated header")
+        (self.type, self.machine, _, self.entry, self._phoff, self._shoff, self.flags, _,
+         self._phentsize, self._phnum, self._shentsize, self._shnum, self._shstrndx) = \
+            header_struct.unpack_from(self._data, _EI_NIDENT)
+
+    def close(self):
+        if self._mmap is not None:
+            self._data.release()
+            self._mmap.close()
+            self._file.close()
+            self._mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _check_range(self, offset: int, size: int):
+        if offset < 0 or size < 0 or offset + size > len(self._data):
+            raise ElfFormatError(f"File \"{self.path}\" is truncated (offset 0x{offset:X}, size 0x{size:X})")
+
+    def _view(self, offset: int, size: int) -> memoryview:
+        self._check_range(offset, size)
+        return self._data[offset:offset + size]
+
+    def _read_string(self, offset: int) -> str:
+        end = self._mmap.find(b'\0', offset)
+        if end < 0:
+            raise ElfFormatError(f"File \"{self.path}\" has unterminated string at offset 0x{offset:X}")
+        return self._mmap[offset:end].decode('utf-8', errors='replace')
+
+    @property
+    def program_headers(self) -> List[ElfProgramHeader]:
+        if self._program_headers is None:
+            ph_struct = struct.Struct(self._endian + 'IIIIIIII')
+            program_headers = []
+            for i in range(self._phnum):
+                offset = self._phoff + i * self._phentsize
+                self._check_range(offset, ph_struct.size)
+                program_headers.append(ElfProgramHeader(*ph_struct.unpack_from(self._data, offset)))
+            self._program_headers = program_headers
+        return self._program_headers
+
+    @property
+    def section_headers(self) -> List[ElfSectionHeader]:
+        if self._section_headers is None:
+            sh_struct = struct.Struct(self._endian + 'IIIIIIIIII')
+            raw_headers = []
+            for i in range(self._shnum):
+                offset = self._shoff + i * self._shentsize
+                self._check_range(offset, sh_struct.size)
+                raw_headers.append(sh_struct.unpack_from(self._data, offset))
+            names_offset = None
+            if 0 < self._shstrndx < len(raw_headers):
+                names_offset = raw_headers[self._shstrndx][4]
+            self._section_headers = [
+                ElfSectionHeader(
+                    self._read_string(names_offset + raw_header[0]) if names_offset is not None else '',
+                    *raw_header[1:]
+                )
+                for raw_header in raw_headers
+            ]
+        return self._section_headers
+
+    def get_section(self, name: str) -> Optional[ElfSectionHeader]:
+        for section_header in self.section_headers:
+            if section_header.name == name:
+                return section_header
+        return None
+
+    def section_data(self, section_header: ElfSectionHeader) -> memoryview:
+        """
+        Get section content without copying.
+        """
+        if section_header.type == SHT_NOBITS:
+            return self._data[0:0]
+        return self._view(section_header.offset, section_header.size)
+
+    def segment_data(self, program_header: ElfProgramHeader) -> memoryview:
+        """
+        Get segment content that is stored in the file without copying.
+        """
+        return self._view(program_header.offset, program_header.filesz)
+
+    @property
+    def symbols(self) -> List[ElfSymbol]:
+        if self._symbols is None:
+            sym_struct = struct.Struct(self._endian + 'IIIBBH')
+            symbols = []
+            section_headers = self.section_headers
+            for section_header in section_headers:
+                if section_header.type != SHT_SYMTAB or not section_header.entsize:
+                    continue
+                if section_header.link >= len(section_headers):
+                    raise ElfFormatError(f"File \"{self.path}\" has invalid symbol table")
+                names_offset = section_headers[section_header.link].offset
+                symtab_data = self.section_data(section_header)
+                symtab_size = len(symtab_data) - len(symtab_data) % sym_struct.size
+                for st_name, st_value, st_size, st_info, _, st_shndx in \
+                        sym_struct.iter_unpack(symtab_data[:symtab_size]):
+                    symbols.append(ElfSymbol(
+                        name=self._read_string(names_offset + st_name) if st_name else '',
+                        value=st_value,
+                        size=st_size,
+                        type=st_info & 0x0F,
+                        bind=st_info >> 4,
+                        section_index=st_shndx
+                    ))
+                symtab_data.release()
+            self._symbols = symbols
+        return self._symbols
+
+    def find_symbol(self, name: str) -> Optional[ElfSymbol]:
+        for symbol in self.symbols:
+            if symbol.name == name and symbol.section_index != SHN_UNDEF:
+                return symbol
+        return None
+
+    def iter_load_segments(self) -> Iterator[ElfLoadSegment]:
+        """
+        Iterate over loadable segments that contain data, sorted by load addresses.
+
+        Segment data is ``memoryview`` of the mapped file.
+        """
+        load_headers = sorted(
+            (ph for ph in self.program_headers if ph.type == PT_LOAD and ph.filesz > 0),
+            key=lambda ph: ph.paddr
+        )
+        for program_header in load_headers:
+            yield ElfLoadSegment(address=program_header.paddr, data=self.segment_data(program_header))
+
+
+def read_elf_load_segments(path: str) -> List[ElfLoadSegment]:
+    """
+    Read loadable segments of ELF32 file that contain data.
+
+    Segments are sorted by their load addresses. Segment data is copied, so it can be used after file closing.
+    """
+    with ElfFile(path) as elf_file:
+        segments = []
+        for segment in elf_file.iter_load_segments():
+            segments.append(ElfLoadSegment(address=segment.address, data=segment.data.tobytes()))
+            segment.data.release()
+        return segments
+
+
+def is_elf_file(path: str) -> bool:
+    """
+    Check if file starts with ELF magic number.
+    """
+    with open(path, 'rb') as f:
+        return f.read(len(_ELF_MAGIC)) == _ELF_MAGIC
+
+
+_SEGMENT_HEADER = struct.Struct('<II')
+
+
+def pack_segments(segments: List[ElfLoadSegment]) -> bytes:
+    """
+    Serialize segments as a sequence of (address, size, data) records.
+    """
+    return b''.join(itertools.chain.from_iterable(
+        (_SEGMENT_HEADER.pack(segment.address, len(segment.data)), segment.data) for segment in segments
+    ))
+
+
+def unpack_segments(data: bytes) -> List[ElfLoadSegment]:
+    """
+    Deserialize segments that are packed by ``pack_segments``.
+
+    :raises ValueError: if data is corrupted
+    """
+    segments = []
+    offset = 0
+    try:
+        while offset < len(data):
+            address, size = _SEGMENT_HEADER.unpack_from(data, offset)
+            offset += _SEGMENT_HEADER.size
+            if offset + size > len(data):
+                raise ValueError("truncated segment")
+            segments.append(ElfLoadSegment(address=address, data=data[offset:offset + size]))
+            offset += size
+    except struct.error as e:
+        raise ValueError(f"truncated segment header: {e}") from e
+    return segments
+
+
+def compute_segments_hash(segments: List[ElfLoadSegment]) -> str:
+    """
+    Compute SHA-256 hash of the loadable segments.
+    """
+    h = hashlib.sha256()
+    for segment in segments:
+        h.update(_SEGMENT_HEADER.pack(segment.address, len(segment.data)))
+        h.update(segment.data)
+    return h.hexdigest()
+
+
+def compute_image_hash(path: str) -> str:
+    """
+    Compute SHA-256 hash of the loadable ELF segments.
+
+    The hash depends only on the data that is written to the target, so it isn't affected by
+    debug information or symbols changes.
+    """
+    with ElfFile(path) as elf_file:
+        segments = list(elf_file.iter_load_segments())
+        try:
+            return compute_segments_hash(segments)
+        finally:
+            for segment in segments:
+                segment.data.release()
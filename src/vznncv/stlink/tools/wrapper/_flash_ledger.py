@@ -0,0 +1,111 @@
+"""
+Helper module to track firmware images that are flashed to ST-Link devices.
+
+The ledger stores information about the last image that has been uploaded with each ST-Link device,
+so an upload of the same image can be skipped, and only changed flash sectors can be programmed
+for a new image.
+"""
+import logging
+import time
+from typing import NamedTuple, Optional, List
+
+from ._cache_utils import get_cache_path, read_json_file, write_json_file, remove_file, write_binary_file
+from ._elf_utils import ElfLoadSegment, compute_segments_hash, pack_segments, unpack_segments
+
+logger = logging.getLogger(__name__)
+
+_LEDGER_DIR = 'flash_ledger'
+
+
+class FlashLedgerEntry(NamedTuple):
+    hla_serial: str
+    # hash of the loadable image segments (see ``compute_image_hash``)
+    image_hash: str
+    elf_file: str
+    backend: str
+    # backend specific target identifier (OpenOCD configuration or PyOCD target)
+    target: str
+    timestamp: float
+
+    def matches_target(self, *, backend: str, target: str) -> bool:
+        return self.backend == backend and self.target == target
+
+    def matches(self, *, image_hash: str, backend: str, target: str) -> bool:
+        return self.image_hash == image_hash and self.matches_target(backend=backend, target=target)
+
+
+def _get_ledger_path(hla_serial: str) -> str:
+    return get_cache_path(_LEDGER_DIR, f'{hla_serial.upper()}.json')
+
+
+def _get_ledger_image_path(hla_serial: str) -> str:
+    return get_cache_path(_LEDGER_DIR, f'{hla_serial.upper()}.image')
+
+
+def get_ledger_entry(hla_serial: str) -> Optional[FlashLedgerEntry]:
+    """
+    Get information about the last image that has been flashed with the device.
+    """
+    data = read_json_file(_get_ledger_path(hla_serial))
+    if data is None:
+        return None
+    try:
+        return FlashLedgerEntry(**data)
+    except TypeError:
+        logger.debug(f"Invalid ledger entry of the device {hla_serial}: {data}")
+        return None
+
+
+def update_ledger_entry(*, hla_serial: str, image_hash: str, elf_file: str, backend: str,
+                        target: str, segments: Optional[List[ElfLoadSegment]] = None) -> FlashLedgerEntry:
+    """
+    Save information about flashed image.
+
+    If image ``segments`` are set, they're saved as well to calculate difference with the next image.
+    """
+    if segments is not None:
+        write_binary_file(_get_ledger_image_path(hla_serial), pack_segments(segments))
+    else:
+        remove_file(_get_ledger_image_path(hla_serial))
+    entry = FlashLedgerEntry(
+        hla_serial=hla_serial.upper(),
+        image_hash=image_hash,
+        elf_file=elf_file,
+        backend=backend,
+        target=target,
+        timestamp=time.time()
+    )
+    write_json_file(_get_ledger_path(hla_serial), entry._asdict())
+    return entry
+
+
+def remove_ledger_entry(hla_serial: str):
+    """
+    Forget information about flashed image, if target state is unknown.
+    """
+    remove_file(_get_ledger_path(hla_serial))
+    remove_file(_get_ledger_image_path(hla_serial))
+
+
+def load_ledger_image(ledger_entry: FlashLedgerEntry) -> Optional[List[ElfLoadSegment]]:
+    """
+    Load segments of the image that has been flashed last.
+
+    :return: image segments or ``None`` if they aren't saved or don't match the ledger entry
+    """
+    try:
+        with open(_get_ledger_image_path(ledger_entry.hla_serial), 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+
+    try:
+        segments = unpack_segments(data)
+    except ValueError as e:
+        logger.debug(f"Invalid ledger image of the device {ledger_entry.hla_serial}: {e}")
+        return None
+
+    if compute_segments_hash(segments) != ledger_entry.image_hash:
+        logger.debug(f"Ledger image of the device {ledger_entry.hla_serial} doesn't match ledger entry")
+        return None
+    return segments
@@ -0,0 +1,214 @@
+"""
+Helper module to track ST-Link device connections and disconnections.
+"""
+import logging
+import select
+import socket
+import sys
+import time
+from typing import NamedTuple, Optional, Iterator, Dict, List, Callable, TypeVar
+
+from ._stlink_utils import StLinkDevice, get_stlink_devices, StLinkDeviceNotFoundError
+
+logger = logging.getLogger(__name__)
+
+
+class UsbEventMonitor:
+    """
+    Base class of the usb event monitors.
+    """
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Wait usb device changes.
+
+        :param timeout: maximal waiting time
+        :return: ``True`` if usb devices may be changed and they should be enumerated again
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class PollingUsbEventMonitor(UsbEventMonitor):
+    """
+    Fallback monitor that requests device enumeration periodically.
+    """
+
+    def __init__(self, poll_interval: float):
+        self.poll_interval = poll_interval
+
+    def wait(self, timeout: float) -> bool:
+        delay = min(timeout, self.poll_interval)
+        if delay > 0:
+            time.sleep(delay)
+        return delay >= self.poll_interval
+
+
+_NETLINK_KOBJECT_UEVENT = 15
+_KERNEL_UEVENT_GROUP = 1
+
+
+class NetlinkUsbEventMonitor(UsbEventMonitor):
+    """
+    Linux monitor of the kernel usb hotplug events (uevents).
+    """
+
+    # delay to collect burst of events, that are generated by device connection
+    _SETTLE_DELAY = 0.1
+    _USB_DEVICE_MARKERS = (b'SUBSYSTEM=usb\0', b'DEVTYPE=usb_device')
+
+    def __init__(self):
+        self._socket = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, _NETLINK_KOBJECT_UEVENT)
+        try:
+            self._socket.bind((0, _KERNEL_UEVENT_GROUP))
+        except OSError:
+            self._socket.close()
+            raise
+
+    def _read_events(self, timeout: float) -> bool:
+        usb_event_found = False
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining_time = max(0.0, deadline - time.monotonic())
+            ready, _, _ = select.select([self._socket], [], [], remaining_time)
+            if not ready:
+                return usb_event_found
+            message = self._socket.recv(16384)
+            if all(marker in message for marker in self._USB_DEVICE_MARKERS):
+                usb_event_found = True
+                # collect subsequent events
+                deadline = min(deadline, time.monotonic() + self._SETTLE_DELAY)
+
+    def wait(self, timeout: float) -> bool:
+        return self._read_events(timeout)
+
+    def close(self):
+        self._socket.close()
+
+
+def create_usb_event_monitor(poll_interval: float) -> UsbEventMonitor:
+    """
+    Create the best available usb event monitor.
+
+    Linux kernel hotplug notifications are used if they're available, otherwise device polling is used.
+    """
+    if sys.platform.startswith('linux'):
+        try:
+            return NetlinkUsbEventMonitor()
+        except (OSError, AttributeError) as e:
+            logger.debug(f"Cannot use netlink hotplug notifications: {e}")
+    return PollingUsbEventMonitor(poll_interval)
+
+
+class DeviceEvent(NamedTuple):
+    # "added" or "removed"
+    event: str
+    device: StLinkDevice
+    timestamp: float
+
+
+def _snapshot_devices(get_devices: Callable[[], List[StLinkDevice]]) -> Dict[str, StLinkDevice]:
+    result = {}
+    for stlink_device in get_devices():
+        try:
+            result[stlink_device.serial_number] = stlink_device
+        except Exception as e:
+            logger.debug(f"Cannot get serial number of the {stlink_device.name}: {e}")
+    return result
+
+
+def watch_stlink_devices(*, poll_interval: float = 1.0, monitor: Optional[UsbEventMonitor] = None,
+                         get_devices: Callable[[], List[StLinkDevice]] = get_stlink_devices,
+                         initial_events: bool = True) -> Iterator[DeviceEvent]:
+    """
+    Watch ST-Link device connections and disconnections.
+
+    Devices are enumerated again after each hotplug notification. If notifications aren't available,
+    the devices are polled with ``poll_interval``.
+
+    :param poll_interval: polling interval. It's also used as a safety re-enumeration interval with hotplug events.
+    :param monitor: custom usb event monitor
+    :param get_devices: device enumeration function
+    :param initial_events: generate "added" events for devices that are connected at start
+    :return: infinite event iterator
+    """
+    own_monitor = monitor is None
+    if own_monitor:
+        monitor = create_usb_event_monitor(poll_interval)
+    try:
+        known_devices: Dict[str, StLinkDevice] = {}
+        if not initial_events:
+            known_devices = _snapshot_devices(get_devices)
+        need_enumeration = initial_events
+        # in hotplug mode re-enumerate devices periodically to recover after missed events
+        safety_interval = poll_interval if isinstance(monitor, PollingUsbEventMonitor) else max(poll_interval, 5.0)
+        while True:
+            if need_enumeration:
+                current_devices = _snapshot_devices(get_devices)
+                timestamp = time.time()
+                for serial_number, stlink_device in known_devices.items():
+                    if serial_number not in current_devices:
+                        yield DeviceEvent(event='removed', device=stlink_device, timestamp=timestamp)
+                for serial_number, stlink_device in current_devices.items():
+                    if serial_number not in known_devices:
+                        yield DeviceEvent(event='added', device=stlink_device, timestamp=timestamp)
+                known_devices = current_devices
+            wait_start = time.monotonic()
+            need_enumeration = monitor.wait(safety_interval)
+            if not need_enumeration and time.monotonic() - wait_start >= safety_interval:
+                need_enumeration = True
+    finally:
+        if own_monitor:
+            monitor.close()
+
+
+T = TypeVar('T')
+
+
+def wait_stlink_devices(resolve_devices: Callable[[List[StLinkDevice]], T], *, timeout: float,
+                        poll_interval: float = 0.5, monitor: Optional[UsbEventMonitor] = None,
+                        get_devices: Callable[[], List[StLinkDevice]] = get_stlink_devices) -> T:
+    """
+    Wait until required ST-Link devices are connected.
+
+    Devices are enumerated again after each hotplug notification, so the function returns immediately after
+    device connection.
+
+    :param resolve_devices: function that selects required devices from the connected ones.
+                            It should raise ``StLinkDeviceNotFoundError`` if they aren't connected yet.
+    :param timeout: maximal waiting time in seconds. ``math.inf`` can be used to wait infinitely.
+    :param poll_interval: polling interval if hotplug notifications aren't available
+    :param monitor: custom usb event monitor
+    :param get_devices: device enumeration function
+    :return: ``resolve_devices`` result
+    """
+    deadline = time.monotonic() + timeout
+    # subscribe to events before enumeration to avoid missing of the device connection
+    own_monitor = monitor is None
+    if own_monitor:
+        monitor = create_usb_event_monitor(poll_interval)
+    try:
+        waiting_logged = False
+        while True:
+            try:
+                return resolve_devices(get_devices())
+            except StLinkDeviceNotFoundError as e:
+                remaining_time = deadline - time.monotonic()
+                if remaining_time <= 0:
+                    raise
+                if not waiting_logged:
+                    logger.info(f"{e}\nWait for ST-Link device connection ...")
+                    waiting_logged = True
+            # re-enumerate devices periodically to recover after missed events
+            monitor.wait(min(remaining_time, max(poll_interval, 5.0)))
+    finally:
+        if own_monitor:
+            monitor.close()
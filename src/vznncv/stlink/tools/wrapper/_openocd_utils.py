@@ -0,0 +1,503 @@
+"""
+Helper module to work with OpenOCD and persistent OpenOCD servers.
+"""
+import itertools
+import logging
+import os
+import os.path
+import signal
+import socket
+import subprocess
+import sys
+import time
+from typing import NamedTuple, Optional, List, Tuple, Sequence
+
+from ._backend_registry import BackendInfo, OPENOCD_HEX_SERIAL, OPENOCD_ADAPTER_SERIAL, OPENOCD_ADAPTER_SPEED, \
+    VERIFY_MODES, VERIFY_NONE, VERIFY_READBACK, VERIFY_CRC
+from ._cache_utils import get_cache_path, read_json_file, write_json_file, remove_file, get_cache_dir
+from ._ram_utils import VTOR_ADDRESS
+
+logger = logging.getLogger(__name__)
+
+
+def _grouper(iterable, n, fillvalue=None):
+    args = [iter(iterable)] * n
+    return itertools.zip_longest(*args, fillvalue=fillvalue)
+
+
+def format_openocd_hla_serial(serial_number: str) -> str:
+    """
+    Convert ST-Link serial number to OpenOCD ``hla_serial`` argument.
+    """
+    if len(serial_number) != 24:
+        raise ValueError(f"Invalid serial number length: {serial_number}")
+    openocd_hla_serial_codes = []
+    for g in _grouper(serial_number, 2):
+        serial_code = int(f'{g[0]}{g[1]}', 16)
+        # openocd hla bug workaround: replace all non-ascii symbols by ? (0x3F)
+        if serial_code > 0x7F:
+            serial_code = 0x3F
+        openocd_hla_serial_codes.append(serial_code)
+
+    return ''.join(f'\\x{serial_code:02X}' for serial_code in openocd_hla_serial_codes)
+
+
+def format_openocd_serial_command(serial_number: str, openocd_info: Optional[BackendInfo] = None) -> str:
+    """
+    Build OpenOCD command that selects ST-Link adapter by serial number.
+
+    OpenOCD 0.11+ matches serial numbers as hex strings, so they are passed as is. Older or unknown versions
+    get escaped ``hla_serial`` argument with non-ascii symbols workaround.
+
+    :param serial_number: ST-Link serial number
+    :param openocd_info: OpenOCD version and capabilities
+    """
+    if openocd_info is not None and openocd_info.has_capability(OPENOCD_ADAPTER_SERIAL):
+        return f'adapter serial "{serial_number}"'
+    elif openocd_info is not None and openocd_info.has_capability(OPENOCD_HEX_SERIAL):
+        return f'hla_serial "{serial_number}"'
+    else:
+        return f'hla_serial "{format_openocd_hla_serial(serial_number)}"'
+
+
+def format_openocd_speed_command(speed_khz: int, openocd_info: Optional[BackendInfo] = None) -> str:
+    """
+    Build OpenOCD command that sets adapter clock.
+
+    :param speed_khz: adapter clock in kHz
+    :param openocd_info: OpenOCD version and capabilities
+    """
+    if openocd_info is not None and openocd_info.has_capability(OPENOCD_ADAPTER_SPEED):
+        return f'adapter speed {speed_khz}'
+    else:
+        return f'adapter_khz {speed_khz}'
+
+
+def quote_tcl_word(value: str) -> str:
+    """
+    Quote string to use it as a single TCL word.
+    """
+    if '{' in value or '}' in value or value.endswith('\\'):
+        return '"{}"'.format(''.join(f'\\{c}' if c in '\\"$[]{}' else c for c in value))
+    return f'{{{value}}}'
+
+
+class OpenOcdTclError(ValueError):
+    pass
+
+
+class OpenOcdTclClient:
+    """
+    Simple client of the OpenOCD TCL RPC server.
+
+    Each command is sent as a string terminated by ``0x1A`` symbol. The server response is terminated
+    by the same symbol.
+    """
+
+    _TERMINATOR = b'\x1a'
+
+    def __init__(self, host: str, port: int, *, timeout: Optional[float] = 10.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._socket: Optional[socket.socket] = None
+        self._buffer = b''
+
+    def connect(self):
+        if self._socket is None:
+            self._socket = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            self._buffer = b''
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def execute(self, command: str, *, timeout: Optional[float] = None) -> str:
+        """
+        Execute OpenOCD command and return its result.
+        """
+        self.connect()
+        self._socket.settimeout(self.timeout if timeout is None else timeout)
+        self._socket.sendall(command.encode('utf-8') + self._TERMINATOR)
+        while self._TERMINATOR not in self._buffer:
+            data = self._socket.recv(4096)
+            if not data:
+                raise OpenOcdTclError(f"OpenOCD server has closed connection during \"{command}\" execution")
+            self._buffer += data
+        response, self._buffer = self._buffer.split(self._TERMINATOR, 1)
+        return response.decode('utf-8', errors='replace')
+
+    def execute_checked(self, command: str, *, timeout: Optional[float] = None) -> str:
+        """
+        Execute OpenOCD command, capture its log output and raise error if command fails.
+        """
+        wrapped_command = (
+            f'if {{[catch {{capture {quote_tcl_word(command)}}} _vznncv_out]}} '
+            f'{{set _vznncv_res "1 $_vznncv_out"}} else {{set _vznncv_res "0 $_vznncv_out"}}'
+        )
+        response = self.execute(wrapped_command, timeout=timeout)
+        status, _, output = response.partition(' ')
+        if status != '0':
+            raise OpenOcdTclError(f"OpenOCD command \"{command}\" has failed:\n{output}")
+        return output
+
+
+class OpenOcdServerInfo(NamedTuple):
+    hla_serial: str
+    pid: int
+    host: str
+    tcl_port: int
+    openocd_path: str
+    openocd_config: str
+    project_dir: str
+    log_file: str
+    start_time: float
+
+
+_SERVERS_DIR = 'openocd_servers'
+_SERVER_HOST = '127.0.0.1'
+_SERVER_START_TIMEOUT = 15.0
+_SERVER_STOP_TIMEOUT = 5.0
+_SERVER_CHECK_TIMEOUT = 2.0
+
+
+def _get_server_state_path(hla_serial: str) -> str:
+    return get_cache_path(_SERVERS_DIR, f'{hla_serial.upper()}.json')
+
+
+def _is_process_alive(pid: int) -> bool:
+    if sys.platform == 'win32':
+        # there is no simple way to check process without extra dependencies,
+        # so rely on TCL port check only
+        return True
+    try:
+        # reap process if it's a finished child of the current process
+        if os.waitpid(pid, os.WNOHANG)[0] == pid:
+            return False
+    except ChildProcessError:
+        pass
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _find_free_port(host: str) -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind((host, 0))
+        return s.getsockname()[1]
+
+
+def check_openocd_server(server_info: OpenOcdServerInfo, *, timeout: float = _SERVER_CHECK_TIMEOUT) -> bool:
+    """
+    Check if OpenOCD server is alive and responds to the TCL RPC requests.
+    """
+    if not _is_process_alive(server_info.pid):
+        return False
+    try:
+        with OpenOcdTclClient(server_info.host, server_info.tcl_port, timeout=timeout) as client:
+            client.execute('version')
+    except (OSError, OpenOcdTclError) as e:
+        logger.debug(f"OpenOCD server {server_info.host}:{server_info.tcl_port} doesn't respond: {e}")
+        return False
+    return True
+
+
+def get_openocd_server(hla_serial: str, *, check: bool = True) -> Optional[OpenOcdServerInfo]:
+    """
+    Get information about running OpenOCD server of the specified device.
+
+    If server information is found, but server isn't alive, the stale information is removed.
+    """
+    state_path = _get_server_state_path(hla_serial)
+    state = read_json_file(state_path)
+    if state is None:
+        return None
+    try:
+        server_info = OpenOcdServerInfo(**state)
+    except TypeError:
+        logger.warning(f"Remove invalid OpenOCD server state file: {state_path}")
+        remove_file(state_path)
+        return None
+    if check and not check_openocd_server(server_info):
+        logger.warning(f"Remove stale OpenOCD server information (device {hla_serial}, pid {server_info.pid})")
+        remove_file(state_path)
+        return None
+    return server_info
+
+
+def list_openocd_servers(*, check: bool = True) -> List[OpenOcdServerInfo]:
+    """
+    Get information about all running OpenOCD servers.
+    """
+    servers_dir = os.path.join(get_cache_dir(), _SERVERS_DIR)
+    if not os.path.isdir(servers_dir):
+        return []
+    result = []
+    for dir_entry in sorted(os.scandir(servers_dir), key=lambda e: e.name):
+        name, ext = os.path.splitext(dir_entry.name)
+        if ext != '.json' or not dir_entry.is_file():
+            continue
+        server_info = get_openocd_server(name, check=check)
+        if server_info is not None:
+            result.append(server_info)
+    return result
+
+
+def _read_log_tail(log_file: str, max_lines: int = 20) -> str:
+    try:
+        with open(log_file, 'r', encoding='utf-8', errors='replace') as f:
+            return ''.join(f.readlines()[-max_lines:])
+    except OSError:
+        return ''
+
+
+def start_openocd_server(*, openocd_path: str, openocd_config: str, hla_serial: str, project_dir: str,
+                         tcl_port: Optional[int] = None, verbose: bool = False,
+                         openocd_info: Optional[BackendInfo] = None,
+                         start_timeout: float = _SERVER_START_TIMEOUT) -> OpenOcdServerInfo:
+    """
+    Start persistent OpenOCD server for the specified device.
+
+    The server is detached from the current process and accepts TCL RPC requests on the ``tcl_port``.
+    """
+    server_info = get_openocd_server(hla_serial)
+    if server_info is not None:
+        raise ValueError(f"OpenOCD server for device {hla_serial} is already running (pid {server_info.pid})")
+
+    if tcl_port is None:
+        tcl_port = _find_free_port(_SERVER_HOST)
+    log_file = get_cache_path(_SERVERS_DIR, f'{hla_serial.upper()}.log')
+
+    command_args = [openocd_path]
+    if verbose:
+        command_args.extend(['--debug', '3'])
+    command_args.extend(['--command', f'tcl_port {tcl_port}'])
+    command_args.extend(['--command', 'gdb_port disabled'])
+    command_args.extend(['--command', 'telnet_port disabled'])
+    command_args.extend(['--file', openocd_config])
+    command_args.extend(['--command', format_openocd_serial_command(hla_serial, openocd_info)])
+    command_args.extend(['--command', 'init'])
+    logger.info(f"Start OpenOCD server: {' '.join(command_args)}")
+
+    popen_kwargs = {}
+    if sys.platform == 'win32':
+        popen_kwargs['creationflags'] = subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        popen_kwargs['start_new_session'] = True
+    with open(log_file, 'wb') as log_f:
+        process = subprocess.Popen(command_args, stdin=subprocess.DEVNULL, stdout=log_f, stderr=subprocess.STDOUT,
+                                   cwd=project_dir, **popen_kwargs)
+
+    server_info = OpenOcdServerInfo(
+        hla_serial=hla_serial.upper(),
+        pid=process.pid,
+        host=_SERVER_HOST,
+        tcl_port=tcl_port,
+        openocd_path=openocd_path,
+        openocd_config=openocd_config,
+        project_dir=project_dir,
+        log_file=log_file,
+        start_time=time.time()
+    )
+
+    # wait server readiness
+    deadline = time.monotonic() + start_timeout
+    while True:
+        return_code = process.poll()
+        if return_code is not None:
+            raise ValueError(f"OpenOCD server has failed with code {return_code}:\n{_read_log_tail(log_file)}")
+        if check_openocd_server(server_info, timeout=0.5):
+            break
+        if time.monotonic() > deadline:
+            process.kill()
+            raise ValueError(f"OpenOCD server doesn't respond during {start_timeout} seconds:\n"
+                             f"{_read_log_tail(log_file)}")
+        time.sleep(0.1)
+
+    write_json_file(_get_server_state_path(hla_serial), server_info._asdict())
+    logger.info(f"OpenOCD server is started (pid {server_info.pid}, tcl port {server_info.tcl_port})")
+    return server_info
+
+
+def stop_openocd_server(server_info: OpenOcdServerInfo, *, timeout: float = _SERVER_STOP_TIMEOUT):
+    """
+    Stop persistent OpenOCD server.
+    """
+    try:
+        with OpenOcdTclClient(server_info.host, server_info.tcl_port, timeout=timeout) as client:
+            client.execute('shutdown')
+    except (OSError, OpenOcdTclError) as e:
+        logger.debug(f"OpenOCD shutdown command has failed: {e}")
+
+    deadline = time.monotonic() + timeout
+    while _is_process_alive(server_info.pid) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    if _is_process_alive(server_info.pid) and sys.platform != 'win32':
+        logger.warning(f"OpenOCD server (pid {server_info.pid}) doesn't respond to shutdown command. Terminate it")
+        try:
+            os.kill(server_info.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    remove_file(_get_server_state_path(server_info.hla_serial))
+    logger.info(f"OpenOCD server of the device {server_info.hla_serial} is stopped")
+
+
+def _join_tcl_commands(setup_commands: Sequence[str], *commands: str) -> str:
+    return '; '.join([*setup_commands, *commands])
+
+
+def build_program_commands(image_file: str, *, base_address: Optional[int] = None, verify: Optional[str] = None,
+                           exit: bool = False) -> List[str]:
+    """
+    Build OpenOCD commands to program, verify and reset target.
+
+    :param image_file: elf, hex or binary image
+    :param base_address: load address of the binary image
+    :param verify: "readback" or ``None`` - ``verify_image`` (memory is read back, if checksums don't match),
+                   "crc" - ``verify_image_checksum`` (only target-side checksums are compared), "none" - skip
+                   verification
+    :param exit: shutdown OpenOCD after reset
+    :return: OpenOCD commands
+    """
+    if verify is not None and verify not in VERIFY_MODES:
+        raise ValueError(f"Unknown verification mode: {verify}")
+    image_args = quote_tcl_word(image_file) + ('' if base_address is None else f' 0x{base_address:08X}')
+    if verify == VERIFY_CRC:
+        # "program" command supports read back verification only, so checksums are checked separately
+        commands = [
+            f'program {image_args}',
+            'echo "** Verify Started **"',
+            f'verify_image_checksum {image_args}',
+            'echo "** Verified OK **"',
+            'reset run',
+        ]
+        if exit:
+            commands.append('shutdown')
+        return commands
+    program_options = ['reset'] if verify == VERIFY_NONE else ['verify', 'reset']
+    if exit:
+        program_options.append('exit')
+    return [f'program {image_args} {" ".join(program_options)}']
+
+
+def program_with_openocd_server(server_info: OpenOcdServerInfo, image_file: str, *,
+                                base_address: Optional[int] = None, verify: Optional[str] = None,
+                                timeout: Optional[float] = None, setup_commands: Sequence[str] = ()) -> str:
+    """
+    Program, verify and reset target using running OpenOCD server.
+
+    :param image_file: elf, hex or binary image
+    :param base_address: load address of the binary image
+    :param verify: verification mode (see ``build_program_commands``)
+    :param setup_commands: commands that are executed before programming (like adapter speed)
+    :return: OpenOCD logs of the operation
+    """
+    with OpenOcdTclClient(server_info.host, server_info.tcl_port, timeout=timeout) as client:
+        return client.execute_checked(_join_tcl_commands(
+            setup_commands, *build_program_commands(image_file, base_address=base_address, verify=verify)
+        ))
+
+
+def check_openocd_image(server_info: OpenOcdServerInfo, elf_file: str, *, timeout: Optional[float] = None,
+                        setup_commands: Sequence[str] = ()) -> str:
+    """
+    Check that target memory holds the image using target-side checksum calculation.
+
+    The target is reset after successful check.
+
+    :return: OpenOCD logs of the operation
+    """
+    with OpenOcdTclClient(server_info.host, server_info.tcl_port, timeout=timeout) as client:
+        return client.execute_checked(_join_tcl_commands(
+            setup_commands, 'reset halt', f'verify_image_checksum {quote_tcl_word(elf_file)}', 'reset run'
+        ))
+
+
+def build_region_program_commands(region_files: List[Tuple[str, int]], elf_file: str, *,
+                                  verify: Optional[str] = None) -> List[str]:
+    """
+    Build OpenOCD commands to program binary flash regions.
+
+    After programming the whole elf image is verified and target is reset.
+
+    :param region_files: binary files and their flash addresses
+    :param elf_file: complete elf image
+    :param verify: "crc" or ``None`` - target-side checksum calculation, "readback" - ``verify_image``,
+                   "none" - skip verification
+    :return: OpenOCD commands
+    """
+    if verify is not None and verify not in VERIFY_MODES:
+        raise ValueError(f"Unknown verification mode: {verify}")
+    commands = ['reset halt']
+    for region_file, address in region_files:
+        commands.append(f'flash write_image erase {quote_tcl_word(region_file)} 0x{address:08X} bin')
+    if verify == VERIFY_READBACK:
+        commands.append(f'verify_image {quote_tcl_word(elf_file)}')
+    elif verify != VERIFY_NONE:
+        commands.append(f'verify_image_checksum {quote_tcl_word(elf_file)}')
+    commands.append('reset run')
+    return commands
+
+
+def program_regions_with_openocd_server(server_info: OpenOcdServerInfo, region_files: List[Tuple[str, int]],
+                                        elf_file: str, *, verify: Optional[str] = None,
+                                        timeout: Optional[float] = None,
+                                        setup_commands: Sequence[str] = ()) -> str:
+    """
+    Program binary flash regions using running OpenOCD server.
+
+    :return: OpenOCD logs of the operation
+    """
+    with OpenOcdTclClient(server_info.host, server_info.tcl_port, timeout=timeout) as client:
+        return client.execute_checked(_join_tcl_commands(
+            setup_commands, *build_region_program_commands(region_files, elf_file, verify=verify)
+        ))
+
+
+def build_ram_load_commands(image_file: str, *, vector_table: int, stack_pointer: int,
+                            entry_point: int) -> List[str]:
+    """
+    Build OpenOCD commands to load image to SRAM and run it without flash programming.
+
+    :param image_file: elf or hex image
+    :param vector_table: vector table address, that is set to VTOR register
+    :param stack_pointer: initial stack pointer
+    :param entry_point: address of the first instruction
+    :return: OpenOCD commands
+    """
+    return [
+        'reset halt',
+        f'load_image {quote_tcl_word(image_file)}',
+        f'mww 0x{VTOR_ADDRESS:08X} 0x{vector_table:08X}',
+        f'reg sp 0x{stack_pointer:08X}',
+        f'reg pc 0x{entry_point:08X}',
+        'resume',
+    ]
+
+
+def load_ram_image_with_openocd_server(server_info: OpenOcdServerInfo, image_file: str, *, vector_table: int,
+                                       stack_pointer: int, entry_point: int, timeout: Optional[float] = None,
+                                       setup_commands: Sequence[str] = ()) -> str:
+    """
+    Load image to SRAM and run it using running OpenOCD server.
+
+    :return: OpenOCD logs of the operation
+    """
+    with OpenOcdTclClient(server_info.host, server_info.tcl_port, timeout=timeout) as client:
+        return client.execute_checked(_join_tcl_commands(
+            setup_commands, *build_ram_load_commands(image_file, vector_table=vector_table, stack_pointer=stack_pointer,
+                                                     entry_point=entry_point)
+        ))
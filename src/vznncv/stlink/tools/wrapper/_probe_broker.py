@@ -0,0 +1,514 @@
+"""
+Helper module to lease ST-Link probes to concurrent processes with a local broker.
+
+The broker listens on a Unix socket and speaks newline-delimited json. A client requests a probe by serial number
+(any of the listed serials) or by pool name, and the broker grants probes to the waiting clients in the order
+of their requests. The lease is held while the client connection is open, so it's released automatically
+if the client process dies.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import os
+import os.path
+import signal
+import socket
+import threading
+import time
+from typing import Optional, Dict, Sequence, List, Callable, Any, Tuple
+
+from ._cache_utils import get_cache_path, remove_file
+from ._process_utils import create_event_loop
+
+logger = logging.getLogger(__name__)
+
+# environment variable to override broker socket location
+BROKER_SOCKET_ENV_VAR = 'VZNNCV_STLINK_BROKER_SOCKET'
+
+_BROKER_SOCKET_FILE = 'broker.sock'
+_CONNECT_TIMEOUT = 5.0
+_REQUEST_TIMEOUT = 5.0
+_MESSAGE_LIMIT = 64 * 1024
+
+
+class ProbeBrokerError(ValueError):
+    pass
+
+
+def get_probe_broker_socket_path() -> str:
+    """
+    Get default broker socket path.
+    """
+    socket_path = os.environ.get(BROKER_SOCKET_ENV_VAR)
+    if socket_path:
+        return os.path.abspath(socket_path)
+    return get_cache_path(_BROKER_SOCKET_FILE, create_dir=False)
+
+
+#
+# Client side
+#
+
+class _BrokerConnection:
+    def __init__(self, sock: socket.socket):
+        self._sock = sock
+        self._buffer = b''
+
+    @classmethod
+    def connect(cls, socket_path: str, *, timeout: float = _CONNECT_TIMEOUT) -> '_BrokerConnection':
+        if not hasattr(socket, 'AF_UNIX'):
+            raise ProbeBrokerError("Probe broker requires Unix sockets, but they aren't supported")
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(timeout)
+            sock.connect(socket_path)
+        except OSError as e:
+            sock.close()
+            raise ProbeBrokerError(f"Cannot connect to probe broker \"{socket_path}\": {e}") from None
+        return cls(sock)
+
+    def send(self, message: Dict[str, Any]):
+        self._sock.sendall(json.dumps(message).encode('utf-8') + b'\n')
+
+    def receive(self, timeout: Optional[float]) -> Dict[str, Any]:
+        """
+        Receive message.
+
+        :raises socket.timeout: if message isn't received during ``timeout`` seconds
+        """
+        self._sock.settimeout(timeout)
+        while b'\n' not in self._buffer:
+            data = self._sock.recv(4096)
+            if not data:
+                raise ProbeBrokerError("Probe broker has closed connection")
+            self._buffer += data
+        line, self._buffer = self._buffer.split(b'\n', 1)
+        message = json.loads(line.decode('utf-8'))
+        if message.get('status') == 'error':
+            raise ProbeBrokerError(f"Probe broker error: {message.get('message')}")
+        return message
+
+    def close(self):
+        self._sock.close()
+
+
+def _request(socket_path: str, message: Dict[str, Any], *, timeout: float = _REQUEST_TIMEOUT) -> Dict[str, Any]:
+    connection = _BrokerConnection.connect(socket_path, timeout=timeout)
+    try:
+        connection.send(message)
+        return connection.receive(timeout=timeout)
+    except socket.timeout:
+        raise ProbeBrokerError(f"Probe broker doesn't respond during {timeout} seconds") from None
+    finally:
+        connection.close()
+
+
+def is_probe_broker_running(socket_path: str) -> bool:
+    """
+    Check if probe broker is listening on the socket.
+    """
+    try:
+        _request(socket_path, {'command': 'ping'})
+    except (OSError, ValueError) as e:
+        logger.debug(f"Probe broker \"{socket_path}\" doesn't respond: {e}")
+        return False
+    return True
+
+
+def resolve_probe_broker(socket_path: Optional[str] = None) -> Optional[str]:
+    """
+    Resolve socket of the probe broker that should be used to lease probes.
+
+    If ``socket_path`` or ``VZNNCV_STLINK_BROKER_SOCKET`` variable is set, the broker is required.
+    Otherwise the broker on the default socket is used only if it's running.
+
+    :return: socket path or ``None`` if probes shouldn't be leased
+    """
+    if socket_path is None:
+        socket_path = os.environ.get(BROKER_SOCKET_ENV_VAR) or None
+    if socket_path is not None:
+        return os.path.abspath(socket_path)
+    socket_path = get_probe_broker_socket_path()
+    if os.path.exists(socket_path) and is_probe_broker_running(socket_path):
+        return socket_path
+    return None
+
+
+def get_probe_broker_stats(socket_path: str) -> Dict[str, Any]:
+    """
+    Get lease statistics of the broker: queue depths, holders and wait times.
+    """
+    return _request(socket_path, {'command': 'stats'})['stats']
+
+
+def stop_probe_broker(socket_path: str):
+    """
+    Stop probe broker. Active leases are revoked.
+    """
+    _request(socket_path, {'command': 'shutdown'})
+
+
+class ProbeLease:
+    """
+    Lease of the probe. It's valid until :meth:`release` is called or the process exits.
+    """
+
+    def __init__(self, connection: _BrokerConnection, *, serial: str, lease_id: int, wait_time: float):
+        self._connection = connection
+        self.serial = serial
+        self.lease_id = lease_id
+        self.wait_time = wait_time
+        self._released = False
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        try:
+            self._connection.send({'command': 'release'})
+            self._connection.receive(timeout=_REQUEST_TIMEOUT)
+        except (OSError, ValueError) as e:
+            # the lease is revoked anyway, when connection is closed
+            logger.debug(f"Probe lease {self.lease_id} release has failed: {e}")
+        finally:
+            self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+    def __repr__(self):
+        return f"ProbeLease(serial={self.serial!r}, lease_id={self.lease_id})"
+
+
+def acquire_probe_lease(socket_path: str, *, serials: Sequence[str] = (), pool: Optional[str] = None,
+                        client: Optional[str] = None, timeout: Optional[float] = None,
+                        queued_callback: Optional[Callable[[int], Any]] = None) -> ProbeLease:
+    """
+    Lease one of the ``serials`` probes or any probe of the ``pool``.
+
+    The function blocks until the probe is granted.
+
+    :param socket_path: broker socket path
+    :param serials: acceptable probe serial numbers
+    :param pool: pool name
+    :param client: client description for the broker statistics
+    :param timeout: maximal wait time. If it's ``None``, the function waits infinitely
+    :param queued_callback: callback that is called with number of clients ahead, if the probe isn't granted
+                            immediately
+    :return: probe lease
+    """
+    if bool(serials) == (pool is not None):
+        raise ValueError("Either probe serials or pool must be set")
+    if client is None:
+        client = f"pid {os.getpid()}"
+    connection = _BrokerConnection.connect(socket_path)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    try:
+        connection.send({'command': 'acquire', 'serials': list(serials), 'pool': pool, 'client': client})
+        while True:
+            remaining_time = None
+            if deadline is not None:
+                remaining_time = deadline - time.monotonic()
+                if remaining_time <= 0:
+                    raise socket.timeout()
+            message = connection.receive(timeout=remaining_time)
+            if message.get('status') == 'queued':
+                if queued_callback is not None:
+                    queued_callback(message['position'])
+            elif message.get('status') == 'granted':
+                return ProbeLease(connection, serial=message['serial'], lease_id=message['lease_id'],
+                                  wait_time=message['wait_time'])
+            else:
+                raise ProbeBrokerError(f"Unexpected probe broker response: {message}")
+    except socket.timeout:
+        connection.close()
+        raise ProbeBrokerError(f"Probe isn't leased during {timeout} seconds") from None
+    except BaseException:
+        connection.close()
+        raise
+
+
+#
+# Broker side
+#
+
+class _Waiter:
+    def __init__(self, *, lease_id: int, client: str, candidates: Tuple[str, ...], granted: asyncio.Future):
+        self.lease_id = lease_id
+        self.client = client
+        self.candidates = candidates
+        self.granted = granted
+        self.enqueue_time = time.monotonic()
+
+
+class _Holder:
+    def __init__(self, *, lease_id: int, client: str):
+        self.lease_id = lease_id
+        self.client = client
+        self.grant_time = time.monotonic()
+
+
+class _ProbeStats:
+    def __init__(self):
+        self.leases = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.hold_time_total = 0.0
+
+    def add_wait(self, wait_time: float):
+        self.leases += 1
+        self.wait_time_total += wait_time
+        self.wait_time_max = max(self.wait_time_max, wait_time)
+
+    def wait_time_dict(self) -> Dict[str, float]:
+        return {
+            'mean': self.wait_time_total / self.leases if self.leases else 0.0,
+            'max': self.wait_time_max,
+        }
+
+
+class ProbeBroker:
+    """
+    Probe broker state.
+
+    Waiters are kept in one queue in the order of their requests. When a probe is released, it's granted
+    to the first waiter that accepts it, so a waiter for a busy probe doesn't block waiters for the free ones.
+
+    :param pools: probe serial numbers by pool name
+    """
+
+    def __init__(self, pools: Optional[Dict[str, Sequence[str]]] = None):
+        self._pools = {name: tuple(serial.upper() for serial in serials) for name, serials in (pools or {}).items()}
+        self._queue: List[_Waiter] = []
+        self._holders: Dict[str, _Holder] = {}
+        self._probe_stats: Dict[str, _ProbeStats] = {}
+        self._total_stats = _ProbeStats()
+        self._lease_ids = itertools.count(1)
+        self._start_time = time.monotonic()
+        self._stop_event: Optional[asyncio.Event] = None
+        self._connection_tasks = set()
+
+    def _resolve_candidates(self, request: Dict[str, Any]) -> Tuple[str, ...]:
+        pool = request.get('pool')
+        serials = request.get('serials') or []
+        if pool is not None:
+            if pool not in self._pools:
+                raise ProbeBrokerError(f"Unknown probe pool \"{pool}\". Known pools: {', '.join(self._pools)}")
+            return self._pools[pool]
+        if not isinstance(serials, list) or not serials or not all(isinstance(s, str) for s in serials):
+            raise ProbeBrokerError("Probe serials or pool must be set")
+        return tuple(serial.upper() for serial in serials)
+
+    def _get_probe_stats(self, serial: str) -> _ProbeStats:
+        probe_stats = self._probe_stats.get(serial)
+        if probe_stats is None:
+            probe_stats = self._probe_stats[serial] = _ProbeStats()
+        return probe_stats
+
+    def _dispatch(self):
+        for waiter in list(self._queue):
+            for serial in waiter.candidates:
+                if serial not in self._holders:
+                    break
+            else:
+                continue
+            self._queue.remove(waiter)
+            wait_time = time.monotonic() - waiter.enqueue_time
+            self._holders[serial] = _Holder(lease_id=waiter.lease_id, client=waiter.client)
+            self._get_probe_stats(serial).add_wait(wait_time)
+            self._total_stats.add_wait(wait_time)
+            waiter.granted.set_result(serial)
+            logger.info(f"Lease {waiter.lease_id}: probe {serial} is leased to {waiter.client} "
+                        f"(wait time {wait_time:.3f} s, queue depth {len(self._queue)})")
+
+    def _release(self, serial: str, lease_id: int):
+        holder = self._holders.get(serial)
+        if holder is None or holder.lease_id != lease_id:
+            return
+        del self._holders[serial]
+        hold_time = time.monotonic() - holder.grant_time
+        self._get_probe_stats(serial).hold_time_total += hold_time
+        self._total_stats.hold_time_total += hold_time
+        logger.info(f"Lease {lease_id}: probe {serial} is released by {holder.client} (hold time {hold_time:.3f} s)")
+        self._dispatch()
+
+    def get_stats(self) -> Dict[str, Any]:
+        current_time = time.monotonic()
+        serials = set(self._probe_stats)
+        serials.update(self._holders)
+        for serials_group in itertools.chain(self._pools.values(), (w.candidates for w in self._queue)):
+            serials.update(serials_group)
+        probes = []
+        for serial in sorted(serials):
+            holder = self._holders.get(serial)
+            probe_stats = self._probe_stats.get(serial, _ProbeStats())
+            probes.append({
+                'serial': serial,
+                'pools': sorted(name for name, pool_serials in self._pools.items() if serial in pool_serials),
+                'holder': None if holder is None else {
+                    'client': holder.client,
+                    'lease_id': holder.lease_id,
+                    'hold_time': current_time - holder.grant_time,
+                },
+                'queue_depth': sum(1 for waiter in self._queue if serial in waiter.candidates),
+                'leases': probe_stats.leases,
+                'wait_time': probe_stats.wait_time_dict(),
+                'hold_time_total': probe_stats.hold_time_total,
+            })
+        return {
+            'uptime': current_time - self._start_time,
+            'queue_depth': len(self._queue),
+            'leases': self._total_stats.leases,
+            'wait_time': self._total_stats.wait_time_dict(),
+            'pools': {name: list(pool_serials) for name, pool_serials in self._pools.items()},
+            'probes': probes,
+            'waiters': [{
+                'client': waiter.client,
+                'lease_id': waiter.lease_id,
+                'candidates': list(waiter.candidates),
+                'wait_time': current_time - waiter.enqueue_time,
+            } for waiter in self._queue],
+        }
+
+    @staticmethod
+    async def _read_message(reader: asyncio.StreamReader) -> Optional[Dict[str, Any]]:
+        line = await reader.readline()
+        if not line:
+            return None
+        try:
+            message = json.loads(line.decode('utf-8'))
+        except ValueError:
+            message = None
+        if not isinstance(message, dict):
+            raise ProbeBrokerError("Invalid request")
+        return message
+
+    @staticmethod
+    async def _send(writer: asyncio.StreamWriter, message: Dict[str, Any]):
+        writer.write(json.dumps(message).encode('utf-8') + b'\n')
+        await writer.drain()
+
+    async def _handle_acquire(self, request: Dict[str, Any], reader: asyncio.StreamReader,
+                              writer: asyncio.StreamWriter):
+        waiter = _Waiter(lease_id=next(self._lease_ids), client=str(request.get('client') or 'unknown client'),
+                         candidates=self._resolve_candidates(request),
+                         granted=asyncio.get_event_loop().create_future())
+        self._queue.append(waiter)
+        self._dispatch()
+        # any message or connection closing releases the lease or cancels the request
+        release_request = asyncio.ensure_future(reader.readline())
+        try:
+            if not waiter.granted.done():
+                position = self._queue.index(waiter)
+                logger.info(f"Lease {waiter.lease_id}: {waiter.client} waits for {', '.join(waiter.candidates)} "
+                            f"(position {position})")
+                await self._send(writer, {'status': 'queued', 'position': position})
+                await asyncio.wait([waiter.granted, release_request], return_when=asyncio.FIRST_COMPLETED)
+                if not waiter.granted.done():
+                    logger.info(f"Lease {waiter.lease_id}: {waiter.client} has cancelled request")
+                    return
+            await self._send(writer, {
+                'status': 'granted',
+                'serial': waiter.granted.result(),
+                'lease_id': waiter.lease_id,
+                'wait_time': time.monotonic() - waiter.enqueue_time,
+            })
+            if await release_request:
+                await self._send(writer, {'status': 'released'})
+        finally:
+            release_request.cancel()
+            if waiter.granted.done():
+                self._release(waiter.granted.result(), waiter.lease_id)
+            else:
+                waiter.granted.cancel()
+                self._queue.remove(waiter)
+                self._dispatch()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        current_task = getattr(asyncio, 'current_task', None) or asyncio.Task.current_task
+        task = current_task()
+        self._connection_tasks.add(task)
+        try:
+            request = await self._read_message(reader)
+            if request is None:
+                return
+            command = request.get('command')
+            if command == 'acquire':
+                await self._handle_acquire(request, reader, writer)
+            elif command == 'stats':
+                await self._send(writer, {'status': 'ok', 'stats': self.get_stats()})
+            elif command == 'ping':
+                await self._send(writer, {'status': 'ok'})
+            elif command == 'shutdown':
+                await self._send(writer, {'status': 'ok'})
+                self._stop_event.set()
+            else:
+                raise ProbeBrokerError(f"Unknown command: {command}")
+        except ProbeBrokerError as e:
+            try:
+                await self._send(writer, {'status': 'error', 'message': str(e)})
+            except OSError:
+                pass
+        except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError) as e:
+            logger.debug(f"Probe broker connection error: {e}")
+        finally:
+            writer.close()
+            self._connection_tasks.discard(task)
+
+    async def serve(self, socket_path: str, *, ready_callback: Optional[Callable[[], Any]] = None):
+        """
+        Serve clients until "shutdown" command or SIGINT/SIGTERM signal.
+        """
+        if os.path.exists(socket_path):
+            if is_probe_broker_running(socket_path):
+                raise ProbeBrokerError(f"Probe broker is already running on \"{socket_path}\"")
+            logger.debug(f"Remove stale probe broker socket \"{socket_path}\"")
+            remove_file(socket_path)
+        os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+
+        loop = asyncio.get_event_loop()
+        self._stop_event = asyncio.Event()
+        server = await asyncio.start_unix_server(self._handle_connection, path=socket_path, limit=_MESSAGE_LIMIT)
+        handle_signals = threading.current_thread() is threading.main_thread()
+        if handle_signals:
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                loop.add_signal_handler(sig, self._stop_event.set)
+        logger.info(f"Probe broker is listening on \"{socket_path}\"")
+        try:
+            if ready_callback is not None:
+                ready_callback()
+            await self._stop_event.wait()
+        finally:
+            if handle_signals:
+                for sig in (signal.SIGINT, signal.SIGTERM):
+                    loop.remove_signal_handler(sig)
+            server.close()
+            # active leases are revoked
+            for task in list(self._connection_tasks):
+                task.cancel()
+            if self._connection_tasks:
+                await asyncio.wait(list(self._connection_tasks))
+            await server.wait_closed()
+            remove_file(socket_path)
+            logger.info("Probe broker is stopped")
+
+
+def run_probe_broker(socket_path: str, pools: Optional[Dict[str, Sequence[str]]] = None, *,
+                     ready_callback: Optional[Callable[[], Any]] = None):
+    """
+    Run probe broker in the current thread until it's stopped.
+
+    :param socket_path: Unix socket path
+    :param pools: probe serial numbers by pool name
+    :param ready_callback: callback that is called when broker accepts connections
+    """
+    broker = ProbeBroker(pools)
+    loop = create_event_loop()
+    try:
+        loop.run_until_complete(broker.serve(socket_path, ready_callback=ready_callback))
+    finally:
+        loop.close()
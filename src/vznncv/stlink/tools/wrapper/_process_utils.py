@@ -0,0 +1,230 @@
+"""
+Helper module to run backend processes with timeouts using asyncio.
+
+Each process is started in a separate process group (session), so it can be terminated with all its children.
+Standard output and error streams are drained concurrently, so a process cannot be blocked by a full pipe.
+"""
+import asyncio
+import logging
+import os
+import signal
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import List, Optional, Callable, Dict, Any, TypeVar, Union, Iterator
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# time to wait process termination before killing it
+_TERMINATE_TIMEOUT = 5.0
+# maximal length of the output line
+_LINE_LIMIT = 1024 * 1024
+
+
+class ProcessTimeoutError(ValueError):
+    pass
+
+
+def create_event_loop() -> asyncio.AbstractEventLoop:
+    if sys.platform == 'win32':
+        # subprocesses are supported by proactor event loop only
+        return asyncio.ProactorEventLoop()
+    return asyncio.new_event_loop()
+
+
+def _signal_process_group(process: asyncio.subprocess.Process, kill: bool):
+    try:
+        if os.name == 'posix':
+            os.killpg(process.pid, signal.SIGKILL if kill else signal.SIGTERM)
+        elif kill:
+            process.kill()
+        else:
+            process.terminate()
+    except (ProcessLookupError, PermissionError):
+        # process has been finished already
+        pass
+
+
+async def _terminate_process(process: asyncio.subprocess.Process, terminate_timeout: float):
+    if process.returncode is not None:
+        return
+    logger.debug(f"Terminate process {process.pid}")
+    _signal_process_group(process, kill=False)
+    try:
+        await asyncio.wait_for(process.wait(), terminate_timeout)
+    except asyncio.TimeoutError:
+        logger.debug(f"Kill process {process.pid}")
+        _signal_process_group(process, kill=True)
+        await process.wait()
+
+
+class _PhaseState:
+    def __init__(self, phase: Optional[str], start_time: float):
+        self.phase = phase
+        self.start_time = start_time
+        self.changed = asyncio.Event()
+
+
+async def run_process(command_args: List[str], *, cwd: Optional[str], line_handler: Callable[[str], Any],
+                      phase_getter: Optional[Callable[[], str]] = None, timeout: Optional[float] = None,
+                      phase_timeouts: Optional[Dict[str, float]] = None,
+                      terminate_timeout: float = _TERMINATE_TIMEOUT) -> int:
+    """
+    Run process and pass its output to ``line_handler`` line by line.
+
+    If process exceeds ``timeout`` or its current phase (that is returned by ``phase_getter`` after each line)
+    lasts longer than corresponding ``phase_timeouts`` value, the process group is terminated and
+    ``ProcessTimeoutError`` is raised. The process group is terminated on cancellation as well.
+
+    :return: process return code
+    """
+    loop = asyncio.get_event_loop()
+    if os.name == 'posix':
+        platform_kwargs = {'start_new_session': True}
+    else:
+        platform_kwargs = {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+    process = await asyncio.create_subprocess_exec(
+        *command_args, cwd=cwd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        limit=_LINE_LIMIT, **platform_kwargs
+    )
+    start_time = loop.time()
+    phase_timeouts = phase_timeouts or {}
+    phase_state = _PhaseState(phase_getter() if phase_getter is not None else None, start_time)
+
+    async def drain(stream: asyncio.StreamReader):
+        while True:
+            line = await stream.readline()
+            if not line:
+                break
+            line_handler(line.decode('utf-8', errors='replace').rstrip('\r\n'))
+            if phase_getter is not None:
+                phase = phase_getter()
+                if phase != phase_state.phase:
+                    phase_state.phase = phase
+                    phase_state.start_time = loop.time()
+                    phase_state.changed.set()
+
+    async def wait_completion():
+        await asyncio.gather(drain(process.stdout), drain(process.stderr))
+        return await process.wait()
+
+    completion = asyncio.ensure_future(wait_completion())
+    try:
+        while not completion.done():
+            deadlines = []
+            if timeout is not None:
+                deadlines.append((start_time + timeout, f"{timeout}s timeout"))
+            phase_timeout = phase_timeouts.get(phase_state.phase)
+            if phase_timeout is not None:
+                deadlines.append((phase_state.start_time + phase_timeout,
+                                  f"{phase_timeout}s timeout of the \"{phase_state.phase}\" phase"))
+            deadline, reason = min(deadlines) if deadlines else (None, None)
+            if deadline is not None and loop.time() >= deadline:
+                raise ProcessTimeoutError(f"Process \"{command_args[0]}\" has exceeded {reason}")
+
+            phase_state.changed.clear()
+            phase_waiter = asyncio.ensure_future(phase_state.changed.wait())
+            try:
+                await asyncio.wait([completion, phase_waiter], return_when=asyncio.FIRST_COMPLETED,
+                                   timeout=None if deadline is None else max(0.0, deadline - loop.time()))
+            finally:
+                phase_waiter.cancel()
+        return completion.result()
+    except BaseException:
+        completion.cancel()
+        await _terminate_process(process, terminate_timeout)
+        raise
+
+
+class ProcessRunner:
+    """
+    Runner of the backend processes.
+
+    Tasks that are passed to ``run_tasks`` are executed in the worker threads. Their backend processes,
+    that are started with ``run_process``, are supervised by one event loop that is driven by
+    the ``run_tasks`` caller thread.
+
+    :param timeout: maximal duration of each backend process
+    :param phase_timeouts: maximal durations of the backend process phases
+    """
+
+    def __init__(self, *, timeout: Optional[float] = None, phase_timeouts: Optional[Dict[str, float]] = None):
+        self.timeout = timeout
+        self.phase_timeouts = dict(phase_timeouts or {})
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_lock = threading.Lock()
+        # process tasks are accessed from the event loop thread only
+        self._process_tasks = set()
+
+    def run_tasks(self, tasks: List[Callable[[], T]], *, max_workers: int) -> List[Union[T, BaseException]]:
+        """
+        Run tasks in the worker threads.
+
+        :return: task results or exceptions, that are raised by tasks
+        """
+        with _event_loop() as loop:
+            with self._loop_lock:
+                if self._loop is not None:
+                    raise ValueError("Process runner is used already")
+                self._loop = loop
+            executor = ThreadPoolExecutor(max_workers=max_workers)
+            try:
+                task_futures = [loop.run_in_executor(executor, task) for task in tasks]
+                return loop.run_until_complete(asyncio.gather(*task_futures, return_exceptions=True))
+            finally:
+                with self._loop_lock:
+                    self._loop = None
+                # terminate processes of the interrupted tasks
+                process_tasks = list(self._process_tasks)
+                for process_task in process_tasks:
+                    process_task.cancel()
+                if process_tasks:
+                    loop.run_until_complete(asyncio.gather(*process_tasks, return_exceptions=True))
+                executor.shutdown(wait=True)
+
+    async def _run_process_async(self, command_args: List[str], **kwargs) -> int:
+        process_task = asyncio.ensure_future(
+            run_process(command_args, timeout=self.timeout, phase_timeouts=self.phase_timeouts, **kwargs)
+        )
+        self._process_tasks.add(process_task)
+        try:
+            return await process_task
+        finally:
+            self._process_tasks.discard(process_task)
+
+    def run_process(self, command_args: List[str], *, cwd: Optional[str], line_handler: Callable[[str], Any],
+                    phase_getter: Optional[Callable[[], str]] = None) -> int:
+        """
+        Run backend process and wait its completion.
+
+        If it's called from ``run_tasks`` task, the process is run with the shared event loop.
+        Otherwise a temporary event loop is used.
+
+        :return: process return code
+        """
+        coro = self._run_process_async(command_args, cwd=cwd, line_handler=line_handler, phase_getter=phase_getter)
+        with self._loop_lock:
+            process_future = None if self._loop is None else asyncio.run_coroutine_threadsafe(coro, self._loop)
+        if process_future is not None:
+            return process_future.result()
+        with _event_loop() as loop:
+            return loop.run_until_complete(coro)
+
+
+@contextmanager
+def _event_loop() -> Iterator[asyncio.AbstractEventLoop]:
+    loop = create_event_loop()
+    is_main_thread = threading.current_thread() is threading.main_thread()
+    if is_main_thread:
+        # attach child watcher to the loop (it's required by python < 3.8)
+        asyncio.set_event_loop(loop)
+    try:
+        yield loop
+    finally:
+        loop.close()
+        if is_main_thread:
+            asyncio.set_event_loop(None)
@@ -0,0 +1,95 @@
+"""
+Helper module to read project configuration file.
+
+The configuration file ``.vznncv-stlink.toml`` is located in the project directory and pins ``upload-app``
+options, so they aren't discovered on each run::
+
+    [upload-app]
+    elf-file = "build/app.elf"
+    backend = "openocd"
+    openocd-config = "openocd.cfg"
+
+Relative paths are resolved against the project directory. Explicit command line options take precedence.
+"""
+import logging
+import os.path
+from typing import NamedTuple, Optional, Dict, Any
+
+logger = logging.getLogger(__name__)
+
+PROJECT_CONFIG_FILE = '.vznncv-stlink.toml'
+
+_UPLOAD_APP_SECTION = 'upload-app'
+# configuration keys and flags if they're paths
+_UPLOAD_APP_KEYS = {
+    'elf-file': True,
+    'backend': False,
+    'openocd-path': True,
+    'openocd-config': True,
+    'pyocd-path': True,
+    'pyocd-target': False,
+    'pyocd-config': True,
+    'pyocd-script': True,
+}
+
+
+class ProjectConfigError(ValueError):
+    pass
+
+
+class ProjectConfig(NamedTuple):
+    # configuration file path or ``None`` if project doesn't have it
+    config_file: Optional[str] = None
+    elf_file: Optional[str] = None
+    backend: Optional[str] = None
+    openocd_path: Optional[str] = None
+    openocd_config: Optional[str] = None
+    pyocd_path: Optional[str] = None
+    pyocd_target: Optional[str] = None
+    pyocd_config: Optional[str] = None
+    pyocd_script: Optional[str] = None
+
+
+def _load_toml_file(path: str) -> Dict[str, Any]:
+    try:
+        import tomllib
+    except ImportError:
+        try:
+            import tomli as tomllib
+        except ImportError:
+            raise ProjectConfigError(f"Cannot read \"{path}\", as toml parser isn't available. "
+                                     f"Install \"tomli\" package or use Python 3.11+") from None
+    try:
+        with open(path, 'rb') as f:
+            return tomllib.load(f)
+    except tomllib.TOMLDecodeError as e:
+        raise ProjectConfigError(f"Invalid project configuration file \"{path}\": {e}") from None
+
+
+def load_project_config(project_dir: str) -> ProjectConfig:
+    """
+    Load project configuration.
+
+    :param project_dir: project directory
+    :return: project configuration. If project doesn't have configuration file, empty configuration is returned
+    """
+    config_file = os.path.join(os.path.abspath(project_dir), PROJECT_CONFIG_FILE)
+    if not os.path.isfile(config_file):
+        return ProjectConfig()
+    data = _load_toml_file(config_file)
+
+    upload_app_data = data.get(_UPLOAD_APP_SECTION, {})
+    if not isinstance(upload_app_data, dict):
+        raise ProjectConfigError(f"\"{_UPLOAD_APP_SECTION}\" of \"{config_file}\" must be a table")
+    values = {}
+    for key, value in upload_app_data.items():
+        if key not in _UPLOAD_APP_KEYS:
+            raise ProjectConfigError(f"Unknown option \"{key}\" in \"{config_file}\". "
+                                     f"Supported options: {', '.join(_UPLOAD_APP_KEYS)}")
+        if not isinstance(value, str):
+            raise ProjectConfigError(f"Option \"{key}\" in \"{config_file}\" must be a string")
+        if _UPLOAD_APP_KEYS[key]:
+            value = os.path.normpath(os.path.join(os.path.dirname(config_file), os.path.expanduser(value)))
+        values[key.replace('-', '_')] = value
+    logger.debug(f"Project configuration \"{config_file}\": {values}")
+    return ProjectConfig(config_file=config_file, **values)
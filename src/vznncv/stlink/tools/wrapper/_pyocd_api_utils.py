@@ -0,0 +1,387 @@
+"""
+Helper module to upload programs with pyocd Python API in the current process.
+
+It avoids pyocd interpreter startup and module import for each upload. Opened probe sessions are kept
+by ``PyOcdSessionPool``, so one session can be used to upload several images.
+"""
+import importlib.util
+import logging
+import sys
+import threading
+import time
+import zlib
+from typing import NamedTuple, Optional, Dict, Tuple, List, Any, Sequence
+
+from ._artifact_cache import ImageFile
+from ._backend_output import BackendEvent, DeviceOutput
+from ._backend_registry import VERIFY_READBACK, VERIFY_CRC
+from ._elf_utils import ElfLoadSegment
+from ._ram_utils import VTOR_ADDRESS
+
+logger = logging.getLogger(__name__)
+
+PYOCD_API_BACKEND = 'pyocd-api'
+
+# pyocd flash analyzer encodes block address as 16-bit number of the block sizes
+_CRC_BLOCK_INDEX_LIMIT = 1 << 16
+# maximal number of blocks that are passed to the flash analyzer at once
+_CRC_BATCH_SIZE = 32
+
+
+def is_pyocd_api_available() -> bool:
+    """
+    Check if pyocd package can be imported.
+    """
+    if sys.modules.get('pyocd') is not None:
+        return True
+    try:
+        return importlib.util.find_spec('pyocd') is not None
+    except (ImportError, ValueError):
+        return False
+
+
+class PyOcdVerifyError(ValueError):
+    pass
+
+
+class PyOcdSessionOptions(NamedTuple):
+    # debug probe unique id (ST-Link hla serial)
+    unique_id: str
+    target: str
+    config_file: Optional[str] = None
+    user_script: Optional[str] = None
+    # SWD clock in Hz
+    frequency: Optional[int] = None
+
+    def to_pyocd_options(self) -> Dict[str, Any]:
+        options = {'target_override': self.target}
+        if self.frequency is not None:
+            options['frequency'] = self.frequency
+        if self.config_file is not None:
+            options['config_file'] = self.config_file
+        if self.user_script is not None:
+            options['user_script'] = self.user_script
+        return options
+
+
+def _open_session(options: PyOcdSessionOptions):
+    from pyocd.core.helpers import ConnectHelper
+
+    logger.debug(f"Open pyocd session with probe {options.unique_id}")
+    session = ConnectHelper.session_with_chosen_probe(
+        unique_id=options.unique_id, blocking=False, return_first=True, options=options.to_pyocd_options()
+    )
+    if session is None:
+        raise ValueError(f"Cannot find pyocd debug probe with unique id {options.unique_id}")
+    session.open()
+    return session
+
+
+def _close_session(session):
+    try:
+        session.close()
+    except Exception:
+        logger.debug("Failed to close pyocd session", exc_info=True)
+
+
+class PyOcdSessionPool:
+    """
+    Pool of the opened pyocd sessions.
+
+    A session is opened on the first request for a debug probe and is kept opened until the pool is closed,
+    so it can be reused for subsequent uploads. Sessions of different probes can be used concurrently.
+    """
+
+    def __init__(self):
+        self._sessions: Dict[str, Tuple[PyOcdSessionOptions, Any]] = {}
+        self._lock = threading.Lock()
+
+    def get_session(self, options: PyOcdSessionOptions):
+        """
+        Get opened session of the probe. If the probe session has other options, it's reopened.
+        """
+        with self._lock:
+            session_options, session = self._sessions.pop(options.unique_id, (None, None))
+        if session is not None and session_options != options:
+            _close_session(session)
+            session = None
+        if session is None:
+            session = _open_session(options)
+        with self._lock:
+            self._sessions[options.unique_id] = (options, session)
+        return session
+
+    def discard_session(self, unique_id: str):
+        """
+        Close probe session, so the next request opens a new one.
+        """
+        with self._lock:
+            _, session = self._sessions.pop(unique_id, (None, None))
+        if session is not None:
+            _close_session(session)
+
+    def close(self):
+        with self._lock:
+            sessions = [session for _, session in self._sessions.values()]
+            self._sessions.clear()
+        for session in sessions:
+            _close_session(session)
+
+    def __enter__(self) -> 'PyOcdSessionPool':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class _ProgressReporter:
+    """
+    Converter of the pyocd programming progress into backend events.
+    """
+
+    def __init__(self, device_output: DeviceOutput):
+        self._device_output = device_output
+        self._last_percent = None
+
+    def write_event(self, kind: str, message: str, **kwargs):
+        event = BackendEvent(timestamp=time.time(), kind=kind, message=message, **kwargs)
+        self._device_output.write_event(PYOCD_API_BACKEND, event)
+
+    def __call__(self, progress: float):
+        percent = int(progress * 100)
+        if percent != self._last_percent:
+            self._last_percent = percent
+            self.write_event('progress', f'{percent}%', progress=percent / 100)
+
+
+def program_with_pyocd_session(session_pool: PyOcdSessionPool, options: PyOcdSessionOptions,
+                               image_files: Sequence[ImageFile], *, data_size: int,
+                               device_output: DeviceOutput, erase: Optional[str] = None):
+    """
+    Program files to the target using pyocd ``FileProgrammer``.
+
+    :param session_pool: pool of the opened sessions
+    :param options: session options
+    :param image_files: elf, hex or binary images
+    :param data_size: total size of the programmed data
+    :param device_output: device output to report progress events
+    :param erase: pyocd erase mode ("chip", "sector", "auto") or ``None`` to use default one
+    """
+    from pyocd.flash.file_programmer import FileProgrammer
+
+    session = session_pool.get_session(options)
+    progress_reporter = _ProgressReporter(device_output)
+    try:
+        progress_reporter.write_event('program_started', 'Programming Started')
+        start_time = time.monotonic()
+        programmer = FileProgrammer(session, progress=progress_reporter, chip_erase=erase)
+        for image_file in image_files:
+            programmer.program(image_file.path, file_format=image_file.format, base_address=image_file.base_address)
+        duration = time.monotonic() - start_time
+    except Exception as e:
+        progress_reporter.write_event('error', f'Programming Failed: {e}')
+        # session state is unknown after failure
+        session_pool.discard_session(options.unique_id)
+        raise
+    progress_reporter.write_event('programmed', f'programmed {data_size} bytes', bytes=data_size, duration=duration,
+                                  rate=data_size / duration if duration > 0 else None)
+    progress_reporter.write_event('program_finished', 'Programming Finished')
+
+
+def _check_memory_readback(target, segments: List[ElfLoadSegment]) -> bool:
+    for segment in segments:
+        memory_data = bytes(target.read_memory_block8(segment.address, len(segment.data)))
+        if memory_data != segment.data:
+            logger.debug(f"Target memory at 0x{segment.address:08X} doesn't match the image")
+            return False
+    return True
+
+
+def check_memory_with_pyocd_session(session_pool: PyOcdSessionPool, options: PyOcdSessionOptions,
+                                    segments: List[ElfLoadSegment]) -> bool:
+    """
+    Check that target memory holds image segments using CRC32 checksums that are calculated on the target.
+
+    Data that cannot be checked by the flash analyzer is read back.
+    """
+    session = session_pool.get_session(options)
+    try:
+        matches, readback_size = _check_memory_crc(session.board.target, segments)
+    except Exception:
+        session_pool.discard_session(options.unique_id)
+        raise
+    if readback_size:
+        logger.debug(f"{readback_size} bytes cannot be checked by flash analyzer and are read back")
+    return matches
+
+
+def _get_crc_blocks(address: int, size: int) -> List[Tuple[int, int]]:
+    """
+    Split memory range into aligned blocks with power of 2 sizes, that are supported by pyocd flash analyzer.
+    """
+    blocks = []
+    end = address + size
+    while address < end:
+        block_size = address & -address if address else 1 << (end - 1).bit_length()
+        while address + block_size > end:
+            block_size >>= 1
+        blocks.append((address, block_size))
+        address += block_size
+    return blocks
+
+
+def _get_crc_flash(target, address: int, size: int):
+    """
+    Get flash object of the memory range, if its algorithm can calculate CRC32 checksums.
+    """
+    memory_map = getattr(target, 'memory_map', None)
+    if memory_map is None:
+        return None
+    region = memory_map.get_region_for_address(address)
+    if region is None or not region.is_flash or not region.contains_range(address, length=size):
+        return None
+    flash = region.flash
+    if flash is None or not flash.get_flash_info().crc_supported:
+        return None
+    return flash
+
+
+def _check_memory_crc(target, segments: List[ElfLoadSegment]) -> Tuple[bool, int]:
+    """
+    Compare CRC32 checksums of the segment blocks with checksums that are calculated by the flash analyzer.
+
+    :return: check result and size of the data that is read back, as its checksums cannot be calculated
+    """
+    crc_blocks = []
+    readback_blocks = []
+    for segment in segments:
+        for address, size in _get_crc_blocks(segment.address, len(segment.data)):
+            data = segment.data[address - segment.address:address - segment.address + size]
+            flash = None
+            if address // size < _CRC_BLOCK_INDEX_LIMIT:
+                flash = _get_crc_flash(target, address, size)
+            if flash is None:
+                readback_blocks.append((address, data))
+            else:
+                crc_blocks.append((flash, address, data))
+
+    for flash in {id(flash): flash for flash, _, _ in crc_blocks}.values():
+        flash_blocks = [(address, data) for block_flash, address, data in crc_blocks if block_flash is flash]
+        flash.init(flash.Operation.VERIFY)
+        try:
+            for i in range(0, len(flash_blocks), _CRC_BATCH_SIZE):
+                batch = flash_blocks[i:i + _CRC_BATCH_SIZE]
+                target_crcs = flash.compute_crcs([(address, len(data)) for address, data in batch])
+                for (address, data), target_crc in zip(batch, target_crcs):
+                    if zlib.crc32(data) != target_crc & 0xFFFFFFFF:
+                        logger.debug(f"Target memory checksum at 0x{address:08X} doesn't match the image")
+                        return False, 0
+        finally:
+            flash.cleanup()
+    if crc_blocks:
+        # flash analyzer is run by the target core, so the application is restarted
+        target.reset()
+
+    readback_segments = [ElfLoadSegment(address, data) for address, data in readback_blocks]
+    if not _check_memory_readback(target, readback_segments):
+        return False, 0
+    return True, sum(len(data) for _, data in readback_blocks)
+
+
+def verify_with_pyocd_session(session_pool: PyOcdSessionPool, options: PyOcdSessionOptions,
+                              segments: List[ElfLoadSegment], *, verify: str, device_output: DeviceOutput):
+    """
+    Verify programmed image segments.
+
+    "readback" mode reads target memory back. "crc" mode compares host CRC32 checksums of the segments with
+    checksums that are calculated by the flash algorithm analyzer on the target, so only checksums are
+    transferred. Data that cannot be checked by the analyzer (like RAM segments or unaligned segment tails) is
+    read back.
+
+    :param verify: "readback" or "crc"
+    :raises PyOcdVerifyError: if target memory doesn't match the image
+    """
+    if verify not in (VERIFY_READBACK, VERIFY_CRC):
+        raise ValueError(f"Unknown verification mode: {verify}")
+    session = session_pool.get_session(options)
+    progress_reporter = _ProgressReporter(device_output)
+    progress_reporter.write_event('verify_started', 'Verify Started')
+    start_time = time.monotonic()
+    try:
+        target = session.board.target
+        if verify == VERIFY_CRC:
+            matches, readback_size = _check_memory_crc(target, segments)
+            if readback_size:
+                logger.debug(f"{readback_size} bytes cannot be checked by flash analyzer and are read back")
+        else:
+            matches = _check_memory_readback(target, segments)
+    except Exception as e:
+        progress_reporter.write_event('error', f'Verification Failed: {e}')
+        session_pool.discard_session(options.unique_id)
+        raise
+    if not matches:
+        progress_reporter.write_event('error', 'Verification Failed: target memory doesn\'t match the image')
+        raise PyOcdVerifyError("Target memory doesn't match the programmed image")
+    duration = time.monotonic() - start_time
+    data_size = sum(len(segment.data) for segment in segments)
+    progress_reporter.write_event('verified', f'verified {data_size} bytes', bytes=data_size, duration=duration,
+                                  rate=data_size / duration if duration > 0 else None)
+    progress_reporter.write_event('verify_finished', 'Verified OK')
+
+
+def _find_non_ram_segment(target, segments: List[ElfLoadSegment]) -> Optional[ElfLoadSegment]:
+    """
+    Find the first segment that isn't placed in RAM regions of the target memory map.
+    """
+    memory_map = getattr(target, 'memory_map', None)
+    if memory_map is None:
+        return None
+    for segment in segments:
+        # segment can span several adjacent RAM regions
+        address = segment.address
+        while address < segment.address + len(segment.data):
+            region = memory_map.get_region_for_address(address)
+            if region is None or not region.is_ram:
+                return segment
+            address = region.end + 1
+    return None
+
+
+def load_ram_image_with_pyocd_session(session_pool: PyOcdSessionPool, options: PyOcdSessionOptions,
+                                      segments: List[ElfLoadSegment], *, vector_table: int, stack_pointer: int,
+                                      entry_point: int, device_output: DeviceOutput):
+    """
+    Write image segments to SRAM and run the image without flash programming.
+
+    :param vector_table: vector table address, that is set to VTOR register
+    :param stack_pointer: initial stack pointer
+    :param entry_point: address of the first instruction
+    :raises ValueError: if image segments aren't placed in RAM regions of the target memory map
+    """
+    session = session_pool.get_session(options)
+    non_ram_segment = _find_non_ram_segment(session.board.target, segments)
+    if non_ram_segment is not None:
+        raise ValueError(f"Image cannot be loaded to RAM, as its segment 0x{non_ram_segment.address:08X} "
+                         f"({len(non_ram_segment.data)} bytes) is placed outside RAM of {options.target} target")
+    progress_reporter = _ProgressReporter(device_output)
+    data_size = sum(len(segment.data) for segment in segments)
+    try:
+        progress_reporter.write_event('program_started', 'RAM Loading Started')
+        start_time = time.monotonic()
+        target = session.board.target
+        target.reset_and_halt()
+        for segment in segments:
+            target.write_memory_block8(segment.address, segment.data)
+        duration = time.monotonic() - start_time
+        # interrupts and faults of the image must be handled by its own vector table instead of the flash one
+        target.write32(VTOR_ADDRESS, vector_table)
+        target.write_core_register('sp', stack_pointer)
+        target.write_core_register('pc', entry_point)
+        target.resume()
+    except Exception as e:
+        progress_reporter.write_event('error', f'RAM Loading Failed: {e}')
+        session_pool.discard_session(options.unique_id)
+        raise
+    progress_reporter.write_event('programmed', f'loaded {data_size} bytes', bytes=data_size, duration=duration,
+                                  rate=data_size / duration if duration > 0 else None)
+    progress_reporter.write_event('program_finished', 'RAM Loading Finished')
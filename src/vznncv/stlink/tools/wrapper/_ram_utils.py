@@ -0,0 +1,115 @@
+"""
+Helper module to run applications from target SRAM without flash programming.
+
+The image segments are written to SRAM, then the vector table offset register, the stack pointer and the program
+counter are set from the image vector table and the target core is resumed. The image isn't kept after target reset.
+"""
+import logging
+import struct
+from typing import NamedTuple, List, Optional
+
+from ._elf_utils import ElfFile, ElfLoadSegment
+
+logger = logging.getLogger(__name__)
+
+# SRAM region of the Cortex-M architectural memory map. Actual SRAM of the target is smaller and
+# it's checked by pyocd-api backend only, so other backends fail on load of the segments outside it
+SRAM_REGION = (0x20000000, 0x40000000)
+# vector table offset register of the Cortex-M system control block
+VTOR_ADDRESS = 0xE000ED08
+# minimal alignment of the vector table, as VTOR bits [6:0] are reserved
+_VECTOR_TABLE_ALIGNMENT = 128
+
+# sections and symbols of the vector table that are used by the common startup files
+_VECTOR_TABLE_SECTIONS = ('.isr_vector', '.vectors', '.vector_table')
+_VECTOR_TABLE_SYMBOLS = ('g_pfnVectors', '__isr_vector', '__Vectors', '__vector_table')
+# initial stack pointer and reset handler
+_VECTOR_TABLE_HEAD = struct.Struct('<II')
+
+
+class RamImageEntry(NamedTuple):
+    vector_table: int
+    stack_pointer: int
+    # reset handler address without thumb bit
+    entry_point: int
+
+    def __str__(self):
+        return f"entry point 0x{self.entry_point:08X}, stack pointer 0x{self.stack_pointer:08X}"
+
+
+def is_sram_range(address: int, size: int) -> bool:
+    """
+    Check if memory range is placed in the SRAM region of the Cortex-M memory map.
+    """
+    sram_start, sram_end = SRAM_REGION
+    return sram_start <= address and address + size <= sram_end
+
+
+def find_non_sram_segment(segments: List[ElfLoadSegment]) -> Optional[ElfLoadSegment]:
+    """
+    Find the first image segment that is placed outside SRAM.
+    """
+    for segment in segments:
+        if not is_sram_range(segment.address, len(segment.data)):
+            return segment
+    return None
+
+
+def is_sram_image(segments: List[ElfLoadSegment]) -> bool:
+    """
+    Check if all image segments are linked to SRAM.
+    """
+    return bool(segments) and find_non_sram_segment(segments) is None
+
+
+def _find_vector_table(elf_path: str) -> Optional[int]:
+    with ElfFile(elf_path) as elf_file:
+        for section_name in _VECTOR_TABLE_SECTIONS:
+            section_header = elf_file.get_section(section_name)
+            if section_header is not None and section_header.size >= _VECTOR_TABLE_HEAD.size:
+                return section_header.addr
+        for symbol_name in _VECTOR_TABLE_SYMBOLS:
+            symbol = elf_file.find_symbol(symbol_name)
+            if symbol is not None:
+                return symbol.value
+    return None
+
+
+def _find_segment(segments: List[ElfLoadSegment], address: int, size: int) -> Optional[ElfLoadSegment]:
+    for segment in segments:
+        if segment.address <= address and address + size <= segment.address + len(segment.data):
+            return segment
+    return None
+
+
+def get_ram_image_entry(elf_path: str, segments: List[ElfLoadSegment]) -> RamImageEntry:
+    """
+    Read initial stack pointer and reset handler from the vector table of SRAM image.
+
+    The vector table is found by its section or symbol name. If they are absent, the vector table
+    is expected at the beginning of the image.
+
+    :param elf_path: elf file
+    :param segments: image segments
+    :raises ValueError: if the vector table isn't valid
+    """
+    vector_table = _find_vector_table(elf_path)
+    if vector_table is None:
+        vector_table = min(segment.address for segment in segments)
+        logger.debug(f"Vector table isn't found by name. Use the image start 0x{vector_table:08X}")
+    segment = _find_segment(segments, vector_table, _VECTOR_TABLE_HEAD.size)
+    if segment is None:
+        raise ValueError(f"Vector table at 0x{vector_table:08X} isn't loaded by the image")
+    if vector_table % _VECTOR_TABLE_ALIGNMENT:
+        raise ValueError(f"Vector table at 0x{vector_table:08X} isn't aligned to {_VECTOR_TABLE_ALIGNMENT} bytes, "
+                         f"so it cannot be set to VTOR register")
+    stack_pointer, reset_handler = _VECTOR_TABLE_HEAD.unpack_from(segment.data, vector_table - segment.address)
+
+    entry_point = reset_handler & ~1
+    if not reset_handler & 1 or _find_segment(segments, entry_point, 2) is None:
+        raise ValueError(f"Reset handler 0x{reset_handler:08X} of the vector table at 0x{vector_table:08X} "
+                         f"doesn't point to thumb code of the image")
+    if not is_sram_range(stack_pointer - 1, 1) or stack_pointer % 4:
+        raise ValueError(f"Initial stack pointer 0x{stack_pointer:08X} of the vector table at "
+                         f"0x{vector_table:08X} isn't aligned SRAM address")
+    return RamImageEntry(vector_table=vector_table, stack_pointer=stack_pointer, entry_point=entry_point)
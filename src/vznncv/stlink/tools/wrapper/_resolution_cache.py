@@ -0,0 +1,132 @@
+"""
+Helper module to memoize results of the project file and executable discovery.
+
+Each result is stored with stamps (modification time and inode number) of the paths that it depends on:
+visited directories, found files and ``PATH`` directories. A result is reused only if all stamps are unchanged,
+so the repeated runs don't walk the project directories and don't lookup executables.
+"""
+import hashlib
+import json
+import logging
+import os
+import os.path
+import shutil
+import time
+from typing import Optional, Dict, Iterable, Any, List
+
+from ._cache_utils import get_cache_path, read_json_file, write_json_file
+
+logger = logging.getLogger(__name__)
+
+_RESOLUTION_CACHE_DIR = 'resolution'
+_RESOLUTION_CACHE_VERSION = 1
+# paths that have been modified recently aren't stamped, as their next changes can keep the same mtime
+_RACY_MTIME_INTERVAL_NS = 2 * 10 ** 9
+
+
+def _get_path_stamp(path: str) -> Optional[List[int]]:
+    try:
+        path_stat = os.stat(path)
+    except OSError:
+        return None
+    return [path_stat.st_mtime_ns, path_stat.st_ino]
+
+
+class ResolutionCache:
+    """
+    Persistent cache of the resolution results.
+
+    :param cache_path: cache file path. If it's ``None``, the cache isn't persistent
+    """
+
+    def __init__(self, cache_path: Optional[str]):
+        self._cache_path = cache_path
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._is_changed = False
+        if cache_path is not None:
+            self._load()
+
+    def _load(self):
+        data = read_json_file(self._cache_path)
+        if not isinstance(data, dict) or data.get('version') != _RESOLUTION_CACHE_VERSION \
+                or not isinstance(data.get('entries'), dict):
+            return
+        self._entries = data['entries']
+
+    def save(self):
+        if self._cache_path is None or not self._is_changed:
+            return
+        try:
+            write_json_file(self._cache_path, {'version': _RESOLUTION_CACHE_VERSION, 'entries': self._entries})
+            self._is_changed = False
+        except OSError as e:
+            logger.debug(f"Cannot save resolution cache \"{self._cache_path}\": {e}")
+
+    def clear(self):
+        self._is_changed = self._is_changed or bool(self._entries)
+        self._entries.clear()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Get cached value, if stamps of its paths are unchanged.
+        """
+        entry = self._entries.get(key)
+        if not isinstance(entry, dict) or not isinstance(entry.get('stamps'), dict):
+            return None
+        for path, stamp in entry['stamps'].items():
+            if _get_path_stamp(path) != stamp:
+                logger.debug(f"Resolution cache entry \"{key}\" is outdated, as \"{path}\" is changed")
+                del self._entries[key]
+                self._is_changed = True
+                return None
+        return entry.get('value')
+
+    def put(self, key: str, value: str, stamp_paths: Iterable[str]):
+        """
+        Cache value with stamps of the paths it depends on.
+
+        Missing paths are stamped too, so the value is invalidated when they are created.
+        If any path has been modified recently, the value isn't cached.
+        """
+        stamps = {path: _get_path_stamp(path) for path in stamp_paths}
+        current_time_ns = int(time.time() * 1e9)
+        if any(stamp is not None and current_time_ns - stamp[0] < _RACY_MTIME_INTERVAL_NS
+               for stamp in stamps.values()):
+            self._entries.pop(key, None)
+            return
+        self._entries[key] = {'value': value, 'stamps': stamps}
+        self._is_changed = True
+
+
+def make_cache_key(kind: str, *args: Any) -> str:
+    return json.dumps([kind, *args])
+
+
+def get_resolution_cache_path(project_dir: str) -> str:
+    project_key = hashlib.sha256(os.path.abspath(project_dir).encode('utf-8')).hexdigest()[:32]
+    return get_cache_path(_RESOLUTION_CACHE_DIR, f'{project_key}.json', create_dir=False)
+
+
+def find_executable(name: str, resolution_cache: Optional[ResolutionCache] = None) -> Optional[str]:
+    """
+    Find executable in the ``PATH`` like ``shutil.which``.
+
+    The result is memoized with stamps of the ``PATH`` directories, so it's invalidated when any executable
+    is added or removed. Missing executables are memoized too.
+    """
+    search_path = os.environ.get('PATH', os.defpath)
+    cache_key = make_cache_key('executable', name, search_path)
+    if resolution_cache is not None:
+        executable_path = resolution_cache.get(cache_key)
+        if executable_path is not None:
+            # empty path means that executable isn't found
+            return executable_path or None
+
+    executable_path = shutil.which(name, path=search_path)
+    if resolution_cache is not None:
+        path_dirs = [os.path.abspath(path_dir) for path_dir in search_path.split(os.pathsep) if path_dir]
+        if executable_path is not None:
+            resolution_cache.put(cache_key, executable_path, [*path_dirs, executable_path])
+        else:
+            resolution_cache.put(cache_key, '', path_dirs)
+    return executable_path
@@ -1,12 +1,17 @@
 """
 Helper module to search files.
 """
-import itertools
+import hashlib
 import logging
 import os
 import os.path
 import re
-from typing import Optional, NamedTuple, Callable, List, Union
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, NamedTuple, Callable, List, Union, Dict, Sequence, Iterable, Tuple, Pattern
+
+from ._cache_utils import get_cache_path, read_json_file, write_json_file
+from ._resolution_cache import ResolutionCache, make_cache_key
 
 logger = logging.getLogger(__name__)
 
@@ -26,43 +31,289 @@ class MultipleFilesAreFound(FileResolveError):
 class SearchResult(NamedTuple):
     path: str
     level: int
+    # file modification time
+    mtime: Optional[float] = None
+
+
+# directories that never contain target files
+DEFAULT_EXCLUDE_PATTERNS = ('.git/', '.hg/', '.svn/', 'CMakeFiles/', '_deps/', '__pycache__/', 'node_modules/')
+
+# default limits of the file search in the project directories
+_DEFAULT_MAX_FILES = 200000
+_DEFAULT_TIME_BUDGET = 10.0
+
+
+def _translate_path_pattern(pattern: str) -> str:
+    i = 0
+    regex_parts = []
+    while i < len(pattern):
+        if pattern.startswith('**/', i):
+            regex_parts.append('(?:.*/)?')
+            i += 3
+        elif pattern.startswith('**', i):
+            regex_parts.append('.*')
+            i += 2
+        elif pattern[i] == '*':
+            regex_parts.append('[^/]*')
+            i += 1
+        elif pattern[i] == '?':
+            regex_parts.append('[^/]')
+            i += 1
+        elif pattern[i] == '[' and pattern.find(']', i + 2) >= 0:
+            end = pattern.find(']', i + 2)
+            char_class = pattern[i + 1:end].replace('\\', '\\\\')
+            if char_class.startswith('!'):
+                char_class = '^' + char_class[1:]
+            regex_parts.append(f'[{char_class}]')
+            i = end + 1
+        elif pattern[i] == '\\' and i + 1 < len(pattern):
+            regex_parts.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            regex_parts.append(re.escape(pattern[i]))
+            i += 1
+    return ''.join(regex_parts)
 
 
-def search_files(start_dirs: Union[str, List[str]], max_depth: int, file_predicate: Callable[[str], bool], *,
-                 exclude_dir_predicate: Optional[Callable[[str], bool]] = None, stop_on_top_level=True) \
-        -> List[SearchResult]:
+class PathPatterns:
     """
-    Search files in the directory.
+    Gitignore-style path patterns.
 
-    :param start_dirs:
-    :param max_depth:
-    :param file_predicate:
-    :param exclude_dir_predicate:
-    :param stop_on_top_level: abort deeper search if any files are found at top level.
-    :return:
+    Supported syntax: ``*``, ``?``, ``[...]``, ``**``, leading ``/`` to anchor pattern to the search root,
+    trailing ``/`` to match directories only, ``!`` to negate previous patterns and ``#`` comments.
+    Patterns without ``/`` (except trailing one) match file names at any level.
+    """
+
+    def __init__(self, patterns: Iterable[str] = ()):
+        self._rules: List[Tuple[Pattern, bool, bool]] = []
+        for pattern in patterns:
+            self.add(pattern)
+
+    def add(self, pattern: str):
+        pattern = pattern.strip()
+        if not pattern or pattern.startswith('#'):
+            return
+        negate = pattern.startswith('!')
+        if negate:
+            pattern = pattern[1:]
+        dir_only = pattern.endswith('/')
+        pattern = pattern.rstrip('/')
+        if not pattern:
+            return
+        if '/' in pattern:
+            regex = _translate_path_pattern(pattern.lstrip('/'))
+        else:
+            regex = '(?:.*/)?' + _translate_path_pattern(pattern)
+        self._rules.append((re.compile(regex + r'\Z'), negate, dir_only))
+
+    def __bool__(self):
+        return bool(self._rules)
+
+    def matches(self, rel_path: str, is_dir: bool) -> bool:
+        """
+        Check if path matches patterns.
+
+        :param rel_path: path relative to the search root with "/" separators
+        :param is_dir: path is directory
+        """
+        matched = False
+        for regex, negate, dir_only in self._rules:
+            if dir_only and not is_dir:
+                continue
+            if matched == negate and regex.match(rel_path):
+                matched = not negate
+        return matched
+
+
+class _SearchBudget:
+    """
+    Limits of the file search, that stop pathological walks.
+    """
+
+    def __init__(self, max_files: Optional[int], time_budget: Optional[float]):
+        self._max_files = max_files
+        self._deadline = None if time_budget is None else time.monotonic() + time_budget
+        self._time_budget = time_budget
+        self.files = 0
+        self.exhausted = False
+
+    def consume(self, count: int = 1) -> bool:
+        """
+        Account visited directory entries.
+
+        :return: ``False`` if search should be stopped
+        """
+        if self.exhausted:
+            return False
+        self.files += count
+        if self._max_files is not None and self.files > self._max_files:
+            reason = f"more than {self._max_files} files are visited"
+        elif self._deadline is not None and time.monotonic() > self._deadline:
+            reason = f"it takes more than {self._time_budget}s"
+        else:
+            return True
+        self.exhausted = True
+        logger.warning(f"File search is stopped, as {reason}. Search results can be incomplete")
+        return False
+
+
+class SearchTrace:
+    """
+    Details of the search process, that can be used to validate memoized search results.
+    """
+
+    def __init__(self):
+        # directories that have been listed
+        self.visited_dirs: List[str] = []
+        # search has been stopped by limits, so results can be incomplete
+        self.incomplete = False
+
+
+def _join_rel_path(rel_dir: str, name: str) -> str:
+    return f'{rel_dir}/{name}' if rel_dir else name
+
+
+def _get_entry_mtime(dir_entry: os.DirEntry) -> Optional[float]:
+    # stat result is cached by directory entry, so it isn't requested again
+    try:
+        return dir_entry.stat().st_mtime
+    except OSError:
+        return None
+
+
+class _SearchExecutor:
+    """
+    Runner of the file system calls of the search.
+
+    If ``workers`` is greater than 1, the calls are run in a thread pool. Results are returned in the order
+    of the arguments, so search results don't depend on the scheduling.
+    """
+
+    # maximal number of the files that are checked by one thread pool task
+    _MAX_CHUNK_SIZE = 64
+
+    def __init__(self, workers: Optional[int]):
+        self._workers = workers if workers is not None and workers > 1 else 1
+        self._executor = ThreadPoolExecutor(max_workers=self._workers) if self._workers > 1 else None
+
+    def map(self, fn: Callable, items: List) -> Iterable:
+        if self._executor is None:
+            return map(fn, items)
+        return self._executor.map(fn, items)
+
+    def map_chunked(self, fn: Callable, items: List) -> List:
+        """
+        Apply function to file items. The items are split into chunks to reduce thread pool overhead.
+        """
+        if self._executor is None:
+            return [fn(item) for item in items]
+        chunk_size = max(1, min(self._MAX_CHUNK_SIZE, len(items) // (self._workers * 4)))
+        chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+        return [
+            value
+            for chunk_values in self._executor.map(lambda chunk: [fn(item) for item in chunk], chunks)
+            for value in chunk_values
+        ]
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+
+    def __enter__(self) -> '_SearchExecutor':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _scan_dir(path: str) -> List[os.DirEntry]:
+    """
+    List directory entries sorted by name.
     """
+    with os.scandir(path) as dir_entries:
+        entries = list(dir_entries)
+    entries.sort(key=lambda dir_entry: dir_entry.name)
+    return entries
 
+
+def _normalize_start_dirs(start_dirs: Union[str, List[str]]) -> List[str]:
     if isinstance(start_dirs, str):
         start_dirs = [start_dirs]
     start_dirs = [os.path.abspath(start_dir) for start_dir in start_dirs]
     for start_dir in start_dirs:
         if not os.path.isdir(start_dir):
             raise ValueError(f"start_dir \"{start_dir}\" isn't a directory")
+    return start_dirs
 
-    dirs_to_visit = start_dirs
-    result = []
-    for level_no in range(max_depth):
-        current_dirs_to_visit, dirs_to_visit = dirs_to_visit, []
-        for dir_entry in itertools.chain.from_iterable(os.scandir(path) for path in current_dirs_to_visit):
-            if dir_entry.is_dir():
-                if exclude_dir_predicate is None or not exclude_dir_predicate(dir_entry.path):
-                    dirs_to_visit.append(dir_entry.path)
-            else:
-                if file_predicate(dir_entry.path):
-                    result.append(SearchResult(dir_entry.path, level_no))
-        if stop_on_top_level and result:
-            break
 
+def search_files(start_dirs: Union[str, List[str]], max_depth: int, file_predicate: Callable[[str], bool], *,
+                 exclude_dir_predicate: Optional[Callable[[str], bool]] = None, stop_on_top_level=True,
+                 exclude_patterns: Sequence[str] = (), max_files: Optional[int] = None,
+                 time_budget: Optional[float] = None, workers: Optional[int] = None,
+                 trace: Optional[SearchTrace] = None) -> List[SearchResult]:
+    """
+    Search files in the directory.
+
+    The directories are visited level by level. If ``workers`` is greater than 1, directory listings of each level
+    and ``file_predicate`` calls are run in a thread pool. It helps with network file systems, where each
+    system call is a round-trip. Search results don't depend on ``workers`` value.
+
+    :param start_dirs: directories to search files
+    :param max_depth: maximal search depth
+    :param file_predicate: predicate of the target files. It must be thread-safe if ``workers`` is used
+    :param exclude_dir_predicate: predicate of the directories that shouldn't be visited
+    :param stop_on_top_level: abort deeper search if any files are found at top level.
+    :param exclude_patterns: gitignore-style patterns of the excluded files and directories
+    :param max_files: maximal number of the visited directory entries
+    :param time_budget: maximal search duration in seconds
+    :param workers: number of threads to scan directories and check files
+    :param trace: optional object to save visited directories
+    :return: found files. If search limits are exceeded, files that are found so far are returned
+    """
+    start_dirs = _normalize_start_dirs(start_dirs)
+    path_patterns = PathPatterns(exclude_patterns)
+    budget = _SearchBudget(max_files, time_budget)
+
+    # directory paths and their paths relative to the start directory
+    dirs_to_visit = [(start_dir, '') for start_dir in start_dirs]
+    result = []
+    with _SearchExecutor(workers) as executor:
+        for level_no in range(max_depth):
+            current_dirs_to_visit, dirs_to_visit = dirs_to_visit, []
+            dir_listings = executor.map(_scan_dir, [dir_path for dir_path, _ in current_dirs_to_visit])
+            candidate_files = []
+            for (dir_path, rel_dir_path), dir_entries in zip(current_dirs_to_visit, dir_listings):
+                for dir_entry in dir_entries:
+                    if not budget.consume():
+                        break
+                    name = dir_entry.name
+                    is_dir = dir_entry.is_dir()
+                    path = os.path.join(dir_path, name)
+                    rel_path = _join_rel_path(rel_dir_path, name)
+                    if path_patterns.matches(rel_path, is_dir=is_dir):
+                        continue
+                    if not is_dir:
+                        candidate_files.append(dir_entry)
+                    elif exclude_dir_predicate is None or not exclude_dir_predicate(path):
+                        dirs_to_visit.append((path, rel_path))
+                if budget.exhausted:
+                    break
+
+            candidate_paths = [dir_entry.path for dir_entry in candidate_files]
+            found_files = [
+                dir_entry
+                for dir_entry, is_found in zip(candidate_files, executor.map_chunked(file_predicate, candidate_paths))
+                if is_found
+            ]
+            result.extend(SearchResult(dir_entry.path, level_no, mtime)
+                          for dir_entry, mtime in zip(found_files, executor.map(_get_entry_mtime, found_files)))
+            if trace is not None:
+                trace.visited_dirs.extend(dir_path for dir_path, _ in current_dirs_to_visit)
+            if budget.exhausted or (stop_on_top_level and result):
+                break
+
+    if trace is not None:
+        trace.incomplete = budget.exhausted
     return result
 
 
@@ -80,20 +331,264 @@ def _is_elf_file(path):
     return prefix == _ELF_SIGNATURE
 
 
+_ELF_INDEX_DIR = 'elf_index'
+_ELF_INDEX_VERSION = 2
+# stamps that are changed recently aren't trusted, as next changes can keep the same mtime
+_RACY_MTIME_INTERVAL_NS = 2 * 10 ** 9
+
+
+class _IndexedDir(NamedTuple):
+    mtime_ns: int
+    ino: int
+    # directory scan time. The content isn't reused if the directory has been modified shortly before it
+    scan_time_ns: int
+    # names of the subdirectories
+    dirs: List[str]
+    # candidate files: name -> [mtime_ns, size, ino, is_elf]
+    files: Dict[str, list]
+
+    def is_racy(self, mtime_ns: int) -> bool:
+        return self.scan_time_ns - mtime_ns <= _RACY_MTIME_INTERVAL_NS
+
+
+def _check_elf_file_entry(item: Tuple[os.DirEntry, Optional[list]]) -> Optional[list]:
+    """
+    Get elf file record of the directory entry. The previous record is reused if the file isn't changed.
+    """
+    dir_entry, file_record = item
+    try:
+        file_stat = dir_entry.stat()
+        file_stamp = [file_stat.st_mtime_ns, file_stat.st_size, file_stat.st_ino]
+        if file_record is not None and file_record[:3] == file_stamp:
+            return file_record
+        return [*file_stamp, _is_elf_file(dir_entry.path)]
+    except OSError:
+        # file is removed or it's a broken link
+        return None
+
+
+class ElfFileIndex:
+    """
+    Persistent index of the elf files in the build directories.
+
+    Content of each visited directory is cached with its modification time and inode number, so only changed
+    directories are scanned again. Elf and non-elf flags of the files are cached with their modification time,
+    size and inode number, so only changed files of the changed directories are opened again.
+
+    Only directories that are visited by the last search are saved.
+
+    :param index_path: index file path. If it's ``None``, the index isn't persistent
+    """
+
+    def __init__(self, index_path: Optional[str]):
+        self._index_path = index_path
+        self._dirs: Dict[str, _IndexedDir] = {}
+        self._visited_dirs: Dict[str, _IndexedDir] = {}
+        # number of the directories that have been scanned instead of using cached content
+        self.scanned_dirs = 0
+        # number of the files that have been opened to check elf signature
+        self.checked_files = 0
+        if index_path is not None:
+            self._load()
+
+    def _load(self):
+        data = read_json_file(self._index_path)
+        if not isinstance(data, dict) or data.get('version') != _ELF_INDEX_VERSION:
+            return
+        try:
+            self._dirs = {path: _IndexedDir(**entry) for path, entry in data['dirs'].items()}
+        except (KeyError, TypeError, AttributeError):
+            logger.debug(f"Invalid elf index \"{self._index_path}\"")
+            self._dirs = {}
+
+    def save(self):
+        if self._index_path is None or self._visited_dirs == self._dirs:
+            return
+        try:
+            write_json_file(self._index_path, {
+                'version': _ELF_INDEX_VERSION,
+                'dirs': {path: indexed_dir._asdict() for path, indexed_dir in self._visited_dirs.items()}
+            })
+        except OSError as e:
+            logger.debug(f"Cannot save elf index \"{self._index_path}\": {e}")
+
+    def _read_dir(self, path: str) -> Tuple[os.stat_result, Optional[_IndexedDir], List[os.DirEntry]]:
+        """
+        Get cached directory content, or list the directory if it has been changed.
+
+        :return: directory stat, cached content or ``None`` and directory entries if cache isn't valid
+        """
+        dir_stat = os.stat(path)
+        indexed_dir = self._dirs.get(path)
+        if indexed_dir is not None and indexed_dir.mtime_ns == dir_stat.st_mtime_ns \
+                and indexed_dir.ino == dir_stat.st_ino and not indexed_dir.is_racy(dir_stat.st_mtime_ns):
+            return dir_stat, indexed_dir, []
+        return dir_stat, None, _scan_dir(path)
+
+    def _get_file_record(self, dir_path: str, name: str) -> Optional[list]:
+        indexed_dir = self._dirs.get(dir_path)
+        if indexed_dir is None:
+            return None
+        file_record = indexed_dir.files.get(name)
+        if file_record is None or indexed_dir.is_racy(file_record[0]):
+            return None
+        return file_record
+
+    def _list_dirs(self, paths: List[str], budget: _SearchBudget, executor: _SearchExecutor) -> List[_IndexedDir]:
+        scan_time_ns = int(time.time() * 1e9)
+        dir_listings = list(executor.map(self._read_dir, paths))
+
+        # collect files of the changed directories, that should be checked
+        scanned_dirs = []
+        candidate_files = []
+        for path, (dir_stat, indexed_dir, dir_entries) in zip(paths, dir_listings):
+            if indexed_dir is not None:
+                continue
+            dirs = []
+            files = []
+            for dir_entry in dir_entries:
+                if not budget.consume():
+                    break
+                if dir_entry.is_dir():
+                    dirs.append(dir_entry.name)
+                elif os.path.splitext(dir_entry.name)[1].lower() in _ELF_EXTS:
+                    files.append(dir_entry.name)
+                    candidate_files.append((dir_entry, self._get_file_record(path, dir_entry.name)))
+            scanned_dirs.append((path, dir_stat, dirs, files, budget.exhausted))
+            if budget.exhausted:
+                break
+        file_records = {}
+        for (dir_entry, previous_record), file_record in zip(
+                candidate_files, executor.map_chunked(_check_elf_file_entry, candidate_files)):
+            if file_record is not None and file_record is not previous_record:
+                self.checked_files += 1
+            file_records[dir_entry.path] = file_record
+
+        indexed_dirs = {}
+        for path, dir_stat, dirs, files, is_incomplete in scanned_dirs:
+            self.scanned_dirs += 1
+            dir_files = {}
+            for name in files:
+                file_record = file_records[os.path.join(path, name)]
+                if file_record is not None:
+                    dir_files[name] = file_record
+            indexed_dir = _IndexedDir(mtime_ns=dir_stat.st_mtime_ns, ino=dir_stat.st_ino, scan_time_ns=scan_time_ns,
+                                      dirs=dirs, files=dir_files)
+            # incomplete directories aren't cached
+            if not is_incomplete:
+                self._visited_dirs[path] = indexed_dir
+            indexed_dirs[path] = indexed_dir
+
+        result = []
+        for path, (_, indexed_dir, _) in zip(paths, dir_listings):
+            if indexed_dir is not None:
+                self._visited_dirs[path] = indexed_dir
+            elif path in indexed_dirs:
+                indexed_dir = indexed_dirs[path]
+            else:
+                # directory isn't visited, as search budget is exhausted
+                break
+            result.append(indexed_dir)
+        return result
+
+    def search(self, start_dirs: Union[str, List[str]], max_depth: int, *,
+               stop_on_top_level: bool = True, exclude_patterns: Sequence[str] = (),
+               max_files: Optional[int] = None, time_budget: Optional[float] = None,
+               workers: Optional[int] = None, trace: Optional[SearchTrace] = None) -> List[SearchResult]:
+        """
+        Search elf files like ``search_files`` function.
+
+        Exclude patterns are applied to the cached directory content, so they can be changed between searches.
+        """
+        start_dirs = _normalize_start_dirs(start_dirs)
+        path_patterns = PathPatterns(exclude_patterns)
+        budget = _SearchBudget(max_files, time_budget)
+
+        dirs_to_visit = [(start_dir, '') for start_dir in start_dirs]
+        result = []
+        with _SearchExecutor(workers) as executor:
+            for level_no in range(max_depth):
+                current_dirs_to_visit, dirs_to_visit = dirs_to_visit, []
+                indexed_dirs = self._list_dirs([dir_path for dir_path, _ in current_dirs_to_visit], budget, executor)
+                for (dir_path, rel_dir_path), indexed_dir in zip(current_dirs_to_visit, indexed_dirs):
+                    for name in indexed_dir.dirs:
+                        rel_path = _join_rel_path(rel_dir_path, name)
+                        if not path_patterns.matches(rel_path, is_dir=True):
+                            dirs_to_visit.append((os.path.join(dir_path, name), rel_path))
+                    for name, (mtime_ns, _, _, is_elf) in indexed_dir.files.items():
+                        if is_elf and not path_patterns.matches(_join_rel_path(rel_dir_path, name), is_dir=False):
+                            result.append(SearchResult(os.path.join(dir_path, name), level_no, mtime_ns / 1e9))
+                if trace is not None:
+                    trace.visited_dirs.extend(dir_path for dir_path, _ in current_dirs_to_visit)
+                if budget.exhausted or (stop_on_top_level and result):
+                    break
+        if trace is not None:
+            trace.incomplete = budget.exhausted
+        return result
+
+
+def get_elf_index_path(project_dir: str) -> str:
+    project_key = hashlib.sha256(os.path.abspath(project_dir).encode('utf-8')).hexdigest()[:32]
+    return get_cache_path(_ELF_INDEX_DIR, f'{project_key}.json', create_dir=False)
+
+
 _BUILD_DIR_RE = re.compile(r'\bbuild\b', re.IGNORECASE)
 _MAX_ELF_SEARCH_DEPTH = 2
 
+# policies to select elf file if multiple files are found: "single" - raise error, "newest" - use the latest one
+ELF_SELECT_POLICIES = ('single', 'newest')
+
 
 def _build_dir_predicate(path):
     basename = os.path.basename(path)
     return _BUILD_DIR_RE.search(basename) is not None
 
 
-def resolve_elf_file_location(project_dir: str, elf_path: Optional[str]) -> str:
+def _select_newest_file(search_results: List[SearchResult]) -> SearchResult:
+    def get_mtime(search_result: SearchResult) -> float:
+        if search_result.mtime is not None:
+            return search_result.mtime
+        try:
+            return os.stat(search_result.path).st_mtime
+        except OSError:
+            return 0.0
+
+    return max(search_results, key=get_mtime)
+
+
+def resolve_elf_file_location(project_dir: str, elf_path: Optional[str], *, use_index: bool = True,
+                              elf_select: str = 'single', exclude_patterns: Sequence[str] = (),
+                              max_files: Optional[int] = _DEFAULT_MAX_FILES,
+                              time_budget: Optional[float] = _DEFAULT_TIME_BUDGET,
+                              workers: Optional[int] = None,
+                              resolution_cache: Optional[ResolutionCache] = None) -> str:
     """
     Resolve elf file location.
+
+    If ``resolution_cache`` is set, the found elf file is memoized with stamps of the visited directories,
+    so the search isn't repeated until they're changed.
+
+    :param project_dir: project directory
+    :param elf_path: elf file or directory with it
+    :param use_index: use persistent index of the project elf files to avoid full scan of unchanged directories
+    :param elf_select: policy to select elf file if multiple files are found (see ``ELF_SELECT_POLICIES``)
+    :param exclude_patterns: gitignore-style patterns of the excluded paths. They're added to the built-in ones
+    :param max_files: maximal number of the visited directory entries
+    :param time_budget: maximal search duration in seconds
+    :param workers: number of threads to scan directories concurrently
+    :param resolution_cache: cache of the resolution results
     """
+    if elf_select not in ELF_SELECT_POLICIES:
+        raise ValueError(f"Unknown elf select policy: {elf_select}")
     elf_dirs = []
+    if elf_path is not None:
+        elf_path = os.path.abspath(elf_path)
+    cache_key = make_cache_key('elf', elf_path, elf_select, list(exclude_patterns))
+    if resolution_cache is not None and (elf_path is None or os.path.isdir(elf_path)):
+        cached_elf_file = resolution_cache.get(cache_key)
+        if cached_elf_file is not None:
+            logger.debug(f"Use memoized elf file location: {cached_elf_file}")
+            return cached_elf_file
 
     if elf_path is None:
         # try to find elf file automatically
@@ -106,7 +601,6 @@ def resolve_elf_file_location(project_dir: str, elf_path: Optional[str]) -> str:
         if not elf_dirs:
             elf_dirs.append(project_dir)
     else:
-        elf_path = os.path.abspath(elf_path)
         if not os.path.exists(elf_path):
             raise FileNotFound(f".elf path \"{elf_path}\" does not exists")
         if os.path.isfile(elf_path):
@@ -118,15 +612,39 @@ def resolve_elf_file_location(project_dir: str, elf_path: Optional[str]) -> str:
             elf_dirs.append(elf_path)
 
     # search elf files in the candidate directories
-    elf_files = search_files(
+    search_kwargs = dict(
         start_dirs=elf_dirs,
         max_depth=_MAX_ELF_SEARCH_DEPTH,
-        file_predicate=_is_elf_file,
-        stop_on_top_level=True
+        stop_on_top_level=True,
+        exclude_patterns=DEFAULT_EXCLUDE_PATTERNS + tuple(exclude_patterns),
+        max_files=max_files,
+        time_budget=time_budget,
+        workers=workers,
+        trace=SearchTrace()
     )
+    if use_index:
+        elf_index = ElfFileIndex(get_elf_index_path(project_dir))
+        elf_files = elf_index.search(**search_kwargs)
+        elf_index.save()
+        logger.debug(f"Elf index: {elf_index.scanned_dirs} directories are scanned")
+    else:
+        elf_files = search_files(file_predicate=_is_elf_file, **search_kwargs)
 
-    if len(elf_files) == 1:
-        return elf_files[0].path
+    if len(elf_files) == 1 or (len(elf_files) > 1 and elf_select == 'newest'):
+        if len(elf_files) == 1:
+            selected_file = elf_files[0]
+        else:
+            selected_file = _select_newest_file(elf_files)
+            logger.info("Multiple elf files are found:\n{}\nSelect the newest one: {}".format(
+                '\n'.join(elf_file.path for elf_file in elf_files), selected_file.path
+            ))
+        trace = search_kwargs['trace']
+        if resolution_cache is not None and not trace.incomplete:
+            # project directory is stamped, as new build directories change elf search directories
+            resolution_cache.put(cache_key, selected_file.path, [
+                project_dir, *trace.visited_dirs, *(elf_file.path for elf_file in elf_files)
+            ])
+        return selected_file.path
     elif len(elf_files) > 1:
         raise MultipleFilesAreFound(
             "Multiple elf files are found:\n{}".format('\n'.join(elf_file.path for elf_file in elf_files))
@@ -143,9 +661,19 @@ def _is_openocd_config_file(path):
     return '.cfg' == ext.lower()
 
 
-def resolve_openocd_config_file(project_dir: str, config_path: Optional[str]) -> str:
+def resolve_openocd_config_file(project_dir: str, config_path: Optional[str], *,
+                                exclude_patterns: Sequence[str] = (), workers: Optional[int] = None,
+                                resolution_cache: Optional[ResolutionCache] = None) -> str:
     """
     Resolve openocd file location.
+
+    If ``resolution_cache`` is set, the found file is memoized with stamps of the visited directories.
+
+    :param project_dir: project directory
+    :param config_path: configuration file or directory with it
+    :param exclude_patterns: gitignore-style patterns of the excluded paths. They're added to the built-in ones
+    :param workers: number of threads to scan directories concurrently
+    :param resolution_cache: cache of the resolution results
     """
     search_dir = project_dir
     if config_path is not None:
@@ -154,13 +682,28 @@ def resolve_openocd_config_file(project_dir: str, config_path: Optional[str]) ->
             return config_path
         else:
             search_dir = config_path
+    search_dir = os.path.abspath(search_dir)
+    cache_key = make_cache_key('openocd_config', search_dir, list(exclude_patterns))
+    if resolution_cache is not None:
+        cached_cfg_file = resolution_cache.get(cache_key)
+        if cached_cfg_file is not None:
+            logger.debug(f"Use memoized OpenOCD configuration file location: {cached_cfg_file}")
+            return cached_cfg_file
+    trace = SearchTrace()
     cfg_files = search_files(
         start_dirs=search_dir,
         max_depth=_MAX_CFG_SEARCH_DEPTH,
         file_predicate=_is_openocd_config_file,
-        stop_on_top_level=True
+        stop_on_top_level=True,
+        exclude_patterns=DEFAULT_EXCLUDE_PATTERNS + tuple(exclude_patterns),
+        max_files=_DEFAULT_MAX_FILES,
+        time_budget=_DEFAULT_TIME_BUDGET,
+        workers=workers,
+        trace=trace
     )
     if len(cfg_files) == 1:
+        if resolution_cache is not None and not trace.incomplete:
+            resolution_cache.put(cache_key, cfg_files[0].path, [*trace.visited_dirs, cfg_files[0].path])
         return cfg_files[0].path
     elif len(cfg_files) > 1:
         raise MultipleFilesAreFound(
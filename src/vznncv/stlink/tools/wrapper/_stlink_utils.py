@@ -1,11 +1,20 @@
 """
 Helper project to detect stlink devices.
 """
-from typing import NamedTuple, List
+import logging
+import os
+import os.path
+import sys
+import time
+from typing import NamedTuple, List, Optional, Tuple
 
 import usb.core
 from cached_property import cached_property
 
+from ._cache_utils import get_cache_path, read_json_file, write_json_file
+
+logger = logging.getLogger(__name__)
+
 
 class StLinkDeviceType(NamedTuple):
     version: str
@@ -25,29 +34,69 @@ _STLINK_DEVICE_TYPES = {(stlink_dev.vendor_id, stlink_dev.product_id): stlink_de
     # without MASS STORAGE
     StLinkDeviceType(version='v3', vendor_id=0x0483, product_id=0x3753, out_pipe=0x01, in_pipe=0x81),
 ]}
+_STLINK_VENDOR_ID = 0x0483
+
+
+class StLinkDeviceNotFoundError(ValueError):
+    """
+    Requested ST-Link device isn't connected.
+    """
+    pass
+
+
+def _normalize_serial_number(serial_number: str) -> str:
+    if len(serial_number) == 12:
+        # invalid STLink serial number due stlink bug. Try to fix it
+        serial_number = ''.join(["%.2x" % ord(c) for c in list(serial_number)])
+
+    serial_number = serial_number.upper()
+    if len(serial_number) != 24:
+        raise ValueError(
+            f"Invalid serial number: \"{serial_number}\". Expected 24 symbols, "
+            f"but it has ({len(serial_number)}) symbols"
+        )
+
+    return serial_number
 
 
 class StLinkDevice:
-    def __init__(self, *, dev, type):
-        self.dev: usb.core.Device = dev
+    """
+    ST-Link device information.
+
+    The device can be found with libusb (``dev`` is set) or with Linux sysfs (``raw_serial_number``,
+    ``bus`` and ``address`` are set). In the last case libusb is used only if sysfs serial number is invalid.
+    """
+
+    def __init__(self, *, type, dev=None, raw_serial_number: Optional[str] = None,
+                 bus: Optional[int] = None, address: Optional[int] = None, port_path: Optional[str] = None):
+        self.dev: Optional[usb.core.Device] = dev
         self.type: StLinkDeviceType = type
+        self._raw_serial_number = raw_serial_number
+        self._bus = bus
+        self._address = address
+        self._port_path = port_path
 
     @cached_property
     def serial_number(self):
-        serial_number = self.dev.serial_number
-
-        if len(serial_number) == 12:
-            # invalid STLink serial number due stlink bug. Try to fix it
-            serial_number = ''.join(["%.2x" % ord(c) for c in list(serial_number)])
-
-        serial_number = serial_number.upper()
-        if len(serial_number) != 24:
-            raise ValueError(
-                f"Invalid serial number: \"{serial_number}\". Expected 24 symbols, "
-                f"but it has ({len(serial_number)}) symbols"
-            )
-
-        return serial_number.upper()
+        if self._raw_serial_number is not None:
+            try:
+                return _normalize_serial_number(self._raw_serial_number)
+            except ValueError as e:
+                logger.debug(f"Cannot use sysfs serial number of the device {self.bus}-{self.address}: {e}")
+
+        # string descriptor reading requires device opening, so try to use cached value
+        cache_key = None
+        if self.bus is not None and self.address is not None:
+            cache_key = f'{self.bus}-{self.address}-{self.vendor_id:04X}:{self.product_id:04X}'
+            serial_number = _get_cached_serial_number(cache_key)
+            if serial_number is not None:
+                return serial_number
+        if self.dev is None:
+            self.dev = _find_libusb_device(self.bus, self.address)
+        serial_number = _normalize_serial_number(self.dev.serial_number)
+        if cache_key is not None:
+            _set_cached_serial_number(cache_key, serial_number)
+        return serial_number
 
     @cached_property
     def name(self):
@@ -55,24 +104,152 @@ class StLinkDevice:
 
     @cached_property
     def vendor_id(self):
-        return self.dev.idVendor
+        return self.type.vendor_id
 
     @cached_property
     def product_id(self):
-        return self.dev.idProduct
+        return self.type.product_id
+
+    @cached_property
+    def bus(self) -> Optional[int]:
+        if self._bus is None and self.dev is not None:
+            return getattr(self.dev, 'bus', None)
+        return self._bus
+
+    @cached_property
+    def address(self) -> Optional[int]:
+        if self._address is None and self.dev is not None:
+            return getattr(self.dev, 'address', None)
+        return self._address
+
+    @cached_property
+    def port_path(self) -> Optional[str]:
+        """
+        USB port path in the "<bus>-<port>.<port>..." format.
+        """
+        if self._port_path is None and self.dev is not None:
+            port_numbers = getattr(self.dev, 'port_numbers', None)
+            if self.bus is not None and port_numbers:
+                return '{}-{}'.format(self.bus, '.'.join(str(port) for port in port_numbers))
+        return self._port_path
 
     def __str__(self):
         return f"{self.name} (serial {self.serial_number})"
 
 
-def get_stlink_devices() -> List[StLinkDevice]:
-    """
-    Get active stlink devices.
-    """
+_SERIAL_NUMBER_CACHE_FILE = 'usb_serial_numbers.json'
+# usb device address is changed after reconnection, but it can be reused later,
+# so keep cached values for short time only
+_SERIAL_NUMBER_CACHE_TTL = 30.0
+
+
+def _get_cached_serial_number(cache_key: str) -> Optional[str]:
+    cache = read_json_file(get_cache_path(_SERIAL_NUMBER_CACHE_FILE, create_dir=False), default={})
+    entry = cache.get(cache_key) if isinstance(cache, dict) else None
+    if not isinstance(entry, dict):
+        return None
+    timestamp = entry.get('timestamp', 0)
+    if not (0 <= time.time() - timestamp <= _SERIAL_NUMBER_CACHE_TTL):
+        return None
+    return entry.get('serial_number')
+
+
+def _set_cached_serial_number(cache_key: str, serial_number: str):
+    cache_path = get_cache_path(_SERIAL_NUMBER_CACHE_FILE)
+    cache = read_json_file(cache_path, default={})
+    if not isinstance(cache, dict):
+        cache = {}
+    now = time.time()
+    cache = {
+        key: entry for key, entry in cache.items()
+        if isinstance(entry, dict) and 0 <= now - entry.get('timestamp', 0) <= _SERIAL_NUMBER_CACHE_TTL
+    }
+    cache[cache_key] = {'serial_number': serial_number, 'timestamp': now}
+    try:
+        write_json_file(cache_path, cache)
+    except OSError as e:
+        logger.debug(f"Cannot save serial number cache: {e}")
+
+
+def _is_stlink_device(usb_dev) -> bool:
+    return (usb_dev.idVendor, usb_dev.idProduct) in _STLINK_DEVICE_TYPES
+
+
+def _find_libusb_device(bus: Optional[int], address: Optional[int]) -> usb.core.Device:
+    dev = usb.core.find(bus=bus, address=address)
+    if dev is None:
+        raise ValueError(f"Cannot find usb device {bus}-{address}")
+    return dev
+
+
+# Linux sysfs directory with usb devices
+_SYSFS_USB_DEVICES_DIR = '/sys/bus/usb/devices'
+
+
+def _read_sysfs_attr(device_dir: str, name: str) -> Optional[bytes]:
+    try:
+        with open(os.path.join(device_dir, name), 'rb') as f:
+            return f.read().rstrip(b'\n')
+    except FileNotFoundError:
+        return None
+
+
+def _parse_sysfs_device_id(device_dir: str) -> Optional[Tuple[int, int]]:
+    vendor_id = _read_sysfs_attr(device_dir, 'idVendor')
+    product_id = _read_sysfs_attr(device_dir, 'idProduct')
+    if vendor_id is None or product_id is None:
+        return None
+    return int(vendor_id, 16), int(product_id, 16)
+
+
+def _get_sysfs_stlink_devices(sysfs_dir: str) -> List[StLinkDevice]:
     result = []
-    for usb_dev in usb.core.find(find_all=True):
+    for dir_entry in os.scandir(sysfs_dir):
+        # skip interfaces like "1-1.2:1.0"
+        if ':' in dir_entry.name:
+            continue
+        device_id = _parse_sysfs_device_id(dir_entry.path)
+        if device_id is None:
+            continue
+        stlink_device_type = _STLINK_DEVICE_TYPES.get(device_id)
+        if stlink_device_type is None:
+            continue
+        raw_serial_number = _read_sysfs_attr(dir_entry.path, 'serial')
+        busnum = _read_sysfs_attr(dir_entry.path, 'busnum')
+        devnum = _read_sysfs_attr(dir_entry.path, 'devnum')
+        result.append(StLinkDevice(
+            type=stlink_device_type,
+            raw_serial_number=None if raw_serial_number is None else raw_serial_number.decode('utf-8', 'replace'),
+            bus=None if busnum is None else int(busnum),
+            address=None if devnum is None else int(devnum),
+            port_path=dir_entry.name
+        ))
+    result.sort(key=lambda d: (d.bus or 0, d.address or 0))
+    return result
+
+
+def _get_libusb_stlink_devices() -> List[StLinkDevice]:
+    result = []
+    for usb_dev in usb.core.find(find_all=True, idVendor=_STLINK_VENDOR_ID, custom_match=_is_stlink_device):
         stlink_device_type = _STLINK_DEVICE_TYPES.get((usb_dev.idVendor, usb_dev.idProduct))
         if stlink_device_type is None:
             continue
         result.append(StLinkDevice(dev=usb_dev, type=stlink_device_type))
     return result
+
+
+def get_stlink_devices() -> List[StLinkDevice]:
+    """
+    Get active stlink devices.
+
+    On Linux devices are found using sysfs without opening them. Otherwise libusb is used.
+
+    Serial numbers are read lazily on first ``StLinkDevice.serial_number`` access. The values that are
+    read with libusb are cached for a short time, as it requires device opening.
+    """
+    if sys.platform.startswith('linux') and os.path.isdir(_SYSFS_USB_DEVICES_DIR):
+        try:
+            return _get_sysfs_stlink_devices(_SYSFS_USB_DEVICES_DIR)
+        except (OSError, ValueError) as e:
+            logger.debug(f"Cannot enumerate usb devices with sysfs: {e}. Use libusb")
+    return _get_libusb_stlink_devices()
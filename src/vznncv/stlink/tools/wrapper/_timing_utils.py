@@ -0,0 +1,109 @@
+"""
+Helper module to measure duration of the operation phases.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import NamedTuple, List, Callable, Dict, Any, Tuple
+
+
+class PhaseRecord(NamedTuple):
+    # name of the phase or "<phase>/<subphase>" for the part of other phase
+    name: str
+    # phase start time relative to the timer creation
+    start: float
+    duration: float
+
+    @property
+    def is_subphase(self) -> bool:
+        return '/' in self.name
+
+    def to_dict(self) -> Dict[str, Any]:
+        return self._asdict()
+
+
+class PhaseTimer:
+    """
+    Timer that records duration of the sequential operation phases using monotonic clock.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self._clock = clock
+        self._start_time = clock()
+        self._records: List[PhaseRecord] = []
+        # names and start times of the phases that are measured now
+        self._active_phases: List[Tuple[str, float]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def elapsed(self) -> float:
+        """
+        Time since timer creation.
+        """
+        return self._clock() - self._start_time
+
+    @property
+    def records(self) -> List[PhaseRecord]:
+        """
+        Phase records ordered by start time. Subphases follow their phases.
+        """
+        with self._lock:
+            return sorted(self._records, key=lambda record: (record.start, record.is_subphase))
+
+    def add_phase(self, name: str, start_time: float, end_time: float):
+        """
+        Add phase that is measured with the timer clock.
+        """
+        record = PhaseRecord(name=name, start=start_time - self._start_time, duration=end_time - start_time)
+        with self._lock:
+            self._records.append(record)
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Measure code block duration. The phase is recorded even if the block raises an exception.
+        """
+        start_time = self._clock()
+        with self._lock:
+            self._active_phases.append((name, start_time))
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active_phases.pop()
+            self.add_phase(name, start_time, self._clock())
+
+    def add_subphase(self, name: str, duration: float):
+        """
+        Add part of the current phase, that has been completed just now.
+        """
+        end_time = self._clock()
+        start_time = end_time - duration
+        with self._lock:
+            if self._active_phases:
+                phase_name, phase_start_time = self._active_phases[-1]
+                name = f'{phase_name}/{name}'
+                start_time = max(start_time, phase_start_time)
+        self.add_phase(name, start_time, end_time)
+
+    def get_duration(self, name_prefix: str) -> float:
+        """
+        Get total duration of the phases which names start with ``name_prefix``.
+        """
+        return sum(record.duration for record in self.records
+                   if record.name.startswith(name_prefix) and not record.is_subphase)
+
+
+def format_duration(duration: float) -> str:
+    if duration < 1.0:
+        return f'{duration * 1000:.1f}ms'
+    return f'{duration:.3f}s'
+
+
+def format_throughput(size: int, duration: float) -> str:
+    if duration <= 0:
+        return 'n/a'
+    throughput = size / duration
+    if throughput >= 1024 * 1024:
+        return f'{throughput / (1024 * 1024):.2f} MiB/s'
+    return f'{throughput / 1024:.2f} KiB/s'
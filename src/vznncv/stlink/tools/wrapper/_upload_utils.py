@@ -1,69 +1,342 @@
-import itertools
+import contextlib
+import functools
 import logging
 import os.path
+import re
 import shlex
-import shutil
-import subprocess
-import sys
-from typing import Optional
+import tempfile
+import threading
+import time
+from typing import Optional, List, Sequence, Union, NamedTuple, Tuple, Callable, Dict
 
+from ._adapter_speed import ADAPTER_SPEED_AUTO, MAX_SPEED_BACKOFF_STEPS, get_adapter_speed_ladder, \
+    get_lower_adapter_speed, get_cached_adapter_speed, store_adapter_speed
+from ._artifact_cache import ImageFile, ImageSource, get_image_artifact, get_combined_image_artifact
+from ._backend_output import BackendEvent, DeviceOutput, OutputSettings
+from ._backend_registry import BackendInfo, get_backend_info, VERIFY_MODES, VERIFY_NONE, VERIFY_READBACK, VERIFY_CRC
+from ._cache_utils import write_json_file
+from ._delta_utils import compute_changed_regions, FlashRegion
+from ._elf_utils import ElfLoadSegment
+from ._flash_ledger import get_ledger_entry, update_ledger_entry, remove_ledger_entry, load_ledger_image
+from ._hotplug_utils import wait_stlink_devices
+from ._process_utils import ProcessRunner
+from ._project_config import load_project_config
+from ._probe_broker import ProbeLease, acquire_probe_lease, resolve_probe_broker
+from ._pyocd_api_utils import PYOCD_API_BACKEND, PyOcdSessionPool, PyOcdSessionOptions, is_pyocd_api_available, \
+    program_with_pyocd_session, check_memory_with_pyocd_session, verify_with_pyocd_session, \
+    load_ram_image_with_pyocd_session, PyOcdVerifyError
+from ._openocd_utils import format_openocd_serial_command, format_openocd_speed_command, get_openocd_server, \
+    start_openocd_server, program_with_openocd_server, check_openocd_image, OpenOcdTclError, \
+    build_program_commands, build_region_program_commands, program_regions_with_openocd_server, OpenOcdServerInfo, \
+    build_ram_load_commands, load_ram_image_with_openocd_server
+from ._ram_utils import RamImageEntry, VTOR_ADDRESS, find_non_sram_segment, get_ram_image_entry, is_sram_image
+from ._resolution_cache import ResolutionCache, get_resolution_cache_path, find_executable
 from ._search_utils import resolve_elf_file_location, resolve_openocd_config_file
-from ._stlink_utils import get_stlink_devices, StLinkDevice
+from ._stlink_utils import get_stlink_devices, StLinkDevice, StLinkDeviceNotFoundError
+from ._timing_utils import PhaseTimer, PhaseRecord, format_duration, format_throughput
+from ._watch_utils import watch_file_changes, get_file_stamp
 
 logger = logging.getLogger(__name__)
 
+_DEFAULT_MAX_JOBS = 8
+# device timer subphases, that are measured by the backend events
+_EVENT_SUBPHASES = {'erased': 'erase', 'programmed': 'program', 'verified': 'verify'}
+# SRAM of the target isn't known by command line backends, so the image is checked against Cortex-M SRAM region only
+_RAM_LOAD_FAILURE_HINT = "Check that all image segments are placed in SRAM of the target"
+# names and log banners of the command line backends
+_BACKEND_NAMES = {'openocd': 'OpenOCD', 'pyocd': 'PyOCD'}
+_BACKEND_LOG_BANNERS = {
+    'openocd': ("============================= start of openocd logs ============================",
+                "============================== end of openocd logs ============================="),
+    'pyocd': ("============================== start of pyocd logs =============================",
+              "=============================== end of pyocd logs =============================="),
+}
+# backend errors, that can be caused by unstable probe connection or failed verification
+_LINK_ERROR_REGEX = re.compile(
+    r'unable to connect to the target|jtag status contains invalid mode|dpidr|ap fault|ack not ok|'
+    r'transfer ?(?:fault|error)|timed out while waiting for target|failed to (?:read|write) memory|'
+    r'communication failure|probe error|verify failed|verification failed|checksum mismatch|contents differ',
+    re.IGNORECASE
+)
+
+
+class BackendCommandError(ValueError):
+    """
+    Backend command failure.
+
+    :param message: error message
+    :param phase: backend phase when the backend has exited (see ``BACKEND_PHASES``)
+    :param error_messages: error lines of the backend output
+    """
+
+    def __init__(self, message: str, *, phase: str = 'finish', error_messages: Sequence[str] = ()):
+        super().__init__(message)
+        self.phase = phase
+        self.error_messages = tuple(error_messages)
+
+
+class _BackendRunResult(NamedTuple):
+    returncode: int
+    # backend phase when the backend has exited
+    phase: str
+    # error lines of the backend output
+    error_messages: Tuple[str, ...]
+
 
 def _list_device_info(stlink_devices):
     return [f'- {stlink_device.name}; hla serial {stlink_device.serial_number}' for stlink_device in stlink_devices]
 
 
-def upload_app(project_dir: str, elf_file: Optional[str], backend: str, hla_serial: Optional[str], *,
+class _DeviceLoggerAdapter(logging.LoggerAdapter):
+    """
+    Logger adapter that marks messages with a device serial number.
+    """
+
+    def process(self, msg, kwargs):
+        return f"[{self.extra['hla_serial']}] {msg}", kwargs
+
+
+class DeviceUploadResult(NamedTuple):
+    stlink_device: StLinkDevice
+    success: bool
+    duration: float
+    error: Optional[str] = None
+    # upload is skipped, as device already holds the same image
+    skipped: bool = False
+    # number of bytes that have been written to the target memory
+    bytes_flashed: int = 0
+    phases: Tuple[PhaseRecord, ...] = ()
+
+    @property
+    def flash_duration(self) -> float:
+        return sum(phase.duration for phase in self.phases if phase.name.startswith('flash') and not phase.is_subphase)
+
+
+class _DeviceUploadStats(NamedTuple):
+    skipped: bool
+    bytes_flashed: int
+
+
+class _UploadSettings(NamedTuple):
+    project_dir: str
+    elf_file: str
+    image_segments: List[ElfLoadSegment]
+    image_hash: str
+    # image file that is passed to the backend
+    image_file: ImageFile
+    backend: str
+    force: bool
+    delta_sector_size: Optional[int]
+    verbose: bool
+    output_settings: OutputSettings
+    # openocd options
+    openocd_path: Optional[str]
+    openocd_config: Optional[str]
+    openocd_server: bool
+    # pyocd options
+    pyocd_path: Optional[str]
+    pyocd_target: Optional[str]
+    pyocd_config: Optional[str]
+    pyocd_script: Optional[str]
+    # opened sessions of the in-process pyocd backend
+    pyocd_sessions: Optional[PyOcdSessionPool] = None
+    # version and capabilities of the openocd tool
+    openocd_info: Optional[BackendInfo] = None
+    # adapter clock in kHz or ``None`` to use backend default one
+    adapter_speed: Optional[int] = None
+    # choose adapter clock automatically
+    auto_adapter_speed: bool = False
+    # socket of the broker that leases probes or ``None`` if the probes are used without lease
+    probe_broker: Optional[str] = None
+    lease_timeout: Optional[float] = None
+    # image file that combines the elf file with extra images or ``None`` if only the elf file is uploaded
+    combined_image_file: Optional[str] = None
+    # verification mode of the programmed image or ``None`` to use backend default one
+    verify: Optional[str] = None
+    # vector table of the image that is loaded to SRAM or ``None`` if the image is programmed to flash
+    ram_entry: Optional[RamImageEntry] = None
+
+    @property
+    def check_image_file(self) -> str:
+        """
+        Image that is used for target-side checksum check.
+        """
+        return self.elf_file if self.combined_image_file is None else self.combined_image_file
+
+    @property
+    def image_size(self) -> int:
+        return sum(len(segment.data) for segment in self.image_segments)
+
+    @property
+    def backend_target(self) -> str:
+        if self.backend == 'openocd':
+            return self.openocd_config
+        elif self.backend in ('pyocd', PYOCD_API_BACKEND):
+            return self.pyocd_target
+        else:
+            raise ValueError(f"Unknown backend: {self.backend}")
+
+    def get_pyocd_session_options(self, hla_serial: str) -> PyOcdSessionOptions:
+        if self.pyocd_target is None:
+            raise ValueError("PyOCD target isn't specified. Please specify '--pyocd-target' option to use "
+                             "pyocd backend")
+        return PyOcdSessionOptions(
+            unique_id=hla_serial,
+            target=self.pyocd_target,
+            config_file=self.pyocd_config,
+            user_script=self.pyocd_script,
+            frequency=None if self.adapter_speed is None else self.adapter_speed * 1000
+        )
+
+
+def _resolve_target_devices(stlink_devices: List[StLinkDevice], hla_serials: Sequence[str],
+                            all_devices: bool) -> List[StLinkDevice]:
+    if not stlink_devices:
+        raise StLinkDeviceNotFoundError("Cannot find any ST-Link device")
+    elif all_devices:
+        if hla_serials:
+            raise ValueError("hla serial and \"all devices\" options cannot be used together")
+        return list(stlink_devices)
+    elif hla_serials:
+        target_devices = []
+        for hla_serial in hla_serials:
+            serial_devices = [
+                stlink_device for stlink_device in stlink_devices if
+                stlink_device.serial_number.upper() == hla_serial.upper()
+            ]
+            if not serial_devices:
+                raise StLinkDeviceNotFoundError(
+                    "Cannot find stink device with hla serial: {}\n"
+                    "Available devices:\n{}".format(hla_serial, '\n'.join(_list_device_info(stlink_devices)))
+                )
+            elif len(serial_devices) > 1:
+                raise ValueError("Found multiple stink devices with the same serial:{}\n".format(
+                    '\n'.join(_list_device_info(stlink_devices))
+                ))
+            if serial_devices[0] not in target_devices:
+                target_devices.append(serial_devices[0])
+        return target_devices
+    elif len(stlink_devices) == 1:
+        return [stlink_devices[0]]
+    else:
+        raise ValueError("Found multiple stink devices:\n{}\nPlease specify one with hal serial number".format(
+            '\n'.join(_list_device_info(stlink_devices))
+        ))
+
+
+def upload_app(project_dir: str, elf_file: Optional[str], backend: str,
+               hla_serial: Union[None, str, Sequence[str]], *,
                openocd_config: Optional[str], openocd_path: Optional[str],
                pyocd_path: Optional[str], pyocd_target: Optional[str],
                pyocd_config: Optional[str], pyocd_script: Optional[str],
-               verbose: bool = False):
+               all_devices: bool = False, jobs: Optional[int] = None,
+               openocd_server: bool = False, force: bool = False, delta_sector_size: Optional[int] = None,
+               wait_for_device: Optional[float] = None, timings: bool = False, timings_file: Optional[str] = None,
+               output_format: str = 'text', quiet: bool = False,
+               timeout: Optional[float] = None, phase_timeouts: Optional[Dict[str, float]] = None,
+               pyocd_sessions: Optional[PyOcdSessionPool] = None, image_format: str = 'elf',
+               elf_select: str = 'single', search_excludes: Sequence[str] = (), search_workers: Optional[int] = None,
+               rescan: bool = False, adapter_speed: Union[int, str, None] = None,
+               broker_socket: Optional[str] = None, probe_pool: Optional[str] = None,
+               lease_timeout: Optional[float] = None, extra_images: Sequence[ImageSource] = (),
+               verify: Optional[str] = None, ram: bool = False, watch: bool = False,
+               verbose: bool = False) -> List[DeviceUploadResult]:
     """
     Upload compiled .elf firmware to target board.
+
+    The firmware is uploaded concurrently if several devices are selected. Upload is skipped for devices
+    that hold the same image already, unless ``force`` flag is set. Options that aren't set explicitly
+    are taken from the project configuration file ``.vznncv-stlink.toml``.
+
+    :return: upload results of the devices
     """
-    # resolve elf file location
+    timer = PhaseTimer()
+    auto_adapter_speed = adapter_speed == ADAPTER_SPEED_AUTO
+    if auto_adapter_speed:
+        adapter_speed = None
+    elif adapter_speed is not None and (not isinstance(adapter_speed, int) or adapter_speed <= 0):
+        raise ValueError(f"Adapter speed must be positive number of kHz or \"{ADAPTER_SPEED_AUTO}\", "
+                         f"but it's {adapter_speed!r}")
+    if verify is not None and verify not in VERIFY_MODES:
+        raise ValueError(f"Unknown verification mode: {verify}")
+    if extra_images and image_format == 'bin':
+        raise ValueError("Extra images are combined with the elf file into Intel HEX image, "
+                         "so binary image format cannot be used")
+
+    # load project configuration
     project_dir = os.path.abspath(project_dir)
     if not os.path.isdir(project_dir):
         raise ValueError(f"Project directory \"{project_dir}\" doesn't not exist")
-    elf_file = resolve_elf_file_location(project_dir=project_dir, elf_path=elf_file)
+    project_config = load_project_config(project_dir)
+    if project_config.config_file is not None:
+        logger.info(f"Project configuration file: {project_config.config_file}")
+        if elf_file is None:
+            elf_file = project_config.elf_file
+        if backend == 'auto' and project_config.backend is not None:
+            backend = project_config.backend
+        openocd_path = openocd_path if openocd_path is not None else project_config.openocd_path
+        openocd_config = openocd_config if openocd_config is not None else project_config.openocd_config
+        pyocd_path = pyocd_path if pyocd_path is not None else project_config.pyocd_path
+        pyocd_target = pyocd_target if pyocd_target is not None else project_config.pyocd_target
+        pyocd_config = pyocd_config if pyocd_config is not None else project_config.pyocd_config
+        pyocd_script = pyocd_script if pyocd_script is not None else project_config.pyocd_script
+    resolution_cache = ResolutionCache(get_resolution_cache_path(project_dir))
+    if rescan:
+        resolution_cache.clear()
+
+    # resolve elf file location
+    with timer.phase('elf resolution'):
+        elf_file = resolve_elf_file_location(project_dir=project_dir, elf_path=elf_file, elf_select=elf_select,
+                                             exclude_patterns=search_excludes, workers=search_workers,
+                                             resolution_cache=resolution_cache)
     logger.info(f"Target elf file to upload: {elf_file}")
 
-    # resolve stlink device
-    stlink_devices = get_stlink_devices()
-    if not stlink_devices:
-        raise ValueError("Cannot find any ST-Link device")
-    elif hla_serial is not None:
-        target_devices = [
-            stlink_device for stlink_device in stlink_devices if
-            stlink_device.serial_number.upper() == hla_serial.upper()
-        ]
-        if not target_devices:
-            raise ValueError("Cannot find stink device with hla serial: {}\n"
-                             "Available devices:\n{}".format(hla_serial, '\n'.join(_list_device_info(stlink_devices))))
-        elif len(target_devices) > 1:
-            raise ValueError("Found multiple stink devices with the same serial:{}\n".format(
-                '\n'.join(_list_device_info(stlink_devices))
-            ))
-        target_device = target_devices[0]
-    elif len(stlink_devices) == 1:
-        target_device = stlink_devices[0]
+    # resolve stlink devices
+    if hla_serial is None:
+        hla_serials = []
+    elif isinstance(hla_serial, str):
+        hla_serials = [hla_serial]
     else:
-        raise ValueError("Found multiple stink devices:\n{}\nPlease specify one with hal serial number".format(
-            '\n'.join(_list_device_info(stlink_devices))
-        ))
-    logger.info(f"Target ST-Link device: {target_device}")
+        hla_serials = list(hla_serial)
+    probe_broker = resolve_probe_broker(broker_socket)
+    if probe_broker is not None:
+        logger.info(f"Probe broker: {probe_broker}")
+
+    def resolve_target_devices(hla_serials: List[str]) -> List[StLinkDevice]:
+        with timer.phase('device enumeration'):
+            if wait_for_device is None:
+                target_devices = _resolve_target_devices(get_stlink_devices(), hla_serials=hla_serials,
+                                                         all_devices=all_devices)
+            else:
+                target_devices = wait_stlink_devices(
+                    lambda stlink_devices: _resolve_target_devices(stlink_devices, hla_serials=hla_serials,
+                                                                   all_devices=all_devices),
+                    timeout=wait_for_device
+                )
+        if len(target_devices) == 1:
+            logger.info(f"Target ST-Link device: {target_devices[0]}")
+        else:
+            logger.info("Target ST-Link devices:\n{}".format('\n'.join(_list_device_info(target_devices))))
+        return target_devices
+
+    if probe_pool is None:
+        target_devices = resolve_target_devices(hla_serials)
+    elif hla_serials or all_devices:
+        raise ValueError("Probe pool cannot be used with explicit hla serials or all devices flag")
+    elif probe_broker is None:
+        raise ValueError(f"Probe pool \"{probe_pool}\" requires running probe broker")
+    else:
+        # the device is chosen by the broker later, so the probe is leased only during upload
+        target_devices = None
 
     # check pyocd/openocd paths
+    backend_discovery_start = time.monotonic()
     if pyocd_path is None:
-        pyocd_path = shutil.which('pyocd')
+        pyocd_path = find_executable('pyocd', resolution_cache)
     elif not os.path.isfile(pyocd_path):
         raise ValueError(f'Give pyocd path "{pyocd_path}" does not exists')
     if openocd_path is None:
-        openocd_path = shutil.which('openocd')
+        openocd_path = find_executable('openocd', resolution_cache)
     elif not os.path.isfile(openocd_path):
         raise ValueError(f'Give openocd path "{openocd_path}" does not exists')
 
@@ -84,101 +357,1198 @@ def upload_app(project_dir: str, elf_file: Optional[str], backend: str, hla_seri
             else:
                 backend = 'openocd'
         logger.info(f"Select \"{backend}\" for program uploading automatically")
+    elif backend == PYOCD_API_BACKEND and not is_pyocd_api_available():
+        raise ValueError("Cannot use pyocd-api backend, as pyocd python package isn't installed")
+    backend_info = None
+    backend_path = {'openocd': openocd_path, 'pyocd': pyocd_path}.get(backend)
+    if backend_path is not None:
+        backend_info = get_backend_info(backend, backend_path)
+    timer.add_phase('backend discovery', backend_discovery_start, time.monotonic())
     logger.info(f"Upload backend: \"{backend}\"")
+    if backend == 'pyocd' and verify in (VERIFY_READBACK, VERIFY_CRC):
+        raise ValueError(f"PyOCD command doesn't support image verification. Use \"{PYOCD_API_BACKEND}\" backend "
+                         f"for \"{verify}\" verification mode")
+    if backend_info is not None:
+        logger.info(f"Backend tool: {backend_info}")
 
-    # upload application
+    # resolve openocd configuration once for all devices
     if backend == 'openocd':
-        _upload_app_with_openocd(
+        with timer.phase('config resolution'):
+            openocd_config = resolve_openocd_config_file(project_dir=project_dir, config_path=openocd_config,
+                                                         exclude_patterns=search_excludes, workers=search_workers,
+                                                         resolution_cache=resolution_cache)
+        logger.info(f"OpenOCD configuration file: {openocd_config}")
+    # resolution is completed, so the results are saved for the next calls (and before infinite watching)
+    resolution_cache.save()
+
+    def read_upload_settings() -> _UploadSettings:
+        # read image and calculate its hash once for all devices
+        with timer.phase('image reading'):
+            if extra_images:
+                image_sources = [ImageSource(path=elf_file)]
+                image_sources.extend(image_source._replace(path=os.path.join(project_dir, image_source.path))
+                                     for image_source in extra_images)
+                logger.info("Images to upload:\n{}".format('\n'.join(f'- {s}' for s in image_sources)))
+                image_artifact = get_combined_image_artifact(image_sources, image_format='hex')
+            else:
+                image_artifact = get_image_artifact(elf_file, image_format=image_format)
+        logger.debug(f"Image hash: {image_artifact.image_hash}")
+        if image_format != 'elf' or extra_images:
+            logger.info(f"Image file to upload: {image_artifact.image_file.path}")
+        ram_entry = None
+        load_to_ram = ram
+        if not load_to_ram and is_sram_image(image_artifact.segments):
+            logger.info("Image is linked to SRAM. Load it to RAM instead of flash programming")
+            load_to_ram = True
+        if load_to_ram:
+            non_sram_segment = find_non_sram_segment(image_artifact.segments)
+            if non_sram_segment is not None:
+                raise ValueError(f"Image cannot be loaded to RAM, as its segment 0x{non_sram_segment.address:08X} "
+                                 f"({len(non_sram_segment.data)} bytes) is placed outside SRAM")
+            ram_entry = get_ram_image_entry(elf_file, image_artifact.segments)
+            logger.info(f"RAM image {ram_entry}")
+
+        return _UploadSettings(
             project_dir=project_dir,
             elf_file=elf_file,
-            stlink_device=target_device,
+            image_segments=image_artifact.segments,
+            image_hash=image_artifact.image_hash,
+            image_file=image_artifact.image_file,
+            backend=backend,
+            force=force,
+            delta_sector_size=delta_sector_size,
             verbose=verbose,
+            output_settings=OutputSettings(output_format=output_format, quiet=quiet),
             openocd_path=openocd_path,
-            openocd_config=openocd_config
-        )
-    elif backend == 'pyocd':
-        _upload_app_with_pyocd(
-            project_dir=project_dir,
-            elf_file=elf_file,
-            stlink_device=target_device,
-            verbose=verbose,
+            openocd_config=openocd_config,
+            openocd_server=openocd_server,
             pyocd_path=pyocd_path,
             pyocd_target=pyocd_target,
             pyocd_config=pyocd_config,
             pyocd_script=pyocd_script,
+            pyocd_sessions=pyocd_sessions,
+            openocd_info=backend_info if backend == 'openocd' else None,
+            adapter_speed=adapter_speed,
+            auto_adapter_speed=auto_adapter_speed,
+            probe_broker=probe_broker,
+            lease_timeout=lease_timeout,
+            combined_image_file=image_artifact.image_file.path if extra_images else None,
+            verify=verify,
+            ram_entry=ram_entry
         )
+
+    def report_timings(upload_results: List[DeviceUploadResult]):
+        if timings:
+            logger.info("Timings:\n{}".format('\n'.join(
+                _format_timings(timer, upload_results, upload_settings.image_size)
+            )))
+        if timings_file is not None:
+            write_json_file(timings_file, _build_timings_dict(timer, upload_results, upload_settings.image_size))
+
+    # upload application
+    process_runner = ProcessRunner(timeout=timeout, phase_timeouts=phase_timeouts)
+
+    def upload_to_target_devices(upload_settings: _UploadSettings, target_devices: List[StLinkDevice]):
+        if backend == PYOCD_API_BACKEND and upload_settings.pyocd_sessions is None:
+            # sessions are used by this upload only
+            with PyOcdSessionPool() as upload_pyocd_sessions:
+                return _upload_to_target_devices(upload_settings._replace(pyocd_sessions=upload_pyocd_sessions),
+                                                 target_devices, jobs=jobs, timer=timer,
+                                                 process_runner=process_runner, report_timings=report_timings)
+        return _upload_to_target_devices(upload_settings, target_devices, jobs=jobs, timer=timer,
+                                         process_runner=process_runner, report_timings=report_timings)
+
+    def upload_image(upload_settings: _UploadSettings) -> List[DeviceUploadResult]:
+        if target_devices is not None:
+            return upload_to_target_devices(upload_settings, target_devices)
+        with timer.phase('probe lease'):
+            pool_lease = _acquire_probe_lease(upload_settings, pool=probe_pool, device_logger=logger)
+        with pool_lease:
+            # the probe has been leased already
+            return upload_to_target_devices(upload_settings._replace(probe_broker=None),
+                                            resolve_target_devices([pool_lease.serial]))
+
+    if not watch:
+        upload_settings = read_upload_settings()
+        return upload_image(upload_settings)
+
+    # upload application after each change of the image files. Resolved files, devices and backend are reused
+    watch_paths = [elf_file]
+    watch_paths.extend(os.path.join(project_dir, image_source.path) for image_source in extra_images)
+    watch_pyocd_sessions = None
+    if backend == PYOCD_API_BACKEND and pyocd_sessions is None:
+        # keep probe sessions opened between uploads
+        watch_pyocd_sessions = pyocd_sessions = PyOcdSessionPool()
+    upload_results = []
+    uploaded_image_hash = None
+    try:
+        # file stamps are taken before image reading, so changes during upload aren't missed
+        file_changes = watch_file_changes(watch_paths,
+                                          stamps={path: get_file_stamp(path) for path in watch_paths})
+        while True:
+            try:
+                upload_settings = read_upload_settings()
+                if upload_settings.image_hash == uploaded_image_hash:
+                    logger.info("Loadable image content isn't changed. Skip upload")
+                else:
+                    upload_results = upload_image(upload_settings)
+                    uploaded_image_hash = upload_settings.image_hash
+            except Exception as e:
+                logger.debug("Upload has failed", exc_info=True)
+                logger.warning(f"Upload has failed: {e}")
+            logger.info("Watch image changes:\n{}\nPress Ctrl+C to stop".format(
+                '\n'.join(f'- {path}' for path in watch_paths)
+            ))
+            try:
+                next(file_changes)
+            except StopIteration:
+                break
+            logger.info("Image is changed")
+            timer = PhaseTimer()
+    except KeyboardInterrupt:
+        logger.info("Stop watching")
+    finally:
+        if watch_pyocd_sessions is not None:
+            watch_pyocd_sessions.close()
+    return upload_results
+
+
+def _upload_to_target_devices(upload_settings: _UploadSettings, target_devices: List[StLinkDevice], *,
+                              jobs: Optional[int], timer: PhaseTimer, process_runner: ProcessRunner,
+                              report_timings: Callable[[List[DeviceUploadResult]], None]) -> List[DeviceUploadResult]:
+    if len(target_devices) == 1:
+        device_timer = PhaseTimer()
+        try:
+            with timer.phase('upload'):
+                upload_stats, = process_runner.run_tasks([lambda: _upload_app_to_device(
+                    upload_settings, target_devices[0], timer=device_timer, output_lock=None,
+                    process_runner=process_runner
+                )], max_workers=1)
+                if isinstance(upload_stats, BaseException):
+                    raise upload_stats
+        except Exception as e:
+            try:
+                report_timings([DeviceUploadResult(stlink_device=target_devices[0], success=False,
+                                                   duration=device_timer.elapsed, error=str(e),
+                                                   phases=tuple(device_timer.records))])
+            except Exception as report_error:
+                # don't hide upload error
+                logger.warning(f"Cannot report timings: {report_error}")
+            raise
+        upload_results = [DeviceUploadResult(stlink_device=target_devices[0], success=True,
+                                             duration=device_timer.elapsed, skipped=upload_stats.skipped,
+                                             bytes_flashed=upload_stats.bytes_flashed,
+                                             phases=tuple(device_timer.records))]
+        report_timings(upload_results)
+        logger.info("Complete")
+        return upload_results
+
+    with timer.phase('upload'):
+        upload_results = _upload_to_devices_concurrently(
+            upload_settings=upload_settings,
+            target_devices=target_devices,
+            jobs=jobs,
+            process_runner=process_runner
+        )
+    logger.info("Upload summary:\n{}".format('\n'.join(_format_upload_summary(upload_results))))
+    report_timings(upload_results)
+    failed_results = [upload_result for upload_result in upload_results if not upload_result.success]
+    if failed_results:
+        raise ValueError(f"Upload has failed for {len(failed_results)} of {len(upload_results)} devices")
     logger.info("Complete")
+    return upload_results
+
+
+def _upload_to_devices_concurrently(*, upload_settings: '_UploadSettings', target_devices: List[StLinkDevice],
+                                    jobs: Optional[int], process_runner: ProcessRunner) -> List[DeviceUploadResult]:
+    if jobs is None:
+        jobs = min(len(target_devices), _DEFAULT_MAX_JOBS)
+    elif jobs < 1:
+        raise ValueError(f"Number of jobs must be positive, but it's {jobs}")
+    logger.info(f"Upload firmware to {len(target_devices)} devices using {jobs} jobs")
+    output_lock = threading.Lock()
+
+    def run_upload(stlink_device: StLinkDevice) -> DeviceUploadResult:
+        device_timer = PhaseTimer()
+        try:
+            upload_stats = _upload_app_to_device(upload_settings, stlink_device, timer=device_timer,
+                                                 output_lock=output_lock, process_runner=process_runner)
+        except Exception as e:
+            logger.debug(f"Upload to {stlink_device} has failed", exc_info=True)
+            return DeviceUploadResult(stlink_device=stlink_device, success=False, duration=device_timer.elapsed,
+                                      error=str(e), phases=tuple(device_timer.records))
+        return DeviceUploadResult(stlink_device=stlink_device, success=True, duration=device_timer.elapsed,
+                                  skipped=upload_stats.skipped, bytes_flashed=upload_stats.bytes_flashed,
+                                  phases=tuple(device_timer.records))
+
+    # backend processes of all devices are supervised by one event loop
+    upload_results = process_runner.run_tasks(
+        [functools.partial(run_upload, stlink_device) for stlink_device in target_devices],
+        max_workers=jobs
+    )
+    for upload_result in upload_results:
+        if isinstance(upload_result, BaseException):
+            raise upload_result
+    return upload_results
+
+
+def _format_upload_status(upload_result: DeviceUploadResult) -> str:
+    if not upload_result.success:
+        return 'FAILED'
+    elif upload_result.skipped:
+        return 'SKIPPED'
+    else:
+        return 'OK'
+
+
+def _format_upload_summary(upload_results: List[DeviceUploadResult]) -> List[str]:
+    rows = [('hla serial', 'device', 'status', 'time', 'error')]
+    for upload_result in upload_results:
+        rows.append((
+            upload_result.stlink_device.serial_number,
+            upload_result.stlink_device.name,
+            _format_upload_status(upload_result),
+            f'{upload_result.duration:.1f}s',
+            upload_result.error or ''
+        ))
+    return _format_table(rows)
+
+
+def _format_table(rows: List[Tuple[str, ...]]) -> List[str]:
+    col_widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    return [' | '.join(cell.ljust(col_width) for cell, col_width in zip(row, col_widths)).rstrip() for row in rows]
+
+
+def _format_timings(timer: PhaseTimer, upload_results: List[DeviceUploadResult], image_size: int) -> List[str]:
+    show_serial = len(upload_results) > 1
+    rows = [('phase', 'time', 'details')]
+    for record in timer.records:
+        rows.append((record.name, format_duration(record.duration), ''))
+        if record.name != 'upload':
+            continue
+        for upload_result in upload_results:
+            prefix = f'  [{upload_result.stlink_device.serial_number}] ' if show_serial else '  '
+            for device_record in upload_result.phases:
+                rows.append((prefix + device_record.name, format_duration(device_record.duration), ''))
+            if upload_result.bytes_flashed:
+                flash_duration = upload_result.flash_duration
+                details = f'{upload_result.bytes_flashed} bytes in {format_duration(flash_duration)} ' \
+                          f'({format_throughput(upload_result.bytes_flashed, flash_duration)})'
+            else:
+                details = _format_upload_status(upload_result)
+            rows.append((prefix + 'total', format_duration(upload_result.duration), details))
+    rows.append(('total', format_duration(timer.elapsed), f'image size {image_size} bytes'))
+    return _format_table(rows)
+
+
+def _build_timings_dict(timer: PhaseTimer, upload_results: List[DeviceUploadResult], image_size: int) -> dict:
+    devices = []
+    for upload_result in upload_results:
+        flash_duration = upload_result.flash_duration
+        devices.append({
+            'hla_serial': upload_result.stlink_device.serial_number,
+            'status': _format_upload_status(upload_result),
+            'duration': upload_result.duration,
+            'bytes_flashed': upload_result.bytes_flashed,
+            'flash_duration': flash_duration,
+            'throughput': upload_result.bytes_flashed / flash_duration if flash_duration > 0 else None,
+            'phases': [record.to_dict() for record in upload_result.phases],
+        })
+    return {
+        'total': timer.elapsed,
+        'image_size': image_size,
+        'phases': [record.to_dict() for record in timer.records],
+        'devices': devices,
+    }
+
+
+def _add_event_subphase(timer: PhaseTimer, event: BackendEvent):
+    # backends report duration of the erase, program and verify steps, when they are completed
+    subphase_name = _EVENT_SUBPHASES.get(event.kind)
+    if subphase_name is not None and event.duration is not None:
+        timer.add_subphase(subphase_name, event.duration)
+
+
+def _upload_app_to_device(upload_settings: _UploadSettings, stlink_device: StLinkDevice, *,
+                          timer: PhaseTimer, output_lock: Optional[threading.Lock],
+                          process_runner: ProcessRunner) -> _DeviceUploadStats:
+    """
+    Upload application to a device.
+
+    Duration of the upload phases is recorded with ``timer``.
+    """
+    if output_lock is None:
+        device_logger = logger
+    else:
+        device_logger = _DeviceLoggerAdapter(logger, {'hla_serial': stlink_device.serial_number})
+    device_output = DeviceOutput(upload_settings.output_settings, hla_serial=stlink_device.serial_number,
+                                 lock=output_lock, prefix_lines=output_lock is not None,
+                                 event_handler=lambda backend, event: _add_event_subphase(timer, event))
+    probe_lease = None
+    if upload_settings.probe_broker is not None:
+        with timer.phase('probe lease'):
+            probe_lease = _acquire_probe_lease(upload_settings, serials=[stlink_device.serial_number],
+                                               device_logger=device_logger)
+    try:
+        return _upload_app_to_leased_device(upload_settings, stlink_device, timer=timer, device_logger=device_logger,
+                                            device_output=device_output, process_runner=process_runner)
+    finally:
+        if probe_lease is not None:
+            probe_lease.release()
+
+
+def _acquire_probe_lease(upload_settings: _UploadSettings, *, serials: Sequence[str] = (),
+                         pool: Optional[str] = None,
+                         device_logger: Union[logging.Logger, logging.LoggerAdapter]) -> ProbeLease:
+    probe_name = ', '.join(serials) if pool is None else f'probe of the pool "{pool}"'
+
+    def log_queue_position(position: int):
+        device_logger.info(f"Wait for {probe_name} lease ({position} clients ahead)")
+
+    probe_lease = acquire_probe_lease(upload_settings.probe_broker, serials=serials, pool=pool,
+                                      client=f"upload-app (pid {os.getpid()})", timeout=upload_settings.lease_timeout,
+                                      queued_callback=log_queue_position)
+    device_logger.info(f"Probe {probe_lease.serial} is leased (wait time {probe_lease.wait_time:.1f} s)")
+    return probe_lease
+
+
+def _upload_app_to_leased_device(upload_settings: _UploadSettings, stlink_device: StLinkDevice, *,
+                                 timer: PhaseTimer, device_logger: Union[logging.Logger, logging.LoggerAdapter],
+                                 device_output: DeviceOutput, process_runner: ProcessRunner) -> _DeviceUploadStats:
+    hla_serial = stlink_device.serial_number
+    backend_target = upload_settings.backend_target
+    if upload_settings.auto_adapter_speed:
+        adapter_speed = get_cached_adapter_speed(hla_serial, backend_target)
+        if adapter_speed is None:
+            adapter_speed = get_adapter_speed_ladder(stlink_device)[0]
+        device_logger.info(f"Adapter speed: {adapter_speed} kHz")
+        upload_settings = upload_settings._replace(adapter_speed=adapter_speed)
+
+    if upload_settings.ram_entry is not None:
+        # SRAM content isn't kept after reset, so the flash ledger isn't used and updated
+        upload_settings = _flash_app_with_speed_backoff(upload_settings, stlink_device, timer=timer,
+                                                        device_logger=device_logger, device_output=device_output,
+                                                        process_runner=process_runner)
+        if upload_settings.auto_adapter_speed:
+            store_adapter_speed(hla_serial, backend_target, upload_settings.adapter_speed)
+        return _DeviceUploadStats(skipped=False, bytes_flashed=upload_settings.image_size)
+
+    with timer.phase('ledger check'):
+        ledger_entry = get_ledger_entry(hla_serial)
+    if ledger_entry is not None and not ledger_entry.matches_target(backend=upload_settings.backend,
+                                                                    target=backend_target):
+        ledger_entry = None
+
+    if not upload_settings.force and ledger_entry is not None \
+            and ledger_entry.image_hash == upload_settings.image_hash:
+        device_logger.info("Device has been flashed with the same image already. Check target memory")
+        with timer.phase('memory check'):
+            image_matches = _check_app_on_device(upload_settings, stlink_device, device_logger=device_logger,
+                                                 device_output=device_output, process_runner=process_runner)
+        if image_matches:
+            device_logger.info("Device holds the same image. Skip upload")
+            return _DeviceUploadStats(skipped=True, bytes_flashed=0)
+        device_logger.info("Device memory doesn't match the image")
+
+    previous_segments = None
+    if not upload_settings.force and upload_settings.delta_sector_size is not None:
+        if not _can_check_app_on_device(upload_settings):
+            # target can be reflashed by other tools, so unverified delta upload can produce mixed firmware
+            device_logger.info("Delta upload requires target memory check. Upload full image")
+        elif ledger_entry is not None:
+            with timer.phase('ledger image loading'):
+                previous_segments = load_ledger_image(ledger_entry)
+        if previous_segments is None:
+            device_logger.info("Previous device image is unknown. Upload full image")
+
+    remove_ledger_entry(hla_serial)
+    bytes_flashed = 0
+    if previous_segments is not None:
+        with timer.phase('delta computation'):
+            regions = compute_changed_regions(previous_segments, upload_settings.image_segments,
+                                              upload_settings.delta_sector_size)
+        regions_size = sum(len(region.data) for region in regions)
+        device_logger.info(f"Delta upload: {len(regions)} changed regions, {regions_size} bytes "
+                           f"(image size is {upload_settings.image_size} bytes)")
+        try:
+            with timer.phase('flash (delta)'):
+                _flash_regions_to_device(upload_settings, stlink_device, regions, device_logger=device_logger,
+                                         device_output=device_output, process_runner=process_runner)
+            if not _is_delta_upload_verified(upload_settings):
+                # the rest of the image must be kept by the target since the previous upload
+                with timer.phase('memory check'):
+                    image_matches = _check_app_on_device(upload_settings, stlink_device, device_logger=device_logger,
+                                                         device_output=device_output, process_runner=process_runner)
+                if not image_matches:
+                    raise ValueError("Target memory doesn't match the image after delta upload")
+            bytes_flashed = regions_size
+        except Exception as e:
+            device_logger.warning(f"Delta upload has failed: {e}\nUpload full image")
+            previous_segments = None
+    if previous_segments is None:
+        upload_settings = _flash_app_with_speed_backoff(upload_settings, stlink_device, timer=timer,
+                                                        device_logger=device_logger, device_output=device_output,
+                                                        process_runner=process_runner)
+        bytes_flashed = upload_settings.image_size
+    if upload_settings.auto_adapter_speed:
+        store_adapter_speed(hla_serial, backend_target, upload_settings.adapter_speed)
+
+    with timer.phase('ledger update'):
+        update_ledger_entry(
+            hla_serial=hla_serial,
+            image_hash=upload_settings.image_hash,
+            elf_file=upload_settings.elf_file,
+            backend=upload_settings.backend,
+            target=backend_target,
+            segments=upload_settings.image_segments
+        )
+    return _DeviceUploadStats(skipped=False, bytes_flashed=bytes_flashed)
+
+
+def _flash_app_with_speed_backoff(upload_settings: _UploadSettings, stlink_device: StLinkDevice, *,
+                                  timer: PhaseTimer, device_logger: Union[logging.Logger, logging.LoggerAdapter],
+                                  device_output: DeviceOutput, process_runner: ProcessRunner) -> _UploadSettings:
+    """
+    Flash application or load it to SRAM. If adapter speed is chosen automatically and upload fails
+    because of probe communication or verification error, it's repeated with lower speed.
+
+    :return: upload settings with adapter speed of the successful upload
+    """
+    speed_ladder = get_adapter_speed_ladder(stlink_device)
+    backoff_steps = 0
+    upload_func = _flash_app_to_device if upload_settings.ram_entry is None else _load_app_to_ram
+    while True:
+        try:
+            upload_func(upload_settings, stlink_device, timer=timer, device_logger=device_logger,
+                        device_output=device_output, process_runner=process_runner)
+            return upload_settings
+        except Exception as e:
+            if not upload_settings.auto_adapter_speed or backoff_steps >= MAX_SPEED_BACKOFF_STEPS \
+                    or not _is_link_failure(e):
+                raise
+            lower_speed = get_lower_adapter_speed(speed_ladder, upload_settings.adapter_speed)
+            if lower_speed is None:
+                raise
+            device_logger.warning(f"Upload at {upload_settings.adapter_speed} kHz adapter speed has failed: {e}\n"
+                                  f"Retry at {lower_speed} kHz")
+            backoff_steps += 1
+            upload_settings = upload_settings._replace(adapter_speed=lower_speed)
+
+
+def _is_link_failure(e: Exception) -> bool:
+    """
+    Check if upload error can be caused by unstable probe connection, so it may be fixed by lower adapter speed.
+
+    Backend failures after backend startup or with known probe communication and verification errors,
+    OpenOCD server command errors, verification mismatches and probe errors are such errors.
+    Other ``ValueError`` exceptions are configuration, resolution or timeout errors, and ``OSError``
+    exceptions are caused by missing or broken backend executables.
+    """
+    if isinstance(e, BackendCommandError):
+        # the backend fails during startup if its configuration is wrong or probe isn't found
+        return e.phase != 'startup' or any(_LINK_ERROR_REGEX.search(message) for message in e.error_messages)
+    if isinstance(e, (OpenOcdTclError, PyOcdVerifyError)):
+        return True
+    return not isinstance(e, (ValueError, OSError))
+
+
+def _flash_app_to_device(upload_settings: _UploadSettings, stlink_device: StLinkDevice, *,
+                         timer: PhaseTimer, device_logger: Union[logging.Logger, logging.LoggerAdapter],
+                         device_output: DeviceOutput, process_runner: ProcessRunner):
+    if upload_settings.backend == 'openocd' and upload_settings.openocd_server:
+        with timer.phase('backend startup'):
+            _ensure_openocd_server(
+                project_dir=upload_settings.project_dir,
+                stlink_device=stlink_device,
+                verbose=upload_settings.verbose,
+                openocd_path=upload_settings.openocd_path,
+                openocd_config=upload_settings.openocd_config,
+                openocd_info=upload_settings.openocd_info,
+                device_logger=device_logger
+            )
+        with timer.phase('flash'):
+            _upload_app_with_openocd_server(
+                project_dir=upload_settings.project_dir,
+                image_file=upload_settings.image_file,
+                stlink_device=stlink_device,
+                verbose=upload_settings.verbose,
+                openocd_path=upload_settings.openocd_path,
+                openocd_config=upload_settings.openocd_config,
+                openocd_info=upload_settings.openocd_info,
+                adapter_speed=upload_settings.adapter_speed,
+                verify=upload_settings.verify,
+                device_logger=device_logger,
+                device_output=device_output,
+                timeout=process_runner.timeout
+            )
+        return
+    if upload_settings.backend == PYOCD_API_BACKEND:
+        # open probe session in advance (it can be opened already by the memory check)
+        with timer.phase('backend startup'):
+            upload_settings.pyocd_sessions.get_session(
+                upload_settings.get_pyocd_session_options(stlink_device.serial_number)
+            )
+
+    # backend process startup, erase, program and verify steps are done by a single backend invocation
+    with timer.phase('flash'):
+        _run_flash_backend(upload_settings, stlink_device, device_logger=device_logger, device_output=device_output,
+                           process_runner=process_runner)
+
+
+def _run_flash_backend(upload_settings: _UploadSettings, stlink_device: StLinkDevice, *,
+                       device_logger: Union[logging.Logger, logging.LoggerAdapter],
+                       device_output: DeviceOutput, process_runner: ProcessRunner):
+    if upload_settings.backend == 'openocd':
+        _upload_app_with_openocd(
+            project_dir=upload_settings.project_dir,
+            image_file=upload_settings.image_file,
+            stlink_device=stlink_device,
+            verbose=upload_settings.verbose,
+            openocd_path=upload_settings.openocd_path,
+            openocd_config=upload_settings.openocd_config,
+            openocd_info=upload_settings.openocd_info,
+            adapter_speed=upload_settings.adapter_speed,
+            verify=upload_settings.verify,
+            device_logger=device_logger,
+            device_output=device_output,
+            process_runner=process_runner
+        )
+    elif upload_settings.backend == 'pyocd':
+        _upload_app_with_pyocd(
+            project_dir=upload_settings.project_dir,
+            image_file=upload_settings.image_file,
+            stlink_device=stlink_device,
+            verbose=upload_settings.verbose,
+            pyocd_path=upload_settings.pyocd_path,
+            pyocd_target=upload_settings.pyocd_target,
+            pyocd_config=upload_settings.pyocd_config,
+            pyocd_script=upload_settings.pyocd_script,
+            adapter_speed=upload_settings.adapter_speed,
+            device_logger=device_logger,
+            device_output=device_output,
+            process_runner=process_runner
+        )
+    elif upload_settings.backend == PYOCD_API_BACKEND:
+        _upload_app_with_pyocd_api(
+            image_file=upload_settings.image_file,
+            image_segments=upload_settings.image_segments,
+            stlink_device=stlink_device,
+            session_options=upload_settings.get_pyocd_session_options(stlink_device.serial_number),
+            session_pool=upload_settings.pyocd_sessions,
+            verify=upload_settings.verify,
+            device_logger=device_logger,
+            device_output=device_output
+        )
+    else:
+        raise ValueError(f"Unknown backend: {upload_settings.backend}")
+
+
+@contextlib.contextmanager
+def _add_ram_load_failure_hint():
+    try:
+        yield
+    except OpenOcdTclError as e:
+        raise OpenOcdTclError(f"{e}\n{_RAM_LOAD_FAILURE_HINT}") from e
+
+
+def _load_app_to_ram(upload_settings: _UploadSettings, stlink_device: StLinkDevice, *,
+                     timer: PhaseTimer, device_logger: Union[logging.Logger, logging.LoggerAdapter],
+                     device_output: DeviceOutput, process_runner: ProcessRunner):
+    ram_entry = upload_settings.ram_entry
+    if upload_settings.backend == 'openocd' and upload_settings.openocd_server:
+        with timer.phase('backend startup'):
+            server_info = _ensure_openocd_server(
+                project_dir=upload_settings.project_dir,
+                stlink_device=stlink_device,
+                verbose=upload_settings.verbose,
+                openocd_path=upload_settings.openocd_path,
+                openocd_config=upload_settings.openocd_config,
+                openocd_info=upload_settings.openocd_info,
+                device_logger=device_logger
+            )
+        device_logger.info(f"Use OpenOCD server (pid {server_info.pid}, tcl port {server_info.tcl_port})")
+        setup_commands = _get_openocd_server_setup_commands(upload_settings.openocd_info,
+                                                            upload_settings.adapter_speed)
+        with timer.phase('flash (ram)'), _add_ram_load_failure_hint():
+            _run_openocd_server_command(
+                lambda: load_ram_image_with_openocd_server(server_info, upload_settings.check_image_file,
+                                                           vector_table=ram_entry.vector_table,
+                                                           stack_pointer=ram_entry.stack_pointer,
+                                                           entry_point=ram_entry.entry_point,
+                                                           timeout=process_runner.timeout,
+                                                           setup_commands=setup_commands),
+                hla_serial=stlink_device.serial_number, device_logger=device_logger, device_output=device_output
+            )
+    elif upload_settings.backend == 'openocd':
+        with timer.phase('flash (ram)'):
+            _load_app_to_ram_with_openocd(
+                project_dir=upload_settings.project_dir,
+                image_file=upload_settings.check_image_file,
+                ram_entry=ram_entry,
+                stlink_device=stlink_device,
+                verbose=upload_settings.verbose,
+                openocd_path=upload_settings.openocd_path,
+                openocd_config=upload_settings.openocd_config,
+                openocd_info=upload_settings.openocd_info,
+                adapter_speed=upload_settings.adapter_speed,
+                device_logger=device_logger,
+                device_output=device_output,
+                process_runner=process_runner
+            )
+    elif upload_settings.backend == 'pyocd':
+        with timer.phase('flash (ram)'):
+            _load_app_to_ram_with_pyocd(
+                project_dir=upload_settings.project_dir,
+                image_segments=upload_settings.image_segments,
+                ram_entry=ram_entry,
+                stlink_device=stlink_device,
+                verbose=upload_settings.verbose,
+                pyocd_path=upload_settings.pyocd_path,
+                pyocd_target=upload_settings.pyocd_target,
+                pyocd_config=upload_settings.pyocd_config,
+                pyocd_script=upload_settings.pyocd_script,
+                adapter_speed=upload_settings.adapter_speed,
+                device_logger=device_logger,
+                device_output=device_output,
+                process_runner=process_runner
+            )
+    elif upload_settings.backend == PYOCD_API_BACKEND:
+        session_options = upload_settings.get_pyocd_session_options(stlink_device.serial_number)
+        with timer.phase('backend startup'):
+            upload_settings.pyocd_sessions.get_session(session_options)
+        with timer.phase('flash (ram)'):
+            device_logger.info(f"Load image to RAM with pyocd API (target {session_options.target})")
+            load_ram_image_with_pyocd_session(upload_settings.pyocd_sessions, session_options,
+                                              upload_settings.image_segments,
+                                              vector_table=ram_entry.vector_table,
+                                              stack_pointer=ram_entry.stack_pointer,
+                                              entry_point=ram_entry.entry_point, device_output=device_output)
+    else:
+        raise ValueError(f"Unknown backend: {upload_settings.backend}")
+
+
+def _flash_regions_to_device(upload_settings: _UploadSettings, stlink_device: StLinkDevice,
+                             regions: List[FlashRegion], *,
+                             device_logger: Union[logging.Logger, logging.LoggerAdapter],
+                             device_output: DeviceOutput, process_runner: ProcessRunner):
+    with tempfile.TemporaryDirectory(prefix='vznncv_stlink_') as tmp_dir:
+        region_files = []
+        for i, region in enumerate(regions):
+            region_file = os.path.join(tmp_dir, f'region_{i}_0x{region.address:08X}.bin')
+            with open(region_file, 'wb') as f:
+                f.write(region.data)
+            region_files.append((region_file, region.address))
+
+        if upload_settings.backend == 'openocd' and upload_settings.openocd_server:
+            _upload_regions_with_openocd_server(
+                elf_file=upload_settings.check_image_file,
+                region_files=region_files,
+                stlink_device=stlink_device,
+                openocd_info=upload_settings.openocd_info,
+                adapter_speed=upload_settings.adapter_speed,
+                verify=upload_settings.verify,
+                device_logger=device_logger,
+                device_output=device_output,
+                timeout=process_runner.timeout
+            )
+        elif upload_settings.backend == 'openocd':
+            _upload_regions_with_openocd(
+                project_dir=upload_settings.project_dir,
+                elf_file=upload_settings.check_image_file,
+                region_files=region_files,
+                stlink_device=stlink_device,
+                verbose=upload_settings.verbose,
+                openocd_path=upload_settings.openocd_path,
+                openocd_config=upload_settings.openocd_config,
+                openocd_info=upload_settings.openocd_info,
+                adapter_speed=upload_settings.adapter_speed,
+                verify=upload_settings.verify,
+                device_logger=device_logger,
+                device_output=device_output,
+                process_runner=process_runner
+            )
+        elif upload_settings.backend == 'pyocd':
+            _upload_regions_with_pyocd(
+                project_dir=upload_settings.project_dir,
+                region_files=region_files,
+                stlink_device=stlink_device,
+                verbose=upload_settings.verbose,
+                pyocd_path=upload_settings.pyocd_path,
+                pyocd_target=upload_settings.pyocd_target,
+                pyocd_config=upload_settings.pyocd_config,
+                pyocd_script=upload_settings.pyocd_script,
+                adapter_speed=upload_settings.adapter_speed,
+                device_logger=device_logger,
+                device_output=device_output,
+                process_runner=process_runner
+            )
+        elif upload_settings.backend == PYOCD_API_BACKEND:
+            _upload_regions_with_pyocd_api(
+                region_files=region_files,
+                regions_size=sum(len(region.data) for region in regions),
+                image_segments=upload_settings.image_segments,
+                stlink_device=stlink_device,
+                session_options=upload_settings.get_pyocd_session_options(stlink_device.serial_number),
+                session_pool=upload_settings.pyocd_sessions,
+                verify=upload_settings.verify,
+                device_logger=device_logger,
+                device_output=device_output
+            )
+        else:
+            raise ValueError(f"Unknown backend: {upload_settings.backend}")
+
+
+def _can_check_app_on_device(upload_settings: _UploadSettings) -> bool:
+    return upload_settings.backend != 'pyocd' or is_pyocd_api_available()
+
+
+def _is_delta_upload_verified(upload_settings: _UploadSettings) -> bool:
+    """
+    Check if backend verifies the whole image after delta upload.
+    """
+    if upload_settings.verify == VERIFY_NONE:
+        return False
+    if upload_settings.backend == 'openocd':
+        return True
+    return upload_settings.backend == PYOCD_API_BACKEND and upload_settings.verify is not None
+
+
+def _check_app_on_device(upload_settings: _UploadSettings, stlink_device: StLinkDevice, *,
+                         device_logger: Union[logging.Logger, logging.LoggerAdapter],
+                         device_output: DeviceOutput, process_runner: ProcessRunner) -> bool:
+    """
+    Check that device memory holds application image using target-side checksum calculation.
+
+    :return: ``False`` if the memory doesn't match the image or it cannot be checked
+    """
+    if upload_settings.backend == 'openocd' and upload_settings.openocd_server:
+        return _check_app_with_openocd_server(
+            elf_file=upload_settings.check_image_file,
+            stlink_device=stlink_device,
+            openocd_info=upload_settings.openocd_info,
+            adapter_speed=upload_settings.adapter_speed,
+            device_logger=device_logger,
+            timeout=process_runner.timeout
+        )
+    elif upload_settings.backend == 'openocd':
+        return _check_app_with_openocd(
+            project_dir=upload_settings.project_dir,
+            elf_file=upload_settings.check_image_file,
+            stlink_device=stlink_device,
+            verbose=upload_settings.verbose,
+            openocd_path=upload_settings.openocd_path,
+            openocd_config=upload_settings.openocd_config,
+            openocd_info=upload_settings.openocd_info,
+            adapter_speed=upload_settings.adapter_speed,
+            device_logger=device_logger,
+            device_output=device_output,
+            process_runner=process_runner
+        )
+    elif upload_settings.backend == 'pyocd':
+        return _check_app_with_pyocd(
+            image_segments=upload_settings.image_segments,
+            session_options=upload_settings.get_pyocd_session_options(stlink_device.serial_number),
+            device_logger=device_logger
+        )
+    elif upload_settings.backend == PYOCD_API_BACKEND:
+        return check_memory_with_pyocd_session(
+            upload_settings.pyocd_sessions,
+            upload_settings.get_pyocd_session_options(stlink_device.serial_number),
+            upload_settings.image_segments
+        )
+    else:
+        raise ValueError(f"Unknown backend: {upload_settings.backend}")
 
 
 def _shlex_join(args):
     return ' '.join(shlex.quote(arg) for arg in args)
 
 
-def _grouper(iterable, n, fillvalue=None):
-    args = [iter(iterable)] * n
-    return itertools.zip_longest(*args, fillvalue=fillvalue)
+def _run_backend_command(command_args: List[str], *, cwd: str, backend: str, hla_serial: str,
+                         device_output: Optional[DeviceOutput],
+                         process_runner: Optional[ProcessRunner]) -> _BackendRunResult:
+    """
+    Run backend command and process its output line by line.
 
+    Output lines are passed to ``device_output``, that shows them and converts them into progress events.
+    The backend phases, that are detected by these events, are used to apply ``process_runner`` timeouts.
+    """
+    if device_output is None:
+        device_output = DeviceOutput(OutputSettings(), hla_serial=hla_serial)
+    if process_runner is None:
+        process_runner = ProcessRunner()
+    output_stream = device_output.open_stream(backend)
+    success = False
+    try:
+        returncode = process_runner.run_process(command_args, cwd=cwd, line_handler=output_stream.feed_line,
+                                                phase_getter=lambda: output_stream.phase)
+        success = returncode == 0
+    finally:
+        output_stream.finish(success=success)
+    error_messages = tuple(event.message for event in output_stream.events if event.kind == 'error')
+    return _BackendRunResult(returncode=returncode, phase=output_stream.phase, error_messages=error_messages)
 
-def _upload_app_with_openocd(*, project_dir: str, elf_file: str, stlink_device: StLinkDevice, verbose: bool,
-                             openocd_path: str,
-                             openocd_config: Optional[str]):
-    # resolve openocd configuration
-    openocd_config = resolve_openocd_config_file(project_dir=project_dir, config_path=openocd_config)
-    logger.info(f"OpenOCD configuration file: {openocd_config}")
 
-    # prepare OpenOCD command
+def _build_openocd_base_args(*, openocd_path: str, openocd_config: str, stlink_device: StLinkDevice,
+                             verbose: bool, openocd_info: Optional[BackendInfo],
+                             adapter_speed: Optional[int]) -> List[str]:
+    """
+    Build OpenOCD arguments, that select configuration file, probe and adapter speed.
+    """
     command_args = [openocd_path]
     if verbose:
         command_args.extend(['--debug', '3'])
     command_args.extend(['--file', openocd_config])
-    if len(stlink_device.serial_number) != 24:
-        raise ValueError(f"Invalid serial number length: {stlink_device.serial_number}")
-    openocd_hla_serial_codes = []
-    for g in _grouper(stlink_device.serial_number, 2):
-        serial_code = int(f'{g[0]}{g[1]}', 16)
-        # openocd hla bug workaround: replace all non-ascii symbols by ? (0x3F)
-        if serial_code > 0x7F:
-            serial_code = 0x3F
-        openocd_hla_serial_codes.append(serial_code)
-
-    openocd_hla_serial = ''.join(f'\\x{serial_code:02X}' for serial_code in openocd_hla_serial_codes)
-    command_args.extend(['--command', f'hla_serial "{openocd_hla_serial}"'])
-    command_args.extend(['--command', f'program "{elf_file}" verify reset exit'])
-
-    logger.info(f"Run command: {_shlex_join(command_args)}")
-    logger.info("============================= start of openocd logs ============================")
-    result = subprocess.run(command_args, stdout=sys.stderr, cwd=project_dir)
-    logger.info("============================== end of openocd logs =============================")
-    logger.info(f"OpenOCD return code: {result.returncode}")
-    if result.returncode != 0:
-        raise ValueError(f"OpenOCD has failed with code {result.returncode}")
-
-
-def _upload_app_with_pyocd(*, project_dir: str, elf_file: str, stlink_device: StLinkDevice, verbose: bool,
-                           pyocd_path: str,
-                           pyocd_target: Optional[str], pyocd_config: Optional[str], pyocd_script: Optional[str]):
+    command_args.extend(['--command', format_openocd_serial_command(stlink_device.serial_number, openocd_info)])
+    if adapter_speed is not None:
+        command_args.extend(['--command', format_openocd_speed_command(adapter_speed, openocd_info)])
+    return command_args
+
+
+def _build_pyocd_base_args(subcommand: str, *, pyocd_path: str, pyocd_target: Optional[str],
+                           pyocd_config: Optional[str], pyocd_script: Optional[str], stlink_device: StLinkDevice,
+                           verbose: bool, adapter_speed: Optional[int]) -> List[str]:
+    """
+    Build PyOCD subcommand arguments, that select target, probe and adapter speed.
+    """
     # resolve pyocd target
     if pyocd_target is None:
         raise ValueError("PyOCD target isn't specified. Please specify '--pyocd-target' option to use pyocd backend")
 
-    # prepare PyOCD command
-    command_args = [pyocd_path, 'flash']
+    command_args = [pyocd_path, subcommand]
     if verbose:
         command_args.append('--verbose')
-    command_args.append('--trust-crc')
     command_args.extend(['--target', pyocd_target])
     command_args.extend(['--uid', stlink_device.serial_number])
     if pyocd_config is not None:
         command_args.extend(['--config', pyocd_config])
     if pyocd_script is not None:
         command_args.extend(['--script', pyocd_script])
-    command_args.extend(['--format', 'elf'])
-    command_args.append(elf_file)
-
-    logger.info(f"Run command: {_shlex_join(command_args)}")
-    logger.info("============================== start of pyocd logs =============================")
-    result = subprocess.run(command_args, stdout=sys.stderr, cwd=project_dir)
-    logger.info("=============================== end of pyocd logs ==============================")
-    logger.info(f"PyOCD return code: {result.returncode}")
-    if result.returncode != 0:
-        raise ValueError(f"PyOCD has failed with code {result.returncode}")
+    if adapter_speed is not None:
+        command_args.extend(['--frequency', str(adapter_speed * 1000)])
+    return command_args
+
+
+def _run_logged_backend(command_args: List[str], *, project_dir: str, backend: str, stlink_device: StLinkDevice,
+                        device_logger: Union[logging.Logger, logging.LoggerAdapter],
+                        device_output: Optional[DeviceOutput], process_runner: Optional[ProcessRunner],
+                        check: bool = True, failure_hint: Optional[str] = None) -> int:
+    """
+    Run backend command and log its output.
+
+    :param check: raise ``BackendCommandError`` if the backend fails
+    :param failure_hint: hint that is added to the error message
+    :return: backend return code
+    """
+    backend_name = _BACKEND_NAMES[backend]
+    start_banner, end_banner = _BACKEND_LOG_BANNERS[backend]
+    device_logger.info(f"Run command: {_shlex_join(command_args)}")
+    device_logger.info(start_banner)
+    run_result = _run_backend_command(command_args, cwd=project_dir, backend=backend,
+                                      hla_serial=stlink_device.serial_number, device_output=device_output,
+                                      process_runner=process_runner)
+    device_logger.info(end_banner)
+    device_logger.info(f"{backend_name} return code: {run_result.returncode}")
+    if check and run_result.returncode != 0:
+        message = f"{backend_name} has failed with code {run_result.returncode}"
+        if failure_hint is not None:
+            message = f"{message}. {failure_hint}"
+        raise BackendCommandError(message, phase=run_result.phase, error_messages=run_result.error_messages)
+    return run_result.returncode
+
+
+def _upload_app_with_openocd(*, project_dir: str, image_file: ImageFile, stlink_device: StLinkDevice, verbose: bool,
+                             openocd_path: str, openocd_config: str, openocd_info: Optional[BackendInfo] = None,
+                             adapter_speed: Optional[int] = None, verify: Optional[str] = None,
+                             device_logger: Union[logging.Logger, logging.LoggerAdapter] = logger,
+                             device_output: Optional[DeviceOutput] = None,
+                             process_runner: Optional[ProcessRunner] = None):
+    command_args = _build_openocd_base_args(openocd_path=openocd_path, openocd_config=openocd_config,
+                                            stlink_device=stlink_device, verbose=verbose, openocd_info=openocd_info,
+                                            adapter_speed=adapter_speed)
+    for command in build_program_commands(image_file.path, base_address=image_file.base_address, verify=verify,
+                                          exit=True):
+        command_args.extend(['--command', command])
+    _run_logged_backend(command_args, project_dir=project_dir, backend='openocd', stlink_device=stlink_device,
+                        device_logger=device_logger, device_output=device_output, process_runner=process_runner)
+
+
+def _check_app_with_openocd(*, project_dir: str, elf_file: str, stlink_device: StLinkDevice, verbose: bool,
+                            openocd_path: str, openocd_config: str, openocd_info: Optional[BackendInfo] = None,
+                            adapter_speed: Optional[int] = None,
+                            device_logger: Union[logging.Logger, logging.LoggerAdapter] = logger,
+                            device_output: Optional[DeviceOutput] = None,
+                            process_runner: Optional[ProcessRunner] = None) -> bool:
+    command_args = _build_openocd_base_args(openocd_path=openocd_path, openocd_config=openocd_config,
+                                            stlink_device=stlink_device, verbose=verbose, openocd_info=openocd_info,
+                                            adapter_speed=adapter_speed)
+    for command in ['init', 'reset halt', f'verify_image_checksum "{elf_file}"', 'reset run', 'shutdown']:
+        command_args.extend(['--command', command])
+    returncode = _run_logged_backend(command_args, project_dir=project_dir, backend='openocd',
+                                     stlink_device=stlink_device, device_logger=device_logger,
+                                     device_output=device_output, process_runner=process_runner, check=False)
+    return returncode == 0
+
+
+def _load_app_to_ram_with_openocd(*, project_dir: str, image_file: str, ram_entry: RamImageEntry,
+                                  stlink_device: StLinkDevice, verbose: bool, openocd_path: str, openocd_config: str,
+                                  openocd_info: Optional[BackendInfo] = None, adapter_speed: Optional[int] = None,
+                                  device_logger: Union[logging.Logger, logging.LoggerAdapter] = logger,
+                                  device_output: Optional[DeviceOutput] = None,
+                                  process_runner: Optional[ProcessRunner] = None):
+    command_args = _build_openocd_base_args(openocd_path=openocd_path, openocd_config=openocd_config,
+                                            stlink_device=stlink_device, verbose=verbose, openocd_info=openocd_info,
+                                            adapter_speed=adapter_speed)
+    command_args.extend(['--command', 'init'])
+    for command in build_ram_load_commands(image_file, vector_table=ram_entry.vector_table,
+                                           stack_pointer=ram_entry.stack_pointer, entry_point=ram_entry.entry_point):
+        command_args.extend(['--command', command])
+    command_args.extend(['--command', 'shutdown'])
+    _run_logged_backend(command_args, project_dir=project_dir, backend='openocd', stlink_device=stlink_device,
+                        device_logger=device_logger, device_output=device_output, process_runner=process_runner,
+                        failure_hint=_RAM_LOAD_FAILURE_HINT)
+
+
+def _get_openocd_server_setup_commands(openocd_info: Optional[BackendInfo], adapter_speed: Optional[int]) -> List[str]:
+    if adapter_speed is None:
+        return []
+    return [format_openocd_speed_command(adapter_speed, openocd_info)]
+
+
+def _check_app_with_openocd_server(*, elf_file: str, stlink_device: StLinkDevice,
+                                   openocd_info: Optional[BackendInfo] = None, adapter_speed: Optional[int] = None,
+                                   device_logger: Union[logging.Logger, logging.LoggerAdapter] = logger,
+                                   timeout: Optional[float] = None) -> bool:
+    server_info = get_openocd_server(stlink_device.serial_number)
+    if server_info is None:
+        return False
+    try:
+        check_openocd_image(server_info, elf_file, timeout=timeout,
+                            setup_commands=_get_openocd_server_setup_commands(openocd_info, adapter_speed))
+    except OpenOcdTclError as e:
+        device_logger.info(str(e))
+        return False
+    return True
+
+
+def _ensure_openocd_server(*, project_dir: str, stlink_device: StLinkDevice, verbose: bool,
+                           openocd_path: str, openocd_config: str, openocd_info: Optional[BackendInfo] = None,
+                           device_logger: Union[logging.Logger, logging.LoggerAdapter] = logger) -> OpenOcdServerInfo:
+    """
+    Get running OpenOCD server of the device or start it.
+    """
+    server_info = get_openocd_server(stlink_device.serial_number)
+    if server_info is None:
+        device_logger.info("OpenOCD server isn't running. Start it")
+        server_info = start_openocd_server(
+            openocd_path=openocd_path,
+            openocd_config=openocd_config,
+            hla_serial=stlink_device.serial_number,
+            project_dir=project_dir,
+            verbose=verbose,
+            openocd_info=openocd_info
+        )
+    elif server_info.openocd_config != openocd_config:
+        device_logger.warning(f"Running OpenOCD server uses different configuration file: "
+                              f"{server_info.openocd_config}")
+    return server_info
+
+
+def _upload_app_with_openocd_server(*, project_dir: str, image_file: ImageFile, stlink_device: StLinkDevice,
+                                    verbose: bool, openocd_path: str, openocd_config: str,
+                                    openocd_info: Optional[BackendInfo] = None, adapter_speed: Optional[int] = None,
+                                    verify: Optional[str] = None,
+                                    device_logger: Union[logging.Logger, logging.LoggerAdapter] = logger,
+                                    device_output: Optional[DeviceOutput] = None,
+                                    timeout: Optional[float] = None):
+    server_info = _ensure_openocd_server(project_dir=project_dir, stlink_device=stlink_device, verbose=verbose,
+                                         openocd_path=openocd_path, openocd_config=openocd_config,
+                                         openocd_info=openocd_info, device_logger=device_logger)
+    device_logger.info(f"Use OpenOCD server (pid {server_info.pid}, tcl port {server_info.tcl_port})")
+
+    setup_commands = _get_openocd_server_setup_commands(openocd_info, adapter_speed)
+    _run_openocd_server_command(lambda: program_with_openocd_server(server_info, image_file.path,
+                                                                    base_address=image_file.base_address,
+                                                                    verify=verify, timeout=timeout,
+                                                                    setup_commands=setup_commands),
+                                hla_serial=stlink_device.serial_number, device_logger=device_logger,
+                                device_output=device_output)
+
+
+def _run_openocd_server_command(command: Callable[[], str], *, hla_serial: str,
+                                device_logger: Union[logging.Logger, logging.LoggerAdapter],
+                                device_output: Optional[DeviceOutput]):
+    """
+    Run command with OpenOCD server and process its logs like output of the OpenOCD process.
+    """
+    if device_output is None:
+        device_output = DeviceOutput(OutputSettings(), hla_serial=hla_serial)
+    output_stream = device_output.open_stream('openocd')
+    start_banner, end_banner = _BACKEND_LOG_BANNERS['openocd']
+    device_logger.info(start_banner)
+    try:
+        output = command()
+    except Exception:
+        output_stream.finish(success=False)
+        raise
+    finally:
+        device_logger.info(end_banner)
+    output_stream.feed_text(output)
+    output_stream.finish(success=True)
+
+
+def _upload_regions_with_openocd(*, project_dir: str, elf_file: str, region_files: List[Tuple[str, int]],
+                                 stlink_device: StLinkDevice, verbose: bool, openocd_path: str, openocd_config: str,
+                                 openocd_info: Optional[BackendInfo] = None, adapter_speed: Optional[int] = None,
+                                 verify: Optional[str] = None,
+                                 device_logger: Union[logging.Logger, logging.LoggerAdapter] = logger,
+                                 device_output: Optional[DeviceOutput] = None,
+                                 process_runner: Optional[ProcessRunner] = None):
+    command_args = _build_openocd_base_args(openocd_path=openocd_path, openocd_config=openocd_config,
+                                            stlink_device=stlink_device, verbose=verbose, openocd_info=openocd_info,
+                                            adapter_speed=adapter_speed)
+    command_args.extend(['--command', 'init'])
+    for command in build_region_program_commands(region_files, elf_file, verify=verify):
+        command_args.extend(['--command', command])
+    command_args.extend(['--command', 'shutdown'])
+    _run_logged_backend(command_args, project_dir=project_dir, backend='openocd', stlink_device=stlink_device,
+                        device_logger=device_logger, device_output=device_output, process_runner=process_runner)
+
+
+def _upload_regions_with_openocd_server(*, elf_file: str, region_files: List[Tuple[str, int]],
+                                        stlink_device: StLinkDevice, openocd_info: Optional[BackendInfo] = None,
+                                        adapter_speed: Optional[int] = None, verify: Optional[str] = None,
+                                        device_logger: Union[logging.Logger, logging.LoggerAdapter] = logger,
+                                        device_output: Optional[DeviceOutput] = None,
+                                        timeout: Optional[float] = None):
+    server_info = get_openocd_server(stlink_device.serial_number)
+    if server_info is None:
+        raise ValueError("OpenOCD server isn't running")
+    device_logger.info(f"Use OpenOCD server (pid {server_info.pid}, tcl port {server_info.tcl_port})")
+
+    setup_commands = _get_openocd_server_setup_commands(openocd_info, adapter_speed)
+    _run_openocd_server_command(lambda: program_regions_with_openocd_server(server_info, region_files, elf_file,
+                                                                            verify=verify, timeout=timeout,
+                                                                            setup_commands=setup_commands),
+                                hla_serial=stlink_device.serial_number, device_logger=device_logger,
+                                device_output=device_output)
+
+
+def _upload_app_with_pyocd(*, project_dir: str, image_file: ImageFile, stlink_device: StLinkDevice, verbose: bool,
+                           pyocd_path: str,
+                           pyocd_target: Optional[str], pyocd_config: Optional[str], pyocd_script: Optional[str],
+                           adapter_speed: Optional[int] = None,
+                           device_logger: Union[logging.Logger, logging.LoggerAdapter] = logger,
+                           device_output: Optional[DeviceOutput] = None,
+                           process_runner: Optional[ProcessRunner] = None):
+    command_args = _build_pyocd_base_args('flash', pyocd_path=pyocd_path, pyocd_target=pyocd_target,
+                                          pyocd_config=pyocd_config, pyocd_script=pyocd_script,
+                                          stlink_device=stlink_device, verbose=verbose, adapter_speed=adapter_speed)
+    command_args.append('--trust-crc')
+    command_args.extend(['--format', image_file.format])
+    if image_file.base_address is not None:
+        command_args.extend(['--base-address', f'0x{image_file.base_address:08X}'])
+    command_args.append(image_file.path)
+    _run_logged_backend(command_args, project_dir=project_dir, backend='pyocd', stlink_device=stlink_device,
+                        device_logger=device_logger, device_output=device_output, process_runner=process_runner)
+
+
+def _upload_regions_with_pyocd(*, project_dir: str, region_files: List[Tuple[str, int]], stlink_device: StLinkDevice,
+                               verbose: bool, pyocd_path: str,
+                               pyocd_target: Optional[str], pyocd_config: Optional[str], pyocd_script: Optional[str],
+                               adapter_speed: Optional[int] = None,
+                               device_logger: Union[logging.Logger, logging.LoggerAdapter] = logger,
+                               device_output: Optional[DeviceOutput] = None,
+                               process_runner: Optional[ProcessRunner] = None):
+    command_args = _build_pyocd_base_args('flash', pyocd_path=pyocd_path, pyocd_target=pyocd_target,
+                                          pyocd_config=pyocd_config, pyocd_script=pyocd_script,
+                                          stlink_device=stlink_device, verbose=verbose, adapter_speed=adapter_speed)
+    if not region_files:
+        device_logger.info("No changed flash regions. Skip PyOCD invocation")
+        return
+    command_args.extend(['--erase', 'sector'])
+    command_args.extend(['--format', 'bin'])
+    command_args.extend(f'{region_file}@0x{address:08X}' for region_file, address in region_files)
+    _run_logged_backend(command_args, project_dir=project_dir, backend='pyocd', stlink_device=stlink_device,
+                        device_logger=device_logger, device_output=device_output, process_runner=process_runner)
+
+
+def _check_app_with_pyocd(*, image_segments: List[ElfLoadSegment], session_options: PyOcdSessionOptions,
+                          device_logger: Union[logging.Logger, logging.LoggerAdapter] = logger) -> bool:
+    # pyocd command has no checksum command, so checksums are calculated with pyocd API if it's available
+    if not is_pyocd_api_available():
+        device_logger.info("Target memory cannot be checked without pyocd python package")
+        return False
+    try:
+        with PyOcdSessionPool() as session_pool:
+            return check_memory_with_pyocd_session(session_pool, session_options, image_segments)
+    except Exception as e:
+        device_logger.info(f"Target memory check has failed: {e}")
+        return False
+
+
+def _load_app_to_ram_with_pyocd(*, project_dir: str, image_segments: List[ElfLoadSegment], ram_entry: RamImageEntry,
+                                stlink_device: StLinkDevice, verbose: bool, pyocd_path: str,
+                                pyocd_target: Optional[str], pyocd_config: Optional[str], pyocd_script: Optional[str],
+                                adapter_speed: Optional[int] = None,
+                                device_logger: Union[logging.Logger, logging.LoggerAdapter] = logger,
+                                device_output: Optional[DeviceOutput] = None,
+                                process_runner: Optional[ProcessRunner] = None):
+    # "pyocd flash" programs flash only, so segments are written to memory directly with pyocd commander
+    command_args = _build_pyocd_base_args('commander', pyocd_path=pyocd_path, pyocd_target=pyocd_target,
+                                          pyocd_config=pyocd_config, pyocd_script=pyocd_script,
+                                          stlink_device=stlink_device, verbose=verbose, adapter_speed=adapter_speed)
+    with tempfile.TemporaryDirectory(prefix='vznncv_stlink_') as tmp_dir:
+        command_args.extend(['--command', 'reset halt'])
+        for i, segment in enumerate(image_segments):
+            segment_file = os.path.join(tmp_dir, f'segment_{i}_0x{segment.address:08X}.bin')
+            with open(segment_file, 'wb') as f:
+                f.write(segment.data)
+            command_args.extend(['--command', f'loadmem 0x{segment.address:08X} {shlex.quote(segment_file)}'])
+        command_args.extend(['--command', f'write32 0x{VTOR_ADDRESS:08X} 0x{ram_entry.vector_table:08X}'])
+        command_args.extend(['--command', f'wreg sp 0x{ram_entry.stack_pointer:08X}'])
+        command_args.extend(['--command', f'wreg pc 0x{ram_entry.entry_point:08X}'])
+        command_args.extend(['--command', 'go'])
+        _run_logged_backend(command_args, project_dir=project_dir, backend='pyocd', stlink_device=stlink_device,
+                            device_logger=device_logger, device_output=device_output, process_runner=process_runner,
+                            failure_hint=_RAM_LOAD_FAILURE_HINT)
+
+
+def _upload_app_with_pyocd_api(*, image_file: ImageFile, image_segments: List[ElfLoadSegment],
+                               stlink_device: StLinkDevice,
+                               session_options: PyOcdSessionOptions, session_pool: PyOcdSessionPool,
+                               verify: Optional[str] = None,
+                               device_logger: Union[logging.Logger, logging.LoggerAdapter] = logger,
+                               device_output: Optional[DeviceOutput] = None):
+    if device_output is None:
+        device_output = DeviceOutput(OutputSettings(), hla_serial=stlink_device.serial_number)
+    device_logger.info(f"Program {image_file.path} with pyocd API (target {session_options.target})")
+    image_size = sum(len(segment.data) for segment in image_segments)
+    program_with_pyocd_session(session_pool, session_options, [image_file], data_size=image_size,
+                               device_output=device_output)
+    if verify is not None and verify != VERIFY_NONE:
+        verify_with_pyocd_session(session_pool, session_options, image_segments, verify=verify,
+                                  device_output=device_output)
+    device_logger.info("PyOCD programming is completed")
+
+
+def _upload_regions_with_pyocd_api(*, region_files: List[Tuple[str, int]], regions_size: int,
+                                   image_segments: List[ElfLoadSegment], stlink_device: StLinkDevice,
+                                   session_options: PyOcdSessionOptions, session_pool: PyOcdSessionPool,
+                                   verify: Optional[str] = None,
+                                   device_logger: Union[logging.Logger, logging.LoggerAdapter] = logger,
+                                   device_output: Optional[DeviceOutput] = None):
+    if not region_files:
+        device_logger.info("No changed flash regions. Skip PyOCD programming")
+        return
+    if device_output is None:
+        device_output = DeviceOutput(OutputSettings(), hla_serial=stlink_device.serial_number)
+    device_logger.info(f"Program {len(region_files)} regions with pyocd API (target {session_options.target})")
+    image_files = [ImageFile(path=region_file, format='bin', base_address=address)
+                   for region_file, address in region_files]
+    program_with_pyocd_session(session_pool, session_options, image_files, data_size=regions_size,
+                               device_output=device_output, erase='sector')
+    if verify is not None and verify != VERIFY_NONE:
+        verify_with_pyocd_session(session_pool, session_options, image_segments, verify=verify,
+                                  device_output=device_output)
+    device_logger.info("PyOCD programming is completed")
@@ -0,0 +1,228 @@
+"""
+Helper module to track changes of the build output files.
+
+Linux inotify notifications of the file directories are used if they're available, otherwise the files
+are polled with ``os.stat``. A change is reported only after the files stay unchanged during debounce interval,
+so partial writes of the linker aren't reported.
+"""
+import ctypes
+import errno
+import logging
+import os
+import os.path
+import select
+import struct
+import sys
+import time
+from typing import Optional, Iterator, Dict, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+FileStamp = Optional[Tuple[int, int, int]]
+
+
+def get_file_stamp(path: str) -> FileStamp:
+    """
+    Get file modification time, size and inode number or ``None`` if the file doesn't exist.
+    """
+    try:
+        path_stat = os.stat(path)
+    except OSError:
+        return None
+    return path_stat.st_mtime_ns, path_stat.st_size, path_stat.st_ino
+
+
+class FileEventMonitor:
+    """
+    Base class of the file event monitors.
+    """
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Wait file changes.
+
+        :param timeout: maximal waiting time
+        :return: ``True`` if files may be changed
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class PollingFileEventMonitor(FileEventMonitor):
+    """
+    Fallback monitor that compares file stamps periodically.
+    """
+
+    def __init__(self, paths: Sequence[str], poll_interval: float):
+        self.poll_interval = poll_interval
+        self._stamps = {path: get_file_stamp(path) for path in paths}
+
+    def wait(self, timeout: float) -> bool:
+        delay = min(timeout, self.poll_interval)
+        if delay > 0:
+            time.sleep(delay)
+        stamps = {path: get_file_stamp(path) for path in self._stamps}
+        is_changed = stamps != self._stamps
+        self._stamps = stamps
+        return is_changed
+
+
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_IGNORED = 0x00008000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_INOTIFY_EVENT = struct.Struct('iIII')
+_INOTIFY_FILE_MASK = _IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE \
+                     | _IN_DELETE
+
+
+class InotifyFileEventMonitor(FileEventMonitor):
+    """
+    Linux monitor of the inotify events of the file directories.
+
+    Directories are watched instead of files, as build tools can replace files. If a directory is removed,
+    it's watched again after its creation.
+    """
+
+    # delay to retry watching of the removed directory
+    _RETRY_DELAY = 0.5
+
+    def __init__(self, paths: Sequence[str]):
+        self._libc = ctypes.CDLL(None, use_errno=True)
+        self._libc.inotify_init1.argtypes = [ctypes.c_int]
+        self._libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._fd = self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            error_code = ctypes.get_errno()
+            raise OSError(error_code, os.strerror(error_code))
+        # watched file names of the directories
+        self._dir_names: Dict[str, set] = {}
+        for path in paths:
+            path = os.path.abspath(path)
+            self._dir_names.setdefault(os.path.dirname(path), set()).add(os.path.basename(path))
+        self._wd_dirs: Dict[int, str] = {}
+        self._unwatched_dirs = set(self._dir_names)
+        self._watch_dirs()
+
+    def _watch_dirs(self):
+        for dir_path in list(self._unwatched_dirs):
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(dir_path), _INOTIFY_FILE_MASK)
+            if wd < 0:
+                logger.debug(f"Cannot watch directory \"{dir_path}\": {os.strerror(ctypes.get_errno())}")
+                continue
+            self._wd_dirs[wd] = dir_path
+            self._unwatched_dirs.discard(dir_path)
+
+    def _read_events(self) -> bool:
+        file_event_found = False
+        try:
+            data = os.read(self._fd, 65536)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return False
+            raise
+        offset = 0
+        while offset + _INOTIFY_EVENT.size <= len(data):
+            wd, mask, _, name_size = _INOTIFY_EVENT.unpack_from(data, offset)
+            offset += _INOTIFY_EVENT.size
+            name = os.fsdecode(data[offset:offset + name_size].rstrip(b'\0'))
+            offset += name_size
+            dir_path = self._wd_dirs.get(wd)
+            if dir_path is None:
+                continue
+            if mask & _IN_IGNORED:
+                # directory is removed
+                del self._wd_dirs[wd]
+                self._unwatched_dirs.add(dir_path)
+                file_event_found = True
+            elif name in self._dir_names[dir_path]:
+                file_event_found = True
+        return file_event_found
+
+    def wait(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while True:
+            if self._unwatched_dirs:
+                self._watch_dirs()
+            remaining_time = max(0.0, deadline - time.monotonic())
+            if self._unwatched_dirs:
+                remaining_time = min(remaining_time, self._RETRY_DELAY)
+            ready, _, _ = select.select([self._fd], [], [], remaining_time)
+            if ready and self._read_events():
+                return True
+            if time.monotonic() >= deadline:
+                # files can be created with directories, that aren't watched yet
+                return bool(self._unwatched_dirs)
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def create_file_event_monitor(paths: Sequence[str], poll_interval: float) -> FileEventMonitor:
+    """
+    Create the best available file event monitor.
+
+    Linux inotify notifications are used if they're available, otherwise the files are polled.
+    """
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyFileEventMonitor(paths)
+        except (OSError, AttributeError) as e:
+            logger.debug(f"Cannot use inotify notifications: {e}")
+    return PollingFileEventMonitor(paths, poll_interval)
+
+
+def watch_file_changes(paths: Sequence[str], *, stamps: Optional[Dict[str, FileStamp]] = None,
+                       debounce: float = 0.3, poll_interval: float = 0.5,
+                       monitor: Optional[FileEventMonitor] = None) -> Iterator[Dict[str, FileStamp]]:
+    """
+    Watch file changes.
+
+    A change is reported after the files stay unchanged during ``debounce`` interval. Changes that don't
+    modify file stamps (modification time, size and inode number) aren't reported.
+
+    :param paths: watched files. They may not exist.
+    :param stamps: known file stamps (see ``get_file_stamp``). By default they're taken when the iteration starts.
+    :param debounce: time during which the files must stay unchanged
+    :param poll_interval: polling interval if inotify notifications aren't available
+    :param monitor: custom file event monitor
+    :return: infinite iterator of the new file stamps
+    """
+    own_monitor = monitor is None
+    if own_monitor:
+        monitor = create_file_event_monitor(paths, poll_interval)
+    try:
+        if stamps is None:
+            stamps = {path: get_file_stamp(path) for path in paths}
+        while True:
+            if {path: get_file_stamp(path) for path in paths} == stamps:
+                # stamps are checked after timeout too to recover after missed events
+                monitor.wait(max(poll_interval, 5.0))
+                continue
+            # skip partial writes
+            while monitor.wait(debounce):
+                pass
+            new_stamps = {path: get_file_stamp(path) for path in paths}
+            if new_stamps == stamps:
+                continue
+            stamps = new_stamps
+            yield new_stamps
+    finally:
+        if own_monitor:
+            monitor.close()
@@ -1,3 +1,22 @@
+import pytest
+
+
 def pytest_configure():
     import logging
     logging.basicConfig(level=logging.INFO)
+
+
+@pytest.fixture(autouse=True)
+def isolated_cache_dir(tmp_path_factory, monkeypatch):
+    cache_dir = tmp_path_factory.mktemp('cache')
+    monkeypatch.setenv('VZNNCV_STLINK_CACHE_DIR', str(cache_dir))
+    yield cache_dir
+
+
+@pytest.fixture(autouse=True)
+def no_sysfs_usb_devices(tmp_path_factory, monkeypatch):
+    # use libusb device enumeration by default, so tests can mock it
+    import vznncv.stlink.tools.wrapper._stlink_utils as stlink_utils
+    sysfs_dir = tmp_path_factory.mktemp('sysfs') / 'not_exists'
+    monkeypatch.setattr(stlink_utils, '_SYSFS_USB_DEVICES_DIR', str(sysfs_dir))
+    yield
@@ -0,0 +1,34 @@
+import pytest
+
+from vznncv.stlink.tools.wrapper._adapter_speed import get_adapter_speed_ladder, get_lower_adapter_speed, \
+    get_cached_adapter_speed, store_adapter_speed
+from vznncv.stlink.tools.wrapper._stlink_utils import StLinkDevice, StLinkDeviceType
+
+
+@pytest.mark.parametrize('version, max_speed', [
+    ('V2', 4000),
+    ('V2-1', 4000),
+    ('V3E', 24000),
+    ('v3', 24000),
+])
+def test_adapter_speed_ladder(version, max_speed):
+    device_type = StLinkDeviceType(version=version, vendor_id=0x0483, product_id=0, out_pipe=0x01, in_pipe=0x81)
+    ladder = get_adapter_speed_ladder(StLinkDevice(type=device_type))
+    assert ladder[0] == max_speed
+    assert list(ladder) == sorted(ladder, reverse=True)
+
+
+def test_lower_adapter_speed():
+    ladder = (4000, 1800, 950)
+    assert get_lower_adapter_speed(ladder, 4000) == 1800
+    assert get_lower_adapter_speed(ladder, 2000) == 1800
+    assert get_lower_adapter_speed(ladder, 950) is None
+
+
+def test_cached_adapter_speed():
+    assert get_cached_adapter_speed('002F003D3438510B34313939', None) is None
+    store_adapter_speed('002F003D3438510B34313939', None, 8000)
+    store_adapter_speed('002F003D3438510B34313939', 'stm32f411ce', 3300)
+    assert get_cached_adapter_speed('002f003d3438510b34313939', None) == 8000
+    assert get_cached_adapter_speed('002F003D3438510B34313939', 'stm32f411ce') == 3300
+    assert get_cached_adapter_speed('0670FF535155878281123912', None) is None
@@ -0,0 +1,155 @@
+import os
+import shutil
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+from testing_utils import FIXTURE_DIR
+from vznncv.stlink.tools.wrapper import _artifact_cache
+from vznncv.stlink.tools.wrapper._artifact_cache import get_image_artifact, convert_segments_to_bin, \
+    convert_segments_to_ihex, evict_artifacts, get_combined_image_artifact, parse_image_source, ImageSource
+from vznncv.stlink.tools.wrapper._elf_utils import ElfLoadSegment, read_elf_load_segments
+
+_DEMO_ELF = os.path.join(FIXTURE_DIR, 'stm_project_stub', 'build', 'demo.elf')
+
+
+def _parse_ihex(text):
+    memory = {}
+    upper_address = 0
+    for line in text.splitlines():
+        assert line.startswith(':')
+        record = bytes.fromhex(line[1:])
+        assert sum(record) & 0xFF == 0
+        size, address, record_type, data = record[0], int.from_bytes(record[1:3], 'big'), record[3], record[4:-1]
+        assert len(data) == size
+        if record_type == 0x04:
+            upper_address = int.from_bytes(data, 'big') << 16
+        elif record_type == 0x00:
+            for i, value in enumerate(data):
+                memory[upper_address + address + i] = value
+        elif record_type == 0x01:
+            break
+    return memory
+
+
+def test_convert_segments():
+    segments = [
+        ElfLoadSegment(address=0x0800FFF8, data=bytes(range(16))),
+        ElfLoadSegment(address=0x08010010, data=b'\xAA\xBB'),
+    ]
+    base_address, bin_data = convert_segments_to_bin(segments)
+    assert base_address == 0x0800FFF8
+    assert bin_data == bytes(range(16)) + b'\xFF' * 8 + b'\xAA\xBB'
+
+    memory = _parse_ihex(convert_segments_to_ihex(segments))
+    assert bytes(memory[0x0800FFF8 + i] for i in range(16)) == bytes(range(16))
+    assert memory[0x08010010] == 0xAA and memory[0x08010011] == 0xBB
+    assert len(memory) == 18
+
+    with pytest.raises(ValueError, match='overlap'):
+        convert_segments_to_bin([ElfLoadSegment(0x100, b'\x00' * 4), ElfLoadSegment(0x102, b'\x00')])
+    with pytest.raises(ValueError, match='too big gap'):
+        convert_segments_to_bin([ElfLoadSegment(0x08000000, b'\x00'), ElfLoadSegment(0x20000000, b'\x00')])
+
+
+def test_artifact_reuse(tmp_path: Path):
+    elf_file = tmp_path / 'demo.elf'
+    shutil.copy(_DEMO_ELF, elf_file)
+    segments = read_elf_load_segments(str(elf_file))
+
+    artifact = get_image_artifact(str(elf_file), image_format='bin')
+    assert artifact.segments == segments
+    assert artifact.image_file.format == 'bin'
+    assert artifact.image_file.base_address == 0x08000000
+    assert Path(artifact.image_file.path).read_bytes() == convert_segments_to_bin(segments)[1]
+
+    # the second request doesn't parse elf file
+    with patch.object(_artifact_cache, 'read_elf_load_segments', side_effect=AssertionError('elf is parsed')):
+        cached_artifact = get_image_artifact(str(elf_file), image_format='hex')
+    assert cached_artifact.image_hash == artifact.image_hash
+    assert cached_artifact.segments == segments
+    assert cached_artifact.image_file.path.endswith('.hex')
+
+    # elf file change produces a new artifact
+    with open(elf_file, 'ab') as f:
+        f.write(b'\x00')
+    assert get_image_artifact(str(elf_file)).elf_sha256 != artifact.elf_sha256
+
+
+@pytest.mark.parametrize('value, expected_image_source', [
+    ('build/app.elf', ImageSource(path='build/app.elf')),
+    ('config.bin@0x080E0000', ImageSource(path='config.bin', base_address=0x080E0000)),
+    ('dir@v1/data.bin@4096', ImageSource(path='dir@v1/data.bin', base_address=4096)),
+])
+def test_parse_image_source(value, expected_image_source):
+    assert parse_image_source(value) == expected_image_source
+
+
+def test_parse_invalid_image_source():
+    with pytest.raises(ValueError, match='Invalid load address'):
+        parse_image_source('config.bin@end')
+
+
+def test_combined_image_artifact(tmp_path: Path):
+    config_file = tmp_path / 'config.bin'
+    config_file.write_bytes(b'\x01\x02\x03\x04')
+    image_sources = [ImageSource(path=_DEMO_ELF), ImageSource(path=str(config_file), base_address=0x080E0000)]
+
+    artifact = get_combined_image_artifact(image_sources)
+    elf_segments = read_elf_load_segments(_DEMO_ELF)
+    assert artifact.elf_file == _DEMO_ELF
+    assert artifact.segments == [*elf_segments, ElfLoadSegment(address=0x080E0000, data=b'\x01\x02\x03\x04')]
+    assert artifact.image_file.format == 'hex'
+    memory = _parse_ihex(Path(artifact.image_file.path).read_text())
+    assert memory[0x08000000] == elf_segments[0].data[0]
+    assert [memory[0x080E0000 + i] for i in range(4)] == [1, 2, 3, 4]
+
+    # the same images produce the same artifact
+    assert get_combined_image_artifact(image_sources).elf_sha256 == artifact.elf_sha256
+    # the image address is a part of the artifact key
+    moved_artifact = get_combined_image_artifact([image_sources[0], image_sources[1]._replace(base_address=0x080F0000)])
+    assert moved_artifact.elf_sha256 != artifact.elf_sha256
+    assert moved_artifact.image_hash != artifact.image_hash
+
+
+def test_combined_image_errors(tmp_path: Path):
+    config_file = tmp_path / 'config.bin'
+    config_file.write_bytes(b'\x00' * 256)
+
+    with pytest.raises(ValueError, match='overlap at 0x08000100'):
+        get_combined_image_artifact([ImageSource(path=_DEMO_ELF),
+                                     ImageSource(path=str(config_file), base_address=0x08000100)])
+    with pytest.raises(ValueError, match='overlap at 0x08000000'):
+        get_combined_image_artifact([ImageSource(path=_DEMO_ELF), ImageSource(path=_DEMO_ELF)])
+    with pytest.raises(ValueError, match='load address must be set'):
+        get_combined_image_artifact([ImageSource(path=_DEMO_ELF), ImageSource(path=str(config_file))])
+    with pytest.raises(ValueError, match='Load address cannot be set'):
+        get_combined_image_artifact([ImageSource(path=_DEMO_ELF, base_address=0x08000000)])
+
+
+def test_artifact_eviction(tmp_path: Path):
+    artifacts = []
+    for i in range(3):
+        elf_file = tmp_path / f'demo_{i}.elf'
+        shutil.copy(_DEMO_ELF, elf_file)
+        with open(elf_file, 'ab') as f:
+            f.write(bytes([i]))
+        artifacts.append(get_image_artifact(str(elf_file), image_format='bin'))
+        # make modification times distinguishable
+        os.utime(os.path.join(os.path.dirname(artifacts[-1].image_file.path), 'metadata.json'),
+                 (time.time() - 100 + i, time.time() - 100 + i))
+    artifact_sizes = [
+        sum(entry.stat().st_size for entry in os.scandir(os.path.dirname(artifact.image_file.path)))
+        for artifact in artifacts
+    ]
+
+    # use the first artifact, so the second one becomes the least recently used
+    get_image_artifact(artifacts[0].elf_file, image_format='bin')
+
+    removed_artifacts = evict_artifacts(sum(artifact_sizes) - 1, keep=(artifacts[1].elf_sha256,))
+    assert removed_artifacts == [artifacts[2].elf_sha256]
+    removed_artifacts = evict_artifacts(artifact_sizes[0])
+    assert removed_artifacts == [artifacts[1].elf_sha256]
+    assert os.path.isfile(artifacts[0].image_file.path)
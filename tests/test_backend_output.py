@@ -0,0 +1,150 @@
+import io
+import json
+
+from hamcrest import assert_that, contains_exactly, has_properties, string_contains_in_order
+
+from vznncv.stlink.tools.wrapper._backend_output import OpenOcdOutputParser, PyOcdOutputParser, DeviceOutput, \
+    OutputSettings
+
+_OPENOCD_PROGRAM_LOG = '''
+Open On-Chip Debugger 0.10.0
+Info : STLINK V2J29S7 (API v2) VID:PID 0483:3748
+target halted due to debug-request, current mode: Thread
+** Programming Started **
+auto erase enabled
+Info : device id = 0x10006431
+wrote 16384 bytes from file build/demo.elf in 0.615000s (26.016 KiB/s)
+** Programming Finished **
+** Verify Started **
+verified 7508 bytes in 0.125000s (58.656 KiB/s)
+** Verified OK **
+** Resetting Target **
+'''.strip()
+
+_PYOCD_PROGRAM_LOG = (
+    '0000817:INFO:board:Target type is stm32f411ce\n'
+    '[====                ] 20%\r[==========          ] 50%\r[====================] 100%\n'
+    '0002183:INFO:loader:Erased 16384 bytes (1 sector), programmed 16384 bytes (16 pages), '
+    'skipped 0 bytes (0 pages) at 11.79 kB/s\n'
+    '0002201 E Target reset failed [pyocd]\n'
+)
+
+
+def _parse(parser, log):
+    events = []
+    for line in log.split('\n'):
+        events.extend(parser.parse_line(line))
+    return events
+
+
+def test_openocd_output_parser():
+    events = _parse(OpenOcdOutputParser(), _OPENOCD_PROGRAM_LOG)
+    assert_that(events, contains_exactly(
+        has_properties(kind='program_started'),
+        has_properties(kind='programmed', bytes=16384, duration=0.615, rate=26.016 * 1024),
+        has_properties(kind='program_finished'),
+        has_properties(kind='verify_started'),
+        has_properties(kind='verified', bytes=7508, duration=0.125, rate=58.656 * 1024),
+        has_properties(kind='verify_finished'),
+    ))
+
+    error_events = _parse(OpenOcdOutputParser(), 'Error: init mode failed (unable to connect to the target)\n'
+                                                 '** Programming Failed **')
+    assert [event.kind for event in error_events] == ['error', 'error']
+
+
+def test_pyocd_output_parser():
+    events = _parse(PyOcdOutputParser(), _PYOCD_PROGRAM_LOG)
+    assert_that(events, contains_exactly(
+        has_properties(kind='progress', progress=0.2),
+        has_properties(kind='progress', progress=0.5),
+        has_properties(kind='progress', progress=1.0),
+        has_properties(kind='erased', bytes=16384),
+        has_properties(kind='programmed', bytes=16384, rate=11.79 * 1024),
+        has_properties(kind='error', message='0002201 E Target reset failed [pyocd]'),
+    ))
+
+
+def _feed_log(settings, log, *, success):
+    log_stream = io.StringIO()
+    event_stream = io.StringIO()
+    device_output = DeviceOutput(settings, hla_serial='002F003D3438510B34313939', prefix_lines=True,
+                                 log_stream=log_stream, event_stream=event_stream)
+    output_stream = device_output.open_stream('openocd')
+    output_stream.feed_text(log)
+    output_stream.finish(success=success)
+    return log_stream.getvalue(), event_stream.getvalue()
+
+
+def test_json_output():
+    log_output, event_output = _feed_log(OutputSettings(output_format='json'), _OPENOCD_PROGRAM_LOG, success=True)
+    assert_that(log_output, string_contains_in_order(
+        '[002F003D3438510B34313939] Open On-Chip Debugger',
+        '[002F003D3438510B34313939] ** Resetting Target **'
+    ))
+    events = [json.loads(line) for line in event_output.splitlines()]
+    assert [event['kind'] for event in events] == [
+        'program_started', 'programmed', 'program_finished', 'verify_started', 'verified', 'verify_finished'
+    ]
+    assert events[1]['hla_serial'] == '002F003D3438510B34313939'
+    assert events[1]['backend'] == 'openocd'
+    assert events[1]['bytes'] == 16384
+
+
+def test_quiet_output():
+    log_output, event_output = _feed_log(OutputSettings(quiet=True), _OPENOCD_PROGRAM_LOG, success=True)
+    assert event_output == ''
+    assert 'Open On-Chip Debugger' not in log_output
+    assert_that(log_output, string_contains_in_order(
+        '[002F003D3438510B34313939] openocd: programmed 16384 bytes in 0.615s (26.02 KiB/s)',
+        '[002F003D3438510B34313939] openocd: verified 7508 bytes in 0.125s (58.66 KiB/s)',
+    ))
+
+
+def test_quiet_output_failure():
+    long_log = '\n'.join(f'line {i}' for i in range(100)) + '\nError: target not halted'
+    log_output, _ = _feed_log(OutputSettings(quiet=True, log_buffer_size=10), long_log, success=False)
+    assert 'line 90' not in log_output
+    assert_that(log_output, string_contains_in_order(
+        'Error: target not halted',
+        'openocd logs (last 10 lines, 91 lines are skipped)',
+        'line 91', 'line 99', 'Error: target not halted',
+        'end of openocd logs'
+    ))
+
+
+class _TtyStringIO(io.StringIO):
+    def isatty(self):
+        return True
+
+
+def _feed_pyocd_log(log_stream, *, quiet, prefix_lines):
+    device_output = DeviceOutput(OutputSettings(quiet=quiet), hla_serial='002F003D3438510B34313939',
+                                 prefix_lines=prefix_lines, log_stream=log_stream, event_stream=io.StringIO())
+    output_stream = device_output.open_stream('pyocd')
+    output_stream.feed_text(_PYOCD_PROGRAM_LOG)
+    output_stream.finish(success=True)
+    return log_stream.getvalue()
+
+
+def test_quiet_output_progress():
+    log_output = _feed_pyocd_log(io.StringIO(), quiet=True, prefix_lines=True)
+    assert_that(log_output, string_contains_in_order(
+        '[002F003D3438510B34313939] pyocd: 20%\n',
+        '[002F003D3438510B34313939] pyocd: 50%\n',
+        '[002F003D3438510B34313939] pyocd: 100%\n',
+        '[002F003D3438510B34313939] pyocd: erased 16384 bytes',
+    ))
+
+
+def test_quiet_output_progress_tty():
+    log_output = _feed_pyocd_log(_TtyStringIO(), quiet=True, prefix_lines=False)
+    # progress line is updated in place
+    assert log_output.startswith('\rpyocd: 20%\rpyocd: 50%\rpyocd: 100%\npyocd: erased 16384 bytes')
+
+
+def test_output_progress_in_logs():
+    log_output = _feed_pyocd_log(_TtyStringIO(), quiet=False, prefix_lines=False)
+    # progress bar is shown by backend logs
+    assert 'pyocd: 50%' not in log_output
+    assert '100%' in log_output
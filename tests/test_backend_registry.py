@@ -0,0 +1,56 @@
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+from vznncv.stlink.tools.wrapper._backend_registry import parse_backend_version, get_backend_info, BackendInfo, \
+    OPENOCD_HEX_SERIAL, OPENOCD_ADAPTER_SERIAL, OPENOCD_ADAPTER_SPEED
+from vznncv.stlink.tools.wrapper._openocd_utils import format_openocd_serial_command
+
+
+@pytest.mark.parametrize('backend, output, expected_version', [
+    ('openocd', 'Open On-Chip Debugger 0.10.0\nLicensed under GNU GPL v2', (0, 10, 0)),
+    ('openocd', 'xPack OpenOCD x86_64 Open On-Chip Debugger 0.11.0+dev (2021-10-16-21:15)', (0, 11, 0)),
+    ('openocd', 'Open On-Chip Debugger v0.12.0-rc2', (0, 12, 0)),
+    ('openocd', 'OpenOCD stub', None),
+    ('pyocd', '0.34.2\n', (0, 34, 2)),
+])
+def test_parse_backend_version(backend, output, expected_version):
+    assert parse_backend_version(backend, output) == expected_version
+
+
+def test_backend_info_cache(tmp_path: Path):
+    counter_file = tmp_path / 'counter'
+    openocd_path = tmp_path / 'openocd'
+    openocd_path.write_text(f'''#!/bin/sh
+echo run >> "{counter_file}"
+echo "Open On-Chip Debugger 0.11.0" 1>&2
+''')
+    openocd_path.chmod(0o755)
+
+    openocd_info = get_backend_info('openocd', str(openocd_path))
+    assert openocd_info.version == (0, 11, 0)
+    assert openocd_info.capabilities == (OPENOCD_ADAPTER_SPEED, OPENOCD_HEX_SERIAL)
+    assert get_backend_info('openocd', str(openocd_path)) == openocd_info
+    assert counter_file.read_text().count('run') == 1
+
+    # tool update invalidates cached version
+    openocd_path.write_text(openocd_path.read_text().replace('0.11.0', '0.12.0'))
+    new_time = time.time() + 10
+    os.utime(openocd_path, (new_time, new_time))
+    openocd_info = get_backend_info('openocd', str(openocd_path))
+    assert openocd_info.version == (0, 12, 0)
+    assert openocd_info.has_capability(OPENOCD_ADAPTER_SERIAL)
+    assert counter_file.read_text().count('run') == 2
+
+
+def test_openocd_serial_command():
+    serial_number = '0670FF535155878281123912'
+    assert format_openocd_serial_command(serial_number) == \
+        r'hla_serial "\x06\x70\x3F\x53\x51\x55\x3F\x3F\x3F\x12\x39\x12"'
+    openocd_info = BackendInfo(name='openocd', path='openocd', version=(0, 11, 0), capabilities=(OPENOCD_HEX_SERIAL,))
+    assert format_openocd_serial_command(serial_number, openocd_info) == f'hla_serial "{serial_number}"'
+    openocd_info = BackendInfo(name='openocd', path='openocd', version=(0, 12, 0),
+                               capabilities=(OPENOCD_ADAPTER_SERIAL, OPENOCD_HEX_SERIAL))
+    assert format_openocd_serial_command(serial_number, openocd_info) == f'adapter serial "{serial_number}"'
@@ -0,0 +1,41 @@
+from vznncv.stlink.tools.wrapper._delta_utils import compute_changed_regions, split_into_sectors, FlashRegion
+from vznncv.stlink.tools.wrapper._elf_utils import ElfLoadSegment
+
+
+def test_split_into_sectors():
+    sectors = split_into_sectors([
+        ElfLoadSegment(address=0x08000002, data=b'\x01\x02\x03\x04\x05\x06'),
+        ElfLoadSegment(address=0x08000010, data=b'\x07'),
+    ], sector_size=4)
+    assert sectors == {
+        0x08000000: b'\xFF\xFF\x01\x02',
+        0x08000004: b'\x03\x04\x05\x06',
+        0x08000010: b'\x07\xFF\xFF\xFF',
+    }
+
+
+def test_compute_changed_regions():
+    old_segments = [
+        ElfLoadSegment(address=0x08000000, data=bytes(range(32))),
+        ElfLoadSegment(address=0x08000040, data=b'\xAA' * 8),
+    ]
+    new_data = bytearray(range(32))
+    new_data[5] = 0xFF
+    new_data[9] = 0xFF
+    new_data[30] = 0xFF
+    new_segments = [
+        ElfLoadSegment(address=0x08000000, data=bytes(new_data)),
+        ElfLoadSegment(address=0x08000020, data=b'\x55' * 4),
+    ]
+
+    regions = compute_changed_regions(old_segments, new_segments, sector_size=4)
+
+    assert regions == [
+        FlashRegion(address=0x08000004, data=bytes(new_data[4:12])),
+        FlashRegion(address=0x0800001C, data=bytes(new_data[28:32]) + b'\x55' * 4),
+    ]
+
+
+def test_compute_changed_regions_same_image():
+    segments = [ElfLoadSegment(address=0x08000000, data=bytes(range(100)))]
+    assert compute_changed_regions(segments, segments, sector_size=16) == []
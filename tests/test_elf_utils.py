@@ -0,0 +1,56 @@
+import os.path
+
+import pytest
+
+from testing_utils import FIXTURE_DIR
+from vznncv.stlink.tools.wrapper._elf_utils import ElfFile, ElfFormatError, PT_LOAD, SHT_NOBITS, \
+    read_elf_load_segments, compute_image_hash
+
+DEMO_ELF = os.path.join(FIXTURE_DIR, 'stm_project_stub', 'build', 'demo.elf')
+
+
+def test_elf_headers():
+    with ElfFile(DEMO_ELF) as elf_file:
+        assert elf_file.entry == 0x08001C4D
+        assert [(ph.type, ph.paddr, ph.filesz) for ph in elf_file.program_headers] == [
+            (PT_LOAD, 0x08000000, 0x1D48),
+            (PT_LOAD, 0x08001D48, 0x0C),
+            (PT_LOAD, 0x08001D54, 0x00),
+        ]
+        isr_vector = elf_file.get_section('.isr_vector')
+        assert (isr_vector.addr, isr_vector.size) == (0x08000000, 0x188)
+        assert elf_file.get_section('.bss').type == SHT_NOBITS
+        assert elf_file.get_section('.unknown') is None
+
+
+def test_elf_symbols():
+    with ElfFile(DEMO_ELF) as elf_file:
+        main_symbol = elf_file.find_symbol('main')
+        vector_symbol = elf_file.find_symbol('g_pfnVectors')
+        assert main_symbol is not None and main_symbol.size > 0
+        assert elf_file.section_headers[main_symbol.section_index].name == '.text'
+        assert vector_symbol.value == 0x08000000
+
+
+def test_elf_segment_data():
+    with ElfFile(DEMO_ELF) as elf_file:
+        segments = list(elf_file.iter_load_segments())
+        isr_vector_data = elf_file.section_data(elf_file.get_section('.isr_vector'))
+        assert isinstance(segments[0].data, memoryview)
+        assert segments[0].data[:0x188] == isr_vector_data
+        isr_vector_data.release()
+        for segment in segments:
+            segment.data.release()
+
+    segments = read_elf_load_segments(DEMO_ELF)
+    assert [(segment.address, len(segment.data)) for segment in segments] == [(0x08000000, 0x1D48), (0x08001D48, 0x0C)]
+    assert isinstance(segments[0].data, bytes)
+    assert len(compute_image_hash(DEMO_ELF)) == 64
+
+
+@pytest.mark.parametrize('content', [b'', b'\x7fELF', b'MZ\x00\x00' * 16])
+def test_invalid_elf(tmp_path, content):
+    path = tmp_path / 'invalid.elf'
+    path.write_bytes(content)
+    with pytest.raises(ElfFormatError):
+        ElfFile(str(path))
@@ -0,0 +1,88 @@
+import itertools
+import json
+from unittest.mock import patch
+
+from click.testing import CliRunner
+from hamcrest import assert_that, contains_exactly, has_entries
+
+from testing_utils import DeviceStub
+from vznncv.stlink.tools.wrapper._cli import main
+from vznncv.stlink.tools.wrapper._hotplug_utils import watch_stlink_devices, UsbEventMonitor
+from vznncv.stlink.tools.wrapper._stlink_utils import StLinkDevice, _STLINK_DEVICE_TYPES
+
+_DEVICE_TYPE = _STLINK_DEVICE_TYPES[(0x0483, 0x374e)]
+
+
+def _create_device(serial_number):
+    return StLinkDevice(type=_DEVICE_TYPE, raw_serial_number=serial_number, bus=1, address=2)
+
+
+class _EventMonitorStub(UsbEventMonitor):
+    def __init__(self, max_waits=None):
+        self.wait_count = 0
+        self.max_waits = max_waits
+
+    def wait(self, timeout):
+        self.wait_count += 1
+        if self.max_waits is not None and self.wait_count > self.max_waits:
+            raise KeyboardInterrupt()
+        return True
+
+
+def _watch_events(device_snapshots, event_count, **kwargs):
+    snapshots = itertools.chain(device_snapshots, itertools.repeat(device_snapshots[-1]))
+    events = watch_stlink_devices(monitor=_EventMonitorStub(), get_devices=lambda: next(snapshots), **kwargs)
+    return [(e.event, e.device.serial_number) for e in itertools.islice(events, event_count)]
+
+
+def test_watch_devices():
+    device_1 = '002F003D3438510B34313939'
+    device_2 = '0674FF525750877267181714'
+    events = _watch_events([
+        [_create_device(device_1)],
+        [_create_device(device_1)],
+        [_create_device(device_1), _create_device(device_2)],
+        [_create_device(device_2)],
+        [],
+    ], event_count=4)
+    assert events == [
+        ('added', device_1),
+        ('added', device_2),
+        ('removed', device_1),
+        ('removed', device_2),
+    ]
+
+
+def test_watch_devices_without_initial_events():
+    device_1 = '002F003D3438510B34313939'
+    device_2 = '0674FF525750877267181714'
+    events = _watch_events([
+        [_create_device(device_1)],
+        [_create_device(device_1), _create_device(device_2)],
+    ], event_count=1, initial_events=False)
+    assert events == [('added', device_2)]
+
+
+def test_show_devices_watch_json():
+    usb_snapshots = [
+        [],
+        [DeviceStub(idVendor=0x0483, idProduct=0x374e, serial_number='002F003D3438510B34313939')],
+        [],
+    ]
+    usb_snapshots_iter = itertools.chain(usb_snapshots, itertools.repeat([]))
+    monitor_stub = _EventMonitorStub(max_waits=len(usb_snapshots))
+
+    with patch('usb.core.find', autospec=True) as find_mock, \
+            patch('vznncv.stlink.tools.wrapper._hotplug_utils.create_usb_event_monitor', return_value=monitor_stub):
+        find_mock.side_effect = lambda *args, **kwargs: next(usb_snapshots_iter)
+        cli_runner = CliRunner(mix_stderr=False)
+        result = cli_runner.invoke(main, ['show-devices', '--watch', '--format', 'json'])
+
+    assert result.exit_code == 0
+    events = [json.loads(line) for line in result.stdout.splitlines()]
+    assert_that(events, contains_exactly(
+        has_entries(event='added', name='ST-Link V3E', vendor_id=0x0483, product_id=0x374e,
+                    hla_serial='002F003D3438510B34313939'),
+        has_entries(event='removed', name='ST-Link V3E', vendor_id=0x0483, product_id=0x374e,
+                    hla_serial='002F003D3438510B34313939'),
+    ))
@@ -0,0 +1,152 @@
+import json
+import os
+import os.path
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+from click.testing import CliRunner
+from hamcrest import assert_that, string_contains_in_order, has_item, contains_string, is_not
+
+from testing_utils import DeviceStub, FIXTURE_DIR, OpenOcdTclServerStub, change_dir, run_invoke_cmd
+from vznncv.stlink.tools.wrapper._cache_utils import get_cache_path, write_json_file
+from vznncv.stlink.tools.wrapper._cli import main
+from vznncv.stlink.tools.wrapper._openocd_utils import OpenOcdTclClient, OpenOcdTclError
+
+_HLA_SERIAL = '002F003D3438510B34313939'
+
+
+@pytest.fixture
+def dummy_usb_devices():
+    with patch('usb.core.find', autospec=True) as find_mock:
+        find_mock.return_value = [
+            DeviceStub(idVendor=0x0483, idProduct=0x374e, serial_number=_HLA_SERIAL)
+        ]
+        yield
+
+
+@pytest.fixture
+def demo_project_path(tmp_path: Path):
+    project_dir = tmp_path / 'stm_project'
+    shutil.copytree(os.path.join(FIXTURE_DIR, 'stm_project_stub'), project_dir)
+    yield project_dir
+
+
+def _openocd_handler(command: str) -> str:
+    if command == 'version':
+        return 'Open On-Chip Debugger 0.11.0'
+    elif 'capture' in command and 'program' in command:
+        return '0 ** Programming Started **\n** Programming Finished **\n** Verified OK **\n** Resetting Target **'
+    else:
+        return ''
+
+
+def _register_server(tcl_server: OpenOcdTclServerStub, pid: int, openocd_config: str = 'openocd.cfg'):
+    write_json_file(get_cache_path('openocd_servers', f'{_HLA_SERIAL}.json'), {
+        'hla_serial': _HLA_SERIAL,
+        'pid': pid,
+        'host': tcl_server.host,
+        'tcl_port': tcl_server.port,
+        'openocd_path': 'openocd',
+        'openocd_config': openocd_config,
+        'project_dir': os.getcwd(),
+        'log_file': 'openocd.log',
+        'start_time': time.time()
+    })
+
+
+def test_tcl_client():
+    with OpenOcdTclServerStub(_openocd_handler) as tcl_server:
+        with OpenOcdTclClient(tcl_server.host, tcl_server.port) as client:
+            assert client.execute('version') == 'Open On-Chip Debugger 0.11.0'
+            output = client.execute_checked('program {demo.elf} verify reset')
+    assert_that(output, string_contains_in_order('Programming Finished', 'Verified OK'))
+    assert_that(tcl_server.commands[-1], string_contains_in_order('catch', 'capture', 'program', 'demo.elf'))
+
+
+def test_tcl_client_command_failure():
+    with OpenOcdTclServerStub(lambda command: '1 ** Programming Failed **') as tcl_server:
+        with OpenOcdTclClient(tcl_server.host, tcl_server.port) as client:
+            with pytest.raises(OpenOcdTclError, match='Programming Failed'):
+                client.execute_checked('program {demo.elf} verify reset')
+
+
+def test_upload_app_with_openocd_server(demo_project_path: Path, dummy_usb_devices, capfd):
+    with OpenOcdTclServerStub(_openocd_handler) as tcl_server:
+        _register_server(tcl_server, pid=os.getpid(), openocd_config=str(demo_project_path / 'openocd_stm.cfg'))
+        with change_dir(demo_project_path):
+            exit_code = run_invoke_cmd(main, ['upload-app', '--backend', 'openocd', '--elf-file', 'build',
+                                              '--openocd-server'])
+
+    assert exit_code == 0
+    assert_that(tcl_server.commands, has_item(contains_string('demo.elf')))
+    out_result = capfd.readouterr()
+    assert_that(out_result.err, string_contains_in_order(
+        'Use OpenOCD server', f'tcl port {tcl_server.port}',
+        'Programming Finished', 'Verified OK',
+        'Complete'
+    ))
+
+
+def test_upload_app_with_openocd_server_crc_verify(demo_project_path: Path, dummy_usb_devices, capfd):
+    with OpenOcdTclServerStub(_openocd_handler) as tcl_server:
+        _register_server(tcl_server, pid=os.getpid(), openocd_config=str(demo_project_path / 'openocd_stm.cfg'))
+        with change_dir(demo_project_path):
+            exit_code = run_invoke_cmd(main, ['upload-app', '--backend', 'openocd', '--elf-file', 'build',
+                                              '--openocd-server', '--verify', 'crc'])
+
+    assert exit_code == 0
+    assert_that(tcl_server.commands, has_item(string_contains_in_order(
+        'program', 'demo.elf', 'verify_image_checksum', 'demo.elf', 'reset run'
+    )))
+    assert_that(tcl_server.commands, is_not(has_item(contains_string('verify reset'))))
+
+
+def test_stale_server_detection():
+    with OpenOcdTclServerStub(_openocd_handler) as tcl_server:
+        _register_server(tcl_server, pid=os.getpid())
+    state_path = get_cache_path('openocd_servers', f'{_HLA_SERIAL}.json')
+    assert os.path.exists(state_path)
+
+    cli_runner = CliRunner(mix_stderr=False)
+    result = cli_runner.invoke(main, ['openocd-server', 'status', '--format', 'json'])
+    assert result.exit_code == 0
+    assert json.loads(result.stdout) == []
+    assert not os.path.exists(state_path)
+
+
+def test_server_status_and_stop():
+    server_process = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)'])
+    reaper_thread = threading.Thread(target=server_process.wait, daemon=True)
+    reaper_thread.start()
+    try:
+        def openocd_handler(command):
+            if command == 'shutdown':
+                server_process.terminate()
+                return 'shutdown command invoked'
+            return _openocd_handler(command)
+
+        with OpenOcdTclServerStub(openocd_handler) as tcl_server:
+            _register_server(tcl_server, pid=server_process.pid)
+
+            cli_runner = CliRunner(mix_stderr=False)
+            result = cli_runner.invoke(main, ['openocd-server', 'status', '--format', 'json'])
+            assert result.exit_code == 0
+            server_infos = json.loads(result.stdout)
+            assert len(server_infos) == 1
+            assert server_infos[0]['hla_serial'] == _HLA_SERIAL
+            assert server_infos[0]['tcl_port'] == tcl_server.port
+
+            result = cli_runner.invoke(main, ['openocd-server', 'stop'])
+            assert result.exit_code == 0
+        assert 'shutdown' in tcl_server.commands
+        reaper_thread.join(timeout=10)
+        assert server_process.returncode is not None
+    finally:
+        if server_process.returncode is None:
+            server_process.kill()
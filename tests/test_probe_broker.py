@@ -0,0 +1,313 @@
+import json
+import os
+import os.path
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+from hamcrest import assert_that, string_contains_in_order
+
+from testing_utils import DeviceStub, FIXTURE_DIR, change_dir, run_invoke_cmd
+from vznncv.stlink.tools.wrapper._cli import main
+from vznncv.stlink.tools.wrapper._probe_broker import acquire_probe_lease, get_probe_broker_stats, \
+    run_probe_broker, stop_probe_broker, get_probe_broker_socket_path, ProbeBrokerError
+
+_HLA_SERIAL = '002F003D3438510B34313939'
+_OTHER_HLA_SERIAL = '0670FF535155878281123912'
+
+
+def _start_broker(socket_path: str, pools=None) -> threading.Thread:
+    ready_event = threading.Event()
+    broker_thread = threading.Thread(target=run_probe_broker, args=(socket_path, pools),
+                                     kwargs={'ready_callback': ready_event.set}, daemon=True)
+    broker_thread.start()
+    assert ready_event.wait(timeout=5)
+    return broker_thread
+
+
+def _stop_broker(socket_path: str, broker_thread: threading.Thread):
+    stop_probe_broker(socket_path)
+    broker_thread.join(timeout=5)
+    assert not broker_thread.is_alive()
+
+
+@pytest.fixture
+def broker_socket():
+    # unix socket path length is limited, so pytest temporary directory cannot be used
+    socket_dir = tempfile.mkdtemp(prefix='broker')
+    socket_path = os.path.join(socket_dir, 'broker.sock')
+    broker_thread = _start_broker(socket_path, {'ci': [_HLA_SERIAL, _OTHER_HLA_SERIAL]})
+    try:
+        yield socket_path
+    finally:
+        _stop_broker(socket_path, broker_thread)
+        shutil.rmtree(socket_dir, ignore_errors=True)
+
+
+def _wait_queue_depth(socket_path: str, queue_depth: int, timeout: float = 5):
+    deadline = time.monotonic() + timeout
+    while get_probe_broker_stats(socket_path)['queue_depth'] != queue_depth:
+        assert time.monotonic() < deadline, f"queue depth isn't {queue_depth}"
+        time.sleep(0.01)
+
+
+class _HolderCounter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.holders = {}
+        self.max_holders = {}
+        self.errors = []
+
+    def hold(self, serial: str, hold_time: float):
+        with self._lock:
+            self.holders[serial] = self.holders.get(serial, 0) + 1
+            self.max_holders[serial] = max(self.max_holders.get(serial, 0), self.holders[serial])
+        time.sleep(hold_time)
+        with self._lock:
+            self.holders[serial] -= 1
+
+
+def _run_clients(client_count: int, client_fn):
+    errors = []
+
+    def run_client(i):
+        try:
+            client_fn(i)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run_client, args=(i,)) for i in range(client_count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=30)
+    assert not errors
+
+
+def test_concurrent_clients_exclusive_lease(broker_socket):
+    counter = _HolderCounter()
+
+    def client(i):
+        with acquire_probe_lease(broker_socket, serials=[_HLA_SERIAL.lower()], client=f'client {i}') as lease:
+            assert lease.serial == _HLA_SERIAL
+            counter.hold(lease.serial, 0.005)
+
+    _run_clients(24, client)
+    assert counter.max_holders == {_HLA_SERIAL: 1}
+
+    stats = get_probe_broker_stats(broker_socket)
+    assert stats['queue_depth'] == 0
+    assert stats['leases'] == 24
+    assert stats['wait_time']['max'] > 0
+    probe_stats = {probe['serial']: probe for probe in stats['probes']}
+    assert probe_stats[_HLA_SERIAL]['leases'] == 24
+    assert probe_stats[_HLA_SERIAL]['holder'] is None
+    assert probe_stats[_OTHER_HLA_SERIAL]['leases'] == 0
+
+
+def test_concurrent_clients_pool_lease(broker_socket):
+    counter = _HolderCounter()
+
+    def client(i):
+        with acquire_probe_lease(broker_socket, pool='ci', client=f'client {i}') as lease:
+            counter.hold(lease.serial, 0.01)
+
+    _run_clients(16, client)
+    assert counter.max_holders == {_HLA_SERIAL: 1, _OTHER_HLA_SERIAL: 1}
+
+
+def test_fair_queue(broker_socket):
+    grant_order = []
+    holder_lease = acquire_probe_lease(broker_socket, serials=[_HLA_SERIAL])
+    queue_positions = []
+
+    def client(i):
+        lease = acquire_probe_lease(broker_socket, serials=[_HLA_SERIAL], client=f'client {i}',
+                                    queued_callback=queue_positions.append)
+        grant_order.append(i)
+        lease.release()
+
+    threads = []
+    for i in range(5):
+        thread = threading.Thread(target=client, args=(i,))
+        thread.start()
+        threads.append(thread)
+        _wait_queue_depth(broker_socket, i + 1)
+
+    # waiter of the busy probe doesn't block leases of the other probes
+    with acquire_probe_lease(broker_socket, pool='ci', timeout=1) as pool_lease:
+        assert pool_lease.serial == _OTHER_HLA_SERIAL
+
+    stats = get_probe_broker_stats(broker_socket)
+    assert [waiter['client'] for waiter in stats['waiters']] == [f'client {i}' for i in range(5)]
+    probe_stats = {probe['serial']: probe for probe in stats['probes']}
+    assert probe_stats[_HLA_SERIAL]['queue_depth'] == 5
+    assert probe_stats[_HLA_SERIAL]['holder']['lease_id'] == holder_lease.lease_id
+
+    holder_lease.release()
+    for thread in threads:
+        thread.join(timeout=5)
+    assert grant_order == [0, 1, 2, 3, 4]
+    assert queue_positions == [0, 1, 2, 3, 4]
+
+
+def test_lease_timeout(broker_socket):
+    with acquire_probe_lease(broker_socket, serials=[_HLA_SERIAL]):
+        with pytest.raises(ProbeBrokerError, match='isn\'t leased'):
+            acquire_probe_lease(broker_socket, serials=[_HLA_SERIAL], timeout=0.2)
+        # cancelled request is removed from the queue
+        _wait_queue_depth(broker_socket, 0)
+
+
+def test_unknown_pool(broker_socket):
+    with pytest.raises(ProbeBrokerError, match='Unknown probe pool'):
+        acquire_probe_lease(broker_socket, pool='unknown')
+
+
+def test_lease_release_on_client_death(broker_socket):
+    client_script = f'''
+import sys, time
+from vznncv.stlink.tools.wrapper._probe_broker import acquire_probe_lease
+lease = acquire_probe_lease({broker_socket!r}, serials=[{_HLA_SERIAL!r}])
+print(lease.serial, flush=True)
+time.sleep(60)
+'''
+    client_process = subprocess.Popen([sys.executable, '-c', client_script], stdout=subprocess.PIPE)
+    try:
+        assert client_process.stdout.readline().decode().strip() == _HLA_SERIAL
+        with pytest.raises(ProbeBrokerError):
+            acquire_probe_lease(broker_socket, serials=[_HLA_SERIAL], timeout=0.1)
+    finally:
+        client_process.kill()
+        client_process.wait()
+        client_process.stdout.close()
+
+    with acquire_probe_lease(broker_socket, serials=[_HLA_SERIAL], timeout=5) as lease:
+        assert lease.serial == _HLA_SERIAL
+
+
+def test_broker_stats_cli(broker_socket, capfd):
+    with acquire_probe_lease(broker_socket, serials=[_HLA_SERIAL], client='test client'):
+        exit_code = run_invoke_cmd(main, ['broker', 'stats', '--socket', broker_socket])
+        assert exit_code == 0
+        assert_that(capfd.readouterr().out, string_contains_in_order(
+            'queue depth: 0', 'leases: 1',
+            f'hla serial: {_HLA_SERIAL}', 'pools: ci', 'holder: test client',
+            f'hla serial: {_OTHER_HLA_SERIAL}', 'pools: ci', 'holder: -',
+        ))
+
+    exit_code = run_invoke_cmd(main, ['broker', 'stats', '--socket', broker_socket, '--format', 'json'])
+    assert exit_code == 0
+    stats = json.loads(capfd.readouterr().out)
+    assert stats['leases'] == 1
+    assert stats['pools'] == {'ci': [_HLA_SERIAL, _OTHER_HLA_SERIAL]}
+
+
+def test_broker_cli_without_broker(tmp_path: Path):
+    exit_code = run_invoke_cmd(main, ['broker', 'stats', '--socket', str(tmp_path / 'broker.sock')])
+    assert exit_code == 1
+
+
+@pytest.fixture
+def dummy_usb_devices():
+    with patch('usb.core.find', autospec=True) as find_mock:
+        find_mock.return_value = [
+            DeviceStub(idVendor=0x0483, idProduct=0x374e, serial_number=_HLA_SERIAL),
+            DeviceStub(idVendor=0x0483, idProduct=0x374b, serial_number=_OTHER_HLA_SERIAL),
+        ]
+        yield
+
+
+@pytest.fixture
+def demo_project_path(tmp_path: Path):
+    project_dir = tmp_path / 'stm_project'
+    shutil.copytree(os.path.join(FIXTURE_DIR, 'stm_project_stub'), project_dir)
+    yield project_dir
+
+
+@pytest.fixture
+def tmp_bin_dir(tmp_path: Path):
+    tmp_bin = tmp_path / 'bin'
+    os.makedirs(tmp_bin, exist_ok=True)
+
+    original_environ = os.environ.copy()
+    path_var = f"{tmp_bin}{os.pathsep}{os.environ.get('PATH', '')}"
+    try:
+        os.environ['PATH'] = path_var
+        yield tmp_bin
+    finally:
+        os.environ.clear()
+        os.environ.update(original_environ)
+
+
+@pytest.fixture
+def openocd_stub_path(tmp_bin_dir):
+    openocd_path = tmp_bin_dir.joinpath('openocd')
+    openocd_path.write_text(r'''
+#!/bin/sh
+echo "OpenOCD stub" 1>&2
+echo "OpenOCD args: $@" 1>&2
+'''.lstrip())
+    openocd_path.chmod(0o777)
+    yield openocd_path
+
+
+def test_upload_app_with_default_broker(demo_project_path: Path, openocd_stub_path: Path, dummy_usb_devices, capfd):
+    # broker on the default socket is used automatically
+    socket_path = get_probe_broker_socket_path()
+    broker_thread = _start_broker(socket_path)
+    try:
+        holder_lease = acquire_probe_lease(socket_path, serials=[_HLA_SERIAL])
+        threading.Timer(0.3, holder_lease.release).start()
+        with change_dir(demo_project_path):
+            exit_code = run_invoke_cmd(main, ['upload-app', '--backend', 'openocd', '--elf-file', 'build',
+                                              '--hla-serial', _HLA_SERIAL, '--timings'])
+        stats = get_probe_broker_stats(socket_path)
+    finally:
+        _stop_broker(socket_path, broker_thread)
+
+    assert exit_code == 0
+    assert_that(capfd.readouterr().err, string_contains_in_order(
+        f'Probe broker: {socket_path}',
+        f'Wait for {_HLA_SERIAL} lease (0 clients ahead)',
+        f'Probe {_HLA_SERIAL} is leased',
+        'OpenOCD args', 'program',
+        'probe lease',
+        'Complete',
+    ))
+    assert stats['leases'] == 2
+    assert stats['probes'][0]['holder'] is None
+    assert stats['wait_time']['max'] >= 0.2
+
+
+def test_upload_app_with_probe_pool(demo_project_path: Path, openocd_stub_path: Path, broker_socket,
+                                    dummy_usb_devices, capfd):
+    with acquire_probe_lease(broker_socket, serials=[_HLA_SERIAL]):
+        with change_dir(demo_project_path):
+            exit_code = run_invoke_cmd(main, ['upload-app', '--backend', 'openocd', '--elf-file', 'build',
+                                              '--broker-socket', broker_socket, '--probe-pool', 'ci'])
+
+    assert exit_code == 0
+    assert_that(capfd.readouterr().err, string_contains_in_order(
+        f'Probe {_OTHER_HLA_SERIAL} is leased',
+        f'Target ST-Link device: ST-Link V2-1', _OTHER_HLA_SERIAL,
+        'OpenOCD args', 'program',
+        'Complete',
+    ))
+    assert get_probe_broker_stats(broker_socket)['leases'] == 2
+
+
+def test_upload_app_probe_pool_without_broker(demo_project_path: Path, openocd_stub_path: Path, dummy_usb_devices,
+                                              capfd):
+    with change_dir(demo_project_path):
+        exit_code = run_invoke_cmd(main, ['upload-app', '--backend', 'openocd', '--elf-file', 'build',
+                                          '--probe-pool', 'ci'])
+
+    assert exit_code == 1
+    assert 'requires running probe broker' in capfd.readouterr().err
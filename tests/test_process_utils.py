@@ -0,0 +1,99 @@
+import os
+import sys
+import time
+
+import pytest
+
+from vznncv.stlink.tools.wrapper._process_utils import ProcessRunner, ProcessTimeoutError
+
+
+def _python_command(code):
+    return [sys.executable, '-c', code]
+
+
+def _is_process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    # zombie processes are considered as finished ones
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            return f.read().split(')')[-1].split()[0] != 'Z'
+    except OSError:
+        return True
+
+
+def test_run_process_output():
+    lines = []
+    code = (
+        'import sys\n'
+        'for i in range(20000):\n'
+        '    sys.stdout.write(f"out {i}\\n")\n'
+        '    sys.stderr.write(f"err {i}\\n")\n'
+        'sys.exit(3)\n'
+    )
+    returncode = ProcessRunner().run_process(_python_command(code), cwd=None, line_handler=lines.append)
+    assert returncode == 3
+    assert len(lines) == 40000
+    assert [line for line in lines if line.startswith('out ')][-1] == 'out 19999'
+    assert [line for line in lines if line.startswith('err ')][-1] == 'err 19999'
+
+
+@pytest.mark.skipif(os.name != 'posix', reason="process group check requires posix system")
+def test_run_process_timeout():
+    lines = []
+    code = (
+        'import subprocess, sys, time\n'
+        'child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])\n'
+        'print(child.pid, flush=True)\n'
+        'time.sleep(60)\n'
+    )
+    start_time = time.monotonic()
+    with pytest.raises(ProcessTimeoutError, match='exceeded 1.0s timeout'):
+        ProcessRunner(timeout=1.0).run_process(_python_command(code), cwd=None, line_handler=lines.append)
+    assert time.monotonic() - start_time < 10
+    child_pid = int(lines[0])
+    for _ in range(50):
+        if not _is_process_alive(child_pid):
+            break
+        time.sleep(0.1)
+    assert not _is_process_alive(child_pid)
+
+
+def test_run_process_phase_timeout():
+    code = (
+        'import time\n'
+        'time.sleep(0.5)\n'
+        'print("program", flush=True)\n'
+        'time.sleep(60)\n'
+    )
+    phases = ['startup']
+
+    def handle_line(line):
+        phases.append(line)
+
+    runner = ProcessRunner(phase_timeouts={'program': 0.5})
+    with pytest.raises(ProcessTimeoutError, match='timeout of the "program" phase'):
+        runner.run_process(_python_command(code), cwd=None, line_handler=handle_line,
+                           phase_getter=lambda: phases[-1])
+
+
+def test_run_tasks():
+    runner = ProcessRunner()
+    code = 'import time; time.sleep(1.0); print("done")'
+
+    def task(i):
+        lines = []
+        runner.run_process(_python_command(code), cwd=None, line_handler=lines.append)
+        if i == 2:
+            raise ValueError("task failure")
+        return i, lines
+
+    start_time = time.monotonic()
+    results = runner.run_tasks([lambda i=i: task(i) for i in range(4)], max_workers=4)
+    assert time.monotonic() - start_time < 3.5
+    assert results[0] == (0, ['done'])
+    assert results[1] == (1, ['done'])
+    assert isinstance(results[2], ValueError)
+    assert results[3] == (3, ['done'])
@@ -0,0 +1,126 @@
+import os
+import shutil
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+from testing_utils import DeviceStub, FIXTURE_DIR
+from vznncv.stlink.tools.wrapper import _search_utils
+from vznncv.stlink.tools.wrapper._project_config import load_project_config, ProjectConfigError, ProjectConfig
+from vznncv.stlink.tools.wrapper._resolution_cache import ResolutionCache, find_executable
+from vznncv.stlink.tools.wrapper._search_utils import resolve_elf_file_location, resolve_openocd_config_file
+from vznncv.stlink.tools.wrapper._upload_utils import upload_app
+
+
+@pytest.fixture
+def demo_project_path(tmp_path: Path):
+    project_dir = tmp_path / 'stm_project'
+    shutil.copytree(os.path.join(FIXTURE_DIR, 'stm_project_stub'), project_dir)
+    # recently modified directories aren't memoized
+    old_time = time.time() - 3600
+    for path in [project_dir, *project_dir.rglob('*')]:
+        os.utime(path, (old_time, old_time))
+    yield project_dir
+
+
+def test_load_project_config(demo_project_path: Path):
+    assert load_project_config(str(demo_project_path)) == ProjectConfig()
+
+    (demo_project_path / '.vznncv-stlink.toml').write_text(
+        '[upload-app]\n'
+        'elf-file = "build/demo.elf"\n'
+        'backend = "openocd"\n'
+        'pyocd-target = "stm32f303vc"\n'
+    )
+    project_config = load_project_config(str(demo_project_path))
+    assert project_config.elf_file == str(demo_project_path / 'build' / 'demo.elf')
+    assert project_config.backend == 'openocd'
+    assert project_config.pyocd_target == 'stm32f303vc'
+    assert project_config.openocd_config is None
+
+    (demo_project_path / '.vznncv-stlink.toml').write_text('[upload-app]\nelf_path = "build"\n')
+    with pytest.raises(ProjectConfigError, match='Unknown option'):
+        load_project_config(str(demo_project_path))
+    (demo_project_path / '.vznncv-stlink.toml').write_text('[upload-app\n')
+    with pytest.raises(ProjectConfigError, match='Invalid project configuration'):
+        load_project_config(str(demo_project_path))
+
+
+def test_memoized_resolution(demo_project_path: Path, tmp_path: Path):
+    project_dir = str(demo_project_path)
+    cache_path = str(tmp_path / 'resolution.json')
+    resolution_cache = ResolutionCache(cache_path)
+    elf_file = resolve_elf_file_location(project_dir, None, use_index=False, resolution_cache=resolution_cache)
+    cfg_file = resolve_openocd_config_file(project_dir, None, resolution_cache=resolution_cache)
+    resolution_cache.save()
+
+    # directories aren't walked again
+    with patch.object(_search_utils, 'search_files', side_effect=AssertionError('directory is walked')), \
+            patch.object(_search_utils.os, 'scandir', side_effect=AssertionError('directory is listed')):
+        resolution_cache = ResolutionCache(cache_path)
+        assert resolve_elf_file_location(project_dir, None, use_index=False,
+                                         resolution_cache=resolution_cache) == elf_file
+        assert resolve_openocd_config_file(project_dir, None, resolution_cache=resolution_cache) == cfg_file
+
+    # new file invalidates memoized result
+    shutil.copy(elf_file, demo_project_path / 'build' / 'demo_2.elf')
+    with pytest.raises(_search_utils.MultipleFilesAreFound):
+        resolve_elf_file_location(project_dir, None, use_index=False, resolution_cache=resolution_cache)
+
+
+def test_memoized_executable(tmp_path: Path, monkeypatch):
+    bin_dirs = [tmp_path / 'bin_1', tmp_path / 'bin_2']
+    for bin_dir in bin_dirs:
+        bin_dir.mkdir()
+    tool_path = bin_dirs[1] / 'tool'
+    tool_path.write_text('#!/bin/sh\n')
+    tool_path.chmod(0o755)
+    old_time = time.time() - 3600
+    for path in [*bin_dirs, tool_path]:
+        os.utime(path, (old_time, old_time))
+    monkeypatch.setenv('PATH', os.pathsep.join(str(bin_dir) for bin_dir in bin_dirs))
+
+    resolution_cache = ResolutionCache(None)
+    assert find_executable('tool', resolution_cache) == str(tool_path)
+    with patch('shutil.which', side_effect=AssertionError('PATH is searched')):
+        assert find_executable('tool', resolution_cache) == str(tool_path)
+
+    # executable that shadows the memoized one
+    shutil.copy(tool_path, bin_dirs[0] / 'tool')
+    assert find_executable('tool', resolution_cache) == str(bin_dirs[0] / 'tool')
+
+
+@pytest.fixture
+def openocd_bin_dir(tmp_path: Path, monkeypatch):
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    openocd_path = bin_dir / 'openocd'
+    openocd_path.write_text('#!/bin/sh\necho "OpenOCD stub" 1>&2\n')
+    openocd_path.chmod(0o755)
+    old_time = time.time() - 3600
+    for path in [bin_dir, openocd_path]:
+        os.utime(path, (old_time, old_time))
+    monkeypatch.setenv('PATH', str(bin_dir))
+    yield bin_dir
+
+
+def test_memoized_upload_app_resolution(demo_project_path: Path, openocd_bin_dir: Path):
+    upload_kwargs = dict(
+        project_dir=str(demo_project_path), elf_file=None, backend='auto', hla_serial=None,
+        openocd_config=None, openocd_path=None, pyocd_path=None, pyocd_target=None, pyocd_config=None,
+        pyocd_script=None, force=True
+    )
+    with patch('usb.core.find', autospec=True) as find_mock:
+        find_mock.return_value = [
+            DeviceStub(idVendor=0x0483, idProduct=0x374e, serial_number='002F003D3438510B34313939')
+        ]
+        upload_app(**upload_kwargs)
+
+        # directories aren't walked and PATH isn't searched again
+        with patch.object(_search_utils, 'search_files', side_effect=AssertionError('directory is walked')), \
+                patch.object(_search_utils.ElfFileIndex, 'search', side_effect=AssertionError('index is searched')), \
+                patch('shutil.which', side_effect=AssertionError('PATH is searched')):
+            upload_results = upload_app(**upload_kwargs)
+    assert len(upload_results) == 1
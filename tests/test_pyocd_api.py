@@ -0,0 +1,446 @@
+import json
+import os
+import shutil
+import sys
+import types
+import zlib
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+from hamcrest import assert_that, string_contains_in_order
+
+from testing_utils import DeviceStub, FIXTURE_DIR, change_dir, make_ram_elf, run_invoke_cmd
+from vznncv.stlink.tools.wrapper import _upload_utils
+from vznncv.stlink.tools.wrapper._cli import main
+from vznncv.stlink.tools.wrapper._elf_utils import read_elf_load_segments
+from vznncv.stlink.tools.wrapper._pyocd_api_utils import PyOcdSessionPool
+
+_HLA_SERIAL = '002F003D3438510B34313939'
+
+
+@pytest.fixture
+def dummy_usb_devices():
+    with patch('usb.core.find', autospec=True) as find_mock:
+        find_mock.return_value = [
+            DeviceStub(idVendor=0x0483, idProduct=0x374e, serial_number=_HLA_SERIAL)
+        ]
+        yield
+
+
+@pytest.fixture
+def demo_project_path(tmp_path: Path):
+    project_dir = tmp_path / 'stm_project'
+    shutil.copytree(os.path.join(FIXTURE_DIR, 'stm_project_stub'), project_dir)
+    yield project_dir
+
+
+class FakePyOcd:
+    """
+    Stand-in pyocd package that emulates target memory.
+    """
+
+    def __init__(self):
+        self.memory = {}
+        self.sessions = []
+        self.programmed_files = []
+        # flash region of the target memory map, that can calculate CRC32 checksums
+        self.flash_range = (0x08000000, 0x80000)
+        self.ram_range = (0x20000000, 0x20000)
+        self.crc_blocks = []
+        # number of bytes that are read after the last programming
+        self.read_size = 0
+        self.core_registers = {}
+        self.is_running = True
+
+    def write_memory(self, address, data):
+        for i, value in enumerate(data):
+            self.memory[address + i] = value
+
+    def read_memory(self, address, size):
+        return [self.memory.get(address + i, 0xFF) for i in range(size)]
+
+    def create_modules(self):
+        fake = self
+
+        class Flash:
+            class Operation:
+                VERIFY = 'verify'
+
+            def __init__(self):
+                self.is_inited = False
+
+            def get_flash_info(self):
+                return types.SimpleNamespace(crc_supported=True)
+
+            def init(self, operation):
+                self.is_inited = True
+
+            def cleanup(self):
+                self.is_inited = False
+
+            def compute_crcs(self, sectors):
+                assert self.is_inited
+                for address, size in sectors:
+                    assert size & (size - 1) == 0 and address % size == 0 and address // size < 1 << 16
+                fake.crc_blocks.extend(sectors)
+                return [zlib.crc32(bytes(fake.read_memory(address, size))) for address, size in sectors]
+
+        class FlashRegion:
+            is_flash = True
+            is_ram = False
+
+            def __init__(self, start, length):
+                self.start = start
+                self.end = start + length - 1
+                self.flash = Flash()
+
+            def contains_range(self, start, length):
+                return self.start <= start and start + length - 1 <= self.end
+
+        class RamRegion:
+            is_flash = False
+            is_ram = True
+
+            def __init__(self, start, length):
+                self.start = start
+                self.end = start + length - 1
+
+        class MemoryMap:
+            def __init__(self):
+                self.regions = [FlashRegion(*fake.flash_range), RamRegion(*fake.ram_range)]
+
+            def get_region_for_address(self, address):
+                return next((region for region in self.regions if region.start <= address <= region.end), None)
+
+        class Target:
+            def __init__(self):
+                self.memory_map = MemoryMap()
+
+            def read_memory_block8(self, address, size):
+                fake.read_size += size
+                return fake.read_memory(address, size)
+
+            def reset(self):
+                pass
+
+            def reset_and_halt(self):
+                fake.is_running = False
+
+            def write_memory_block8(self, address, data):
+                fake.write_memory(address, data)
+
+            def write32(self, address, value):
+                fake.write_memory(address, value.to_bytes(4, 'little'))
+
+            def write_core_register(self, name, value):
+                fake.core_registers[name] = value
+
+            def resume(self):
+                fake.is_running = True
+
+        class Session:
+            def __init__(self, unique_id, options):
+                self.unique_id = unique_id
+                self.options = options
+                self.board = types.SimpleNamespace(target=Target())
+                self.is_open = False
+                self.is_closed = False
+
+            def open(self):
+                self.is_open = True
+
+            def close(self):
+                self.is_closed = True
+
+        class ConnectHelper:
+            @staticmethod
+            def session_with_chosen_probe(unique_id=None, blocking=True, return_first=False, options=None):
+                session = Session(unique_id, options)
+                fake.sessions.append(session)
+                return session
+
+        class FileProgrammer:
+            def __init__(self, session, progress=None, chip_erase=None):
+                assert session.is_open and not session.is_closed
+                self._progress = progress
+                self._chip_erase = chip_erase
+
+            def program(self, file_path, file_format=None, base_address=None):
+                fake.programmed_files.append((os.path.basename(file_path), file_format, base_address,
+                                              self._chip_erase))
+                if file_format == 'elf':
+                    for segment in read_elf_load_segments(file_path):
+                        fake.write_memory(segment.address, segment.data)
+                else:
+                    with open(file_path, 'rb') as f:
+                        fake.write_memory(base_address, f.read())
+                for progress in (0.0, 0.5, 1.0):
+                    self._progress(progress)
+                fake.read_size = 0
+
+        modules = {
+            'pyocd': types.ModuleType('pyocd'),
+            'pyocd.core': types.ModuleType('pyocd.core'),
+            'pyocd.core.helpers': types.ModuleType('pyocd.core.helpers'),
+            'pyocd.flash': types.ModuleType('pyocd.flash'),
+            'pyocd.flash.file_programmer': types.ModuleType('pyocd.flash.file_programmer'),
+        }
+        modules['pyocd.core.helpers'].ConnectHelper = ConnectHelper
+        modules['pyocd.flash.file_programmer'].FileProgrammer = FileProgrammer
+        return modules
+
+
+@pytest.fixture
+def fake_pyocd(monkeypatch):
+    fake = FakePyOcd()
+    for name, module in fake.create_modules().items():
+        monkeypatch.setitem(sys.modules, name, module)
+    yield fake
+
+
+_UPLOAD_ARGS = ['upload-app', '--backend', 'pyocd-api', '--elf-file', 'build', '--pyocd-target', 'stm32f411ce']
+
+
+def test_pyocd_api_usage(demo_project_path: Path, fake_pyocd: FakePyOcd, dummy_usb_devices, capfd):
+    with change_dir(demo_project_path):
+        exit_code = run_invoke_cmd(main, _UPLOAD_ARGS + ['--output-format', 'json'])
+
+    assert exit_code == 0
+    assert fake_pyocd.programmed_files == [('demo.elf', 'elf', None, None)]
+    session, = fake_pyocd.sessions
+    assert session.unique_id == _HLA_SERIAL
+    assert session.options == {'target_override': 'stm32f411ce'}
+    assert session.is_closed
+    events = [json.loads(line) for line in capfd.readouterr().out.splitlines()]
+    assert [event['kind'] for event in events] == [
+        'program_started', 'progress', 'progress', 'progress', 'programmed', 'program_finished'
+    ]
+    assert events[-2]['backend'] == 'pyocd-api'
+    assert events[-2]['bytes'] > 0
+
+
+def test_pyocd_api_skip_same_image(demo_project_path: Path, fake_pyocd: FakePyOcd, dummy_usb_devices, capfd):
+    with change_dir(demo_project_path):
+        assert run_invoke_cmd(main, _UPLOAD_ARGS) == 0
+        assert run_invoke_cmd(main, _UPLOAD_ARGS) == 0
+        assert len(fake_pyocd.programmed_files) == 1
+        assert 'Skip upload' in capfd.readouterr().err
+
+        # target memory is changed by somebody else
+        fake_pyocd.write_memory(0x08000100, b'\x55\xAA')
+        assert run_invoke_cmd(main, _UPLOAD_ARGS) == 0
+        assert len(fake_pyocd.programmed_files) == 2
+        assert "Device memory doesn't match the image" in capfd.readouterr().err
+
+
+def test_pyocd_api_delta_upload(demo_project_path: Path, fake_pyocd: FakePyOcd, dummy_usb_devices):
+    upload_args = _UPLOAD_ARGS + ['--delta-sector-size', '0x800']
+    with change_dir(demo_project_path):
+        assert run_invoke_cmd(main, upload_args) == 0
+        elf_path = demo_project_path / 'build' / 'demo.elf'
+        elf_data = bytearray(elf_path.read_bytes())
+        elf_data[0x10000 + 0x900] ^= 0xFF
+        elf_path.write_bytes(bytes(elf_data))
+        assert run_invoke_cmd(main, upload_args) == 0
+
+    assert fake_pyocd.programmed_files[0] == ('demo.elf', 'elf', None, None)
+    assert fake_pyocd.programmed_files[1][1:] == ('bin', 0x08000800, 'sector')
+    for segment in read_elf_load_segments(str(elf_path)):
+        assert bytes(fake_pyocd.read_memory(segment.address, len(segment.data))) == segment.data
+
+
+def test_pyocd_api_delta_upload_reflashed_target(demo_project_path: Path, fake_pyocd: FakePyOcd, dummy_usb_devices,
+                                                 capfd):
+    upload_args = _UPLOAD_ARGS + ['--delta-sector-size', '0x800']
+    with change_dir(demo_project_path):
+        assert run_invoke_cmd(main, upload_args) == 0
+        # target memory outside of the changed sectors is changed by other tool
+        fake_pyocd.write_memory(0x08000100, b'\x55\xAA')
+        elf_path = demo_project_path / 'build' / 'demo.elf'
+        elf_data = bytearray(elf_path.read_bytes())
+        elf_data[0x10000 + 0x900] ^= 0xFF
+        elf_path.write_bytes(bytes(elf_data))
+        capfd.readouterr()
+        assert run_invoke_cmd(main, upload_args) == 0
+        out_result = capfd.readouterr()
+        # ledger is updated only after the full upload
+        assert run_invoke_cmd(main, upload_args) == 0
+        skip_out_result = capfd.readouterr()
+
+    assert [programmed_file[1:] for programmed_file in fake_pyocd.programmed_files] == [
+        ('elf', None, None), ('bin', 0x08000800, 'sector'), ('elf', None, None)
+    ]
+    assert_that(out_result.err, string_contains_in_order(
+        "Target memory doesn't match the image after delta upload", 'Upload full image', 'Complete'
+    ))
+    for segment in read_elf_load_segments(str(elf_path)):
+        assert bytes(fake_pyocd.read_memory(segment.address, len(segment.data))) == segment.data
+    assert 'Skip upload' in skip_out_result.err
+
+
+def test_pyocd_api_session_reuse(demo_project_path: Path, fake_pyocd: FakePyOcd, dummy_usb_devices):
+    with PyOcdSessionPool() as session_pool:
+        for _ in range(3):
+            _upload_utils.upload_app(
+                project_dir=str(demo_project_path), elf_file=None, backend='pyocd-api', hla_serial=None,
+                openocd_config=None, openocd_path=None, pyocd_path=None, pyocd_target='stm32f411ce',
+                pyocd_config=None, pyocd_script=None, force=True, pyocd_sessions=session_pool
+            )
+        session, = fake_pyocd.sessions
+        assert not session.is_closed
+    assert len(fake_pyocd.programmed_files) == 3
+    assert session.is_closed
+
+
+def test_pyocd_api_not_installed(demo_project_path: Path, dummy_usb_devices, monkeypatch, capfd):
+    monkeypatch.setitem(sys.modules, 'pyocd', None)
+    with change_dir(demo_project_path):
+        exit_code = run_invoke_cmd(main, _UPLOAD_ARGS)
+
+    assert exit_code == 1
+    assert "pyocd python package isn't installed" in capfd.readouterr().err
+
+
+def test_pyocd_api_crc_verify(demo_project_path: Path, fake_pyocd: FakePyOcd, dummy_usb_devices, capfd):
+    with change_dir(demo_project_path):
+        exit_code = run_invoke_cmd(main, _UPLOAD_ARGS + ['--verify', 'crc', '--output-format', 'json'])
+
+    assert exit_code == 0
+    events = [json.loads(line) for line in capfd.readouterr().out.splitlines()]
+    assert [event['kind'] for event in events][-3:] == ['verify_started', 'verified', 'verify_finished']
+    image_size = sum(len(segment.data) for segment in read_elf_load_segments(
+        str(demo_project_path / 'build' / 'demo.elf')
+    ))
+    assert events[-2]['bytes'] == image_size
+    # only unaligned segment tails are read back
+    assert fake_pyocd.crc_blocks
+    assert sum(size for _, size in fake_pyocd.crc_blocks) + fake_pyocd.read_size == image_size
+    assert fake_pyocd.read_size < image_size // 2
+
+
+def test_pyocd_api_readback_verify(demo_project_path: Path, fake_pyocd: FakePyOcd, dummy_usb_devices):
+    with change_dir(demo_project_path):
+        assert run_invoke_cmd(main, _UPLOAD_ARGS + ['--verify', 'readback']) == 0
+
+    image_size = sum(len(segment.data) for segment in read_elf_load_segments(
+        str(demo_project_path / 'build' / 'demo.elf')
+    ))
+    assert not fake_pyocd.crc_blocks
+    assert fake_pyocd.read_size == image_size
+
+
+def test_pyocd_api_crc_verify_failure(demo_project_path: Path, fake_pyocd: FakePyOcd, dummy_usb_devices,
+                                      monkeypatch, capfd):
+    original_write_memory = fake_pyocd.write_memory
+
+    def write_memory(address, data):
+        original_write_memory(address, bytes(value ^ 0x01 for value in data))
+
+    monkeypatch.setattr(fake_pyocd, 'write_memory', write_memory)
+    with change_dir(demo_project_path):
+        exit_code = run_invoke_cmd(main, _UPLOAD_ARGS + ['--verify', 'crc'])
+
+    assert exit_code == 1
+    assert "Target memory doesn't match the programmed image" in capfd.readouterr().err
+
+
+@pytest.fixture
+def pyocd_stub_path(tmp_path: Path):
+    tmp_bin = tmp_path / 'bin'
+    tmp_bin.mkdir()
+    pyocd_path = tmp_bin / 'pyocd'
+    pyocd_path.write_text('#!/bin/sh\necho "PyOCD args: $@" 1>&2\n')
+    pyocd_path.chmod(0o777)
+    with patch.dict(os.environ, {'PATH': f"{tmp_bin}{os.pathsep}{os.environ.get('PATH', '')}"}):
+        yield pyocd_path
+
+
+@pytest.mark.parametrize('target_matches', [True, False])
+def test_pyocd_same_image_check(demo_project_path: Path, fake_pyocd: FakePyOcd, pyocd_stub_path: Path,
+                                dummy_usb_devices, capfd, target_matches):
+    upload_args = ['upload-app', '--backend', 'pyocd', '--elf-file', 'build', '--pyocd-target', 'stm32f411ce']
+    with change_dir(demo_project_path):
+        exit_code = run_invoke_cmd(main, upload_args)
+        assert exit_code == 0
+        capfd.readouterr()
+        # pyocd command stub doesn't write fake memory, so the device may be reflashed by other tools
+        if target_matches:
+            for segment in read_elf_load_segments(str(demo_project_path / 'build' / 'demo.elf')):
+                fake_pyocd.write_memory(segment.address, segment.data)
+        exit_code = run_invoke_cmd(main, upload_args)
+        assert exit_code == 0
+        out_result = capfd.readouterr()
+
+    # target memory is checked with checksums, only small blocks that cannot be encoded for analyzer are read back
+    assert fake_pyocd.crc_blocks
+    assert fake_pyocd.read_size < 4096
+    assert fake_pyocd.sessions[-1].is_closed
+    if target_matches:
+        assert_that(out_result.err, string_contains_in_order('Skip upload', 'Complete'))
+        assert 'PyOCD args' not in out_result.err
+    else:
+        assert_that(out_result.err, string_contains_in_order(
+            "Device memory doesn't match the image", 'PyOCD args', 'flash', 'demo.elf', 'Complete'
+        ))
+
+
+def test_pyocd_api_ram_image(demo_project_path: Path, fake_pyocd: FakePyOcd, dummy_usb_devices, capfd):
+    elf_path = demo_project_path / 'build' / 'demo.elf'
+    make_ram_elf(elf_path, elf_path)
+    with change_dir(demo_project_path):
+        exit_code = run_invoke_cmd(main, _UPLOAD_ARGS + ['--output-format', 'json'])
+
+    assert exit_code == 0
+    assert fake_pyocd.programmed_files == []
+    for segment in read_elf_load_segments(str(elf_path)):
+        assert bytes(fake_pyocd.read_memory(segment.address, len(segment.data))) == segment.data
+    assert fake_pyocd.core_registers['pc'] == 0x20001C4C
+    # VTOR points to the vector table of the image
+    assert bytes(fake_pyocd.read_memory(0xE000ED08, 4)) == (0x20000000).to_bytes(4, 'little')
+    assert fake_pyocd.core_registers['sp'] == int.from_bytes(fake_pyocd.read_memory(0x20000000, 4), 'little')
+    assert fake_pyocd.is_running
+    events = [json.loads(line) for line in capfd.readouterr().out.splitlines()]
+    assert [event['kind'] for event in events] == ['program_started', 'programmed', 'program_finished']
+
+
+def test_pyocd_api_ram_image_outside_ram(demo_project_path: Path, fake_pyocd: FakePyOcd, dummy_usb_devices, capfd):
+    elf_path = demo_project_path / 'build' / 'demo.elf'
+    make_ram_elf(elf_path, elf_path)
+    fake_pyocd.ram_range = (0x20000000, 0x1000)
+    with change_dir(demo_project_path):
+        exit_code = run_invoke_cmd(main, _UPLOAD_ARGS)
+
+    assert exit_code == 1
+    assert 'segment 0x20000000 (7496 bytes) is placed outside RAM of stm32f411ce target' in capfd.readouterr().err
+    assert fake_pyocd.core_registers == {}
+
+
+def test_pyocd_api_watch(demo_project_path: Path, fake_pyocd: FakePyOcd, dummy_usb_devices, monkeypatch, capfd):
+    elf_path = demo_project_path / 'build' / 'demo.elf'
+
+    def watch_file_changes(paths, stamps):
+        assert paths == [str(elf_path)]
+        assert stamps[str(elf_path)] is not None
+        # rebuild with the same loadable content
+        elf_path.touch()
+        yield
+        elf_data = bytearray(elf_path.read_bytes())
+        elf_data[0x10000 + 0x900] ^= 0xFF
+        elf_path.write_bytes(bytes(elf_data))
+        yield
+
+    monkeypatch.setattr(_upload_utils, 'watch_file_changes', watch_file_changes)
+    with change_dir(demo_project_path):
+        exit_code = run_invoke_cmd(main, _UPLOAD_ARGS + ['--watch'])
+
+    assert exit_code == 0
+    assert len(fake_pyocd.programmed_files) == 2
+    session, = fake_pyocd.sessions
+    assert session.is_closed
+    for segment in read_elf_load_segments(str(elf_path)):
+        assert bytes(fake_pyocd.read_memory(segment.address, len(segment.data))) == segment.data
+    assert_that(capfd.readouterr().err, string_contains_in_order(
+        'Complete', 'Watch image changes', 'Image is changed', "Loadable image content isn't changed. Skip upload",
+        'Image is changed', 'Complete'
+    ))
@@ -0,0 +1,111 @@
+import os
+import os.path
+import shutil
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+from hamcrest import assert_that, string_contains_in_order
+
+from testing_utils import DeviceStub, FIXTURE_DIR, change_dir, make_ram_elf, run_invoke_cmd
+from vznncv.stlink.tools.wrapper import _ram_utils
+from vznncv.stlink.tools.wrapper._cli import main
+from vznncv.stlink.tools.wrapper._elf_utils import ElfLoadSegment, read_elf_load_segments
+from vznncv.stlink.tools.wrapper._ram_utils import get_ram_image_entry, is_sram_image, find_non_sram_segment
+
+DEMO_ELF = os.path.join(FIXTURE_DIR, 'stm_project_stub', 'build', 'demo.elf')
+
+
+@pytest.fixture
+def dummy_usb_devices():
+    with patch('usb.core.find', autospec=True) as find_mock:
+        find_mock.return_value = [
+            DeviceStub(idVendor=0x0483, idProduct=0x374e, serial_number='002F003D3438510B34313939')
+        ]
+        yield
+
+
+@pytest.fixture
+def demo_project_path(tmp_path: Path):
+    project_dir = tmp_path / 'stm_project'
+    shutil.copytree(os.path.join(FIXTURE_DIR, 'stm_project_stub'), project_dir)
+    yield project_dir
+
+
+@pytest.fixture
+def openocd_stub_path(tmp_path: Path):
+    tmp_bin = tmp_path / 'bin'
+    os.makedirs(tmp_bin, exist_ok=True)
+    openocd_path = tmp_bin.joinpath('openocd')
+    openocd_path.write_text(r'''
+#!/bin/sh
+echo "OpenOCD stub" 1>&2
+echo "OpenOCD args: $@" 1>&2
+'''.lstrip())
+    openocd_path.chmod(0o777)
+    with patch.dict(os.environ, {'PATH': f"{tmp_bin}{os.pathsep}{os.environ.get('PATH', '')}"}):
+        yield openocd_path
+
+
+def test_sram_image_detection(tmp_path: Path):
+    ram_elf = tmp_path / 'demo_ram.elf'
+    make_ram_elf(DEMO_ELF, ram_elf)
+
+    flash_segments = read_elf_load_segments(DEMO_ELF)
+    ram_segments = read_elf_load_segments(str(ram_elf))
+    assert not is_sram_image(flash_segments)
+    assert find_non_sram_segment(flash_segments).address == 0x08000000
+    assert is_sram_image(ram_segments)
+    assert not is_sram_image([])
+
+    ram_entry = get_ram_image_entry(str(ram_elf), ram_segments)
+    assert ram_entry.vector_table == 0x20000000
+    assert ram_entry.entry_point == 0x20001C4C
+    assert 0x20000000 < ram_entry.stack_pointer <= 0x40000000
+
+
+def test_invalid_vector_table(tmp_path: Path):
+    ram_elf = tmp_path / 'demo_ram.elf'
+    make_ram_elf(DEMO_ELF, ram_elf)
+    ram_segments = read_elf_load_segments(str(ram_elf))
+    vector_table = bytearray(ram_segments[0].data)
+    # reset handler points outside the image
+    vector_table[4:8] = (0x08001C4D).to_bytes(4, 'little')
+
+    with pytest.raises(ValueError, match='Reset handler 0x08001C4D'):
+        get_ram_image_entry(str(ram_elf), [ElfLoadSegment(0x20000000, bytes(vector_table)), *ram_segments[1:]])
+    # vector table must be aligned to be set to VTOR register
+    with patch.object(_ram_utils, '_find_vector_table', return_value=0x20000040), \
+            pytest.raises(ValueError, match="isn't aligned to 128 bytes"):
+        get_ram_image_entry(str(ram_elf), ram_segments)
+
+
+def test_upload_app_ram_image(demo_project_path: Path, openocd_stub_path: Path, dummy_usb_devices, capfd):
+    make_ram_elf(demo_project_path / 'build' / 'demo.elf', demo_project_path / 'build' / 'demo.elf')
+    with change_dir(demo_project_path):
+        for _ in range(2):
+            exit_code = run_invoke_cmd(main, ['upload-app', '--backend', 'openocd', '--elf-file', 'build'])
+
+            assert exit_code == 0
+            out_result = capfd.readouterr()
+            assert_that(out_result.err, string_contains_in_order(
+                'Image is linked to SRAM',
+                'RAM image entry point 0x20001C4C',
+                'OpenOCD args', 'init', 'reset halt', 'load_image', 'demo.elf', 'mww 0xE000ED08 0x20000000',
+                'reg sp 0x', 'reg pc 0x20001C4C',
+                'resume', 'shutdown',
+                'Complete',
+            ))
+            # SRAM image isn't remembered by the flash ledger
+            assert 'Skip upload' not in out_result.err
+            assert 'program' not in out_result.err.split('OpenOCD args')[-1]
+
+
+def test_upload_app_ram_flash_image(demo_project_path: Path, openocd_stub_path: Path, dummy_usb_devices, capfd):
+    with change_dir(demo_project_path):
+        exit_code = run_invoke_cmd(main, ['upload-app', '--backend', 'openocd', '--elf-file', 'build', '--ram'])
+
+    assert exit_code == 1
+    out_result = capfd.readouterr()
+    assert 'segment 0x08000000 (7496 bytes) is placed outside SRAM' in out_result.err
+    assert 'OpenOCD args' not in out_result.err
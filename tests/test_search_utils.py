@@ -0,0 +1,194 @@
+import os
+import shutil
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+from testing_utils import FIXTURE_DIR
+from vznncv.stlink.tools.wrapper import _search_utils
+from vznncv.stlink.tools.wrapper._search_utils import ElfFileIndex, resolve_elf_file_location, \
+    MultipleFilesAreFound, PathPatterns, search_files
+
+_DEMO_ELF = os.path.join(FIXTURE_DIR, 'stm_project_stub', 'build', 'demo.elf')
+
+
+def _set_old_mtime(*paths, age=3600):
+    mtime = time.time() - age
+    for path in paths:
+        os.utime(path, (mtime, mtime))
+
+
+@pytest.fixture
+def build_tree(tmp_path: Path):
+    build_dir = tmp_path / 'project' / 'build'
+    (build_dir / 'CMakeFiles').mkdir(parents=True)
+    (build_dir / 'bin').mkdir()
+    for i in range(20):
+        (build_dir / 'CMakeFiles' / f'helper_{i}').write_text('#!/bin/sh\n')
+        (build_dir / 'CMakeFiles' / f'object_{i}.o').write_bytes(b'\x7fELF')
+    (build_dir / 'Makefile').write_text('all:\n')
+    shutil.copy(_DEMO_ELF, build_dir / 'bin' / 'demo')
+    _set_old_mtime(build_dir, build_dir / 'CMakeFiles', build_dir / 'bin')
+    yield build_dir
+
+
+def test_elf_index(build_tree: Path, tmp_path: Path):
+    index_path = str(tmp_path / 'index.json')
+    elf_index = ElfFileIndex(index_path)
+    results = elf_index.search(str(build_tree), max_depth=2)
+    elf_index.save()
+    assert [result.path for result in results] == [str(build_tree / 'bin' / 'demo')]
+    assert elf_index.scanned_dirs == 3
+
+    # unchanged directories aren't scanned and their files aren't opened
+    with patch.object(_search_utils, '_is_elf_file', side_effect=AssertionError("file is checked")):
+        elf_index = ElfFileIndex(index_path)
+        assert elf_index.search(str(build_tree), max_depth=2) == results
+    assert elf_index.scanned_dirs == 0
+
+    # only changed directory is scanned
+    shutil.copy(_DEMO_ELF, build_tree / 'CMakeFiles' / 'other.elf')
+    _set_old_mtime(build_tree / 'CMakeFiles', age=1800)
+    elf_index = ElfFileIndex(index_path)
+    results = elf_index.search(str(build_tree), max_depth=2)
+    assert elf_index.scanned_dirs == 1
+    assert sorted(result.path for result in results) == [
+        str(build_tree / 'CMakeFiles' / 'other.elf'), str(build_tree / 'bin' / 'demo')
+    ]
+
+
+def test_elf_index_changed_file(build_tree: Path, tmp_path: Path):
+    index_path = str(tmp_path / 'index.json')
+    _set_old_mtime(*build_tree.rglob('*'))
+    elf_index = ElfFileIndex(index_path)
+    elf_index.search(str(build_tree), max_depth=2)
+    elf_index.save()
+    # extension-less helpers, makefile and elf file are checked
+    assert elf_index.checked_files == 22
+
+    # only new file of the changed directory is opened
+    (build_tree / 'CMakeFiles' / 'helper_new').write_text('#!/bin/sh\n')
+    _set_old_mtime(build_tree / 'CMakeFiles', age=1800)
+    with patch.object(_search_utils, '_is_elf_file', wraps=_search_utils._is_elf_file) as is_elf_file_mock:
+        elf_index = ElfFileIndex(index_path)
+        results = elf_index.search(str(build_tree), max_depth=2)
+    assert [result.path for result in results] == [str(build_tree / 'bin' / 'demo')]
+    assert elf_index.scanned_dirs == 1
+    assert elf_index.checked_files == 1
+    assert [call[0][0] for call in is_elf_file_mock.call_args_list] == [
+        str(build_tree / 'CMakeFiles' / 'helper_new')
+    ]
+
+
+def test_elf_index_recent_changes(build_tree: Path, tmp_path: Path):
+    index_path = str(tmp_path / 'index.json')
+    # recently modified directory isn't cached, as its next change can have the same mtime
+    (build_tree / 'bin' / 'demo.map').write_text('')
+    for _ in range(2):
+        elf_index = ElfFileIndex(index_path)
+        elf_index.search(str(build_tree), max_depth=2)
+        elf_index.save()
+    assert elf_index.scanned_dirs == 1
+
+
+def test_resolve_elf_file_with_index(build_tree: Path):
+    project_dir = str(build_tree.parent)
+    expected_path = str(build_tree / 'bin' / 'demo')
+    assert resolve_elf_file_location(project_dir, None) == expected_path
+    assert resolve_elf_file_location(project_dir, None) == expected_path
+    assert resolve_elf_file_location(project_dir, None, use_index=False) == expected_path
+
+    shutil.copy(_DEMO_ELF, build_tree / 'bin' / 'demo_2.elf')
+    with pytest.raises(MultipleFilesAreFound):
+        resolve_elf_file_location(project_dir, None)
+
+
+def test_path_patterns():
+    patterns = PathPatterns(['# comment', 'CMakeFiles/', '*.o', '/bin/*.map', 'docs/**/*.elf', '!keep.o'])
+    assert patterns.matches('CMakeFiles', is_dir=True)
+    assert patterns.matches('sub/CMakeFiles', is_dir=True)
+    assert not patterns.matches('CMakeFiles', is_dir=False)
+    assert patterns.matches('sub/main.o', is_dir=False)
+    assert not patterns.matches('sub/keep.o', is_dir=False)
+    assert patterns.matches('bin/app.map', is_dir=False)
+    assert not patterns.matches('other/bin/app.map', is_dir=False)
+    assert patterns.matches('docs/app.elf', is_dir=False)
+    assert patterns.matches('docs/a/b/app.elf', is_dir=False)
+    assert not patterns.matches('app.elf', is_dir=False)
+
+
+@pytest.mark.parametrize('use_index', [False, True])
+def test_resolve_elf_file_excludes(build_tree: Path, use_index):
+    project_dir = str(build_tree.parent)
+    # elf files in the built-in excluded directories are ignored
+    shutil.copy(_DEMO_ELF, build_tree / 'CMakeFiles' / 'compiler_check')
+    expected_path = str(build_tree / 'bin' / 'demo')
+    assert resolve_elf_file_location(project_dir, None, use_index=use_index) == expected_path
+
+    shutil.copy(_DEMO_ELF, build_tree / 'bin' / 'demo_test')
+    with pytest.raises(MultipleFilesAreFound):
+        resolve_elf_file_location(project_dir, None, use_index=use_index)
+    assert resolve_elf_file_location(project_dir, None, use_index=use_index,
+                                     exclude_patterns=['*_test']) == expected_path
+
+
+@pytest.mark.parametrize('use_index', [False, True])
+def test_resolve_newest_elf_file(build_tree: Path, use_index):
+    project_dir = str(build_tree.parent)
+    shutil.copy(_DEMO_ELF, build_tree / 'bin' / 'demo_new.elf')
+    _set_old_mtime(build_tree / 'bin' / 'demo', age=600)
+    _set_old_mtime(build_tree / 'bin' / 'demo_new.elf', age=60)
+
+    with pytest.raises(MultipleFilesAreFound):
+        resolve_elf_file_location(project_dir, None, use_index=use_index)
+    # modification times of the search results are used, so files aren't checked again
+    with patch.object(_search_utils, '_select_newest_file', wraps=_search_utils._select_newest_file) as select_mock:
+        assert resolve_elf_file_location(project_dir, None, use_index=use_index, elf_select='newest') == \
+            str(build_tree / 'bin' / 'demo_new.elf')
+    assert all(result.mtime is not None for result in select_mock.call_args[0][0])
+
+
+def test_search_budget(build_tree: Path, caplog):
+    results = search_files(str(build_tree), max_depth=2, file_predicate=lambda path: True, max_files=10,
+                           stop_on_top_level=False)
+    assert len(results) < 10
+    assert 'File search is stopped' in caplog.text
+
+
+@pytest.fixture
+def wide_build_tree(build_tree: Path):
+    for i in range(10):
+        module_dir = build_tree / f'module_{i}'
+        (module_dir / 'sub').mkdir(parents=True)
+        for j in range(30):
+            (module_dir / f'file_{j}').write_bytes(b'\x7fELF' if j % 7 == 0 else b'#!/bin/sh\n')
+        (module_dir / 'sub' / 'nested.elf').write_bytes(b'\x7fELF')
+    _set_old_mtime(build_tree, *(path for path in build_tree.rglob('*') if path.is_dir()))
+    yield build_tree
+
+
+@pytest.mark.parametrize('stop_on_top_level', [False, True])
+def test_concurrent_search(wide_build_tree: Path, tmp_path: Path, stop_on_top_level):
+    search_kwargs = dict(start_dirs=str(wide_build_tree), max_depth=3, stop_on_top_level=stop_on_top_level,
+                         exclude_patterns=['file_14'])
+    sequential_results = search_files(file_predicate=_search_utils._is_elf_file, **search_kwargs)
+    concurrent_results = search_files(file_predicate=_search_utils._is_elf_file, workers=8, **search_kwargs)
+    assert concurrent_results == sequential_results
+    assert len(sequential_results) == (41 if stop_on_top_level else 51)
+
+    # modification times are taken from the directory scan results
+    assert all(result.mtime == os.stat(result.path).st_mtime for result in sequential_results)
+
+    for _ in range(2):
+        elf_index = ElfFileIndex(str(tmp_path / 'index.json'))
+        index_results = elf_index.search(workers=8, **search_kwargs)
+        elf_index.save()
+        assert [result._replace(mtime=None) for result in index_results] == [
+            result._replace(mtime=None) for result in sequential_results
+        ]
+        assert [result.mtime for result in index_results] == pytest.approx(
+            [result.mtime for result in sequential_results]
+        )
+    assert elf_index.scanned_dirs == 0
@@ -0,0 +1,127 @@
+import os
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+import vznncv.stlink.tools.wrapper._stlink_utils as stlink_utils
+from testing_utils import DeviceStub
+from vznncv.stlink.tools.wrapper._stlink_utils import get_stlink_devices
+
+
+def _create_sysfs_device(sysfs_dir: Path, name: str, *, vendor_id: int, product_id: int, busnum: int, devnum: int,
+                         serial: bytes = None):
+    device_dir = sysfs_dir / name
+    device_dir.mkdir()
+    (device_dir / 'idVendor').write_text(f'{vendor_id:04x}\n')
+    (device_dir / 'idProduct').write_text(f'{product_id:04x}\n')
+    (device_dir / 'busnum').write_text(f'{busnum}\n')
+    (device_dir / 'devnum').write_text(f'{devnum}\n')
+    if serial is not None:
+        (device_dir / 'serial').write_bytes(serial + b'\n')
+    # interface directory
+    (sysfs_dir / f'{name}:1.0').mkdir()
+
+
+@pytest.fixture
+def fake_sysfs_dir(tmp_path: Path, monkeypatch):
+    sysfs_dir = tmp_path / 'sys_bus_usb_devices'
+    sysfs_dir.mkdir()
+    # root hubs and a lot of other devices
+    for bus in range(1, 5):
+        _create_sysfs_device(sysfs_dir, f'usb{bus}', vendor_id=0x1D6B, product_id=0x0002, busnum=bus, devnum=1)
+        for port in range(1, 101):
+            _create_sysfs_device(sysfs_dir, f'{bus}-{port}', vendor_id=0x0BDA, product_id=0x0411 + port,
+                                 busnum=bus, devnum=port + 1, serial=f'SN{bus:02}{port:04}'.encode())
+    # ST-Link devices
+    _create_sysfs_device(sysfs_dir, '1-101.1', vendor_id=0x0483, product_id=0x374e, busnum=1, devnum=120,
+                         serial=b'002F003D3438510B34313939')
+    _create_sysfs_device(sysfs_dir, '3-101.4', vendor_id=0x0483, product_id=0x374b, busnum=3, devnum=121,
+                         serial=b'0670ff535155878281123912')
+    # buggy ST-Link V2 serial number is truncated by kernel at the first zero symbol
+    _create_sysfs_device(sysfs_dir, '2-101', vendor_id=0x0483, product_id=0x3748, busnum=2, devnum=122,
+                         serial=b'4')
+    monkeypatch.setattr(stlink_utils, '_SYSFS_USB_DEVICES_DIR', str(sysfs_dir))
+    yield sysfs_dir
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason='sysfs is available on Linux only')
+def test_sysfs_enumeration(fake_sysfs_dir):
+    libusb_device = DeviceStub(idVendor=0x0483, idProduct=0x3748,
+                               serial_number=b'4\x00j\x061A29\x100\x02C'.decode('utf-8'))
+    with patch('usb.core.find', autospec=True) as find_mock:
+        find_mock.return_value = libusb_device
+        stlink_devices = get_stlink_devices()
+
+        assert [(d.name, d.bus, d.address, d.port_path) for d in stlink_devices] == [
+            ('ST-Link V3E', 1, 120, '1-101.1'),
+            ('ST-Link V2', 2, 122, '2-101'),
+            ('ST-Link V2-1', 3, 121, '3-101.4'),
+        ]
+        assert stlink_devices[0].serial_number == '002F003D3438510B34313939'
+        assert stlink_devices[2].serial_number == '0670FF535155878281123912'
+        find_mock.assert_not_called()
+
+        # invalid sysfs serial number is read with libusb
+        assert stlink_devices[1].serial_number == '34006A063141323910300243'
+        find_mock.assert_called_once_with(bus=2, address=122)
+
+
+def test_libusb_fallback(tmp_path: Path, monkeypatch):
+    monkeypatch.setattr(stlink_utils, '_SYSFS_USB_DEVICES_DIR', os.path.join(tmp_path, 'not_exists'))
+    with patch('usb.core.find', autospec=True) as find_mock:
+        find_mock.return_value = [
+            DeviceStub(idVendor=0x0BDA, idProduct=0x0411, serial_number=None),
+            DeviceStub(idVendor=0x0483, idProduct=0x374e, serial_number='002F003D3438510B34313939')
+        ]
+        stlink_devices = get_stlink_devices()
+    assert [(d.name, d.serial_number) for d in stlink_devices] == [('ST-Link V3E', '002F003D3438510B34313939')]
+
+
+class _CountingDeviceStub:
+    def __init__(self, *, idVendor, idProduct, serial_number, bus, address):
+        self.idVendor = idVendor
+        self.idProduct = idProduct
+        self.bus = bus
+        self.address = address
+        self.port_numbers = (1, address)
+        self._serial_number = serial_number
+        self.serial_number_reads = 0
+
+    @property
+    def serial_number(self):
+        self.serial_number_reads += 1
+        return self._serial_number
+
+
+def test_libusb_filter_and_serial_number_cache():
+    usb_devices = [
+        _CountingDeviceStub(idVendor=0x0483, idProduct=0x374e, serial_number='002F003D3438510B34313939',
+                            bus=1, address=5),
+        _CountingDeviceStub(idVendor=0x0483, idProduct=0x5740, serial_number='00000000001A', bus=1, address=6),
+    ]
+    with patch('usb.core.find', autospec=True) as find_mock:
+        find_mock.return_value = usb_devices
+        first_devices = get_stlink_devices()
+        assert [d.serial_number for d in first_devices] == ['002F003D3438510B34313939']
+        second_devices = get_stlink_devices()
+        assert [d.serial_number for d in second_devices] == ['002F003D3438510B34313939']
+        assert second_devices[0].port_path == '1-1.5'
+
+    custom_match = find_mock.call_args[1]['custom_match']
+    assert find_mock.call_args[1]['idVendor'] == 0x0483
+    assert [custom_match(d) for d in usb_devices] == [True, False]
+    assert usb_devices[0].serial_number_reads == 1
+    assert usb_devices[1].serial_number_reads == 0
+
+
+def test_serial_number_cache_expiration(monkeypatch):
+    usb_device = _CountingDeviceStub(idVendor=0x0483, idProduct=0x374e, serial_number='002F003D3438510B34313939',
+                                     bus=1, address=5)
+    with patch('usb.core.find', autospec=True) as find_mock:
+        find_mock.return_value = [usb_device]
+        assert get_stlink_devices()[0].serial_number == '002F003D3438510B34313939'
+        monkeypatch.setattr(stlink_utils, '_SERIAL_NUMBER_CACHE_TTL', -1.0)
+        assert get_stlink_devices()[0].serial_number == '002F003D3438510B34313939'
+    assert usb_device.serial_number_reads == 2
@@ -1,6 +1,8 @@
+import json
 import os
 import os.path
 import shutil
+import time
 from pathlib import Path
 from unittest.mock import patch
 
@@ -9,6 +11,7 @@ from hamcrest import assert_that, string_contains_in_order
 
 from testing_utils import DeviceStub, FIXTURE_DIR, change_dir, run_invoke_cmd
 from vznncv.stlink.tools.wrapper._cli import main
+from vznncv.stlink.tools.wrapper._hotplug_utils import UsbEventMonitor, PollingUsbEventMonitor
 
 
 @pytest.fixture
@@ -84,6 +87,210 @@ def test_openocd_usage(demo_project_path: Path, openocd_stub_path: Path, dummy_u
     ))
 
 
+def test_openocd_new_version_usage(demo_project_path: Path, tmp_bin_dir: Path, dummy_usb_devices, capfd):
+    openocd_path = tmp_bin_dir.joinpath('openocd')
+    openocd_path.write_text(r'''
+#!/bin/sh
+if [ "$1" = "--version" ]; then
+    echo "Open On-Chip Debugger 0.12.0" 1>&2
+    exit 0
+fi
+echo "OpenOCD args: $@" 1>&2
+'''.lstrip())
+    openocd_path.chmod(0o777)
+    with change_dir(demo_project_path):
+        exit_code = run_invoke_cmd(main, ['upload-app', '--backend', 'openocd', '--elf-file', 'build'])
+
+    assert exit_code == 0
+    out_result = capfd.readouterr()
+    assert_that(out_result.err, string_contains_in_order(
+        'Backend tool: openocd 0.12.0',
+        'OpenOCD args', 'adapter serial "002F003D3438510B34313939"', 'program',
+    ))
+    assert 'hla_serial' not in out_result.err
+
+
+def test_openocd_adapter_speed(demo_project_path: Path, openocd_stub_path: Path, dummy_usb_devices, capfd):
+    with change_dir(demo_project_path):
+        exit_code = run_invoke_cmd(main, ['upload-app', '--backend', 'openocd', '--elf-file', 'build',
+                                          '--adapter-speed', '1800'])
+
+    assert exit_code == 0
+    out_result = capfd.readouterr()
+    assert_that(out_result.err, string_contains_in_order(
+        'OpenOCD args', 'hla_serial', 'adapter_khz 1800', 'program',
+    ))
+
+
+def test_openocd_auto_adapter_speed(demo_project_path: Path, tmp_bin_dir: Path, dummy_usb_devices, capfd):
+    openocd_path = tmp_bin_dir.joinpath('openocd')
+    openocd_path.write_text(r'''
+#!/bin/sh
+if [ "$1" = "--version" ]; then
+    echo "Open On-Chip Debugger 0.12.0" 1>&2
+    exit 0
+fi
+echo "OpenOCD args: $@" 1>&2
+case "$*" in
+    *"adapter speed 24000"*|*"adapter speed 8000"*)
+        echo "Error: unable to connect to the target" 1>&2
+        exit 1
+        ;;
+esac
+'''.lstrip())
+    openocd_path.chmod(0o777)
+    with change_dir(demo_project_path):
+        exit_code = run_invoke_cmd(main, ['upload-app', '--backend', 'openocd', '--elf-file', 'build',
+                                          '--adapter-speed', 'auto'])
+
+    assert exit_code == 0
+    out_result = capfd.readouterr()
+    assert_that(out_result.err, string_contains_in_order(
+        'Adapter speed: 24000 kHz',
+        'adapter speed 24000', 'Retry at 8000 kHz',
+        'adapter speed 8000', 'Retry at 3300 kHz',
+        'adapter speed 3300', 'program',
+        'Complete',
+    ))
+
+    # the next upload starts with the speed of the successful upload
+    with change_dir(demo_project_path):
+        exit_code = run_invoke_cmd(main, ['upload-app', '--backend', 'openocd', '--elf-file', 'build',
+                                          '--adapter-speed', 'auto', '--force'])
+
+    assert exit_code == 0
+    out_result = capfd.readouterr()
+    assert_that(out_result.err, string_contains_in_order(
+        'Adapter speed: 3300 kHz', 'adapter speed 3300', 'program', 'Complete',
+    ))
+    assert 'Retry at' not in out_result.err
+
+
+def test_auto_adapter_speed_configuration_error(demo_project_path: Path, pyocd_stub_path: Path, dummy_usb_devices,
+                                                capfd):
+    with change_dir(demo_project_path):
+        exit_code = run_invoke_cmd(main, ['upload-app', '--backend', 'pyocd', '--elf-file', 'build',
+                                          '--adapter-speed', 'auto'])
+
+    assert exit_code == 1
+    out_result = capfd.readouterr()
+    assert "PyOCD target isn't specified" in out_result.err
+    # configuration errors aren't retried with lower speed
+    assert 'Retry at' not in out_result.err
+
+
+def test_auto_adapter_speed_backend_configuration_error(demo_project_path: Path, tmp_bin_dir: Path,
+                                                        dummy_usb_devices, capfd):
+    openocd_path = tmp_bin_dir.joinpath('openocd')
+    openocd_path.write_text(r'''
+#!/bin/sh
+if [ "$1" = "--version" ]; then
+    echo "Open On-Chip Debugger 0.12.0" 1>&2
+    exit 0
+fi
+echo "OpenOCD args: $@" 1>&2
+echo "Error: Can't find interface/unknown.cfg" 1>&2
+exit 1
+'''.lstrip())
+    openocd_path.chmod(0o777)
+    with change_dir(demo_project_path):
+        exit_code = run_invoke_cmd(main, ['upload-app', '--backend', 'openocd', '--elf-file', 'build',
+                                          '--adapter-speed', 'auto'])
+
+    assert exit_code == 1
+    out_result = capfd.readouterr()
+    assert 'OpenOCD has failed with code 1' in out_result.err
+    # backend fails before programming without probe communication errors, so lower speed doesn't help
+    assert out_result.err.count('OpenOCD args') == 1
+    assert 'Retry at' not in out_result.err
+
+
+def test_invalid_adapter_speed(demo_project_path: Path, openocd_stub_path: Path, dummy_usb_devices, capfd):
+    with change_dir(demo_project_path):
+        exit_code = run_invoke_cmd(main, ['upload-app', '--backend', 'openocd', '--elf-file', 'build',
+                                          '--adapter-speed', 'fast'])
+
+    assert exit_code != 0
+    assert 'positive number of kHz' in capfd.readouterr().err
+
+
+def test_openocd_crc_verify(demo_project_path: Path, openocd_stub_path: Path, dummy_usb_devices, capfd):
+    with change_dir(demo_project_path):
+        exit_code = run_invoke_cmd(main, ['upload-app', '--backend', 'openocd', '--elf-file', 'build',
+                                          '--verify', 'crc'])
+
+    assert exit_code == 0
+    out_result = capfd.readouterr()
+    assert_that(out_result.err, string_contains_in_order(
+        'OpenOCD args', 'program', 'demo.elf', 'verify_image_checksum', 'demo.elf', 'reset run', 'shutdown',
+    ))
+    assert 'verify reset' not in out_result.err
+
+
+def test_openocd_no_verify(demo_project_path: Path, openocd_stub_path: Path, dummy_usb_devices, capfd):
+    with change_dir(demo_project_path):
+        exit_code = run_invoke_cmd(main, ['upload-app', '--backend', 'openocd', '--elf-file', 'build',
+                                          '--verify', 'none'])
+
+    assert exit_code == 0
+    out_result = capfd.readouterr()
+    assert_that(out_result.err, string_contains_in_order('OpenOCD args', 'program', 'demo.elf', 'reset exit'))
+    assert 'verify reset' not in out_result.err
+
+
+def test_pyocd_verify_isnt_supported(demo_project_path: Path, pyocd_stub_path: Path, dummy_usb_devices, capfd):
+    with change_dir(demo_project_path):
+        exit_code = run_invoke_cmd(main, ['upload-app', '--backend', 'pyocd', '--elf-file', 'build',
+                                          '--pyocd-target', 'stm32f411ce', '--verify', 'crc'])
+
+    assert exit_code != 0
+    out_result = capfd.readouterr()
+    assert_that(out_result.err, string_contains_in_order('PyOCD command doesn\'t support image verification'))
+    assert 'PyOCD args' not in out_result.err
+
+
+def test_openocd_extra_images(demo_project_path: Path, openocd_stub_path: Path, dummy_usb_devices, capfd):
+    demo_project_path.joinpath('config.bin').write_bytes(b'\x01\x02\x03\x04')
+    with change_dir(demo_project_path):
+        exit_code = run_invoke_cmd(main, ['upload-app', '--backend', 'openocd', '--elf-file', 'build',
+                                          '--extra-image', 'config.bin@0x080E0000'])
+
+    assert exit_code == 0
+    out_result = capfd.readouterr()
+    assert_that(out_result.err, string_contains_in_order(
+        'Images to upload', 'build/demo.elf', 'config.bin@0x080E0000',
+        'Image file to upload', 'image.hex',
+        'OpenOCD args', 'program', 'image.hex', 'verify reset exit',
+        'Complete',
+    ))
+    # all images are programmed by one backend invocation
+    assert out_result.err.count('OpenOCD args:') == 1
+
+    # unchanged images are checked with the combined image
+    with change_dir(demo_project_path):
+        exit_code = run_invoke_cmd(main, ['upload-app', '--backend', 'openocd', '--elf-file', 'build',
+                                          '--extra-image', 'config.bin@0x080E0000'])
+
+    assert exit_code == 0
+    assert_that(capfd.readouterr().err, string_contains_in_order(
+        'Device has been flashed with the same image already',
+        'OpenOCD args', 'verify_image_checksum', 'image.hex',
+        'Skip upload',
+    ))
+
+
+def test_overlapped_extra_images(demo_project_path: Path, openocd_stub_path: Path, dummy_usb_devices, capfd):
+    demo_project_path.joinpath('config.bin').write_bytes(b'\x01\x02\x03\x04')
+    with change_dir(demo_project_path):
+        exit_code = run_invoke_cmd(main, ['upload-app', '--backend', 'openocd', '--elf-file', 'build',
+                                          '--extra-image', 'config.bin@0x08000100'])
+
+    assert exit_code == 1
+    out_result = capfd.readouterr()
+    assert 'overlap at 0x08000100' in out_result.err
+    assert 'OpenOCD args' not in out_result.err
+
+
 def test_pyocd_usage(demo_project_path: Path, pyocd_stub_path: Path, dummy_usb_devices, capfd):
     with change_dir(demo_project_path):
         exit_code = run_invoke_cmd(main, ['upload-app', '--backend', 'pyocd', '--elf-file', 'build', '--pyocd-target',
@@ -100,3 +307,434 @@ def test_pyocd_usage(demo_project_path: Path, pyocd_stub_path: Path, dummy_usb_d
         'PyOCD args', 'flash', '--target', 'stm32f411ce', '--format', 'elf', 'demo.elf',
         'Complete',
     ))
+
+
+@pytest.fixture
+def multiple_dummy_usb_devices():
+    with patch('usb.core.find', autospec=True) as find_mock:
+        find_mock.return_value = [
+            DeviceStub(idVendor=0x0483, idProduct=0x374e, serial_number='002F003D3438510B34313939'),
+            DeviceStub(idVendor=0x0483, idProduct=0x374b, serial_number='0670FF535155878281123912'),
+            DeviceStub(idVendor=0x0483, idProduct=0x3748, serial_number='34006A063141323910300243'),
+        ]
+        yield
+
+
+def test_openocd_usage_all_devices(demo_project_path: Path, openocd_stub_path: Path, multiple_dummy_usb_devices,
+                                   capfd):
+    with change_dir(demo_project_path):
+        exit_code = run_invoke_cmd(main, ['upload-app', '--backend', 'openocd', '--elf-file', 'build',
+                                          '--all-devices', '--jobs', '2'])
+
+    assert exit_code == 0
+    out_result = capfd.readouterr()
+    for hla_serial in ['002F003D3438510B34313939', '0670FF535155878281123912', '34006A063141323910300243']:
+        assert_that(out_result.err, string_contains_in_order(
+            f'[{hla_serial}] Run command', 'openocd',
+            f'[{hla_serial}] OpenOCD stub',
+            f'[{hla_serial}] OpenOCD return code: 0',
+        ))
+    assert_that(out_result.err, string_contains_in_order(
+        'Upload summary',
+        '002F003D3438510B34313939', 'OK',
+        '0670FF535155878281123912', 'OK',
+        '34006A063141323910300243', 'OK',
+        'Complete'
+    ))
+
+
+def test_pyocd_usage_selected_devices(demo_project_path: Path, pyocd_stub_path: Path, multiple_dummy_usb_devices,
+                                      capfd):
+    with change_dir(demo_project_path):
+        exit_code = run_invoke_cmd(main, ['upload-app', '--backend', 'pyocd', '--elf-file', 'build',
+                                          '--pyocd-target', 'stm32f411ce',
+                                          '--hla-serial', '002F003D3438510B34313939',
+                                          '--hla-serial', '34006A063141323910300243'])
+
+    assert exit_code == 0
+    out_result = capfd.readouterr()
+    assert_that(out_result.err, string_contains_in_order(
+        '[002F003D3438510B34313939] PyOCD args', '--uid 002F003D3438510B34313939',
+    ))
+    assert_that(out_result.err, string_contains_in_order(
+        '[34006A063141323910300243] PyOCD args', '--uid 34006A063141323910300243',
+    ))
+    assert '[0670FF535155878281123912]' not in out_result.err
+
+
+def test_openocd_timings(demo_project_path: Path, openocd_stub_path: Path, dummy_usb_devices, capfd):
+    timings_file = demo_project_path / 'timings.json'
+    with change_dir(demo_project_path):
+        exit_code = run_invoke_cmd(main, ['upload-app', '--backend', 'openocd', '--elf-file', 'build',
+                                          '--timings', '--timings-file', str(timings_file)])
+
+    assert exit_code == 0
+    out_result = capfd.readouterr()
+    assert_that(out_result.err, string_contains_in_order(
+        'OpenOCD stub',
+        'Timings:',
+        'elf resolution', 'device enumeration', 'backend discovery', 'config resolution', 'image reading',
+        'upload', 'ledger check', 'flash', 'ledger update', 'bytes in',
+        'total',
+        'Complete',
+    ))
+
+    timings_data = json.loads(timings_file.read_text())
+    assert [phase['name'] for phase in timings_data['phases']] == [
+        'elf resolution', 'device enumeration', 'backend discovery', 'config resolution', 'image reading', 'upload'
+    ]
+    assert timings_data['image_size'] > 0
+    device_timings, = timings_data['devices']
+    assert device_timings['hla_serial'] == '002F003D3438510B34313939'
+    assert device_timings['status'] == 'OK'
+    assert device_timings['bytes_flashed'] == timings_data['image_size']
+    assert [phase['name'] for phase in device_timings['phases']] == ['ledger check', 'flash', 'ledger update']
+    assert device_timings['flash_duration'] == device_timings['phases'][1]['duration']
+    assert device_timings['throughput'] == device_timings['bytes_flashed'] / device_timings['flash_duration']
+
+
+@pytest.fixture
+def reporting_openocd_stub_path(tmp_bin_dir):
+    openocd_path = tmp_bin_dir.joinpath('openocd')
+    openocd_path.write_text(r'''
+#!/bin/sh
+echo "** Programming Started **"
+echo "wrote 16384 bytes from file build/demo.elf in 0.015000s (1066.667 KiB/s)"
+echo "** Programming Finished **"
+echo "** Verify Started **"
+echo "verified 7508 bytes in 0.005000s (1466.406 KiB/s)"
+echo "** Verified OK **"
+'''.lstrip())
+    openocd_path.chmod(0o777)
+    yield openocd_path
+
+
+def test_openocd_timings_subphases(demo_project_path: Path, reporting_openocd_stub_path: Path, dummy_usb_devices,
+                                   capfd):
+    timings_file = demo_project_path / 'timings.json'
+    with change_dir(demo_project_path):
+        exit_code = run_invoke_cmd(main, ['upload-app', '--backend', 'openocd', '--elf-file', 'build',
+                                          '--timings', '--timings-file', str(timings_file)])
+
+    assert exit_code == 0
+    assert_that(capfd.readouterr().err, string_contains_in_order(
+        'Timings:', 'ledger check', 'flash', 'flash/program', 'flash/verify', 'ledger update', 'Complete'
+    ))
+    device_timings, = json.loads(timings_file.read_text())['devices']
+    phases = {phase['name']: phase for phase in device_timings['phases']}
+    assert list(phases) == ['ledger check', 'flash', 'flash/program', 'flash/verify', 'ledger update']
+    # reported durations are limited by the flash phase, as the stub is faster than the real backend
+    assert 0 < phases['flash/program']['duration'] <= 0.015
+    assert 0 < phases['flash/verify']['duration'] <= 0.005
+    assert phases['flash']['start'] <= phases['flash/program']['start'] <= phases['flash/verify']['start']
+    # subphases are parts of the flash phase
+    assert device_timings['flash_duration'] == phases['flash']['duration']
+
+
+def test_openocd_timings_relative_file(demo_project_path: Path, openocd_stub_path: Path, dummy_usb_devices):
+    with change_dir(demo_project_path):
+        exit_code = run_invoke_cmd(main, ['upload-app', '--backend', 'openocd', '--elf-file', 'build',
+                                          '--timings-file', 'timings.json'])
+
+    assert exit_code == 0
+    timings_data = json.loads((demo_project_path / 'timings.json').read_text())
+    device_timings, = timings_data['devices']
+    assert device_timings['status'] == 'OK'
+
+
+@pytest.fixture
+def failing_openocd_stub_path(tmp_bin_dir):
+    openocd_path = tmp_bin_dir.joinpath('openocd')
+    openocd_path.write_text(r'''
+#!/bin/sh
+echo "OpenOCD stub" 1>&2
+echo "** Programming Started **"
+echo "Error: flash write algorithm aborted by target"
+echo "** Programming Failed **"
+exit 1
+'''.lstrip())
+    openocd_path.chmod(0o777)
+    yield openocd_path
+
+
+def test_openocd_quiet_json_output(demo_project_path: Path, failing_openocd_stub_path: Path, dummy_usb_devices,
+                                   capfd):
+    with change_dir(demo_project_path):
+        exit_code = run_invoke_cmd(main, ['upload-app', '--backend', 'openocd', '--elf-file', 'build',
+                                          '--quiet', '--output-format', 'json'])
+
+    assert exit_code == 1
+    out_result = capfd.readouterr()
+    events = [json.loads(line) for line in out_result.out.splitlines()]
+    assert [event['kind'] for event in events] == ['program_started', 'error', 'error']
+    assert events[1]['message'] == 'Error: flash write algorithm aborted by target'
+    assert events[1]['hla_serial'] == '002F003D3438510B34313939'
+    # logs are shown after failure only
+    assert_that(out_result.err, string_contains_in_order(
+        'start of openocd logs',
+        '==== openocd logs ====', 'Programming Failed', '==== end of openocd logs ====',
+        'end of openocd logs',
+        'OpenOCD has failed with code 1'
+    ))
+    assert 'OpenOCD stub' in out_result.err
+
+
+def test_openocd_failure_timings_file_error(demo_project_path: Path, failing_openocd_stub_path: Path,
+                                            dummy_usb_devices, capfd):
+    with change_dir(demo_project_path):
+        # timings file cannot be created, as its parent is a file
+        exit_code = run_invoke_cmd(main, ['upload-app', '--backend', 'openocd', '--elf-file', 'build',
+                                          '--timings-file', 'build/demo.elf/timings.json'])
+
+    assert exit_code == 1
+    assert_that(capfd.readouterr().err, string_contains_in_order(
+        'Cannot report timings', 'OpenOCD has failed with code 1'
+    ))
+
+
+@pytest.fixture
+def hanging_openocd_stub_path(tmp_bin_dir):
+    openocd_path = tmp_bin_dir.joinpath('openocd')
+    openocd_path.write_text(r'''
+#!/bin/sh
+if [ "$1" = "--version" ]; then
+    echo "Open On-Chip Debugger 0.10.0" 1>&2
+    exit 0
+fi
+echo "** Programming Started **"
+sleep 60
+'''.lstrip())
+    openocd_path.chmod(0o777)
+    yield openocd_path
+
+
+def test_openocd_phase_timeout(demo_project_path: Path, hanging_openocd_stub_path: Path, dummy_usb_devices, capfd):
+    start_time = time.monotonic()
+    with change_dir(demo_project_path):
+        exit_code = run_invoke_cmd(main, ['upload-app', '--backend', 'openocd', '--elf-file', 'build',
+                                          '--timeout', '30', '--phase-timeout', 'program=0.5'])
+    assert exit_code == 1
+    assert time.monotonic() - start_time < 20
+    out_result = capfd.readouterr()
+    assert 'has exceeded 0.5s timeout of the "program" phase' in out_result.err
+
+
+class _UsbEventMonitorStub(UsbEventMonitor):
+    def __init__(self):
+        self.wait_count = 0
+
+    def wait(self, timeout):
+        self.wait_count += 1
+        return True
+
+
+def test_openocd_wait_for_device(demo_project_path: Path, openocd_stub_path: Path, capfd):
+    usb_snapshots = iter([
+        [],
+        [DeviceStub(idVendor=0x0483, idProduct=0x374e, serial_number='0670FF535155878281123912')],
+        [
+            DeviceStub(idVendor=0x0483, idProduct=0x374e, serial_number='0670FF535155878281123912'),
+            DeviceStub(idVendor=0x0483, idProduct=0x374e, serial_number='002F003D3438510B34313939'),
+        ],
+    ])
+    monitor_stub = _UsbEventMonitorStub()
+    with change_dir(demo_project_path), \
+            patch('usb.core.find', autospec=True, side_effect=lambda *args, **kwargs: next(usb_snapshots)), \
+            patch('vznncv.stlink.tools.wrapper._hotplug_utils.create_usb_event_monitor', return_value=monitor_stub):
+        exit_code = run_invoke_cmd(main, ['upload-app', '--backend', 'openocd', '--elf-file', 'build',
+                                          '--hla-serial', '002F003D3438510B34313939', '--wait-for-device'])
+
+    assert exit_code == 0
+    assert monitor_stub.wait_count == 2
+    out_result = capfd.readouterr()
+    assert_that(out_result.err, string_contains_in_order(
+        'Cannot find any ST-Link device',
+        'Wait for ST-Link device connection',
+        'Target ST-Link device: ST-Link V3E (serial 002F003D3438510B34313939)',
+        'OpenOCD stub',
+        'Complete',
+    ))
+
+
+def test_openocd_wait_for_device_timeout(demo_project_path: Path, openocd_stub_path: Path, capfd):
+    with change_dir(demo_project_path), \
+            patch('usb.core.find', autospec=True, return_value=[]), \
+            patch('vznncv.stlink.tools.wrapper._hotplug_utils.create_usb_event_monitor',
+                  return_value=PollingUsbEventMonitor(0.05)):
+        start_time = time.monotonic()
+        exit_code = run_invoke_cmd(main, ['upload-app', '--backend', 'openocd', '--elf-file', 'build',
+                                          '--wait-for-device=0.2'])
+        duration = time.monotonic() - start_time
+
+    assert exit_code == 1
+    assert 0.2 <= duration < 5.0
+    out_result = capfd.readouterr()
+    assert_that(out_result.err, string_contains_in_order(
+        'Wait for ST-Link device connection',
+        'Cannot find any ST-Link device',
+    ))
+    assert 'OpenOCD stub' not in out_result.err
+
+
+def test_openocd_skip_same_image(demo_project_path: Path, openocd_stub_path: Path, dummy_usb_devices, capfd):
+    with change_dir(demo_project_path):
+        exit_code = run_invoke_cmd(main, ['upload-app', '--backend', 'openocd', '--elf-file', 'build'])
+        assert exit_code == 0
+        capfd.readouterr()
+        exit_code = run_invoke_cmd(main, ['upload-app', '--backend', 'openocd', '--elf-file', 'build'])
+        assert exit_code == 0
+        skip_out_result = capfd.readouterr()
+        exit_code = run_invoke_cmd(main, ['upload-app', '--backend', 'openocd', '--elf-file', 'build', '--force'])
+        assert exit_code == 0
+        force_out_result = capfd.readouterr()
+
+    assert_that(skip_out_result.err, string_contains_in_order(
+        'Device has been flashed with the same image already',
+        'OpenOCD args', 'verify_image_checksum', 'demo.elf',
+        'Skip upload',
+        'Complete',
+    ))
+    assert 'verify reset exit' not in skip_out_result.err
+    assert 'verify_image_checksum' not in force_out_result.err
+    assert_that(force_out_result.err, string_contains_in_order(
+        'OpenOCD args', 'program', 'demo.elf', 'verify reset exit',
+        'Complete',
+    ))
+
+
+def test_pyocd_same_image_without_api(demo_project_path: Path, pyocd_stub_path: Path, dummy_usb_devices, capfd):
+    upload_args = ['upload-app', '--backend', 'pyocd', '--elf-file', 'build', '--pyocd-target', 'stm32f411ce']
+    with change_dir(demo_project_path), \
+            patch('vznncv.stlink.tools.wrapper._upload_utils.is_pyocd_api_available', return_value=False):
+        exit_code = run_invoke_cmd(main, upload_args)
+        assert exit_code == 0
+        capfd.readouterr()
+        exit_code = run_invoke_cmd(main, upload_args)
+        assert exit_code == 0
+        out_result = capfd.readouterr()
+
+    # ledger isn't trusted without target memory check
+    assert_that(out_result.err, string_contains_in_order(
+        'Device has been flashed with the same image already',
+        'Target memory cannot be checked without pyocd python package',
+        'PyOCD args', 'flash', 'demo.elf',
+        'Complete'
+    ))
+    assert 'Skip upload' not in out_result.err
+
+
+def test_openocd_bin_image(demo_project_path: Path, openocd_stub_path: Path, dummy_usb_devices, capfd):
+    with change_dir(demo_project_path):
+        exit_code = run_invoke_cmd(main, ['upload-app', '--backend', 'openocd', '--elf-file', 'build',
+                                          '--image-format', 'bin'])
+
+    assert exit_code == 0
+    out_result = capfd.readouterr()
+    assert_that(out_result.err, string_contains_in_order(
+        'Image file to upload', 'image.bin',
+        'OpenOCD args', 'program', 'image.bin', '0x08000000 verify reset exit',
+        'Complete',
+    ))
+
+
+def test_pyocd_hex_image(demo_project_path: Path, pyocd_stub_path: Path, dummy_usb_devices, capfd):
+    with change_dir(demo_project_path):
+        exit_code = run_invoke_cmd(main, ['upload-app', '--backend', 'pyocd', '--elf-file', 'build',
+                                          '--pyocd-target', 'stm32f411ce', '--image-format', 'hex'])
+
+    assert exit_code == 0
+    out_result = capfd.readouterr()
+    assert_that(out_result.err, string_contains_in_order('PyOCD args', '--format hex', 'image.hex', 'Complete'))
+
+
+def test_openocd_newest_elf_file(demo_project_path: Path, openocd_stub_path: Path, dummy_usb_devices, capfd):
+    build_dir = demo_project_path / 'build'
+    shutil.copy(build_dir / 'demo.elf', build_dir / 'demo_new.elf')
+    old_time = time.time() - 600
+    os.utime(build_dir / 'demo.elf', (old_time, old_time))
+    with change_dir(demo_project_path):
+        exit_code = run_invoke_cmd(main, ['upload-app', '--backend', 'openocd'])
+        assert exit_code == 1
+        assert 'Multiple elf files are found' in capfd.readouterr().err
+        exit_code = run_invoke_cmd(main, ['upload-app', '--backend', 'openocd', '--elf-select', 'newest'])
+
+    assert exit_code == 0
+    out_result = capfd.readouterr()
+    assert_that(out_result.err, string_contains_in_order(
+        'Select the newest one', 'demo_new.elf',
+        'OpenOCD args', 'program', 'demo_new.elf', 'verify reset exit',
+    ))
+
+
+def test_openocd_project_config(demo_project_path: Path, openocd_stub_path: Path, pyocd_stub_path: Path,
+                                dummy_usb_devices, capfd):
+    build_dir = demo_project_path / 'build'
+    shutil.copy(build_dir / 'demo.elf', build_dir / 'demo_new.elf')
+    (demo_project_path / '.vznncv-stlink.toml').write_text(
+        '[upload-app]\n'
+        'elf-file = "build/demo_new.elf"\n'
+        'backend = "openocd"\n'
+        'openocd-config = "openocd_stm.cfg"\n'
+    )
+    with change_dir(demo_project_path):
+        exit_code = run_invoke_cmd(main, ['upload-app'])
+
+    assert exit_code == 0
+    out_result = capfd.readouterr()
+    assert_that(out_result.err, string_contains_in_order(
+        'Project configuration file', '.vznncv-stlink.toml',
+        'Target elf file ', 'build/demo_new.elf',
+        'Upload backend: "openocd"',
+        'OpenOCD args', 'openocd_stm.cfg', 'program', 'demo_new.elf', 'verify reset exit',
+    ))
+
+
+def _patch_demo_elf(demo_project_path: Path):
+    elf_path = demo_project_path / 'build' / 'demo.elf'
+    elf_data = bytearray(elf_path.read_bytes())
+    # .text section starts at file offset 0x10000 (address 0x08000000)
+    elf_data[0x10000 + 0x900] ^= 0xFF
+    elf_path.write_bytes(bytes(elf_data))
+
+
+def test_openocd_delta_upload(demo_project_path: Path, openocd_stub_path: Path, dummy_usb_devices, capfd):
+    upload_args = ['upload-app', '--backend', 'openocd', '--elf-file', 'build', '--delta-sector-size', '2K']
+    with change_dir(demo_project_path):
+        exit_code = run_invoke_cmd(main, upload_args)
+        assert exit_code == 0
+        full_out_result = capfd.readouterr()
+        _patch_demo_elf(demo_project_path)
+        exit_code = run_invoke_cmd(main, upload_args)
+        assert exit_code == 0
+        delta_out_result = capfd.readouterr()
+
+    assert_that(full_out_result.err, string_contains_in_order(
+        'Previous device image is unknown',
+        'OpenOCD args', 'program', 'demo.elf', 'verify reset exit',
+    ))
+    assert_that(delta_out_result.err, string_contains_in_order(
+        'Delta upload: 1 changed regions, 2048 bytes',
+        'OpenOCD args', 'reset halt', 'flash write_image erase', '0x08000800 bin',
+        'verify_image_checksum', 'demo.elf', 'reset run',
+        'Complete'
+    ))
+    assert 'verify reset exit' not in delta_out_result.err
+
+
+def test_pyocd_delta_upload(demo_project_path: Path, pyocd_stub_path: Path, dummy_usb_devices, capfd):
+    upload_args = ['upload-app', '--backend', 'pyocd', '--elf-file', 'build', '--pyocd-target', 'stm32f303vc',
+                   '--delta-sector-size', '0x800']
+    with change_dir(demo_project_path):
+        exit_code = run_invoke_cmd(main, upload_args)
+        assert exit_code == 0
+        capfd.readouterr()
+        _patch_demo_elf(demo_project_path)
+        exit_code = run_invoke_cmd(main, upload_args)
+        assert exit_code == 0
+        delta_out_result = capfd.readouterr()
+
+    # target memory cannot be checked without pyocd python package, so delta upload isn't safe
+    assert_that(delta_out_result.err, string_contains_in_order(
+        'Delta upload requires target memory check', 'PyOCD args', 'flash', 'demo.elf', 'Complete'
+    ))
+    assert '.bin@0x08000800' not in delta_out_result.err
@@ -0,0 +1,78 @@
+import shutil
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from vznncv.stlink.tools.wrapper._watch_utils import InotifyFileEventMonitor, PollingFileEventMonitor, \
+    watch_file_changes, get_file_stamp
+
+
+def _create_inotify_monitor(paths):
+    if not sys.platform.startswith('linux'):
+        pytest.skip("inotify is available on Linux only")
+    return InotifyFileEventMonitor(paths)
+
+
+def _create_polling_monitor(paths):
+    return PollingFileEventMonitor(paths, poll_interval=0.05)
+
+
+@pytest.fixture(params=[_create_inotify_monitor, _create_polling_monitor], ids=['inotify', 'polling'])
+def monitor_factory(request):
+    yield request.param
+
+
+def _run_in_thread(func):
+    thread = threading.Thread(target=func, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_watch_file_changes(tmp_path: Path, monitor_factory):
+    elf_path = tmp_path / 'build' / 'demo.elf'
+    elf_path.parent.mkdir()
+    elf_path.write_bytes(b'old image')
+
+    def build():
+        time.sleep(0.2)
+        # linker writes the file by parts
+        with open(elf_path, 'wb') as f:
+            for part in (b'new ', b'ima', b'ge'):
+                f.write(part)
+                f.flush()
+                time.sleep(0.05)
+
+    with monitor_factory([str(elf_path)]) as monitor:
+        changes = watch_file_changes([str(elf_path)], debounce=0.2, monitor=monitor)
+        thread = _run_in_thread(build)
+        stamps = next(changes)
+        thread.join()
+        assert elf_path.read_bytes() == b'new image'
+        assert stamps == {str(elf_path): get_file_stamp(str(elf_path))}
+
+
+def test_watch_recreated_directory(tmp_path: Path, monitor_factory):
+    elf_path = tmp_path / 'build' / 'demo.elf'
+    elf_path.parent.mkdir()
+    elf_path.write_bytes(b'old image')
+
+    def clean_build():
+        time.sleep(0.2)
+        shutil.rmtree(elf_path.parent)
+        time.sleep(0.2)
+        elf_path.parent.mkdir()
+        elf_path.write_bytes(b'new image')
+
+    with monitor_factory([str(elf_path)]) as monitor:
+        changes = watch_file_changes([str(elf_path)], debounce=0.3, monitor=monitor)
+        thread = _run_in_thread(clean_build)
+        stamps = next(changes)
+        thread.join()
+        # the file can be reported as removed, if the build directory is cleaned slowly
+        if stamps[str(elf_path)] is None:
+            stamps = next(changes)
+        assert stamps[str(elf_path)] is not None
+        assert elf_path.read_bytes() == b'new image'
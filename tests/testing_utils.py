@@ -1,4 +1,7 @@
 import os
+import socket
+import struct
+import threading
 from collections import namedtuple
 from contextlib import contextmanager
 from os.path import join, dirname
@@ -18,8 +21,84 @@ def change_dir(new_dir):
         os.chdir(old_dir)
 
 
+def make_ram_elf(src_path, dst_path, *, flash_address=0x08000000, ram_address=0x20000000):
+    """
+    Copy elf file and relocate its flash segments, sections and reset vector to SRAM.
+    """
+    data = bytearray(open(src_path, 'rb').read())
+
+    def relocate(offset):
+        value, = struct.unpack_from('<I', data, offset)
+        if flash_address <= value < ram_address:
+            struct.pack_into('<I', data, offset, value - flash_address + ram_address)
+
+    phoff, shoff = struct.unpack_from('<II', data, 28)
+    phentsize, phnum, shentsize, shnum = struct.unpack_from('<HHHH', data, 42)
+    for i in range(phnum):
+        relocate(phoff + i * phentsize + 8)
+        relocate(phoff + i * phentsize + 12)
+    for i in range(shnum):
+        relocate(shoff + i * shentsize + 12)
+    # the vector table is placed at the beginning of the first segment
+    vector_table_offset, = struct.unpack_from('<I', data, phoff + 4)
+    relocate(vector_table_offset + 4)
+    with open(dst_path, 'wb') as f:
+        f.write(data)
+
+
 def run_invoke_cmd(cli, args):
     try:
         cli.main(args=args)
     except SystemExit as e:
         return e.code
+
+
+class OpenOcdTclServerStub:
+    """
+    Stand-in OpenOCD TCL RPC server.
+
+    Received commands are stored in ``commands`` list. Responses are produced by ``handler`` callable.
+    """
+
+    def __init__(self, handler=None):
+        self.commands = []
+        self.handler = handler if handler is not None else (lambda command: '')
+        self._server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server_socket.bind(('127.0.0.1', 0))
+        self._server_socket.listen(5)
+        self.host, self.port = self._server_socket.getsockname()
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self._server_socket.accept()
+            except OSError:
+                return
+            with conn:
+                buffer = b''
+                while True:
+                    try:
+                        data = conn.recv(4096)
+                    except OSError:
+                        break
+                    if not data:
+                        break
+                    buffer += data
+                    while b'\x1a' in buffer:
+                        command, buffer = buffer.split(b'\x1a', 1)
+                        command = command.decode('utf-8')
+                        self.commands.append(command)
+                        conn.sendall(self.handler(command).encode('utf-8') + b'\x1a')
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            self._server_socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._server_socket.close()
+        self._thread.join(timeout=5)